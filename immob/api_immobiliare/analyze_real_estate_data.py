@@ -12,8 +12,6 @@ import pandas as pd
 import os
 import sys
 from pathlib import Path
-import matplotlib.pyplot as plt
-import numpy as np
 
 # Add parent directory to path to import helpers
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -21,6 +19,7 @@ from sqlite_helpers import (
     init_database, write_df_to_sqlite, read_ads_from_sqlite,
     clean_df_from_sqlite, get_database_stats
 )
+from market_analytics import price_per_m2_stats, room_distribution
 
 def process_real_estate_data(csv_path, db_path):
     """
@@ -92,26 +91,16 @@ def analyze_real_estate_data(db_path):
                 if city and city.lower() != 'null':
                     print(f"  - {city}: {count} records")
     
-    # Basic data analysis
-    if 'surface_m2' in df.columns and len(df) > 0:
-        # Calculate price per square meter for properties with both price and surface data
-        if 'price' in df.columns:
-            # Extract numeric values from price strings
-            df['price_numeric'] = df['price'].str.extract(r'(\d+(?:\.\d+)?)')
-            df['price_numeric'] = pd.to_numeric(df['price_numeric'], errors='coerce')
-            
-            # Calculate price per square meter
-            valid_df = df[df['surface_m2'].notna() & df['price_numeric'].notna()]
-            if len(valid_df) > 0:
-                valid_df['price_per_m2'] = valid_df['price_numeric'] / valid_df['surface_m2']
-                
-                print("\nPrice per square meter statistics:")
-                print(f"Average: {valid_df['price_per_m2'].mean():.2f} €/m²")
-                print(f"Median: {valid_df['price_per_m2'].median():.2f} €/m²")
-                print(f"Min: {valid_df['price_per_m2'].min():.2f} €/m²")
-                print(f"Max: {valid_df['price_per_m2'].max():.2f} €/m²")
-        
-        # Surface statistics
+    # Price per square meter, per contract (computed by market_analytics from price_value and surface_m2)
+    price_stats = price_per_m2_stats(db_path, by="contract")
+    if not price_stats.empty:
+        print("\nPrice per square meter statistics:")
+        for _, row in price_stats.iterrows():
+            print(f"  {row['contract']}: average {row['mean']:.2f} €/m², median {row['p50']:.2f} €/m² "
+                  f"(10%-90%: {row['p10']:.2f}-{row['p90']:.2f}, {row['ads']} ads)")
+    
+    # Surface statistics
+    if 'surface_m2' in df.columns and df['surface_m2'].notna().any():
         print("\nSurface statistics:")
         print(f"Average: {df['surface_m2'].mean():.2f} m²")
         print(f"Median: {df['surface_m2'].median():.2f} m²")
@@ -119,12 +108,12 @@ def analyze_real_estate_data(db_path):
         print(f"Max: {df['surface_m2'].max():.2f} m²")
     
     # Room distribution
-    if 'rooms' in df.columns and len(df) > 0:
-        room_counts = df['rooms'].value_counts().sort_index()
+    rooms = room_distribution(db_path, by="contract")
+    if not rooms.empty:
         print("\nRoom distribution:")
-        for rooms, count in room_counts.items():
-            if not pd.isna(rooms):
-                print(f"  - {rooms} rooms: {count} properties")
+        for _, row in rooms.iterrows():
+            counts = ", ".join(f"{column} rooms: {row[column]}" for column in rooms.columns if column not in ("contract", "ads"))
+            print(f"  - {row['contract']}: {counts}")
     
     return df
 
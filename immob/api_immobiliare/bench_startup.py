@@ -0,0 +1,153 @@
+"""
+Startup benchmark of the api_immobiliare command-line tools.
+
+Looking up a city, listing its macrozones or printing --help should not wait
+for pandas, pydantic, requests or the Azure SDK: those are imported by the
+functions that need them. This script keeps an eye on it by timing the lookup
+commands in fresh interpreters and by checking which heavy packages a plain
+import of each module drags in.
+
+This module provides functions to:
+1. Time command-line invocations (best and median of several runs), net of
+   the interpreter's own startup
+2. List the heavy packages loaded by importing a module
+3. Show the slowest imports of a module (python -X importtime)
+"""
+
+import sys
+import time
+import logging
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+
+logger = logging.getLogger(__name__)
+
+MODULE_DIR = Path(__file__).resolve().parent
+
+# Packages that take tens to hundreds of milliseconds to import
+HEAVY_PACKAGES = ("pandas", "numpy", "pydantic", "requests", "azure")
+
+# Lookups that must start quickly: (label, arguments of the python interpreter)
+LOOKUP_COMMANDS = [
+    ("fetch_ads --help", ["fetch_ads.py", "--help"]),
+    ("fetch_ads --list-macrozones", ["fetch_ads.py", "--city", "genova", "--list-macrozones"]),
+    ("geography_store --city", ["geography_store.py", "--city", "genova"]),
+    ("gazetteer --search", ["gazetteer.py", "--search", "genova"])
+]
+
+# Modules imported by the lookups, which must not load any HEAVY_PACKAGES
+LIGHT_MODULES = ("fetch_ads", "helpers", "geography_store", "gazetteer", "sqlite_helpers", "validation",
+                 "cosmos_ingest")
+
+DEFAULT_BUDGET_MS = 200
+
+
+def time_command(args: Sequence[str], repeat: int = 5) -> Dict[str, float]:
+    """
+    Run `python <args>` several times in the module directory and time it.
+
+    Args:
+        args: Arguments of the python interpreter (script and options)
+        repeat: Number of timed runs, after one untimed warm-up run
+
+    Returns:
+        Dictionary with the best and median wall time in milliseconds
+    """
+    command = [sys.executable, *args]
+    subprocess.run(command, cwd=MODULE_DIR, capture_output=True)  # Warm-up: disk cache, .pyc, geography.db
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=MODULE_DIR, capture_output=True)
+        timings.append((time.perf_counter() - start) * 1000)
+        if result.returncode != 0:
+            logger.warning(f"[WARNING] {' '.join(args)} exited with {result.returncode}: "
+                           f"{result.stderr.decode(errors='replace')[-200:]}")
+    return {"best_ms": min(timings), "median_ms": statistics.median(timings)}
+
+
+def heavy_imports(module: str) -> List[str]:
+    """
+    Import a module in a fresh interpreter and list the heavy packages it loaded.
+
+    Args:
+        module: Name of a module of this directory
+
+    Returns:
+        The HEAVY_PACKAGES found in sys.modules after the import
+    """
+    code = (f"import sys, {module}; "
+            f"print(' '.join(p for p in {HEAVY_PACKAGES!r} if p in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=MODULE_DIR, capture_output=True, text=True,
+                            check=True)
+    return result.stdout.split()
+
+
+def slowest_imports(module: str, limit: int = 15) -> List[Dict[str, object]]:
+    """
+    Profile the import of a module with `python -X importtime`.
+
+    Args:
+        module: Name of the module to import
+        limit: Number of imports to return
+
+    Returns:
+        The slowest imports by cumulative time: [{"module": ..., "self_ms": ..., "cumulative_ms": ...}]
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=MODULE_DIR,
+                            capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():  # Header line
+            continue
+        imports.append({"module": name.strip(), "self_ms": int(self_us) / 1000,
+                        "cumulative_ms": int(cumulative_us) / 1000})
+    return sorted(imports, key=lambda i: i["cumulative_ms"], reverse=True)[:limit]
+
+
+def main():
+    """Time the lookup commands and check the imports of the light modules."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of the api_immobiliare CLIs')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per command (default: 5)')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f'Maximum median startup of a lookup, net of the interpreter (default: {DEFAULT_BUDGET_MS})')
+    parser.add_argument('--importtime', type=str, metavar='MODULE',
+                        help='Only show the slowest imports of MODULE')
+    args = parser.parse_args()
+
+    if args.importtime:
+        for entry in slowest_imports(args.importtime):
+            print(f"{entry['cumulative_ms']:8.1f} ms  {entry['self_ms']:7.1f} ms  {entry['module']}")
+        return 0
+
+    interpreter = time_command(["-c", "pass"], repeat=args.repeat)
+    print(f"{'python -c pass':32s} {interpreter['median_ms']:7.1f} ms (interpreter startup)")
+
+    failures = []
+    for label, command in LOOKUP_COMMANDS:
+        timing = time_command(command, repeat=args.repeat)
+        net_ms = timing["median_ms"] - interpreter["median_ms"]
+        print(f"{label:32s} {timing['median_ms']:7.1f} ms (best {timing['best_ms']:.1f}, net {net_ms:.1f})")
+        if net_ms > args.budget_ms:
+            failures.append(f"{label} takes {net_ms:.0f} ms")
+
+    for module in LIGHT_MODULES:
+        loaded = heavy_imports(module)
+        if loaded:
+            failures.append(f"import {module} loads {', '.join(loaded)}")
+
+    for failure in failures:
+        logger.error(f"[ERROR] {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# --- conftest.py ---
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+
+def make_ads(ids, url="https://www.immobiliare.it/annunci/{id}/", **columns):
+    """
+    Build an ads DataFrame for the tests, one row per id.
+
+    Args:
+        ids: Ids of the ads, or their number for ids 0 .. ids - 1
+        url: URL of the ads, with an "{id}" placeholder
+        **columns: Other columns, each a single value for every ad, a list with
+                   one value per ad, or a string with an "{id}" placeholder
+
+    Returns:
+        DataFrame with the url column followed by the given columns
+    """
+    ids = list(range(ids)) if isinstance(ids, int) else list(ids)
+
+    def values(value):
+        if isinstance(value, str) and "{id}" in value:
+            return [value.format(id=i) for i in ids]
+        return value
+
+    return pd.DataFrame({"url": values(url), **{name: values(value) for name, value in columns.items()}},
+                        index=range(len(ids)))
@@ -0,0 +1,256 @@
+"""
+Content hashing of flattened ads and skip-unchanged bookkeeping for the sinks.
+
+Every ad gets a stable hash of its flattened fields. A small SQLite hash index
+remembers, per sink (Cosmos container, SQLite database, CSV/JSON file), the
+hash last written for each ad, so a re-crawl only sends new or changed records.
+
+This module provides functions to:
+1. Compute a stable content hash for every row of an ads DataFrame
+2. Split a DataFrame into changed and unchanged rows for a given sink
+3. Record the hashes of the rows a sink has written successfully
+4. Count the ads a sink holds, to detect ads that dropped out of a full-crawl file
+"""
+
+import os
+import json
+import math
+import sqlite3
+import hashlib
+import logging
+import pandas as pd
+from typing import Iterable, List, Optional, Set
+
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+# Columns that change on every write without the ad itself changing
+HASH_EXCLUDED_COLUMNS = {'raw_data', 'db_id', 'created_at', 'updated_at'}
+
+
+def _normalise_value(value):
+    """Map NaN-like values to None so that cleaned and raw frames hash the same."""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if hasattr(value, 'item'):  # numpy scalars
+        return value.item()
+    return value
+
+
+def compute_content_hash(record: dict) -> str:
+    """
+    Compute a stable content hash for a single flattened ad.
+
+    Args:
+        record: Dictionary with the flattened ad fields
+
+    Returns:
+        Hex digest of the record content (independent of key order)
+    """
+    payload = {
+        key: _normalise_value(value)
+        for key, value in record.items()
+        if key not in HASH_EXCLUDED_COLUMNS
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def compute_content_hashes(df: pd.DataFrame) -> pd.Series:
+    """
+    Compute the content hash of every row of an ads DataFrame.
+
+    Args:
+        df: DataFrame of flattened ads
+
+    Returns:
+        Series of hex digests aligned with the DataFrame index
+    """
+    columns = sorted(col for col in df.columns if col not in HASH_EXCLUDED_COLUMNS)
+    hashes = [compute_content_hash(dict(zip(columns, row))) for row in df[columns].itertuples(index=False, name=None)]
+    return pd.Series(hashes, index=df.index, dtype=object)
+
+
+def get_ad_keys(df: pd.DataFrame) -> pd.Series:
+    """
+    Get the key identifying each ad in the hash index (URL, falling back to the ad id).
+
+    Args:
+        df: DataFrame of flattened ads
+
+    Returns:
+        Series of keys aligned with the DataFrame index (None if the ad has neither)
+    """
+    keys = pd.Series(None, index=df.index, dtype=object)
+    if 'id' in df.columns:
+        ids = df['id']
+        keys = keys.where(ids.isna(), 'id:' + ids.astype(str))
+    if 'url' in df.columns:
+        keys = keys.where(df['url'].isna(), df['url'])
+    return keys
+
+
+def init_hash_index(db_path: str) -> bool:
+    """
+    Initialize the hash index database.
+
+    Args:
+        db_path: Path to the SQLite file holding the hash index
+
+    Returns:
+        True if initialization was successful, False otherwise
+    """
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with get_connection(db_path) as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS ad_hashes (
+                sink TEXT NOT NULL,
+                ad_key TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (sink, ad_key)
+            ) WITHOUT ROWID
+            ''')
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error initializing hash index: {e}")
+        return False
+
+
+def find_unchanged_keys(db_path: str, sink: str, keys: Iterable[str], hashes: Iterable[str]) -> Set[str]:
+    """
+    Find the ads whose current hash matches the one last written to a sink.
+
+    The incoming (key, hash) pairs are loaded into a temporary table and
+    joined against the index in a single query.
+
+    Args:
+        db_path: Path to the SQLite file holding the hash index
+        sink: Identifier of the sink (e.g. "cosmos:ads_rent")
+        keys: Ad keys, as returned by get_ad_keys
+        hashes: Content hashes aligned with `keys`
+
+    Returns:
+        Set of keys that are unchanged for this sink
+    """
+    pairs = [(key, content_hash) for key, content_hash in zip(keys, hashes) if key is not None]
+    if not pairs or not init_hash_index(db_path):
+        return set()
+
+    try:
+        with get_connection(db_path) as conn:
+            conn.execute("CREATE TEMP TABLE incoming_hashes (ad_key TEXT PRIMARY KEY, content_hash TEXT)")
+            conn.executemany("INSERT OR REPLACE INTO incoming_hashes VALUES (?, ?)", pairs)
+            rows = conn.execute('''
+                SELECT i.ad_key FROM incoming_hashes i
+                JOIN ad_hashes h ON h.sink = ? AND h.ad_key = i.ad_key AND h.content_hash = i.content_hash
+            ''', (sink,)).fetchall()
+            return {row[0] for row in rows}
+    except sqlite3.Error as e:
+        logger.error(f"Error reading hash index: {e}")
+        return set()
+
+
+def filter_changed(df: pd.DataFrame, db_path: str, sink: str, hashes: Optional[pd.Series] = None):
+    """
+    Keep only the rows of a DataFrame that are new or changed for a sink.
+
+    Args:
+        df: DataFrame of flattened ads
+        db_path: Path to the SQLite file holding the hash index
+        sink: Identifier of the sink
+        hashes: Precomputed content hashes (computed if not provided)
+
+    Returns:
+        Tuple of (DataFrame of new or changed rows, number of unchanged rows skipped)
+    """
+    if df.empty:
+        return df, 0
+    if hashes is None:
+        hashes = compute_content_hashes(df)
+
+    keys = get_ad_keys(df)
+    unchanged = find_unchanged_keys(db_path, sink, keys, hashes)
+    mask = ~keys.isin(unchanged) | keys.isna()
+    return df[mask], int((~mask).sum())
+
+
+def mark_written(db_path: str, sink: str, keys: Iterable[str], hashes: Iterable[str], replace: bool = False) -> int:
+    """
+    Record that a sink now holds the given version of some ads.
+
+    Args:
+        db_path: Path to the SQLite file holding the hash index
+        sink: Identifier of the sink
+        keys: Ad keys that were written successfully
+        hashes: Content hashes aligned with `keys`
+        replace: The sink holds exactly these ads (a rewritten file): forget the others
+
+    Returns:
+        Number of index entries written
+    """
+    rows: List[tuple] = [(sink, key, content_hash) for key, content_hash in zip(keys, hashes) if key is not None]
+    if not (rows or replace) or not init_hash_index(db_path):
+        return 0
+
+    try:
+        with get_connection(db_path) as conn:
+            if replace:
+                conn.execute("DELETE FROM ad_hashes WHERE sink = ?", (sink,))
+            conn.executemany('''
+                INSERT INTO ad_hashes (sink, ad_key, content_hash) VALUES (?, ?, ?)
+                ON CONFLICT(sink, ad_key) DO UPDATE SET
+                    content_hash = excluded.content_hash,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', rows)
+            conn.commit()
+        return len(rows)
+    except sqlite3.Error as e:
+        logger.error(f"Error updating hash index: {e}")
+        return 0
+
+
+def mark_df_written(db_path: str, sink: str, df: pd.DataFrame, hashes: pd.Series, replace: bool = False) -> int:
+    """
+    Record the hashes of all rows of a DataFrame written successfully to a sink.
+
+    Args:
+        db_path: Path to the SQLite file holding the hash index
+        sink: Identifier of the sink
+        df: DataFrame of the rows that were written
+        hashes: Content hashes of the full crawl (aligned by index)
+        replace: The sink holds exactly these rows (a rewritten file): forget the other ads
+
+    Returns:
+        Number of index entries written
+    """
+    if df.empty and not replace:
+        return 0
+    return mark_written(db_path, sink, get_ad_keys(df), hashes.loc[df.index], replace=replace)
+
+
+def count_written(db_path: str, sink: str) -> int:
+    """
+    Count the ads recorded in the hash index for a sink.
+
+    Args:
+        db_path: Path to the SQLite file holding the hash index
+        sink: Identifier of the sink
+
+    Returns:
+        Number of ads (0 if the index cannot be read)
+    """
+    if not init_hash_index(db_path):
+        return 0
+    try:
+        with get_connection(db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM ad_hashes WHERE sink = ?", (sink,)).fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Error reading hash index: {e}")
+        return 0
@@ -0,0 +1,371 @@
+"""
+Parallel bulk ingestion of ads into Cosmos DB.
+
+Records are written through the async SDK (`azure.cosmos.aio`) with a bounded
+number of requests in flight. Records sharing the same partition key (`/city`)
+are grouped into transactional batches (`execute_item_batch`, at most 100
+operations each); partition keys with a single record use a plain upsert.
+
+Throttled requests (HTTP 429) are retried after the delay the service asks for
+in `x-ms-retry-after-ms`, falling back to exponential backoff. The request
+charge (`x-ms-request-charge`) of every response is summed so that each upload
+reports its RU consumption.
+
+The engine only needs an object with async `upsert_item` / `execute_item_batch`
+methods, so tests can pass a local stand-in instead of a real container.
+
+This module provides functions to:
+1. Prepare records for Cosmos DB (id and partition key)
+2. Ingest records asynchronously with batching, retries and RU accounting
+3. Run the ingestion from synchronous code, optionally sharing one client
+   and its containers between threads (CosmosSession)
+
+The Azure SDK is only imported once records are uploaded, so that importing
+the defaults of this module (e.g. DEFAULT_CONCURRENCY) does not load it.
+"""
+
+import uuid
+import random
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_OPERATIONS = 100  # Cosmos DB limit for a transactional batch
+DEFAULT_CONCURRENCY = 16
+DEFAULT_MAX_RETRIES = 8
+PARTITION_KEY_FIELD = "city"
+
+
+def prepare_cosmos_records(records: List[Dict[str, Any]], default_city: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Add the `id` and partition key required by Cosmos DB to each record (in place).
+
+    Args:
+        records: Records to upload (e.g. from DataFrame.to_dict('records'))
+        default_city: City used when a record has no `city` value
+
+    Returns:
+        The same list of records
+    """
+    for record in records:
+        if record.get('uuid'):
+            record['id'] = str(record['uuid'])  # Cosmos DB requires a unique ID
+        else:
+            record['id'] = str(uuid.uuid4())    # Generate UUID if not present
+
+        # Ensure partition key (city) is present
+        if not record.get(PARTITION_KEY_FIELD):
+            record[PARTITION_KEY_FIELD] = default_city
+    return records
+
+
+def new_ingest_stats() -> Dict[str, Any]:
+    """Create an empty statistics dictionary for an ingestion."""
+    return {
+        "successful": 0,
+        "failed": 0,
+        "request_charge": 0.0,
+        "throttled": 0,
+        "batches": 0,
+        "single_upserts": 0,
+        "succeeded_positions": [],
+        "errors": []
+    }
+
+
+def _retry_delay(error, attempt: int) -> float:
+    """Seconds to wait before retrying a throttled request."""
+    headers = getattr(error, "headers", None) or {}
+    retry_after_ms = headers.get("x-ms-retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    return min(0.1 * (2 ** attempt), 10.0) * random.uniform(0.5, 1.5)
+
+
+class CosmosIngestor:
+    """
+    Async writer of records into one Cosmos DB container.
+
+    Args:
+        container: Async container client (azure.cosmos.aio ContainerProxy or a stand-in)
+        concurrency: Maximum number of requests in flight
+        use_batches: Group records with the same partition key into transactional batches
+        max_batch_operations: Maximum operations per batch (capped at 100)
+        max_retries: Retries of a throttled (429) request before giving up
+        partition_key_field: Record field holding the partition key value
+    """
+
+    def __init__(
+        self,
+        container,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        use_batches: bool = True,
+        max_batch_operations: int = MAX_BATCH_OPERATIONS,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        partition_key_field: str = PARTITION_KEY_FIELD
+    ):
+        self.container = container
+        self.concurrency = max(1, concurrency)
+        self.use_batches = use_batches
+        self.max_batch_operations = max(1, min(max_batch_operations, MAX_BATCH_OPERATIONS))
+        self.max_retries = max_retries
+        self.partition_key_field = partition_key_field
+        self.stats = new_ingest_stats()
+
+    def _response_hook(self, headers, *_):
+        """Accumulate the request charge of every response."""
+        try:
+            self.stats["request_charge"] += float((headers or {}).get("x-ms-request-charge", 0) or 0)
+        except (TypeError, ValueError):
+            pass
+
+    def _record_error(self, message: str) -> None:
+        logger.warning(f"[WARNING] {message}")
+        if len(self.stats["errors"]) < 10:  # Limit number of stored errors
+            self.stats["errors"].append(message)
+
+    async def _with_retry(self, call):
+        """Run a request, retrying it while the service answers 429."""
+        from azure.cosmos.exceptions import CosmosHttpResponseError
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await call()
+            except CosmosHttpResponseError as e:
+                if e.status_code != 429 or attempt == self.max_retries:
+                    raise
+                self.stats["throttled"] += 1
+                await asyncio.sleep(_retry_delay(e, attempt))
+
+    def _plan(self, records: Sequence[Dict[str, Any]]) -> List[List[int]]:
+        """Split record positions into work units: batches per partition key, or single records."""
+        if not self.use_batches:
+            return [[i] for i in range(len(records))]
+
+        groups: Dict[Any, List[int]] = {}
+        for i, record in enumerate(records):
+            groups.setdefault(record.get(self.partition_key_field), []).append(i)
+
+        units = []
+        for positions in groups.values():
+            for start in range(0, len(positions), self.max_batch_operations):
+                units.append(positions[start:start + self.max_batch_operations])
+        return units
+
+    async def _upsert_one(self, records, position: int) -> None:
+        record = records[position]
+        try:
+            await self._with_retry(
+                lambda: self.container.upsert_item(body=record, response_hook=self._response_hook)
+            )
+            self.stats["successful"] += 1
+            self.stats["single_upserts"] += 1
+            self.stats["succeeded_positions"].append(position)
+        except Exception as e:
+            self.stats["failed"] += 1
+            self._record_error(f"Error uploading record {position + 1}: {str(e)}")
+
+    async def _upsert_batch(self, records, positions: List[int]) -> None:
+        from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosBatchOperationError
+
+        partition_key = records[positions[0]].get(self.partition_key_field)
+        operations = [("upsert", (records[i],)) for i in positions]
+        try:
+            await self._with_retry(
+                lambda: self.container.execute_item_batch(
+                    batch_operations=operations,
+                    partition_key=partition_key,
+                    response_hook=self._response_hook
+                )
+            )
+            self.stats["batches"] += 1
+            self.stats["successful"] += len(positions)
+            self.stats["succeeded_positions"].extend(positions)
+        except (CosmosBatchOperationError, CosmosHttpResponseError) as e:
+            # The batch is atomic: one bad record rolls back all of them, so retry them one by one
+            logger.warning(f"[WARNING] Batch for partition '{partition_key}' failed ({e.status_code}), retrying records individually")
+            for i in positions:
+                await self._upsert_one(records, i)
+
+    async def ingest(self, records: Sequence[Dict[str, Any]], log_every: int = 10) -> Dict[str, Any]:
+        """
+        Upsert all records, with at most `concurrency` requests in flight.
+
+        Args:
+            records: Prepared records (see prepare_cosmos_records)
+            log_every: Log progress every N completed work units
+
+        Returns:
+            Statistics: successful/failed counts, RU charge, throttled retries,
+            batches, and the positions of the records written successfully
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        units = self._plan(records)
+        done = 0
+
+        async def run(positions):
+            nonlocal done
+            async with semaphore:
+                if len(positions) > 1:
+                    await self._upsert_batch(records, positions)
+                else:
+                    await self._upsert_one(records, positions[0])
+            done += 1
+            if done % log_every == 0 or done == len(units):
+                logger.info(
+                    f"[INFO] Cosmos DB: {self.stats['successful']}/{len(records)} record scritti "
+                    f"({self.stats['request_charge']:.1f} RU)"
+                )
+
+        await asyncio.gather(*(run(positions) for positions in units))
+        self.stats["succeeded_positions"].sort()
+        return self.stats
+
+
+async def open_async_container(client, db_name: str, container_name: str):
+    """
+    Get (creating it if needed) a container from an async Cosmos client.
+
+    Args:
+        client: azure.cosmos.aio.CosmosClient
+        db_name: Database name
+        container_name: Container name
+
+    Returns:
+        Async container client partitioned by /city
+    """
+    from azure.cosmos import PartitionKey
+
+    db = client.get_database_client(db_name)
+    return await db.create_container_if_not_exists(id=container_name, partition_key=PartitionKey(path="/city"))
+
+
+async def ingest_records_async(
+    records: Sequence[Dict[str, Any]],
+    container=None,
+    endpoint: Optional[str] = None,
+    key: Optional[str] = None,
+    db_name: Optional[str] = None,
+    container_name: Optional[str] = None,
+    **ingestor_options
+) -> Dict[str, Any]:
+    """
+    Upsert records into Cosmos DB, either into `container` or into a container
+    opened from the connection settings.
+
+    Args:
+        records: Prepared records (see prepare_cosmos_records)
+        container: Async container client to use (optional)
+        endpoint: Cosmos DB account URI (used when no container is given)
+        key: Cosmos DB account key
+        db_name: Database name
+        container_name: Container name
+        **ingestor_options: Options passed to CosmosIngestor
+
+    Returns:
+        Ingestion statistics (see CosmosIngestor.ingest)
+    """
+    if container is not None:
+        return await CosmosIngestor(container, **ingestor_options).ingest(records)
+
+    from azure.cosmos.aio import CosmosClient
+
+    async with CosmosClient(endpoint, credential=key) as client:
+        async_container = await open_async_container(client, db_name, container_name)
+        return await CosmosIngestor(async_container, **ingestor_options).ingest(records)
+
+
+def ingest_records(records: Sequence[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+    """
+    Synchronous wrapper around ingest_records_async, for scripts.
+
+    Args:
+        records: Prepared records (see prepare_cosmos_records)
+        **kwargs: Arguments of ingest_records_async
+
+    Returns:
+        Ingestion statistics
+    """
+    return asyncio.run(ingest_records_async(records, **kwargs))
+
+
+class CosmosSession:
+    """
+    One async Cosmos client shared by several threads.
+
+    The client runs on a background event loop; every container is opened
+    (and created if needed) only once, and ingest() can be called concurrently
+    from any thread.
+
+    Args:
+        endpoint: Cosmos DB account URI
+        key: Cosmos DB account key
+        db_name: Database name
+    """
+
+    def __init__(self, endpoint: str, key: str, db_name: str):
+        self.endpoint = endpoint
+        self.key = key
+        self.db_name = db_name
+        self._client = None
+        self._containers: Dict[str, asyncio.Future] = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="cosmos-session", daemon=True)
+        self._thread.start()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _get_container(self, container_name: str):
+        if self._client is None:
+            from azure.cosmos.aio import CosmosClient
+            self._client = CosmosClient(self.endpoint, credential=self.key)
+        if container_name not in self._containers:
+            self._containers[container_name] = asyncio.ensure_future(
+                open_async_container(self._client, self.db_name, container_name)
+            )
+        try:
+            return await asyncio.shield(self._containers[container_name])
+        except Exception:
+            self._containers.pop(container_name, None)  # Let the next call try again
+            raise
+
+    async def _ingest(self, records, container_name, options):
+        container = await self._get_container(container_name)
+        return await CosmosIngestor(container, **options).ingest(records)
+
+    def ingest(self, records: Sequence[Dict[str, Any]], container_name: str, **ingestor_options) -> Dict[str, Any]:
+        """
+        Upsert records into a container of the shared client.
+
+        Args:
+            records: Prepared records (see prepare_cosmos_records)
+            container_name: Container name
+            **ingestor_options: Options passed to CosmosIngestor
+
+        Returns:
+            Ingestion statistics (see CosmosIngestor.ingest)
+        """
+        return self._run(self._ingest(records, container_name, ingestor_options))
+
+    def close(self) -> None:
+        """Close the client and stop the background event loop."""
+        if self._client is not None:
+            self._run(self._client.close())
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
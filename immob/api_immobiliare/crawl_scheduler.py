@@ -0,0 +1,527 @@
+"""
+Change-rate-aware scheduling of the crawls.
+
+Instead of crawling fixed cities at fixed times, the scheduler keeps a list of
+scopes (city, contract and optionally macrozones) and re-crawls each one at a
+frequency proportional to how fast its ads change:
+
+- After every crawl, the churn of the scope (new + changed + delisted ads) is
+  divided by the hours since its previous crawl, and the change rate of the
+  scope (changes per hour) is updated as an exponentially weighted moving
+  average (weight `alpha` for the latest observation).
+- The hourly request budget is shared among the scopes: a scope with change
+  rate r_i and p_i requests per crawl is crawled f_i = c * r_i times per hour,
+  with c chosen so that sum(f_i * p_i) equals the budget. A scope is never
+  crawled more often than once per expected change (f_i <= r_i): the budget
+  it leaves goes to the busier scopes. Intervals are kept within
+  [min_interval_hours, max_interval_hours]; scopes without a change rate yet
+  (fewer than two crawls) use `default_interval_hours`.
+- Before each crawl, the requests of the last hour (from the crawl history)
+  plus the expected requests of the crawl must fit the budget; otherwise the
+  scheduler waits.
+
+Every crawl runs process_ads with skip-unchanged and delisting tracking, so the
+churn counts only real changes. Scopes, change rates and the crawl history are
+stored in the SQLite database (the ads database by default), so the daemon can
+be restarted at any time.
+
+    python crawl_scheduler.py --db data/ads.db --add genova rent
+    python crawl_scheduler.py --db data/ads.db --add milano sale --max-pages 20
+    python crawl_scheduler.py --db data/ads.db --list
+    python crawl_scheduler.py --db data/ads.db --budget 300 --output-path data
+
+This module provides functions to:
+1. Register the scopes to crawl and their crawl history in SQLite
+2. Estimate the change rate of each scope and allocate the request budget
+3. Run the crawls when they are due, as a long-running daemon
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from crawl_sessions import crawl_scope
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET_PER_HOUR = 300
+DEFAULT_MIN_INTERVAL_HOURS = 0.5
+DEFAULT_MAX_INTERVAL_HOURS = 48.0
+DEFAULT_INTERVAL_HOURS = 6.0       # Scopes without a change rate yet
+DEFAULT_ALPHA = 0.3
+DEFAULT_REQUESTS_PER_CRAWL = 10    # Expected cost of a scope never crawled
+MIN_CHANGE_RATE = 0.01             # Changes per hour of a scope that never changes
+POLL_SECONDS = 60
+
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _format_time(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime(_TIME_FORMAT)
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.strptime(value, _TIME_FORMAT).replace(tzinfo=timezone.utc) if value else None
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def init_scheduler_tables(db_path: str) -> bool:
+    """
+    Initialize the crawl_scopes and scheduled_crawls tables.
+
+    Args:
+        db_path: Path to the SQLite database
+
+    Returns:
+        True if initialization was successful, False otherwise
+    """
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with get_connection(db_path) as conn:
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS crawl_scopes (
+                scope TEXT PRIMARY KEY,
+                city TEXT NOT NULL,
+                contract TEXT NOT NULL,
+                macrozones TEXT,
+                max_pages INTEGER,
+                enabled INTEGER NOT NULL DEFAULT 1,
+                crawls INTEGER NOT NULL DEFAULT 0,
+                change_rate REAL,
+                requests_per_crawl REAL,
+                interval_hours REAL,
+                last_crawled_at TIMESTAMP,
+                next_crawl_at TIMESTAMP,
+                last_error TEXT
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS scheduled_crawls (
+                crawl_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope TEXT NOT NULL,
+                started_at TIMESTAMP NOT NULL,
+                finished_at TIMESTAMP,
+                requests INTEGER NOT NULL DEFAULT 0,
+                new INTEGER NOT NULL DEFAULT 0,
+                changed INTEGER NOT NULL DEFAULT 0,
+                delisted INTEGER NOT NULL DEFAULT 0,
+                change_rate REAL,
+                error TEXT
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_scheduled_crawls_started ON scheduled_crawls(started_at);
+            CREATE INDEX IF NOT EXISTS idx_scheduled_crawls_scope ON scheduled_crawls(scope, started_at);
+            ''')
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error initializing scheduler tables: {e}")
+        return False
+
+
+def update_change_rate(previous: Optional[float], changes: int, hours: float, alpha: float = DEFAULT_ALPHA) -> float:
+    """
+    Exponentially weighted moving average of the changes per hour of a scope.
+
+    Args:
+        previous: Previous change rate (None for the first observation)
+        changes: New, changed and delisted ads seen by the crawl
+        hours: Hours since the previous crawl of the scope
+        alpha: Weight of the latest observation
+
+    Returns:
+        The updated change rate
+    """
+    observed = changes / max(hours, 1e-6)
+    return observed if previous is None else alpha * observed + (1 - alpha) * previous
+
+
+def allocate_intervals(
+    scopes: List[Dict[str, Any]],
+    budget_per_hour: float,
+    min_interval_hours: float = DEFAULT_MIN_INTERVAL_HOURS,
+    max_interval_hours: float = DEFAULT_MAX_INTERVAL_HOURS,
+    default_interval_hours: float = DEFAULT_INTERVAL_HOURS
+) -> Dict[str, float]:
+    """
+    Crawl interval of each scope, with frequencies proportional to the change
+    rates (at most one crawl per expected change) and the expected requests
+    per hour at most equal to the budget.
+
+    Args:
+        scopes: Dictionaries with scope, change_rate (None if unknown) and requests_per_crawl
+        budget_per_hour: Requests per hour shared by all the scopes
+        min_interval_hours: Shortest interval
+        max_interval_hours: Longest interval
+        default_interval_hours: Interval of the scopes without a change rate
+
+    Returns:
+        Mapping scope -> interval in hours
+    """
+    def clamp(hours: float) -> float:
+        return min(max(hours, min_interval_hours), max_interval_hours)
+
+    def cost(scope: Dict[str, Any]) -> float:
+        return scope.get("requests_per_crawl") or DEFAULT_REQUESTS_PER_CRAWL
+
+    def rate(scope: Dict[str, Any]) -> float:
+        return max(scope["change_rate"], MIN_CHANGE_RATE)
+
+    intervals = {}
+    for scope in scopes:
+        if scope.get("change_rate") is None:
+            intervals[scope["scope"]] = clamp(default_interval_hours)
+
+    # Budget left once the scopes without a change rate are served
+    remaining = budget_per_hour - sum(cost(scope) / intervals[scope["scope"]] for scope in scopes
+                                      if scope["scope"] in intervals)
+    free = [scope for scope in scopes if scope.get("change_rate") is not None]
+    frequencies = {}
+    while free and remaining > 0:
+        # A scope is never crawled more often than once per expected change (nor
+        # than min_interval_hours); the budget it leaves goes to the other scopes
+        factor = remaining / sum(rate(scope) * cost(scope) for scope in free)
+        saturated = [scope for scope in free if factor * rate(scope) >= min(rate(scope), 1 / min_interval_hours)]
+        if not saturated:
+            frequencies.update({scope["scope"]: factor * rate(scope) for scope in free})
+            break
+        for scope in saturated:
+            frequencies[scope["scope"]] = min(rate(scope), 1 / min_interval_hours)
+            remaining -= frequencies[scope["scope"]] * cost(scope)
+            free.remove(scope)
+    for scope in scopes:
+        if scope.get("change_rate") is not None:
+            frequency = frequencies.get(scope["scope"])
+            intervals[scope["scope"]] = clamp(1 / frequency) if frequency else max_interval_hours
+    return intervals
+
+
+def run_fetch_ads(scope: Dict[str, Any], base_config: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Crawl one scope with fetch_ads.process_ads.
+
+    Args:
+        scope: Row of crawl_scopes
+        base_config: process_ads configuration shared by all the scopes
+
+    Returns:
+        Counters: requests, new, changed, delisted
+    """
+    from fetch_ads import process_ads  # heavy, only needed when a crawl runs
+
+    config = dict(base_config)
+    config.update({
+        "city": scope["city"],
+        "contract_type": scope["contract"],
+        "macrozones": [zone for zone in (scope["macrozones"] or "").split(",") if zone],
+        "max_pages": scope["max_pages"],
+        "start_page": 1,
+        "skip_unchanged": True,
+        "track_delistings": True
+    })
+    df = process_ads(config)
+    results = df.attrs.get("results")
+    if results is None:
+        raise RuntimeError(f"crawl of {scope['scope']} did not run")
+    if results["sqlite"]["error"]:
+        raise RuntimeError(results["sqlite"]["error"])
+    return {
+        "requests": df.attrs.get("requests", 0),
+        "new": results["sqlite"]["new"],
+        "changed": results["sqlite"]["updated"],
+        "delisted": results["delistings"]["delisted"]
+    }
+
+
+class CrawlScheduler:
+    """
+    Schedule the crawls of the registered scopes within a request budget.
+
+    Args:
+        db_path: Path to the SQLite database holding the scheduler state
+        crawl: Function crawling one scope (a crawl_scopes row) and returning
+            the counters requests, new, changed and delisted
+        budget_per_hour: Requests per hour shared by all the scopes
+        min_interval_hours: Shortest interval between two crawls of a scope
+        max_interval_hours: Longest interval between two crawls of a scope
+        default_interval_hours: Interval of the scopes without a change rate yet
+        alpha: Weight of the latest crawl in the change rate
+        clock: Function returning the current UTC datetime (for tests)
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        crawl: Callable[[Dict[str, Any]], Dict[str, int]],
+        budget_per_hour: float = DEFAULT_BUDGET_PER_HOUR,
+        min_interval_hours: float = DEFAULT_MIN_INTERVAL_HOURS,
+        max_interval_hours: float = DEFAULT_MAX_INTERVAL_HOURS,
+        default_interval_hours: float = DEFAULT_INTERVAL_HOURS,
+        alpha: float = DEFAULT_ALPHA,
+        clock: Callable[[], datetime] = _utc_now
+    ):
+        if not init_scheduler_tables(db_path):
+            raise sqlite3.DatabaseError(f"Could not initialize the scheduler tables in {db_path}")
+        self.db_path = db_path
+        self.crawl = crawl
+        self.budget_per_hour = budget_per_hour
+        self.min_interval_hours = min_interval_hours
+        self.max_interval_hours = max_interval_hours
+        self.default_interval_hours = default_interval_hours
+        self.alpha = alpha
+        self.clock = clock
+
+    def add_scope(self, city: str, contract: str, macrozones: Optional[Iterable[Any]] = None,
+                  max_pages: Optional[int] = None) -> str:
+        """
+        Register a scope (or re-enable it), due immediately if it was never crawled.
+
+        Returns:
+            The scope key (see crawl_sessions.crawl_scope)
+        """
+        scope = crawl_scope(city, contract, macrozones)
+        zones = ",".join(sorted(str(zone) for zone in macrozones or []))
+        with get_connection(self.db_path) as conn:
+            conn.execute('''
+                INSERT INTO crawl_scopes (scope, city, contract, macrozones, max_pages, next_crawl_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(scope) DO UPDATE SET enabled = 1, max_pages = excluded.max_pages
+            ''', (scope, city.lower(), contract, zones, max_pages, _format_time(self.clock())))
+            conn.commit()
+        self.reschedule()
+        return scope
+
+    def remove_scope(self, scope: str) -> bool:
+        """Disable a scope; its history is kept. Returns False if it does not exist."""
+        with get_connection(self.db_path) as conn:
+            updated = conn.execute("UPDATE crawl_scopes SET enabled = 0 WHERE scope = ?", (scope,)).rowcount
+            conn.commit()
+        self.reschedule()
+        return bool(updated)
+
+    def scopes(self) -> pd.DataFrame:
+        """The enabled scopes with their change rate and schedule, next due first."""
+        with get_connection(self.db_path) as conn:
+            return pd.read_sql_query(
+                "SELECT * FROM crawl_scopes WHERE enabled = 1 ORDER BY next_crawl_at", conn
+            )
+
+    def requests_last_hour(self) -> int:
+        """Requests sent by the crawls started in the last hour."""
+        since = _format_time(self.clock() - timedelta(hours=1))
+        with get_connection(self.db_path) as conn:
+            return conn.execute(
+                "SELECT COALESCE(SUM(requests), 0) FROM scheduled_crawls WHERE started_at >= ?", (since,)
+            ).fetchone()[0]
+
+    def reschedule(self) -> None:
+        """Recompute the interval and next crawl time of every enabled scope."""
+        with get_connection(self.db_path) as conn:
+            rows = [dict(row) for row in conn.execute("SELECT * FROM crawl_scopes WHERE enabled = 1")]
+            intervals = allocate_intervals(
+                rows, self.budget_per_hour, self.min_interval_hours,
+                self.max_interval_hours, self.default_interval_hours
+            )
+            for row in rows:
+                last_crawled = _parse_time(row["last_crawled_at"])
+                next_crawl = row["next_crawl_at"]
+                if last_crawled is not None:
+                    next_crawl = _format_time(last_crawled + timedelta(hours=intervals[row["scope"]]))
+                conn.execute(
+                    "UPDATE crawl_scopes SET interval_hours = ?, next_crawl_at = ? WHERE scope = ?",
+                    (intervals[row["scope"]], next_crawl, row["scope"])
+                )
+            conn.commit()
+
+    def next_due(self) -> Optional[Dict[str, Any]]:
+        """The most overdue scope, or None if no scope is due."""
+        with get_connection(self.db_path) as conn:
+            row = conn.execute('''
+                SELECT * FROM crawl_scopes WHERE enabled = 1 AND next_crawl_at <= ?
+                ORDER BY next_crawl_at LIMIT 1
+            ''', (_format_time(self.clock()),)).fetchone()
+        return dict(row) if row else None
+
+    def run_once(self) -> Optional[Dict[str, Any]]:
+        """
+        Crawl the most overdue scope if the request budget allows it.
+
+        Returns:
+            The counters of the crawl (with scope and change_rate), or None if
+            nothing was crawled (nothing due, or budget exhausted)
+        """
+        scope = self.next_due()
+        if scope is None:
+            return None
+        expected = scope["requests_per_crawl"] or DEFAULT_REQUESTS_PER_CRAWL
+        spent = self.requests_last_hour()
+        if spent > 0 and spent + expected > self.budget_per_hour:
+            logger.info(f"[INFO] Request budget reached ({spent}/{self.budget_per_hour} in the last hour), "
+                        f"{scope['scope']} waits")
+            return None
+
+        started = self.clock()
+        logger.info(f"[INFO] Crawling {scope['scope']} (change rate: {scope['change_rate']}, "
+                    f"interval: {scope['interval_hours']}h)")
+        error = None
+        try:
+            counters = self.crawl(scope)
+        except Exception as e:
+            logger.error(f"[ERROR] Crawl of {scope['scope']} failed: {e}")
+            counters, error = {}, str(e)
+        finished = self.clock()
+        stats = {key: int(counters.get(key, 0)) for key in ("requests", "new", "changed", "delisted")}
+        stats.update(scope=scope["scope"], error=error, change_rate=scope["change_rate"])
+
+        last_crawled = _parse_time(scope["last_crawled_at"])
+        if error is None and last_crawled is not None:
+            # The first crawl only fills the database, its churn is not a rate
+            hours = (started - last_crawled).total_seconds() / 3600
+            stats["change_rate"] = update_change_rate(
+                scope["change_rate"], stats["new"] + stats["changed"] + stats["delisted"], hours, self.alpha
+            )
+        requests_per_crawl = scope["requests_per_crawl"]
+        if error is None and stats["requests"]:
+            requests_per_crawl = (stats["requests"] if requests_per_crawl is None
+                                  else self.alpha * stats["requests"] + (1 - self.alpha) * requests_per_crawl)
+
+        with get_connection(self.db_path) as conn:
+            conn.execute('''
+                INSERT INTO scheduled_crawls (scope, started_at, finished_at, requests, new, changed, delisted,
+                                              change_rate, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (scope["scope"], _format_time(started), _format_time(finished), stats["requests"], stats["new"],
+                  stats["changed"], stats["delisted"], stats["change_rate"], error))
+            if error is None:
+                conn.execute('''
+                    UPDATE crawl_scopes SET crawls = crawls + 1, change_rate = ?, requests_per_crawl = ?,
+                        last_crawled_at = ?, last_error = NULL
+                    WHERE scope = ?
+                ''', (stats["change_rate"], requests_per_crawl, _format_time(started), scope["scope"]))
+            else:
+                # Retry after the shortest interval rather than hammering a failing scope
+                retry_at = finished + timedelta(hours=self.min_interval_hours)
+                conn.execute("UPDATE crawl_scopes SET last_error = ?, next_crawl_at = ? WHERE scope = ?",
+                             (error, _format_time(retry_at), scope["scope"]))
+            conn.commit()
+        if error is None:
+            self.reschedule()
+            logger.info(
+                f"[INFO] {scope['scope']}: {stats['new']} new, {stats['changed']} changed, "
+                f"{stats['delisted']} delisted, {stats['requests']} requests, "
+                f"change rate {stats['change_rate'] if stats['change_rate'] is not None else 'n/a'}/h"
+            )
+        return stats
+
+    def seconds_until_next(self) -> float:
+        """Seconds until the next scope is due (0 if one is due, POLL_SECONDS if none is registered)."""
+        with get_connection(self.db_path) as conn:
+            row = conn.execute("SELECT MIN(next_crawl_at) FROM crawl_scopes WHERE enabled = 1").fetchone()
+        next_crawl = _parse_time(row[0]) if row and row[0] else None
+        if next_crawl is None:
+            return POLL_SECONDS
+        return max(0.0, (next_crawl - self.clock()).total_seconds())
+
+    def run_forever(self, poll_seconds: float = POLL_SECONDS, max_crawls: Optional[int] = None) -> int:
+        """
+        Run the due crawls until interrupted.
+
+        Args:
+            poll_seconds: Longest sleep between two checks (the budget and new scopes are re-read)
+            max_crawls: Stop after this many crawls (optional)
+
+        Returns:
+            Number of crawls run
+        """
+        crawls = 0
+        try:
+            while max_crawls is None or crawls < max_crawls:
+                if self.run_once() is not None:
+                    crawls += 1
+                    continue
+                time.sleep(min(poll_seconds, max(1.0, self.seconds_until_next())))
+        except KeyboardInterrupt:
+            logger.info(f"[INFO] Scheduler stopped after {crawls} crawls")
+        return crawls
+
+
+def main():
+    """Run the crawl scheduler or manage its scopes from the command line."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Crawl scopes at a frequency proportional to their change rate')
+    parser.add_argument('--db', type=str, required=True, help='SQLite database of the ads and of the scheduler state')
+    parser.add_argument('--add', nargs=2, metavar=('CITY', 'CONTRACT'), help='Register a scope')
+    parser.add_argument('--macrozones', nargs='+', default=[], help='Macrozone IDs of the scope to add')
+    parser.add_argument('--max-pages', type=int, help='Maximum pages per crawl of the scope to add (default: all)')
+    parser.add_argument('--remove', type=str, metavar='SCOPE', help='Disable a scope, e.g. "genova|rent|"')
+    parser.add_argument('--list', action='store_true', help='List the scopes and their schedule')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_PER_HOUR,
+                        help=f'Requests per hour across all scopes (default: {DEFAULT_BUDGET_PER_HOUR})')
+    parser.add_argument('--min-interval-hours', type=float, default=DEFAULT_MIN_INTERVAL_HOURS,
+                        help=f'Shortest interval between crawls of a scope (default: {DEFAULT_MIN_INTERVAL_HOURS})')
+    parser.add_argument('--max-interval-hours', type=float, default=DEFAULT_MAX_INTERVAL_HOURS,
+                        help=f'Longest interval between crawls of a scope (default: {DEFAULT_MAX_INTERVAL_HOURS})')
+    parser.add_argument('--output-path', type=str, default='.', help='Output directory of the crawls (default: .)')
+    parser.add_argument('--save-cosmos', action='store_true', help='Also save the crawls to Cosmos DB')
+    parser.add_argument('--once', action='store_true', help='Run the due crawls once and exit')
+    args = parser.parse_args()
+
+    def crawl(scope):
+        from fetch_ads import DEFAULT_HEADERS
+        from helpers import load_env_vars
+
+        env_vars = load_env_vars()
+        return run_fetch_ads(scope, {
+            "base_url": env_vars["BASE_URL"],
+            "headers": DEFAULT_HEADERS,
+            "cookies": env_vars["COOKIES"],
+            "cosmos_endpoint": env_vars["COSMOS_ENDPOINT"],
+            "cosmos_key": env_vars["COSMOS_KEY"],
+            "cosmos_db": env_vars["COSMOS_DB"],
+            "output_path": args.output_path,
+            "save_to_cosmos": args.save_cosmos,
+            "save_to_sqlite": True,
+            "save_to_csv": False,
+            "sqlite_db_path": args.db
+        })
+
+    scheduler = CrawlScheduler(
+        args.db,
+        crawl,
+        budget_per_hour=args.budget,
+        min_interval_hours=args.min_interval_hours,
+        max_interval_hours=args.max_interval_hours
+    )
+    if args.add:
+        scope = scheduler.add_scope(args.add[0], args.add[1], args.macrozones, args.max_pages)
+        logger.info(f"[INFO] Scope {scope} registered")
+    if args.remove:
+        if not scheduler.remove_scope(args.remove):
+            logger.error(f"[ERROR] Scope {args.remove} not found")
+    if args.list:
+        scopes = scheduler.scopes()
+        columns = ["scope", "crawls", "change_rate", "requests_per_crawl", "interval_hours", "last_crawled_at", "next_crawl_at"]
+        print(scopes[columns].to_string(index=False) if not scopes.empty else "No scopes registered")
+    if args.add or args.remove or args.list:
+        return
+
+    if args.once:
+        while scheduler.run_once() is not None:
+            pass
+    else:
+        logger.info(f"[INFO] Scheduler started with a budget of {args.budget} requests per hour")
+        scheduler.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Crawl sessions and delisting detection.
+
+Each run of fetch_ads.py crawls one scope (city, contract and macrozones). A
+CrawlSession collects the URLs seen during the run in a TEMP table; when the
+run ends, two set-based statements update the listing_status table: the seen
+URLs are upserted (first/last seen, relisted ads), and every ad of the scope
+that was not seen is marked as delisted, with a timestamp. Python never builds
+a set over the whole table, so scopes of 100k ads cost two indexed statements.
+
+Delistings are only recorded for complete crawls (every page of the search
+was fetched): a crawl stopped by --max-pages or by an error only refreshes the
+ads it saw. As a further guard against blocked or truncated responses, a crawl
+that saw less than `min_seen_ratio` of the active ads of its scope does not
+delist anything.
+
+    python crawl_sessions.py --db data/ads.db --sessions
+    python crawl_sessions.py --db data/ads.db --delisted --since 2024-05-01
+
+This module provides functions to:
+1. Create the crawl_sessions and listing_status tables
+2. Record the ads seen by a crawl and mark the missing ones as delisted
+3. Read the crawl history and the delisted ads
+"""
+
+import os
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_SEEN_RATIO = 0.5
+
+
+def init_crawl_tables(db_path: str) -> bool:
+    """
+    Initialize the crawl session tables.
+
+    Args:
+        db_path: Path to the SQLite database (usually the ads database)
+
+    Returns:
+        True if initialization was successful, False otherwise
+    """
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with get_connection(db_path) as conn:
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS crawl_sessions (
+                session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope TEXT NOT NULL,
+                city TEXT,
+                contract TEXT,
+                macrozones TEXT,
+                started_at TIMESTAMP NOT NULL,
+                finished_at TIMESTAMP,
+                complete BOOLEAN,
+                seen INTEGER,
+                new INTEGER,
+                relisted INTEGER,
+                delisted INTEGER
+            );
+
+            CREATE TABLE IF NOT EXISTS listing_status (
+                url TEXT PRIMARY KEY,
+                scope TEXT NOT NULL,
+                first_seen_at TIMESTAMP NOT NULL,
+                last_seen_at TIMESTAMP NOT NULL,
+                last_session_id INTEGER NOT NULL,
+                delisted_at TIMESTAMP
+            ) WITHOUT ROWID;
+
+            CREATE INDEX IF NOT EXISTS idx_listing_status_scope ON listing_status(scope, delisted_at);
+            CREATE INDEX IF NOT EXISTS idx_listing_status_delisted ON listing_status(delisted_at);
+            ''')
+            # Ads still on the site, when the ads table lives in the same database
+            if conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'real_estate_ads'"
+            ).fetchone():
+                conn.execute('''
+                CREATE VIEW IF NOT EXISTS active_ads AS
+                SELECT a.* FROM real_estate_ads a
+                LEFT JOIN listing_status s ON s.url = a.url
+                WHERE s.delisted_at IS NULL
+                ''')
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error initializing crawl tables: {e}")
+        return False
+
+
+def crawl_scope(city: str, contract: str, macrozones: Optional[Iterable[Any]] = None) -> str:
+    """Key of the scope of a crawl, e.g. "genova|rent|10001,10002"."""
+    zones = ",".join(sorted(str(zone) for zone in macrozones or []))
+    return f"{(city or '').lower()}|{contract or ''}|{zones}"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class CrawlSession:
+    """
+    The set of ads seen by one crawl of a scope.
+
+    Use it as a context manager: the URLs added with add_seen() are diffed
+    against listing_status by finish(), or when the block ends (as an
+    incomplete crawl if an exception was raised).
+
+    Args:
+        db_path: Path to the SQLite database holding the crawl tables
+        city: City of the crawl
+        contract: Contract type of the crawl
+        macrozones: Macrozone filters of the crawl (optional)
+        min_seen_ratio: Minimum share of the active ads of the scope a crawl must see to delist the others
+    """
+
+    def __init__(self, db_path: str, city: str, contract: str, macrozones: Optional[Iterable[Any]] = None,
+                 min_seen_ratio: float = DEFAULT_MIN_SEEN_RATIO):
+        self.db_path = db_path
+        self.city = city
+        self.contract = contract
+        self.macrozones = list(macrozones or [])
+        self.scope = crawl_scope(city, contract, self.macrozones)
+        self.min_seen_ratio = min_seen_ratio
+        self.session_id = None
+        self.stats = None
+        self.conn = None
+
+    def start(self) -> "CrawlSession":
+        """Register the session and create the TEMP table of seen URLs."""
+        if not init_crawl_tables(self.db_path):
+            raise sqlite3.OperationalError(f"Crawl tables not available in {self.db_path}")
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("CREATE TEMP TABLE seen_urls (url TEXT PRIMARY KEY) WITHOUT ROWID")
+        cursor = self.conn.execute(
+            "INSERT INTO crawl_sessions (scope, city, contract, macrozones, started_at) VALUES (?, ?, ?, ?, ?)",
+            (self.scope, self.city, self.contract, ",".join(map(str, self.macrozones)), _now())
+        )
+        self.session_id = cursor.lastrowid
+        self.conn.commit()
+        return self
+
+    def add_seen(self, urls: Iterable[Any]) -> None:
+        """
+        Add the URLs of a page or batch of ads to the session.
+
+        Args:
+            urls: URLs of the ads (missing values are ignored)
+        """
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO seen_urls VALUES (?)",
+            ((str(url),) for url in urls if isinstance(url, str) and url)
+        )
+
+    def finish(self, complete: bool) -> Dict[str, Any]:
+        """
+        Update listing_status from the seen URLs and close the session.
+
+        Args:
+            complete: Whether every page of the search was fetched; only then are missing ads delisted
+
+        Returns:
+            Dictionary with seen, new, relisted and delisted counts, and the reason delisting was skipped
+        """
+        if self.stats is not None:
+            return self.stats
+        now = _now()
+        conn = self.conn
+        stats = {"session_id": self.session_id, "scope": self.scope, "complete": complete,
+                 "seen": 0, "new": 0, "relisted": 0, "delisted": 0, "skipped": None}
+        try:
+            stats["seen"] = conn.execute("SELECT COUNT(*) FROM seen_urls").fetchone()[0]
+            known, relisted = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(l.delisted_at IS NOT NULL), 0)
+                FROM seen_urls s JOIN listing_status l ON l.url = s.url
+            ''').fetchone()
+            active = conn.execute(
+                "SELECT COUNT(*) FROM listing_status WHERE scope = ? AND delisted_at IS NULL", (self.scope,)
+            ).fetchone()[0]
+            stats["new"], stats["relisted"] = stats["seen"] - known, relisted
+
+            # Seen ads: new, still listed or back on the site
+            conn.execute('''
+                INSERT INTO listing_status (url, scope, first_seen_at, last_seen_at, last_session_id, delisted_at)
+                SELECT url, ?, ?, ?, ?, NULL FROM seen_urls WHERE true
+                ON CONFLICT(url) DO UPDATE SET
+                    scope = excluded.scope,
+                    last_seen_at = excluded.last_seen_at,
+                    last_session_id = excluded.last_session_id,
+                    delisted_at = NULL
+            ''', (self.scope, now, now, self.session_id))
+
+            # Ads of the scope not seen by this crawl
+            if not complete:
+                stats["skipped"] = "incomplete crawl"
+            elif stats["seen"] < self.min_seen_ratio * active:
+                stats["skipped"] = f"only {stats['seen']} of {active} active ads seen"
+            else:
+                cursor = conn.execute('''
+                    UPDATE listing_status SET delisted_at = ?
+                    WHERE scope = ? AND delisted_at IS NULL AND last_session_id <> ?
+                ''', (now, self.scope, self.session_id))
+                stats["delisted"] = cursor.rowcount
+
+            conn.execute('''
+                UPDATE crawl_sessions SET finished_at = ?, complete = ?, seen = ?, new = ?, relisted = ?, delisted = ?
+                WHERE session_id = ?
+            ''', (now, complete, stats["seen"], stats["new"], stats["relisted"], stats["delisted"], self.session_id))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"[ERRORE] Aggiornamento degli annunci rimossi fallito: {e}")
+            stats["skipped"] = str(e)
+        finally:
+            conn.close()
+
+        if stats["skipped"]:
+            logger.warning(f"[WARNING] Annunci rimossi non rilevati per {self.scope}: {stats['skipped']}")
+        logger.info(
+            f"[INFO] Sessione {self.session_id} ({self.scope}): {stats['seen']} visti, {stats['new']} nuovi, "
+            f"{stats['relisted']} ripubblicati, {stats['delisted']} rimossi"
+        )
+        self.stats = stats
+        return stats
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.stats is None:
+            self.finish(complete=False)
+
+
+def record_crawl(db_path: str, city: str, contract: str, urls: Iterable[Any], complete: bool,
+                 macrozones: Optional[Iterable[Any]] = None,
+                 min_seen_ratio: float = DEFAULT_MIN_SEEN_RATIO) -> Dict[str, Any]:
+    """
+    Record a finished crawl in one call.
+
+    Args:
+        db_path: Path to the SQLite database holding the crawl tables
+        city: City of the crawl
+        contract: Contract type of the crawl
+        urls: URLs of all the ads seen
+        complete: Whether every page of the search was fetched
+        macrozones: Macrozone filters of the crawl (optional)
+        min_seen_ratio: See CrawlSession
+
+    Returns:
+        Statistics of the session (see CrawlSession.finish)
+    """
+    with CrawlSession(db_path, city, contract, macrozones, min_seen_ratio) as session:
+        session.add_seen(urls)
+        return session.finish(complete)
+
+
+def read_delisted(db_path: str, since: Optional[str] = None, scope: Optional[str] = None) -> pd.DataFrame:
+    """
+    Read the ads marked as delisted.
+
+    Args:
+        db_path: Path to the SQLite database holding the crawl tables
+        since: Only ads delisted at or after this date/timestamp (optional)
+        scope: Only ads of this scope, see crawl_scope (optional)
+
+    Returns:
+        DataFrame with url, scope, first_seen_at, last_seen_at and delisted_at
+    """
+    query = "SELECT url, scope, first_seen_at, last_seen_at, delisted_at FROM listing_status WHERE delisted_at IS NOT NULL"
+    params: List[Any] = []
+    if since:
+        query += " AND delisted_at >= ?"
+        params.append(since)
+    if scope:
+        query += " AND scope = ?"
+        params.append(scope)
+    query += " ORDER BY delisted_at DESC"
+    try:
+        with get_connection(db_path) as conn:
+            return pd.read_sql_query(query, conn, params=params)
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        logger.error(f"Error reading delisted ads: {e}")
+        return pd.DataFrame()
+
+
+def read_crawl_sessions(db_path: str, limit: int = 20) -> pd.DataFrame:
+    """
+    Read the most recent crawl sessions.
+
+    Args:
+        db_path: Path to the SQLite database holding the crawl tables
+        limit: Maximum number of sessions
+
+    Returns:
+        DataFrame of sessions, most recent first
+    """
+    try:
+        with get_connection(db_path) as conn:
+            return pd.read_sql_query(
+                "SELECT * FROM crawl_sessions ORDER BY session_id DESC LIMIT ?", conn, params=[limit]
+            )
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        logger.error(f"Error reading crawl sessions: {e}")
+        return pd.DataFrame()
+
+
+def main():
+    """Show the crawl history or the delisted ads from the command line."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Crawl sessions and delisted ads')
+    parser.add_argument('--db', type=str, required=True, help='Path to the SQLite database')
+    parser.add_argument('--sessions', action='store_true', help='Show the most recent crawl sessions')
+    parser.add_argument('--delisted', action='store_true', help='Show the delisted ads')
+    parser.add_argument('--since', type=str, help='Only ads delisted since this date (YYYY-MM-DD)')
+    parser.add_argument('--limit', type=int, default=20, help='Maximum number of sessions shown (default: 20)')
+    args = parser.parse_args()
+
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        if args.sessions:
+            print(read_crawl_sessions(args.db, args.limit).to_string(index=False))
+        if args.delisted:
+            df = read_delisted(args.db, since=args.since)
+            logger.info(f"[INFO] {len(df)} annunci rimossi")
+            if not df.empty:
+                print(df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
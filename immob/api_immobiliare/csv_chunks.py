@@ -0,0 +1,257 @@
+"""
+Memory-bounded, resumable reading of large CSV files.
+
+The file is read as bytes and split into chunks of whole records: a newline
+only ends a record when it is outside a quoted field (even number of quote
+characters so far), so descriptions with embedded newlines are never cut.
+Each chunk is parsed on its own with pandas, together with the header line,
+and the byte offset where it ends is reported. Only a few chunks are in memory
+at a time.
+
+The offset after the last chunk uploaded successfully is stored in a
+`<csv>.progress.json` file next to the CSV, so an interrupted upload can
+resume from there instead of starting over.
+
+Splitting the file into byte ranges is cheap, so the parsing of the ranges can
+be spread over a process pool.
+
+This module provides functions to:
+1. Split a CSV file into byte ranges of whole records and parse a range
+2. Iterate over a CSV file in DataFrame chunks with their byte offsets
+3. Save, load and clear the upload progress of a CSV file
+"""
+
+import io
+import os
+import logging
+from collections import deque
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import pandas as pd
+
+import json_codec
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKSIZE = 50000
+
+
+def progress_path(csv_path: str) -> str:
+    """Path of the progress file of a CSV file."""
+    return f"{csv_path}.progress.json"
+
+
+def load_progress(csv_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Load the saved upload progress of a CSV file.
+
+    The progress is ignored if the size or modification time of the file
+    differs from the saved ones, i.e. it was replaced or rewritten since the
+    last run, since the saved offset may no longer be a record boundary.
+
+    Args:
+        csv_path: Path to the CSV file
+
+    Returns:
+        Progress dictionary ({"offset", "rows", "size", "mtime_ns"}) or None
+    """
+    path = progress_path(csv_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        progress = json_codec.load_file(path)
+    except Exception as e:
+        logger.warning(f"[WARNING] Could not read progress file {path}: {e}")
+        return None
+    stat = os.stat(csv_path)
+    if (stat.st_size, stat.st_mtime_ns) != (progress.get("size"), progress.get("mtime_ns")):
+        logger.warning(f"[WARNING] {csv_path} changed since the last run, starting from the beginning")
+        return None
+    return progress
+
+
+def save_progress(csv_path: str, offset: int, rows: int) -> None:
+    """
+    Save the upload progress of a CSV file (atomically).
+
+    Args:
+        csv_path: Path to the CSV file
+        offset: Byte offset after the last record uploaded
+        rows: Number of data rows read up to `offset`
+    """
+    path = progress_path(csv_path)
+    tmp_path = f"{path}.tmp"
+    stat = os.stat(csv_path)
+    json_codec.dump_file({"offset": offset, "rows": rows, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+                         tmp_path)
+    os.replace(tmp_path, path)
+
+
+def clear_progress(csv_path: str) -> None:
+    """Remove the progress file of a CSV file, once it has been fully uploaded."""
+    path = progress_path(csv_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _read_record(f) -> bytes:
+    """Read one CSV record, which may span several lines if a quoted field contains newlines."""
+    record = f.readline()
+    quotes = record.count(b'"')
+    while quotes % 2 and record:
+        line = f.readline()
+        if not line:
+            break
+        record += line
+        quotes += line.count(b'"')
+    return record
+
+
+def iter_csv_ranges(csv_path: str, chunksize: int = DEFAULT_CHUNKSIZE, start_offset: int = 0) -> Iterator[Tuple[int, int]]:
+    """
+    Split a CSV file into byte ranges of at most `chunksize` whole records, without parsing them.
+
+    Args:
+        csv_path: Path to the CSV file
+        chunksize: Maximum number of records per range
+        start_offset: Byte offset to start from (0 or a saved offset)
+
+    Yields:
+        Tuples of (start offset, end offset)
+    """
+    with open(csv_path, 'rb') as f:
+        _read_record(f)  # header
+        if start_offset > f.tell():
+            f.seek(start_offset)
+
+        while True:
+            start = f.tell()
+            rows = 0
+            while rows < chunksize and _read_record(f):
+                rows += 1
+            if not rows:
+                return
+            yield start, f.tell()
+
+
+def read_csv_range(csv_path: str, start: Optional[int] = None, end: Optional[int] = None,
+                   transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+                   **read_csv_kwargs) -> pd.DataFrame:
+    """
+    Parse a byte range of a CSV file (the whole file if no range is given).
+
+    This is a module-level function so that it can run in a process pool.
+
+    Args:
+        csv_path: Path to the CSV file
+        start: Start offset of the range, as returned by iter_csv_ranges
+        end: End offset of the range
+        transform: Optional function applied to the parsed DataFrame (e.g. cleaning)
+        **read_csv_kwargs: Extra arguments for pandas.read_csv
+
+    Returns:
+        The parsed (and transformed) DataFrame
+    """
+    if start is None:
+        df = pd.read_csv(csv_path, **read_csv_kwargs)
+    else:
+        with open(csv_path, 'rb') as f:
+            buffer = io.BytesIO()
+            buffer.write(_read_record(f))
+            f.seek(start)
+            buffer.write(f.read(end - start))
+        buffer.seek(0)
+        df = pd.read_csv(buffer, **read_csv_kwargs)
+    return transform(df) if transform is not None else df
+
+
+def iter_csv_chunks(
+    csv_path: str,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    start_offset: int = 0,
+    **read_csv_kwargs
+) -> Iterator[Tuple[pd.DataFrame, int]]:
+    """
+    Iterate over a CSV file in DataFrames of at most `chunksize` rows.
+
+    Args:
+        csv_path: Path to the CSV file
+        chunksize: Maximum number of rows per chunk
+        start_offset: Byte offset to start from (0 or a saved offset)
+        **read_csv_kwargs: Extra arguments for pandas.read_csv
+
+    Yields:
+        Tuples of (chunk DataFrame, byte offset after the chunk)
+    """
+    for start, end in iter_csv_ranges(csv_path, chunksize, start_offset):
+        yield read_csv_range(csv_path, start, end, **read_csv_kwargs), end
+
+
+def _prefetch_chunks(executor: Executor, csv_path: str, ranges, transform, prefetch: int):
+    """Parse ranges in the executor, keeping at most `prefetch` chunks in progress ahead of the consumer."""
+    pending = deque()
+    for start, end in ranges:
+        pending.append((executor.submit(read_csv_range, csv_path, start, end, transform), end))
+        if len(pending) > prefetch:
+            future, chunk_end = pending.popleft()
+            yield future.result(), chunk_end
+    while pending:
+        future, chunk_end = pending.popleft()
+        yield future.result(), chunk_end
+
+
+def iter_csv_frames(
+    csv_path: str,
+    chunksize: Optional[int] = None,
+    resume: bool = False,
+    transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    executor: Optional[Executor] = None,
+    prefetch: int = 2
+) -> Iterator[Tuple[pd.DataFrame, int, int]]:
+    """
+    Iterate over a CSV file as one DataFrame, or in chunks when `chunksize` is set.
+
+    With an executor (e.g. a ProcessPoolExecutor), parsing and `transform` run
+    in the pool and up to `prefetch` chunks are prepared ahead of the consumer.
+    Progress is logged after each chunk as the share of the file read.
+
+    Args:
+        csv_path: Path to the CSV file
+        chunksize: Rows per chunk (None reads the whole file at once)
+        resume: Start from the offset saved by a previous interrupted run
+        transform: Optional function applied to every DataFrame (must be picklable with an executor)
+        executor: Optional executor used to parse and transform chunks
+        prefetch: Number of chunks submitted ahead when using an executor
+
+    Yields:
+        Tuples of (DataFrame, byte offset after it, data rows read so far including it)
+    """
+    size = os.path.getsize(csv_path)
+    if not chunksize:
+        if executor is not None:
+            df = executor.submit(read_csv_range, csv_path, None, None, transform).result()
+        else:
+            df = read_csv_range(csv_path, transform=transform)
+        yield df, size, len(df)
+        return
+
+    start_offset, rows = 0, 0
+    if resume:
+        progress = load_progress(csv_path)
+        if progress:
+            start_offset, rows = progress["offset"], progress["rows"]
+            logger.info(f"[INFO] Resuming {csv_path} from byte {start_offset} ({rows} rows already uploaded)")
+
+    ranges = iter_csv_ranges(csv_path, chunksize, start_offset)
+    if executor is None:
+        chunks = ((read_csv_range(csv_path, start, end, transform), end) for start, end in ranges)
+    else:
+        chunks = _prefetch_chunks(executor, csv_path, ranges, transform, prefetch)
+
+    for df, end in chunks:
+        rows += len(df)
+        logger.info(f"[INFO] {Path(csv_path).name}: {rows} rows read, {end / (size or 1):.1%} of the file")
+        yield df, end, rows
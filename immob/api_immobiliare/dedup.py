@@ -0,0 +1,493 @@
+"""
+Near-duplicate detection of listings published by several agencies.
+
+The same flat often appears several times with a different uuid, agency and
+wording. Comparing every pair of listings is not feasible (200k listings are
+20 billion pairs), so duplicates are found in near-linear time:
+
+1. Blocking: only listings with the same contract, number of rooms and
+   geohash cell (precision 5, about 5 x 5 km, computed from the coordinates)
+   can be duplicates.
+2. MinHash: title and description are normalised (case, accents,
+   punctuation) and cut into word shingles; each listing gets a signature of
+   `num_perm` minimum hashes, whose agreement estimates the Jaccard
+   similarity of two texts.
+3. LSH: signatures are split into bands; listings sharing a band within the
+   same block become candidates. Candidates are verified on the estimated
+   similarity and on the surface (within `surface_tolerance`).
+4. Verified pairs are merged with union-find into clusters, written to the
+   listing_clusters table with a canonical listing (the first seen) per
+   cluster. The deduplicated_ads view keeps one listing per cluster, e.g. for
+   median prices per zone.
+
+    python dedup.py --db data/ads.db --city genova --threshold 0.5
+
+This module provides functions to:
+1. Normalise listing texts and compute MinHash signatures
+2. Find clusters of near-duplicate listings with blocking and LSH
+3. Write the clusters to the listing_clusters table
+"""
+
+import time
+import zlib
+import sqlite3
+import logging
+import argparse
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NUM_PERM = 128
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_SHINGLE_SIZE = 3
+DEFAULT_GEOHASH_PRECISION = 5
+DEFAULT_SURFACE_TOLERANCE = 0.1
+MAX_BUCKET_PAIRS = 50          # Larger LSH buckets are only compared with their first listing
+MINHASH_BATCH_SHINGLES = 20000
+
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_NON_WORD_TO_SPACE = {code: " " for code in range(128) if not chr(code).isalnum()}
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def normalize_text(text: Any) -> str:
+    """Lower-case text without accents and punctuation, words separated by one space."""
+    if not isinstance(text, str):
+        return ""
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    return " ".join(text.translate(_NON_WORD_TO_SPACE).split())
+
+
+def shingles(text: str, size: int = DEFAULT_SHINGLE_SIZE) -> np.ndarray:
+    """
+    Hashes of the word shingles of a normalised text.
+
+    Args:
+        text: Normalised text
+        size: Words per shingle
+
+    Returns:
+        Array of unique 64-bit hashes (empty for an empty text)
+    """
+    words = text.split()
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    # Hash the words once and combine consecutive hashes into shingle hashes
+    word_hashes = np.fromiter(map(zlib.crc32, map(str.encode, words)), dtype=np.uint64, count=len(words))
+    count = max(1, len(words) - size + 1)
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(min(size, len(words))):
+        hashes = hashes * _SHINGLE_MULTIPLIER + word_hashes[offset:offset + count]
+    return np.unique(hashes)
+
+
+def geohash_cells(latitudes: np.ndarray, longitudes: np.ndarray, precision: int = DEFAULT_GEOHASH_PRECISION) -> np.ndarray:
+    """
+    Geohash cells of points, as the integer value of their geohash.
+
+    Args:
+        latitudes: Latitudes in degrees
+        longitudes: Longitudes in degrees
+        precision: Geohash characters
+
+    Returns:
+        Array of int64 cells (the base-32 value of the geohash string)
+    """
+    total_bits = 5 * precision
+    lon_bits, lat_bits = (total_bits + 1) // 2, total_bits // 2
+    lat = np.clip(((np.asarray(latitudes, dtype=float) + 90) / 180 * (1 << lat_bits)).astype(np.int64),
+                  0, (1 << lat_bits) - 1)
+    lon = np.clip(((np.asarray(longitudes, dtype=float) + 180) / 360 * (1 << lon_bits)).astype(np.int64),
+                  0, (1 << lon_bits) - 1)
+    # Interleave the bits, longitude first
+    cells = np.zeros(len(lat), dtype=np.int64)
+    for bit in range(total_bits):
+        if bit % 2 == 0:
+            lon_bits -= 1
+            cells = (cells << 1) | ((lon >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            cells = (cells << 1) | ((lat >> lat_bits) & 1)
+    return cells
+
+
+def geohash_to_cell(geohash: str, precision: int = DEFAULT_GEOHASH_PRECISION) -> Optional[int]:
+    """Integer cell of the first `precision` characters of a geohash, None if it is too short or invalid."""
+    if not isinstance(geohash, str) or len(geohash) < precision:
+        return None
+    cell = 0
+    for char in geohash[:precision].lower():
+        value = _GEOHASH_ALPHABET.find(char)
+        if value < 0:
+            return None
+        cell = (cell << 5) | value
+    return cell
+
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Bands and rows per band whose similarity threshold (1/b)^(1/r) is closest to `threshold`.
+
+    Returns:
+        Tuple (bands, rows)
+    """
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+
+class MinHasher:
+    """
+    MinHash signatures with `num_perm` multiply-shift hash functions ((a * x + b) mod 2^64) >> 32.
+
+    Args:
+        num_perm: Length of the signatures
+        seed: Seed of the hash functions (signatures are comparable with the same seed only)
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, seed: int = 1):
+        generator = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        # Odd multipliers; the uint64 arithmetic wraps around, which is the mod 2^64
+        self.a = generator.randint(0, 1 << 62, size=(num_perm, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = generator.randint(0, 1 << 62, size=(num_perm, 1), dtype=np.uint64)
+
+    def signatures(self, shingle_sets: List[np.ndarray]) -> np.ndarray:
+        """
+        Signatures of several shingle sets, computed in vectorised batches.
+
+        Args:
+            shingle_sets: Non-empty arrays of shingle hashes
+
+        Returns:
+            Array of uint32 of shape (len(shingle_sets), num_perm)
+        """
+        result = np.empty((len(shingle_sets), self.num_perm), dtype=np.uint32)
+        lengths = np.fromiter((len(s) for s in shingle_sets), dtype=np.int64, count=len(shingle_sets))
+        ends = np.cumsum(lengths)
+        start = 0
+        while start < len(shingle_sets):
+            # Group documents until the batch holds enough shingles (at least one document)
+            first_shingle = ends[start] - lengths[start]
+            end = max(start + 1, int(np.searchsorted(ends, first_shingle + MINHASH_BATCH_SHINGLES, side="right")))
+            values = np.concatenate(shingle_sets[start:end])
+            offsets = ends[start:end] - lengths[start:end] - first_shingle
+            # In place, the batch is the only large temporary
+            hashed = np.multiply(self.a, values)
+            hashed += self.b
+            hashed >>= np.uint64(32)
+            result[start:end] = np.minimum.reduceat(hashed, offsets, axis=1).T
+            start = end
+        return result
+
+
+class UnionFind:
+    """Disjoint sets of integers with path halving and union by size."""
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def find(self, item: int) -> int:
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, first: int, second: int) -> bool:
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return False
+        if self.size[first] < self.size[second]:
+            first, second = second, first
+        self.parent[second] = first
+        self.size[first] += self.size[second]
+        return True
+
+
+def _block_ids(df: pd.DataFrame, precision: int) -> np.ndarray:
+    """Block (contract, rooms, geohash cell) of each listing as an integer, -1 if it has no location."""
+    latitudes = pd.to_numeric(df["latitude"], errors="coerce").to_numpy(dtype=float)
+    longitudes = pd.to_numeric(df["longitude"], errors="coerce").to_numpy(dtype=float)
+    located = ~(np.isnan(latitudes) | np.isnan(longitudes))
+    cells = pd.Series(pd.NA, index=df.index, dtype="Int64")
+    cells[located] = geohash_cells(latitudes[located], longitudes[located], precision)
+    # Listings without coordinates fall back to the geohash of the API
+    missing = ~located & df["geoHash"].notna().to_numpy()
+    if missing.any():
+        cells[missing] = df.loc[missing, "geoHash"].map(lambda value: geohash_to_cell(value, precision))
+    rooms = pd.to_numeric(df["rooms"], errors="coerce")
+    blocks = pd.DataFrame({"contract": df["contract"], "rooms": rooms, "cell": cells})
+    ids = blocks.groupby(["contract", "rooms", "cell"], dropna=False, sort=False).ngroup().to_numpy()
+    return np.where(cells.notna().to_numpy(), ids, -1)
+
+
+def _similar_surface(first: Any, second: Any, tolerance: float) -> bool:
+    if pd.isna(first) or pd.isna(second) or not first or not second:
+        return True
+    return abs(float(first) - float(second)) <= tolerance * max(float(first), float(second))
+
+
+def _lsh_buckets(blocks: np.ndarray, signatures: np.ndarray, bands: int, rows: int) -> Iterable[np.ndarray]:
+    """
+    Groups of two or more listings sharing a block and the values of a band.
+
+    Every band is reduced to one 64-bit hash and the (block, hash) keys are sorted,
+    so that the buckets are the runs of equal keys.
+    """
+    multipliers = np.random.RandomState(0).randint(0, 1 << 62, size=rows, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    for band in range(bands):
+        values = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        with np.errstate(over="ignore"):
+            band_hashes = (values * multipliers).sum(axis=1, dtype=np.uint64)
+        order = np.lexsort((band_hashes, blocks))
+        same = (blocks[order][1:] == blocks[order][:-1]) & (band_hashes[order][1:] == band_hashes[order][:-1])
+        if not same.any():
+            continue
+        # Runs of equal keys: starts where a key differs from the previous one
+        boundaries = np.flatnonzero(np.diff(np.concatenate(([False], same, [False])).astype(np.int8)))
+        for run_start, run_end in zip(boundaries[::2], boundaries[1::2]):
+            yield order[run_start:run_end + 1]
+
+
+def find_duplicate_clusters(
+    df: pd.DataFrame,
+    threshold: float = DEFAULT_THRESHOLD,
+    num_perm: int = DEFAULT_NUM_PERM,
+    shingle_size: int = DEFAULT_SHINGLE_SIZE,
+    geohash_precision: int = DEFAULT_GEOHASH_PRECISION,
+    surface_tolerance: float = DEFAULT_SURFACE_TOLERANCE
+) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Cluster near-duplicate listings.
+
+    Args:
+        df: Listings with url, title, description, contract, rooms, surface_m2,
+            latitude/longitude or geoHash (and optionally db_id, used to pick the canonical listing)
+        threshold: Minimum estimated Jaccard similarity of the texts of two duplicates
+        num_perm: Length of the MinHash signatures
+        shingle_size: Words per shingle
+        geohash_precision: Geohash characters of the blocking cell
+        surface_tolerance: Maximum relative difference of the surfaces of two duplicates
+
+    Returns:
+        Tuple (clusters, stats): clusters has one row per listing in a cluster of two or more
+        (url, cluster_id, canonical_url, cluster_size, similarity); stats has the counters of the run
+    """
+    start_time = time.time()
+    stats = {"listings": len(df), "signed": 0, "blocks": 0, "candidate_pairs": 0, "verified_pairs": 0,
+             "clusters": 0, "duplicates": 0, "seconds": 0.0}
+    columns = ["url", "cluster_id", "canonical_url", "cluster_size", "similarity"]
+    df = df.reset_index(drop=True)
+    for column in ("title", "description", "contract", "rooms", "surface_m2", "latitude", "longitude", "geoHash"):
+        if column not in df.columns:
+            df[column] = None
+
+    # Signatures of the listings with a location and some text
+    blocks = _block_ids(df, geohash_precision)
+    texts = (df["title"].map(normalize_text) + " " + df["description"].map(normalize_text)).str.strip()
+    positions = np.flatnonzero((blocks >= 0) & (texts.str.len() > 0).to_numpy())
+    stats["signed"] = len(positions)
+    if not len(positions):
+        stats["seconds"] = time.time() - start_time
+        return pd.DataFrame(columns=columns), stats
+    signatures = MinHasher(num_perm).signatures([shingles(texts.iat[p], shingle_size) for p in positions])
+    blocks = blocks[positions]
+    stats["blocks"] = len(np.unique(blocks))
+
+    # Verify the candidates of the LSH buckets and merge the duplicates
+    bands, rows = lsh_params(threshold, num_perm)
+    union_find = UnionFind(len(positions))
+    checked = set()
+    surfaces = df["surface_m2"].to_numpy()
+
+    def verify(first: int, second: int) -> None:
+        pair = (first, second) if first < second else (second, first)
+        if pair in checked:
+            return
+        checked.add(pair)
+        similarity = float(np.mean(signatures[first] == signatures[second]))
+        if similarity >= threshold and _similar_surface(
+            surfaces[positions[first]], surfaces[positions[second]], surface_tolerance
+        ):
+            stats["verified_pairs"] += 1
+            union_find.union(first, second)
+
+    for members in _lsh_buckets(blocks, signatures, bands, rows):
+        members = sorted(members.tolist())
+        if len(members) * (len(members) - 1) // 2 > MAX_BUCKET_PAIRS:
+            for other in members[1:]:
+                verify(members[0], other)
+        else:
+            for i, first in enumerate(members):
+                for second in members[i + 1:]:
+                    verify(first, second)
+    stats["candidate_pairs"] = len(checked)
+
+    # Clusters of two or more listings, the first seen one being canonical
+    groups = defaultdict(list)
+    for index in range(len(positions)):
+        groups[union_find.find(index)].append(index)
+    order = df["db_id"].to_numpy() if "db_id" in df.columns else np.arange(len(df))
+    urls = df["url"].to_numpy()
+    records = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        canonical = min(members, key=lambda index: order[positions[index]])
+        cluster_id = int(order[positions[canonical]])
+        for index in members:
+            records.append((
+                urls[positions[index]], cluster_id, urls[positions[canonical]], len(members),
+                float(np.mean(signatures[index] == signatures[canonical]))
+            ))
+        stats["clusters"] += 1
+        stats["duplicates"] += len(members) - 1
+
+    stats["seconds"] = time.time() - start_time
+    logger.info(
+        f"[INFO] Dedup: {stats['listings']} listings, {stats['candidate_pairs']} candidate pairs, "
+        f"{stats['clusters']} clusters, {stats['duplicates']} duplicates in {stats['seconds']:.1f}s"
+    )
+    return pd.DataFrame(records, columns=columns), stats
+
+
+def init_cluster_tables(db_path: str) -> bool:
+    """
+    Initialize the listing_clusters table and the deduplicated_ads view.
+
+    Args:
+        db_path: Path to the ads database
+
+    Returns:
+        True if initialization was successful, False otherwise
+    """
+    try:
+        with get_connection(db_path) as conn:
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS listing_clusters (
+                url TEXT PRIMARY KEY,
+                cluster_id INTEGER NOT NULL,
+                canonical_url TEXT NOT NULL,
+                cluster_size INTEGER NOT NULL,
+                similarity REAL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID;
+
+            CREATE INDEX IF NOT EXISTS idx_listing_clusters_cluster ON listing_clusters(cluster_id);
+
+            CREATE VIEW IF NOT EXISTS deduplicated_ads AS
+            SELECT a.* FROM real_estate_ads a
+            LEFT JOIN listing_clusters c ON c.url = a.url
+            WHERE c.url IS NULL OR c.url = c.canonical_url;
+            ''')
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error initializing cluster tables: {e}")
+        return False
+
+
+def write_clusters(db_path: str, clusters: pd.DataFrame, scope_urls: Iterable[str]) -> int:
+    """
+    Replace the clusters of a set of listings.
+
+    Args:
+        db_path: Path to the ads database
+        clusters: Clusters returned by find_duplicate_clusters
+        scope_urls: URLs of all the listings that were deduplicated (their old clusters are removed)
+
+    Returns:
+        Number of rows written, or -1 on error
+    """
+    if not init_cluster_tables(db_path):
+        return -1
+    try:
+        with get_connection(db_path) as conn:
+            conn.execute("CREATE TEMP TABLE dedup_scope (url TEXT PRIMARY KEY) WITHOUT ROWID")
+            conn.executemany("INSERT OR IGNORE INTO dedup_scope VALUES (?)", ((url,) for url in scope_urls))
+            conn.execute("DELETE FROM listing_clusters WHERE url IN (SELECT url FROM dedup_scope)")
+            conn.executemany(
+                "INSERT OR REPLACE INTO listing_clusters (url, cluster_id, canonical_url, cluster_size, similarity) "
+                "VALUES (?, ?, ?, ?, ?)",
+                clusters[["url", "cluster_id", "canonical_url", "cluster_size", "similarity"]].itertuples(index=False)
+            )
+            conn.commit()
+        return len(clusters)
+    except sqlite3.Error as e:
+        logger.error(f"[ERROR] Could not write the listing clusters: {e}")
+        return -1
+
+
+def dedup_database(
+    db_path: str,
+    city: Optional[str] = None,
+    contract: Optional[str] = None,
+    **options
+) -> Dict[str, Any]:
+    """
+    Find the duplicates among the ads of a database and store the clusters.
+
+    Args:
+        db_path: Path to the ads database
+        city: Only ads of this city (optional)
+        contract: Only ads with this contract (optional)
+        **options: Parameters of find_duplicate_clusters
+
+    Returns:
+        Statistics of the run (see find_duplicate_clusters)
+    """
+    query = ("SELECT db_id, url, title, description, contract, rooms, surface_m2, latitude, longitude, geoHash "
+             "FROM real_estate_ads WHERE url IS NOT NULL")
+    params: List[Any] = []
+    if city:
+        query += " AND LOWER(city) = LOWER(?)"
+        params.append(city)
+    if contract:
+        query += " AND contract = ?"
+        params.append(contract)
+    with get_connection(db_path) as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+
+    clusters, stats = find_duplicate_clusters(df, **options)
+    stats["written"] = write_clusters(db_path, clusters, df["url"])
+    return stats
+
+
+def main():
+    """Deduplicate the ads of a SQLite database from the command line."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate listings with MinHash/LSH')
+    parser.add_argument('--db', type=str, required=True, help='Path to the SQLite database')
+    parser.add_argument('--city', type=str, help='Only deduplicate the ads of this city')
+    parser.add_argument('--contract', type=str, help='Only deduplicate the ads with this contract')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Minimum text similarity of duplicates, 0-1 (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--num-perm', type=int, default=DEFAULT_NUM_PERM,
+                        help=f'Length of the MinHash signatures (default: {DEFAULT_NUM_PERM})')
+    parser.add_argument('--geohash-precision', type=int, default=DEFAULT_GEOHASH_PRECISION,
+                        help=f'Geohash characters of the blocking cell (default: {DEFAULT_GEOHASH_PRECISION})')
+    parser.add_argument('--surface-tolerance', type=float, default=DEFAULT_SURFACE_TOLERANCE,
+                        help=f'Maximum relative surface difference of duplicates (default: {DEFAULT_SURFACE_TOLERANCE})')
+    args = parser.parse_args()
+
+    dedup_database(
+        args.db,
+        city=args.city,
+        contract=args.contract,
+        threshold=args.threshold,
+        num_perm=args.num_perm,
+        geohash_precision=args.geohash_precision,
+        surface_tolerance=args.surface_tolerance
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,475 @@
+"""
+Enrichment of the ads with the fields of their detail page.
+
+The search API only returns a summary of each ad (flattened from
+`properties[0]`); the energy class, the condominium fees, the full feature
+list and all the photos are only on the detail page of the ad, in its
+`__NEXT_DATA__` JSON. Fetching one page per ad is expensive, so enrichment
+only fetches the ads that are new or whose summary changed since their details
+were fetched: a hash of the main summary fields (price, surface, rooms, texts,
+main photo, ...) is stored with the details and compared on the next crawl.
+
+Pages are fetched by a pool of threads under one RateLimiter and one pooled
+session; the results are written by the calling thread to the ad_details table
+of the ads database, next to real_estate_ads. The enriched_ads view joins the
+two tables. Failed pages are retried on later runs up to `max_attempts` times,
+or as soon as the summary of the ad changes.
+
+    python fetch_ads.py --city genova --contract rent --save-sqlite --enrich-details
+    python enrichment.py --db data/ads.db --city genova --workers 4 --rate 1
+
+This module provides functions to:
+1. Parse the details of an ad from its detail page
+2. Select the new or changed ads and fetch their details concurrently
+3. Store the details in the ad_details table of the ads database
+"""
+
+import re
+import json
+import math
+import time
+import hashlib
+import sqlite3
+import logging
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+import requests
+
+from rate_limit import RateLimiter, make_session, retry_after_seconds
+from raw_payload import compress_payloads
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_RATE = 1.0
+DEFAULT_MAX_ATTEMPTS = 3
+COMMIT_EVERY = 50
+REQUEST_TIMEOUT = 30
+DETAIL_HEADERS = {
+    "User-Agent": "Mozilla/5.0",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Referer": "https://www.immobiliare.it"
+}
+
+# Summary fields whose change makes the details worth fetching again
+DETAIL_HASH_COLUMNS = [
+    "title", "description", "price_value", "surface", "rooms", "bathrooms", "floor",
+    "ga4features", "ga4Heating", "photo_id", "propertiesCount"
+]
+
+_NEXT_DATA = re.compile(r'<script[^>]*id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL)
+_AMOUNT = re.compile(r"\d+(?:\.\d{3})*(?:,\d+)?")
+
+DETAIL_COLUMNS = [
+    "energy_class", "energy_consumption", "heating_type", "condominium_fees", "condominium_fees_text",
+    "features", "primary_features", "photo_urls", "photo_count", "description_full"
+]
+
+
+def init_details_table(db_path: str) -> bool:
+    """
+    Initialize the ad_details table and, if the ads table exists, the enriched_ads view.
+
+    Args:
+        db_path: Path to the ads database
+
+    Returns:
+        True if initialization was successful, False otherwise
+    """
+    try:
+        with get_connection(db_path) as conn:
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS ad_details (
+                url TEXT PRIMARY KEY,
+                listing_hash TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                energy_class TEXT,
+                energy_consumption TEXT,
+                heating_type TEXT,
+                condominium_fees REAL,
+                condominium_fees_text TEXT,
+                features TEXT,
+                primary_features TEXT,
+                photo_urls TEXT,
+                photo_count INTEGER,
+                description_full TEXT,
+                raw_details BLOB
+            ) WITHOUT ROWID;
+
+            CREATE INDEX IF NOT EXISTS idx_ad_details_status ON ad_details(status);
+            ''')
+            if conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'real_estate_ads'"
+            ).fetchone():
+                conn.execute(f'''
+                CREATE VIEW IF NOT EXISTS enriched_ads AS
+                SELECT a.*, {", ".join(f"d.{column}" for column in DETAIL_COLUMNS)}, d.fetched_at AS details_fetched_at
+                FROM real_estate_ads a
+                LEFT JOIN ad_details d ON d.url = a.url AND d.status = 'ok'
+                ''')
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error initializing ad details table: {e}")
+        return False
+
+
+def _hash_value(value: Any) -> Optional[str]:
+    """Same text for a value read from a crawl or from the database (e.g. 3, 3.0 and '3')."""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if hasattr(value, "item"):  # numpy scalars
+        value = value.item()
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            value = int(value)
+    return str(value)
+
+
+def listing_hashes(ads: pd.DataFrame) -> pd.Series:
+    """
+    Hash of the summary fields of each ad (DETAIL_HASH_COLUMNS), comparable
+    between a crawl DataFrame and the rows of the ads database.
+
+    Args:
+        ads: Flattened ads
+
+    Returns:
+        Series of hex digests aligned with the DataFrame index
+    """
+    # A missing column hashes like a column of NULLs
+    summary = ads.reindex(columns=DETAIL_HASH_COLUMNS)
+    hashes = [
+        hashlib.sha1(json.dumps([_hash_value(value) for value in row], ensure_ascii=False).encode("utf-8")).hexdigest()
+        for row in summary.itertuples(index=False, name=None)
+    ]
+    return pd.Series(hashes, index=ads.index, dtype=object)
+
+
+def parse_next_data(html: str) -> Optional[Dict[str, Any]]:
+    """
+    The realEstate object of the __NEXT_DATA__ JSON of a detail page.
+
+    Args:
+        html: Detail page
+
+    Returns:
+        The realEstate dictionary, or None if the page has none
+    """
+    match = _NEXT_DATA.search(html)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(1))
+    except ValueError:
+        return None
+    page_props = data.get("props", {}).get("pageProps", {})
+    real_estate = (page_props.get("detailData") or {}).get("realEstate") or page_props.get("realEstate")
+    return real_estate if isinstance(real_estate, dict) else None
+
+
+def _parse_amount(text: Any) -> Optional[float]:
+    """Euro amount of a formatted value such as '€ 1.200/mese'."""
+    if isinstance(text, (int, float)):
+        return float(text)
+    if not isinstance(text, str):
+        return None
+    match = _AMOUNT.search(text)
+    return float(match.group(0).replace(".", "").replace(",", ".")) if match else None
+
+
+def _label(value: Any) -> Optional[str]:
+    """Text of a value that is either a string or a {name/label/value: ...} object."""
+    if isinstance(value, dict):
+        value = value.get("name") or value.get("label") or value.get("value")
+    return str(value) if value not in (None, "") else None
+
+
+def extract_details(real_estate: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Flatten the detail fields of an ad.
+
+    Args:
+        real_estate: realEstate object of the detail page
+
+    Returns:
+        Dictionary with the DETAIL_COLUMNS (lists and mappings as JSON text)
+    """
+    main_property = (real_estate.get("properties") or [{}])[0] or {}
+    energy = main_property.get("energy") or {}
+    costs = main_property.get("costs") or real_estate.get("costs") or {}
+    fees_text = _label(costs.get("condominiumExpenses"))
+
+    features = [_label(feature) for feature in main_property.get("features") or []]
+    features += [_label(feature) for feature in main_property.get("ga4features") or []]
+    primary_features = {
+        _label(feature.get("name")): feature.get("value")
+        for feature in main_property.get("primaryFeatures") or []
+        if isinstance(feature, dict) and feature.get("name") and feature.get("isVisible", True)
+    }
+    photos = (main_property.get("multimedia") or real_estate.get("multimedia") or {}).get("photos") or []
+    photo_urls = [
+        photo.get("urls", {}).get("large") or photo.get("urls", {}).get("medium")
+        for photo in photos if isinstance(photo, dict) and photo.get("urls")
+    ]
+
+    return {
+        "energy_class": _label(energy.get("class")),
+        "energy_consumption": _label(energy.get("epi") or energy.get("consumption")),
+        "heating_type": _label(energy.get("heatingType") or main_property.get("heatingType")),
+        "condominium_fees": _parse_amount(fees_text),
+        "condominium_fees_text": fees_text,
+        "features": json.dumps(list(dict.fromkeys(f for f in features if f)), ensure_ascii=False),
+        "primary_features": json.dumps(primary_features, ensure_ascii=False),
+        "photo_urls": json.dumps([url for url in photo_urls if url]),
+        "photo_count": len(photos),
+        "description_full": main_property.get("description") or real_estate.get("description")
+    }
+
+
+def fetch_details(
+    session: requests.Session,
+    url: str,
+    rate_limiter: Optional[RateLimiter] = None,
+    timeout: float = REQUEST_TIMEOUT
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Fetch and parse the detail page of an ad.
+
+    Args:
+        session: Requests session
+        url: URL of the ad
+        rate_limiter: Rate limiter shared by the workers (optional)
+        timeout: Request timeout in seconds
+
+    Returns:
+        Tuple (real_estate, error); real_estate is None on error
+    """
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    try:
+        response = session.get(url, timeout=timeout)
+    except requests.RequestException as e:
+        return None, str(e)
+    if response.status_code == 429 and rate_limiter is not None:
+        rate_limiter.pause(retry_after_seconds(response.headers, 30))
+    if response.status_code != 200:
+        return None, f"HTTP {response.status_code}"
+    real_estate = parse_next_data(response.text)
+    if real_estate is None:
+        return None, "no __NEXT_DATA__ in the page"
+    return real_estate, None
+
+
+def select_ads_to_enrich(
+    db_path: str,
+    urls: Iterable[str],
+    hashes: Iterable[str],
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+) -> List[Tuple[str, str]]:
+    """
+    Ads whose details must be fetched: new ads, ads whose summary changed since
+    their details were fetched, and failed ads not retried `max_attempts` times.
+
+    Args:
+        db_path: Path to the ads database
+        urls: URLs of the ads
+        hashes: Hashes of their summaries (see listing_hashes)
+        max_attempts: Attempts after which a failing ad is only retried if it changes
+
+    Returns:
+        List of (url, hash)
+    """
+    with get_connection(db_path) as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS crawled_ads (url TEXT PRIMARY KEY, listing_hash TEXT) WITHOUT ROWID")
+        conn.execute("DELETE FROM crawled_ads")
+        conn.executemany("INSERT OR REPLACE INTO crawled_ads VALUES (?, ?)",
+                         ((url, value) for url, value in zip(urls, hashes) if isinstance(url, str) and url))
+        rows = conn.execute('''
+            SELECT c.url, c.listing_hash FROM crawled_ads c
+            LEFT JOIN ad_details d ON d.url = c.url
+            WHERE d.url IS NULL
+               OR d.listing_hash IS NOT c.listing_hash
+               OR (d.status <> 'ok' AND d.attempts < ?)
+        ''', (max_attempts,)).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+def _record(conn: sqlite3.Connection, futures: Iterable, stats: Dict[str, int]) -> None:
+    """Write the results of finished fetches to ad_details."""
+    for future in futures:
+        url, listing_hash, real_estate, error = future.result()
+        if real_estate is None:
+            stats["failed"] += 1
+            logger.warning(f"[WARNING] Could not fetch the details of {url}: {error}")
+            # A changed summary resets the attempts
+            conn.execute('''
+                INSERT INTO ad_details (url, listing_hash, status, attempts, error) VALUES (?, ?, 'error', 1, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    attempts = CASE WHEN listing_hash IS excluded.listing_hash THEN attempts + 1 ELSE 1 END,
+                    listing_hash = excluded.listing_hash, error = excluded.error,
+                    status = CASE WHEN status = 'ok' THEN 'stale' ELSE 'error' END,
+                    fetched_at = CURRENT_TIMESTAMP
+            ''', (url, listing_hash, error))
+            continue
+        stats["fetched"] += 1
+        details = extract_details(real_estate)
+        columns = ["url", "listing_hash", "status", "attempts", "error"] + DETAIL_COLUMNS + ["raw_details"]
+        values = [url, listing_hash, "ok", 1, None] + [details[column] for column in DETAIL_COLUMNS]
+        values += compress_payloads([real_estate], codec="zlib")
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+        conn.execute(f'''
+            INSERT INTO ad_details ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})
+            ON CONFLICT(url) DO UPDATE SET {updates}, fetched_at = CURRENT_TIMESTAMP
+        ''', values)
+
+
+def enrich_ads(
+    db_path: str,
+    ads: pd.DataFrame,
+    workers: int = DEFAULT_WORKERS,
+    rate: Optional[float] = DEFAULT_RATE,
+    rate_limiter: Optional[RateLimiter] = None,
+    session: Optional[requests.Session] = None,
+    headers: Optional[dict] = None,
+    cookies: Optional[dict] = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    commit_every: int = COMMIT_EVERY
+) -> Dict[str, int]:
+    """
+    Fetch the details of the new or changed ads of a crawl and store them.
+
+    Args:
+        db_path: Path to the ads database
+        ads: Flattened ads of the crawl (with url)
+        workers: Concurrent requests
+        rate: Maximum requests per second across all workers (ignored if rate_limiter is given)
+        rate_limiter: Rate limiter shared with other stages (optional)
+        session: Requests session (default: a pooled session sized for the workers)
+        headers: Headers of the default session (default: DETAIL_HEADERS)
+        cookies: Cookies of the default session (optional)
+        max_attempts: Attempts after which a failing ad is only retried if it changes
+        commit_every: Ads between two commits
+
+    Returns:
+        Counters: ads, unchanged, fetched, failed
+    """
+    stats = {"ads": 0, "unchanged": 0, "fetched": 0, "failed": 0}
+    if ads.empty or "url" not in ads.columns:
+        return stats
+    if not init_details_table(db_path):
+        raise sqlite3.DatabaseError(f"Could not initialize the ad_details table in {db_path}")
+    pending = select_ads_to_enrich(db_path, ads["url"], listing_hashes(ads), max_attempts)
+    stats["ads"] = int(ads["url"].nunique())
+    stats["unchanged"] = stats["ads"] - len(pending)
+    if not pending:
+        logger.info(f"[INFO] Details: all {stats['ads']} ads are unchanged")
+        return stats
+
+    if session is None:
+        session = make_session(pool_size=workers, headers=headers or DETAIL_HEADERS)
+        if cookies:
+            session.cookies.update(cookies)
+    if rate_limiter is None and rate:
+        rate_limiter = RateLimiter(rate)
+    start_time = time.time()
+
+    def work(item: Tuple[str, str]) -> Tuple[str, str, Optional[Dict[str, Any]], Optional[str]]:
+        real_estate, error = fetch_details(session, item[0], rate_limiter)
+        return item[0], item[1], real_estate, error
+
+    with get_connection(db_path) as conn, ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight, since_commit = set(), 0
+        try:
+            for item in pending:
+                in_flight.add(executor.submit(work, item))
+                if len(in_flight) < workers * 2:
+                    continue
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                _record(conn, finished, stats)
+                since_commit += len(finished)
+                if since_commit >= commit_every:
+                    conn.commit()
+                    since_commit = 0
+                    logger.info(f"[INFO] Details: {stats['fetched'] + stats['failed']} of {len(pending)} ads")
+            _record(conn, wait(in_flight).done, stats)
+            in_flight = set()
+        except KeyboardInterrupt:
+            logger.warning("[WARNING] Interrupted, saving the details fetched so far")
+            for future in in_flight:
+                future.cancel()
+            _record(conn, {future for future in in_flight if future.done() and not future.cancelled()}, stats)
+            raise
+        finally:
+            conn.commit()
+
+    logger.info(
+        f"[INFO] Details: {stats['fetched']} fetched, {stats['failed']} failed, "
+        f"{stats['unchanged']} unchanged in {time.time() - start_time:.1f}s"
+    )
+    return stats
+
+
+def enrich_database(db_path: str, city: Optional[str] = None, limit: Optional[int] = None, **options) -> Dict[str, int]:
+    """
+    Fetch the details of the new or changed ads already stored in a database.
+
+    Args:
+        db_path: Path to the ads database
+        city: Only ads of this city (optional)
+        limit: Maximum number of ads, most recently updated first (optional)
+        **options: Parameters of enrich_ads
+
+    Returns:
+        Counters of enrich_ads
+    """
+    query = "SELECT * FROM real_estate_ads WHERE url IS NOT NULL"
+    params: List[Any] = []
+    if city:
+        query += " AND LOWER(city) = LOWER(?)"
+        params.append(city)
+    query += " ORDER BY updated_at DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(int(limit))
+    with get_connection(db_path) as conn:
+        ads = pd.read_sql_query(query, conn, params=params)
+    return enrich_ads(db_path, ads, **options)
+
+
+def main():
+    """Fetch the details of the ads of a SQLite database from the command line."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Enrich stored ads with the fields of their detail page')
+    parser.add_argument('--db', type=str, required=True, help='Path to the SQLite database')
+    parser.add_argument('--city', type=str, help='Only the ads of this city')
+    parser.add_argument('--limit', type=int, help='Maximum number of ads, most recent first')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'Concurrent requests (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help=f'Maximum requests per second (default: {DEFAULT_RATE})')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help=f'Attempts before a failing ad is only retried when it changes (default: {DEFAULT_MAX_ATTEMPTS})')
+    args = parser.parse_args()
+
+    enrich_database(
+        args.db,
+        city=args.city,
+        limit=args.limit,
+        workers=args.workers,
+        rate=args.rate,
+        max_attempts=args.max_attempts
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Streaming export files written page by page during a crawl.
+
+Unlike the `--save-csv` / `--save-json` exports, which rewrite one file with
+the whole crawl at the end, stream files are appended to as every API page
+arrives, so they can be tailed or read line by line while the crawl runs and
+accumulate across runs.
+
+The format and compression are chosen from the file name:
+    ads.jsonl / ads.ndjson    -> JSON Lines, one ad per line
+    ads.csv                   -> CSV, header written only when the file is new;
+                                 appended pages follow the existing header
+    ... + .gz                 -> gzip compressed (e.g. ads.jsonl.gz)
+    ... + .zst                -> zstd compressed (requires `zstandard`)
+
+Appending to a compressed file adds a new gzip member / zstd frame, which
+standard readers (gzip, zstd, pandas) decompress as one continuous stream.
+
+Paths can contain {city}, {contract} and {date} placeholders (date is the
+crawl date as YYYYMMDD), so that e.g. "archive/{city}/{date}.jsonl.zst" rotates
+to a new file every day.
+
+This module provides functions to:
+1. Render a stream path template for a crawl
+2. Open a JSONL or CSV stream writer with the right compression
+3. Read the header of an existing (compressed) CSV stream
+4. Append the column arrays of one page to the stream
+"""
+
+import io
+import os
+import csv
+import gzip
+import logging
+from datetime import date
+from pathlib import Path
+from typing import List, Optional, Set
+
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+import json_codec
+
+
+logger = logging.getLogger(__name__)
+
+STREAM_FORMATS = {".jsonl": "jsonl", ".ndjson": "jsonl", ".csv": "csv"}
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+DECOMPRESSION_ERRORS = (zstandard.ZstdError,) if zstandard is not None else ()
+
+
+def render_stream_path(template: str, city: str, contract: str, crawl_date: Optional[date] = None) -> str:
+    """
+    Fill the {city}, {contract} and {date} placeholders of a stream path.
+
+    Args:
+        template: Path template, e.g. "archive/{city}_{contract}_{date}.jsonl.gz"
+        city: City of the crawl
+        contract: Contract type of the crawl
+        crawl_date: Date of the crawl (default: today)
+
+    Returns:
+        The rendered path
+    """
+    crawl_date = crawl_date or date.today()
+    return template.format(city=city, contract=contract, date=crawl_date.strftime("%Y%m%d"))
+
+
+def detect_stream_format(path: str):
+    """
+    Detect format and compression from the file name.
+
+    Args:
+        path: Stream file path
+
+    Returns:
+        Tuple of (format, compression) where format is 'jsonl' or 'csv'
+        and compression is None, 'gzip' or 'zstd'
+    """
+    suffixes = [s.lower() for s in Path(path).suffixes]
+    compression = None
+    if suffixes and suffixes[-1] in COMPRESSIONS:
+        compression = COMPRESSIONS[suffixes.pop()]
+    if not suffixes or suffixes[-1] not in STREAM_FORMATS:
+        raise ValueError(f"Unsupported stream file '{path}': use .jsonl, .ndjson or .csv, optionally followed by .gz or .zst")
+    return STREAM_FORMATS[suffixes[-1]], compression
+
+
+def _open_append(path: str, compression: Optional[str], level: int):
+    """Open a binary file for appending, compressing if requested."""
+    if compression == "gzip":
+        return gzip.open(path, "ab", compresslevel=level)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstandard package is required for .zst stream files")
+        raw = open(path, "ab")
+        return zstandard.ZstdCompressor(level=level).stream_writer(raw, closefd=True)
+    return open(path, "ab")
+
+
+def read_csv_header(path: str, compression: Optional[str] = None) -> Optional[List[str]]:
+    """
+    Read the header of an existing CSV stream file.
+
+    Args:
+        path: CSV file path
+        compression: None, 'gzip' or 'zstd'
+
+    Returns:
+        List of column names, or None if the file is missing, empty or unreadable
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    try:
+        if compression == "gzip":
+            raw = gzip.open(path, "rb")
+        elif compression == "zstd":
+            if zstandard is None:
+                raise ValueError("zstandard package is required for .zst stream files")
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                             closefd=True)
+        else:
+            raw = open(path, "rb")
+        with io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+            return next(csv.reader(f), None)
+    except (OSError, EOFError, UnicodeDecodeError, csv.Error) + DECOMPRESSION_ERRORS as e:
+        logger.warning(f"[WARNING] Could not read the CSV header of {path}: {e}")
+        return None
+
+
+class StreamWriter:
+    """
+    Append-only writer of ads to a JSONL or CSV stream file.
+
+    Every call to write_page() writes one page and flushes it, so that a
+    complete page is on disk (as a gzip member / zstd frame) before the next
+    page is fetched.
+    """
+
+    def __init__(self, path: str, level: Optional[int] = None):
+        self.path = str(path)
+        self.format, self.compression = detect_stream_format(self.path)
+        if level is None:
+            level = 6 if self.compression == "gzip" else 3
+        self.level = level
+        self.records = 0
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        # Appending to an existing CSV must keep the columns of its header
+        self._columns: Optional[List[str]] = None
+        self._dropped: Set[str] = set()
+        if self.format == "csv" and not self._is_new:
+            self._columns = read_csv_header(self.path, self.compression)
+
+    def _append(self, data: bytes) -> None:
+        # A new compressor per page keeps every page a self-contained member/frame
+        with _open_append(self.path, self.compression, self.level) as f:
+            f.write(data)
+
+    def _encode_jsonl(self, df: pd.DataFrame) -> bytes:
+        return b"".join(json_codec.dumps(record) + b"\n" for record in df.to_dict("records"))
+
+    def _encode_csv(self, df: pd.DataFrame) -> bytes:
+        if self._columns is None:
+            self._columns = list(df.columns)
+        dropped = [column for column in df.columns if column not in self._columns and column not in self._dropped]
+        if dropped:
+            self._dropped.update(dropped)
+            logger.warning(f"[WARNING] Columns not in the header of {self.path} are not written: {dropped}")
+        buffer = io.StringIO()
+        df.reindex(columns=self._columns).to_csv(buffer, index=False, header=self._is_new)
+        return buffer.getvalue().encode("utf-8")
+
+    def write_page(self, df: pd.DataFrame) -> int:
+        """
+        Append the ads of one page.
+
+        Args:
+            df: Cleaned DataFrame of the page (export columns only)
+
+        Returns:
+            Number of records written
+        """
+        if df.empty:
+            return 0
+        data = self._encode_jsonl(df) if self.format == "jsonl" else self._encode_csv(df)
+        self._append(data)
+        self._is_new = False
+        self.records += len(df)
+        return len(df)
+
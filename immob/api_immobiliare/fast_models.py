@@ -0,0 +1,217 @@
+"""
+msgspec Structs mirroring the pydantic models in models.py.
+
+Used by json_codec.decode_page(typed=True) to decode search-list pages
+straight into typed objects while parsing. Field names, types and optional
+fields follow models.py (checked by test_json_codec.py, so a change to one
+must be made to the other); unknown fields are ignored.
+"""
+
+from functools import lru_cache
+from typing import Any, List, Optional
+
+import msgspec
+
+
+class Phone(msgspec.Struct):
+    """Numero di telefono."""
+    type: str
+    value: str
+
+
+class BookableVisit(msgspec.Struct):
+    """Visita prenotabile."""
+    isVisitBookable: bool
+    virtualVisitEnabled: bool
+
+
+class ImageUrls(msgspec.Struct):
+    """URL delle immagini."""
+    small: Optional[str] = None
+    medium: Optional[str] = None
+    large: Optional[str] = None
+
+
+class Agency(msgspec.Struct):
+    """Agenzia immobiliare."""
+    id: int
+    type: str
+    showOnlyAgentPhone: bool
+    phones: List[Phone]
+    bookableVisit: BookableVisit
+    isPaid: bool
+    label: str
+    displayName: str
+    guaranteed: bool
+    showAgentPhone: bool
+    showLogo: bool
+    imageUrls: ImageUrls
+    agencyUrl: str
+    showExternalLink: bool
+
+
+class Supervisor(msgspec.Struct):
+    """Supervisore (agente immobiliare)."""
+    type: str
+    imageGender: str
+    phones: List[Phone]
+    imageType: str
+    displayName: str
+    label: str
+    imageUrl: str
+
+
+class Advertiser(msgspec.Struct):
+    """Inserzionista."""
+    agency: Agency
+    supervisor: Supervisor
+    hasCallNumbers: bool
+
+
+class Price(msgspec.Struct):
+    """Prezzo di un immobile."""
+    visible: bool
+    value: int
+    formattedValue: str
+    minValue: str
+    maxValue: Optional[str] = None
+    priceRange: Optional[str] = None
+
+
+class Nation(msgspec.Struct):
+    """Nazione."""
+    id: str
+    name: str
+
+
+class Location(msgspec.Struct):
+    """Posizione di un immobile."""
+    address: str
+    latitude: float
+    longitude: float
+    marker: str
+    region: str
+    province: str
+    city: str
+    nation: Nation
+    macrozone: Optional[str] = None
+
+
+class View(msgspec.Struct):
+    """Vista."""
+    id: int
+    name: str
+
+
+class Typology(msgspec.Struct):
+    """Tipologia di un immobile."""
+    id: int
+    name: str
+
+
+class Category(msgspec.Struct):
+    """Categoria di un immobile."""
+    id: int
+    name: str
+
+
+class Photo(msgspec.Struct):
+    """Foto di un immobile."""
+    id: int
+    caption: str
+    urls: ImageUrls
+
+
+class FeatureItem(msgspec.Struct):
+    """Caratteristica."""
+    type: str
+    label: str
+    compactLabel: Optional[str] = None
+
+
+class Floor(msgspec.Struct):
+    """Piano di un immobile."""
+    abbreviation: str
+    value: str
+    floorOnlyValue: str
+    ga4FloorValue: str
+
+
+class Multimedia(msgspec.Struct):
+    """Elementi multimediali."""
+    photos: List[Photo]
+    hasMultimedia: bool
+    virtualTours: List[Any] = []
+
+
+class PropertyDetail(msgspec.Struct):
+    """Dettagli di una proprietà."""
+    price: Price
+    surface: str
+    typology: Typology
+    typologyGA4Translation: str
+    ga4features: List[str]
+    featureList: List[FeatureItem]
+    multimedia: Optional[Multimedia] = None
+    bathrooms: Optional[str] = None
+    floor: Optional[Floor] = None
+    rooms: Optional[str] = None
+    elevator: Optional[bool] = None
+    seaDistanceValue: Optional[str] = None
+    views: Optional[List[View]] = None
+    ga4Heating: Optional[str] = None
+    ga4Garage: Optional[str] = None
+    caption: Optional[str] = None
+    category: Optional[Category] = None
+    description: Optional[str] = None
+    photo: Optional[Photo] = None
+    location: Optional[Location] = None
+    url: Optional[str] = None
+    matchSearch: Optional[bool] = None
+
+
+class RealEstateAd(msgspec.Struct):
+    """Annuncio immobiliare."""
+    visibility: str
+    dataType: str
+    id: int
+    uuid: str
+    advertiser: Advertiser
+    contract: str
+    isNew: bool
+    luxury: bool
+    price: Price
+    properties: List[PropertyDetail]
+    propertiesCount: int
+    title: str
+    type: str
+    typology: Typology
+    hasMainProperty: bool
+    isProjectLike: bool
+    isMosaic: bool
+
+
+class SeoInfo(msgspec.Struct):
+    """Informazioni SEO di un annuncio."""
+    anchor: str
+    url: str
+
+
+class ImmobiliareListItem(msgspec.Struct):
+    """Elemento della lista di risultati."""
+    realEstate: RealEstateAd
+    seo: SeoInfo
+    idGeoHash: str
+
+
+class SearchListPage(msgspec.Struct):
+    """Pagina della search-list API (solo i campi usati da fetch_ads)."""
+    results: List[ImmobiliareListItem]
+    maxPages: Optional[int] = None
+    count: Optional[int] = None
+
+
+@lru_cache(maxsize=1)
+def page_decoder() -> msgspec.json.Decoder:
+    """Build (once) the decoder for a whole search-list page."""
+    return msgspec.json.Decoder(SearchListPage)
@@ -0,0 +1,599 @@
+"""
+Feature store and batch valuation of the ads.
+
+The numeric features of a price model (surface, rooms, bathrooms, floor,
+elevator, position bins and the amenity flags of `ga4features`) are derived
+once per listing, with vectorised pandas operations, and stored in the
+ad_features table of the ads database with a hash of their values. A crawl
+only writes the features of its ads; a listing whose features and price did
+not change keeps its hash, so nothing downstream is recomputed for it.
+
+A serialized model (pickle or joblib) scores the listings in batches: the
+ad_scores table keeps, for each model, the feature hash each prediction was
+made from, so scoring only picks the listings that are new, changed, or never
+scored by that model. Ads whose price is at least `threshold` below the
+predicted one are flagged as under-priced (see the underpriced_ads view).
+
+    python fetch_ads.py --city genova --contract sale --save-sqlite --score-model models/sale.pkl
+    python feature_store.py --db data/ads.db --build --score models/sale.pkl
+    python feature_store.py --db data/ads.db --underpriced --city genova
+
+A model is either an object with a `predict(DataFrame)` method, or a
+dictionary holding it under "pipeline" or "model", with optional "features"
+(the input columns, default: the columns the model was fitted on, or
+FEATURE_COLUMNS), "target" ("price" or "price_per_m2") and "contract" (only
+score the ads of this contract). read_training_set() returns the stored
+features with the prices, to fit such a model.
+
+This module provides functions to:
+1. Derive the numeric features of flattened ads
+2. Store the features of new or changed ads in the ad_features table
+3. Score the pending listings with a serialized model and flag under-priced ads
+4. Read the training set and the under-priced ads
+"""
+
+import os
+import pickle
+import sqlite3
+import hashlib
+import logging
+import argparse
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_THRESHOLD = 0.15  # An ad 15% below its predicted price is under-priced
+GEO_BIN_DEGREES = 0.01  # About 1.1 km of latitude
+
+# Floors written in words; "interrato (-2)" and the like keep their number
+FLOOR_LEVELS = {
+    "piano terra": 0,
+    "seminterrato": 0,
+    "piano rialzato": 0.5,
+    "ammezzato": 0.5
+}
+BASEMENT_LEVEL = -1
+
+# Amenity flags: regular expression matched against ga4features and ga4Garage
+AMENITY_PATTERNS = {
+    "has_terrace": r"terrazz",
+    "has_balcony": r"balcon",
+    "has_garden": r"giardino",
+    "has_cellar": r"cantina",
+    "has_garage": r"box|garage|posto auto",
+    "has_air_conditioning": r"aria condizionata|climatizzat",
+    "has_concierge": r"portiere|portineria",
+    "has_pool": r"piscina",
+    "has_fireplace": r"camino",
+    "furnished": r"(?<!non )arredato"
+}
+
+FEATURE_COLUMNS = [
+    "surface_m2", "rooms", "bathrooms", "floor_level", "elevator", "latitude", "longitude", "lat_bin", "lon_bin",
+    *AMENITY_PATTERNS
+]
+
+# Columns of the ads the features are derived from
+SOURCE_COLUMNS = [
+    "url", "contract", "city", "price_value", "surface", "surface_m2", "rooms", "bathrooms", "floor",
+    "floor_number", "elevator", "latitude", "longitude", "ga4features", "ga4Garage"
+]
+
+# Columns a model can take as input (they are interpolated in the queries)
+MODEL_INPUT_COLUMNS = ("contract", "city", *FEATURE_COLUMNS)
+TARGETS = ("price", "price_per_m2")
+
+_FEATURE_TYPES = {"latitude": "REAL", "longitude": "REAL", "floor_level": "REAL", "surface_m2": "REAL"}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def init_feature_tables(db_path: str) -> bool:
+    """
+    Initialize the ad_features and ad_scores tables and the underpriced_ads view.
+
+    Args:
+        db_path: Path to the ads database
+
+    Returns:
+        True if initialization was successful, False otherwise
+    """
+    feature_columns = ",\n                ".join(
+        f"{column} {_FEATURE_TYPES.get(column, 'INTEGER')}" for column in FEATURE_COLUMNS
+    )
+    try:
+        with get_connection(db_path) as conn:
+            conn.executescript(f'''
+            CREATE TABLE IF NOT EXISTS ad_features (
+                url TEXT PRIMARY KEY,
+                feature_hash TEXT NOT NULL,
+                contract TEXT,
+                city TEXT,
+                price_value REAL,
+                {feature_columns},
+                computed_at TIMESTAMP NOT NULL
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS ad_scores (
+                url TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                feature_hash TEXT NOT NULL,
+                predicted_price REAL,
+                price_value REAL,
+                price_ratio REAL,
+                underpriced INTEGER NOT NULL DEFAULT 0,
+                scored_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (url, model_id)
+            ) WITHOUT ROWID;
+
+            CREATE INDEX IF NOT EXISTS idx_ad_scores_underpriced
+                ON ad_scores(model_id, price_ratio) WHERE underpriced = 1;
+
+            CREATE VIEW IF NOT EXISTS underpriced_ads AS
+            SELECT s.url, s.model_id, f.contract, f.city, s.price_value, s.predicted_price, s.price_ratio,
+                   f.surface_m2, f.rooms, s.scored_at
+            FROM ad_scores s
+            JOIN ad_features f ON f.url = s.url
+            WHERE s.underpriced = 1;
+            ''')
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error initializing feature tables: {e}")
+        return False
+
+
+def _leading_number(values: pd.Series) -> pd.Series:
+    """First number of each value, e.g. 3 for 3, "3" and "5+" -> 5; "1.200 m²" -> 1200."""
+    numeric = pd.to_numeric(values, errors="coerce").astype(float)
+    parse = numeric.isna() & values.notna()
+    if parse.any():  # Only the texts go through the string methods
+        text = values[parse].astype(str).str.replace(".", "", regex=False)
+        numeric[parse] = pd.to_numeric(text.str.extract(r"(\d+)", expand=False), errors="coerce")
+    return numeric
+
+
+def _floor_level(ads: pd.DataFrame) -> pd.Series:
+    """Floor as a number: floors in words are mapped with FLOOR_LEVELS, basements are negative."""
+    floor_number = ads["floor_number"] if "floor_number" in ads.columns else pd.Series(None, index=ads.index)
+    floor_text = ads["floor"] if "floor" in ads.columns else pd.Series(None, index=ads.index)
+    level = pd.to_numeric(floor_number, errors="coerce").astype(float)
+    text = floor_number.where(floor_number.notna(), floor_text)
+    parse = level.isna() & text.notna()
+    if not parse.any():
+        return level
+
+    text = text[parse].astype(str).str.lower()
+    parsed = pd.Series(np.nan, index=text.index)
+    for words, value in FLOOR_LEVELS.items():
+        parsed = parsed.mask(parsed.isna() & text.str.contains(words, regex=False), value)
+    parsed = parsed.fillna(pd.to_numeric(text.str.extract(r"(-?\d+)", expand=False), errors="coerce"))
+    level[parse] = parsed.mask(parsed.isna() & text.str.contains("interrato", regex=False), BASEMENT_LEVEL)
+    return level
+
+
+def feature_hashes(features: pd.DataFrame) -> pd.Series:
+    """
+    Hash of the price and FEATURE_COLUMNS of each listing, vectorised over the rows.
+
+    The values are hashed as float64, so a feature read back from the database
+    (3, 3.0 or a NULL) hashes like the one derived from a crawl.
+
+    Args:
+        features: Derived features (see compute_features)
+
+    Returns:
+        Series of 16-digit hex digests aligned with the DataFrame index
+    """
+    values = features[["price_value", *FEATURE_COLUMNS]].astype(float)
+    return pd.util.hash_pandas_object(values, index=False).map("{:016x}".format)
+
+
+def compute_features(ads: pd.DataFrame) -> pd.DataFrame:
+    """
+    Derive the numeric features of flattened ads (crawl DataFrame or rows of the ads database).
+
+    Args:
+        ads: Ads with url and some of SOURCE_COLUMNS
+
+    Returns:
+        DataFrame with url, feature_hash, contract, city, price_value and FEATURE_COLUMNS,
+        aligned with the index of the ads
+    """
+    ads = ads.reindex(columns=SOURCE_COLUMNS)
+    features = pd.DataFrame({
+        "url": ads["url"],
+        "contract": ads["contract"],
+        "city": ads["city"],
+        "price_value": pd.to_numeric(ads["price_value"], errors="coerce").astype(float)
+    }, index=ads.index)
+
+    # The surface text has the thousands separators the stored surface_m2 lost
+    features["surface_m2"] = _leading_number(ads["surface"]).fillna(_leading_number(ads["surface_m2"]))
+    features["rooms"] = _leading_number(ads["rooms"])
+    features["bathrooms"] = _leading_number(ads["bathrooms"])
+    features["floor_level"] = _floor_level(ads)
+    elevator = ads["elevator"].map(
+        lambda value: None if value is None or pd.isna(value) else float(str(value).lower() in ("true", "1", "1.0"))
+    )
+    features["elevator"] = pd.to_numeric(elevator, errors="coerce")
+    features["latitude"] = pd.to_numeric(ads["latitude"], errors="coerce").astype(float)
+    features["longitude"] = pd.to_numeric(ads["longitude"], errors="coerce").astype(float)
+    features["lat_bin"] = np.floor(features["latitude"] / GEO_BIN_DEGREES)
+    features["lon_bin"] = np.floor(features["longitude"] / GEO_BIN_DEGREES)
+
+    # Feature lists repeat a lot: match the distinct ones and map the flags back
+    amenities = ads["ga4features"].fillna("").astype(str) + " | " + ads["ga4Garage"].fillna("").astype(str)
+    codes, distinct = pd.factorize(amenities)
+    distinct = pd.Series(distinct).str.lower()
+    for column, pattern in AMENITY_PATTERNS.items():
+        features[column] = distinct.str.contains(pattern, regex=True).astype(int).to_numpy()[codes]
+
+    features["feature_hash"] = feature_hashes(features)
+    return features[["url", "feature_hash", "contract", "city", "price_value", *FEATURE_COLUMNS]]
+
+
+def _write_features(conn: sqlite3.Connection, features: pd.DataFrame) -> None:
+    """Upsert derived features into ad_features (computed_at is refreshed even if the hash is unchanged)."""
+    columns = ["url", "feature_hash", "contract", "city", "price_value", *FEATURE_COLUMNS, "computed_at"]
+    features = features.assign(computed_at=_now())[columns]
+    values = features.astype(object).where(features.notna(), None)
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+    conn.executemany(
+        f"INSERT INTO ad_features ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+        f"ON CONFLICT(url) DO UPDATE SET {updates}",
+        values.itertuples(index=False, name=None)
+    )
+
+
+def update_features(db_path: str, ads: pd.DataFrame) -> Dict[str, int]:
+    """
+    Store the features of the ads of a crawl.
+
+    Args:
+        db_path: Path to the ads database
+        ads: Flattened ads of the crawl (with url)
+
+    Returns:
+        Counters: ads, changed (new or different features), unchanged
+    """
+    stats = {"ads": 0, "changed": 0, "unchanged": 0}
+    if ads.empty or "url" not in ads.columns:
+        return stats
+    if not init_feature_tables(db_path):
+        raise sqlite3.DatabaseError(f"Could not initialize the feature tables in {db_path}")
+
+    ads = ads[ads["url"].notna()].drop_duplicates(subset="url", keep="last")
+    features = compute_features(ads)
+    with get_connection(db_path) as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS crawled_features (url TEXT PRIMARY KEY, feature_hash TEXT) WITHOUT ROWID")
+        conn.execute("DELETE FROM crawled_features")
+        conn.executemany("INSERT INTO crawled_features VALUES (?, ?)",
+                         features[["url", "feature_hash"]].itertuples(index=False, name=None))
+        unchanged = conn.execute('''
+            SELECT COUNT(*) FROM crawled_features c
+            JOIN ad_features f ON f.url = c.url AND f.feature_hash = c.feature_hash
+        ''').fetchone()[0]
+        _write_features(conn, features)
+        conn.commit()
+
+    stats.update(ads=len(features), changed=len(features) - unchanged, unchanged=unchanged)
+    return stats
+
+
+def build_features(db_path: str, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Derive the features of the stored ads that have none, or were updated after them.
+
+    Args:
+        db_path: Path to the ads database
+        batch_size: Ads read and written per transaction
+
+    Returns:
+        Counters: ads (derived), batches
+    """
+    if not init_feature_tables(db_path):
+        raise sqlite3.DatabaseError(f"Could not initialize the feature tables in {db_path}")
+
+    stats = {"ads": 0, "batches": 0}
+    with get_connection(db_path) as conn:
+        conn.row_factory = None
+        available = {row[1] for row in conn.execute("PRAGMA table_info(real_estate_ads)")}
+        columns = [column for column in SOURCE_COLUMNS if column in available]
+        if "url" not in columns:
+            return stats
+        query = f'''
+            SELECT {", ".join(f"a.{column}" for column in columns)} FROM real_estate_ads a
+            LEFT JOIN ad_features f ON f.url = a.url
+            WHERE a.url > ? AND (f.url IS NULL OR a.updated_at > f.computed_at)
+            ORDER BY a.url LIMIT ?
+        '''
+        last_url = ""
+        while True:
+            batch = pd.DataFrame(conn.execute(query, (last_url, batch_size)).fetchall(), columns=columns)
+            if batch.empty:
+                break
+            _write_features(conn, compute_features(batch))
+            conn.commit()
+            last_url = batch["url"].iloc[-1]
+            stats["ads"] += len(batch)
+            stats["batches"] += 1
+
+    logger.info(f"[INFO] Features derived for {stats['ads']} ads in {stats['batches']} batches")
+    return stats
+
+
+def _file_id(path: str) -> str:
+    """Name and content hash of a model file, so that a retrained model is a new model."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return f"{os.path.basename(path)}:{digest.hexdigest()[:12]}"
+
+
+@lru_cache(maxsize=8)
+def _load_model_file(path: str, mtime_ns: int) -> Dict[str, Any]:
+    try:
+        import joblib
+    except ImportError:
+        joblib = None
+
+    if joblib is not None:
+        loaded = joblib.load(path)
+    else:
+        with open(path, "rb") as file:
+            loaded = pickle.load(file)
+
+    bundle = dict(loaded) if isinstance(loaded, dict) else {"model": loaded}
+    model = bundle.get("pipeline", bundle.get("model"))
+    if model is None or not hasattr(model, "predict"):
+        raise ValueError(f"{path} holds no model with a predict method")
+    features = list(bundle.get("features") or getattr(model, "feature_names_in_", FEATURE_COLUMNS))
+    unknown = [column for column in features if column not in MODEL_INPUT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Model {path} uses features that are not stored: {unknown}")
+    target = bundle.get("target", "price")
+    if target not in TARGETS:
+        raise ValueError(f"Model {path} predicts {target!r}, expected one of {TARGETS}")
+    return {"model": model, "features": features, "target": target, "contract": bundle.get("contract"),
+            "model_id": bundle.get("model_id") or _file_id(path)}
+
+
+def load_model(path: str) -> Dict[str, Any]:
+    """
+    Load a serialized price model (cached until the file changes).
+
+    Args:
+        path: Path of the pickle or joblib file
+
+    Returns:
+        Dictionary with model, features, target, contract and model_id
+    """
+    return _load_model_file(os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+
+def _predict_prices(model: Dict[str, Any], batch: pd.DataFrame) -> np.ndarray:
+    """Predicted prices of a batch of stored features."""
+    predictions = np.asarray(model["model"].predict(batch[model["features"]]), dtype=float).reshape(-1)
+    if model["target"] == "price_per_m2":
+        predictions = predictions * batch["surface_m2"].to_numpy(dtype=float)
+    return predictions
+
+
+def score_pending(
+    db_path: str,
+    model_path: str,
+    threshold: float = DEFAULT_THRESHOLD,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    urls: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """
+    Score the listings the model has not scored with their current features.
+
+    Args:
+        db_path: Path to the ads database
+        model_path: Path of the serialized model (see load_model)
+        threshold: Relative gap below the predicted price from which an ad is under-priced
+        batch_size: Listings predicted and written per batch
+        urls: Only score these listings (default: all the stored features)
+
+    Returns:
+        Counters: model_id, scored, underpriced, batches
+    """
+    if not init_feature_tables(db_path):
+        raise sqlite3.DatabaseError(f"Could not initialize the feature tables in {db_path}")
+    model = load_model(model_path)
+    stats = {"model_id": model["model_id"], "scored": 0, "underpriced": 0, "batches": 0}
+
+    columns = ["url", "feature_hash", "price_value", *MODEL_INPUT_COLUMNS]
+    conditions, params = [], []
+    if model["contract"]:
+        conditions.append("f.contract = ?")
+        params.append(model["contract"])
+    with get_connection(db_path) as conn:
+        conn.row_factory = None
+        if urls is not None:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS scoring_urls (url TEXT PRIMARY KEY) WITHOUT ROWID")
+            conn.execute("DELETE FROM scoring_urls")
+            conn.executemany("INSERT OR IGNORE INTO scoring_urls VALUES (?)",
+                             ((url,) for url in urls if isinstance(url, str) and url))
+            conditions.append("f.url IN (SELECT url FROM scoring_urls)")
+        query = f'''
+            SELECT {", ".join(f"f.{column}" for column in columns)} FROM ad_features f
+            LEFT JOIN ad_scores s ON s.url = f.url AND s.model_id = ?
+            WHERE f.url > ? AND (s.url IS NULL OR s.feature_hash IS NOT f.feature_hash)
+            {"".join(f" AND {condition}" for condition in conditions)}
+            ORDER BY f.url LIMIT ?
+        '''
+        last_url = ""
+        while True:
+            batch = pd.DataFrame(conn.execute(query, (model["model_id"], last_url, *params, batch_size)).fetchall(),
+                                 columns=columns)
+            if batch.empty:
+                break
+            # Vectorised over the batch: one predict call, one executemany
+            predicted = _predict_prices(model, batch)
+            prices = batch["price_value"].to_numpy(dtype=float)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = np.where(predicted > 0, prices / predicted, np.nan)
+            underpriced = (prices > 0) & (ratio <= 1 - threshold)
+            scored_at = _now()
+            conn.executemany(
+                '''
+                INSERT INTO ad_scores (url, model_id, feature_hash, predicted_price, price_value, price_ratio,
+                                       underpriced, scored_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url, model_id) DO UPDATE SET
+                    feature_hash = excluded.feature_hash,
+                    predicted_price = excluded.predicted_price,
+                    price_value = excluded.price_value,
+                    price_ratio = excluded.price_ratio,
+                    underpriced = excluded.underpriced,
+                    scored_at = excluded.scored_at
+                ''',
+                (
+                    (url, model["model_id"], feature_hash, _sql_float(value), _sql_float(price), _sql_float(share),
+                     int(flag), scored_at)
+                    for url, feature_hash, value, price, share, flag in zip(
+                        batch["url"], batch["feature_hash"], predicted, prices, ratio, underpriced)
+                )
+            )
+            conn.commit()
+            last_url = batch["url"].iloc[-1]
+            stats["scored"] += len(batch)
+            stats["underpriced"] += int(underpriced.sum())
+            stats["batches"] += 1
+
+    logger.info(f"[INFO] Model {stats['model_id']}: {stats['scored']} ads scored, {stats['underpriced']} under-priced")
+    return stats
+
+
+def _sql_float(value: float) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+def score_ads(
+    db_path: str,
+    ads: pd.DataFrame,
+    model_path: str,
+    threshold: float = DEFAULT_THRESHOLD,
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Dict[str, Any]:
+    """
+    Store the features of the ads of a crawl and score the new or changed ones.
+
+    Args:
+        db_path: Path to the ads database
+        ads: Flattened ads of the crawl (with url)
+        model_path: Path of the serialized model (see load_model)
+        threshold: Relative gap below the predicted price from which an ad is under-priced
+        batch_size: Listings predicted and written per batch
+
+    Returns:
+        Counters: ads, changed, unchanged, model_id, scored, underpriced, batches
+    """
+    stats = update_features(db_path, ads)
+    if not stats["ads"]:
+        return {**stats, "model_id": None, "scored": 0, "underpriced": 0, "batches": 0}
+    stats.update(score_pending(db_path, model_path, threshold=threshold, batch_size=batch_size, urls=ads["url"]))
+    return stats
+
+
+def read_training_set(db_path: str, contract: Optional[str] = None, cities: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Stored features with the prices, to fit a model for score_pending.
+
+    Args:
+        db_path: Path to the ads database
+        contract: Only the ads of this contract (optional)
+        cities: Only the ads of these cities (optional, case-insensitive)
+
+    Returns:
+        DataFrame with url, contract, city, price_value and FEATURE_COLUMNS of the ads with a price
+    """
+    conditions, params = ["price_value > 0"], []
+    if contract:
+        conditions.append("contract = ?")
+        params.append(contract)
+    if cities:
+        conditions.append(f"LOWER(city) IN ({', '.join('?' * len(cities))})")
+        params.extend(city.lower() for city in cities)
+    with get_connection(db_path) as conn:
+        conn.row_factory = None
+        return pd.read_sql_query(
+            f"SELECT url, {', '.join(MODEL_INPUT_COLUMNS)}, price_value FROM ad_features "
+            f"WHERE {' AND '.join(conditions)} ORDER BY url",
+            conn, params=params
+        )
+
+
+def read_underpriced(db_path: str, model_id: Optional[str] = None, cities: Optional[List[str]] = None,
+                     limit: int = 50) -> pd.DataFrame:
+    """
+    Under-priced ads, cheapest relative to their predicted price first.
+
+    Args:
+        db_path: Path to the ads database
+        model_id: Only the scores of this model (optional)
+        cities: Only the ads of these cities (optional, case-insensitive)
+        limit: Maximum number of ads
+
+    Returns:
+        DataFrame of the underpriced_ads view
+    """
+    conditions, params = [], []
+    if model_id:
+        conditions.append("model_id = ?")
+        params.append(model_id)
+    if cities:
+        conditions.append(f"LOWER(city) IN ({', '.join('?' * len(cities))})")
+        params.extend(city.lower() for city in cities)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with get_connection(db_path) as conn:
+        conn.row_factory = None
+        return pd.read_sql_query(f"SELECT * FROM underpriced_ads {where} ORDER BY price_ratio LIMIT ?",
+                                 conn, params=[*params, limit])
+
+
+def main():
+    """Build the feature store and score the ads of a SQLite database from the command line."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Derive the features of stored ads and flag under-priced ads')
+    parser.add_argument('--db', type=str, required=True, help='Path to the SQLite database')
+    parser.add_argument('--build', action='store_true',
+                        help='Derive the features of the ads that have none or were updated since')
+    parser.add_argument('--score', type=str, metavar='MODEL', help='Score the pending ads with this pickle/joblib model')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Gap below the predicted price that flags an ad as under-priced (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Ads per batch (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--underpriced', action='store_true', help='Print the under-priced ads')
+    parser.add_argument('--city', nargs='+', dest='cities', help='Only these cities (with --underpriced)')
+    parser.add_argument('--limit', type=int, default=50, help='Maximum number of ads printed (default: 50)')
+    args = parser.parse_args()
+
+    if args.build:
+        build_features(args.db, batch_size=args.batch_size)
+    model_id = None
+    if args.score:
+        model_id = score_pending(args.db, args.score, threshold=args.threshold, batch_size=args.batch_size)["model_id"]
+    if args.underpriced:
+        ads = read_underpriced(args.db, model_id=model_id, cities=args.cities, limit=args.limit)
+        with pd.option_context("display.max_rows", None, "display.width", 200, "display.max_colwidth", 80):
+            print(ads.to_string(index=False) if not ads.empty else "No under-priced ads")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,37 @@
 # --- fetch_ads.py ---
 
-import requests
 import time
 import random
-import uuid
 import os
-import json
 import logging
 import argparse
-import pandas as pd
-from helpers import (
-    RealEstateAd, 
-    init_cosmos_client, 
-    create_ads_dataframe
-)
-from sqlite_helpers import write_df_to_sqlite, init_database
-from dotenv import load_dotenv
+from helpers import load_env_vars
+from geography_store import get_geography_store
+from validation import VALIDATION_MODES
 from pathlib import Path
 
+# requests, pandas, pydantic, the Azure SDK and the output modules are imported
+# by the functions using them: --help and lookups like --list-macrozones only
+# need argparse and the geography store, and start in a fraction of the time
+
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 logging.getLogger("azure.cosmos").setLevel(logging.WARNING)  # Suppress Cosmos SDK logs
 logging.getLogger("pydantic").setLevel(logging.WARNING)  # Suppress Pydantic validation logs
 
-# Load common cities from JSON file
+# Common cities live in the geography store (synced from common_cities.json),
+# queried one city at a time; COMMON_CITIES is only built if someone asks for it
 COMMON_CITIES_FILE = Path(__file__).resolve().parent / "common_cities.json"
-try:
-    with open(COMMON_CITIES_FILE, 'r', encoding='utf-8') as f:
-        COMMON_CITIES = json.load(f)
-    logger.debug(f"Loaded {len(COMMON_CITIES)} cities from {COMMON_CITIES_FILE}")
-except Exception as e:
-    logger.error(f"Error loading common_cities.json: {e}")
-    # Fallback to an empty dictionary if the file cannot be loaded
-    COMMON_CITIES = {}
-
-# Load environment variables
-def load_env_vars():
-    """Load environment variables from .env file"""
-    env_path = Path(__file__).resolve().parent / ".env"
-    load_dotenv(env_path)
-    
-    # Get environment variables with fallbacks
-    env_vars = {
-        "COSMOS_ENDPOINT": os.environ.get("COSMOS_DB_ACCOUNT_URI", ""),
-        "COSMOS_KEY": os.environ.get("COSMOS_DB_ACCOUNT_KEY", ""),
-        "COSMOS_DB": os.environ.get("COSMOS_DB_DATABASE_NAME", ""),
-        "BASE_URL": os.environ.get("IMMOBILIARE_API_URL", "https://www.immobiliare.it/api-next/search-list/listings/"),
-        "COOKIES": {
-            "PHPSESSID": os.environ.get("PHPSESSID", "e5686b96fbe172ee7cd72d2fee24712d"),
-            "IMMSESSID": os.environ.get("IMMSESSID", "e463dc3c67fb3bbc2073da5b3b8fcfed"),
-            "datadome": os.environ.get("DATADOME", "raRTHfOWVs3UHHI0mL8JHd28BnmNGvrwoW0YQoe1OGWN0396cfnXqNZrH0efDY3YacgoqDuIrgM200pQSPu_HDzKNaXsJwGE6B2_cz_TqXauGiR04B_nuZPm7RCwmRt7")
-        }
-    }
-    
-    return env_vars
 
 
+def __getattr__(name):
+    if name == "COMMON_CITIES":
+        common_cities = get_geography_store(json_path=COMMON_CITIES_FILE).export_common_cities()
+        globals()["COMMON_CITIES"] = common_cities
+        return common_cities
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # Default headers for API requests
 DEFAULT_HEADERS = {
     "User-Agent": "Mozilla/5.0",
@@ -74,7 +47,11 @@ DEFAULT_HEADERS = {
 # Parameters mapper for different cities
 def get_comune_id_by_name(query):
     """
-    Retrieve the idComune for a given search query using Immobiliare.it's autocomplete API.
+    Retrieve the idComune for a given search query.
+    
+    The local gazetteer (common cities, imported ISTAT comuni and previously
+    resolved queries, with typo-tolerant matching) is checked first; Immobiliare.it's
+    autocomplete API is only queried on a cache miss and its answer is cached.
     
     Args:
         query: The name of the comune/city to search for
@@ -82,15 +59,32 @@ def get_comune_id_by_name(query):
     Returns:
         Dictionary containing idComune, name, and path if found, None otherwise
     """
-    # Use the global COMMON_CITIES dictionary loaded from the JSON file
-    
-    # First check if query matches a common city directly
-    query_lower = query.lower().strip()
-    if query_lower in COMMON_CITIES:
-        city_info = COMMON_CITIES[query_lower]
-        logger.info(f"[INFO] Found comune from local database: {city_info['name']} (ID: {city_info['idComune']})")
-        return city_info
+    from gazetteer import get_gazetteer
+
+    comune_info = get_gazetteer(seed=get_geography_store(json_path=COMMON_CITIES_FILE).comuni()).resolve(
+        query, fetch=fetch_comune_from_api
+    )
+    if comune_info is None:
+        logger.warning(f"[WARNING] No comune found for query: {query}")
+    return comune_info
+
+def fetch_comune_from_api(query):
+    """
+    Query Immobiliare.it's autocomplete API for a comune.
     
+    Args:
+        query: The name of the comune/city to search for
+        
+    Returns:
+        Dictionary containing idComune, name, and path if found, None otherwise
+        
+    Raises:
+        requests.exceptions.RequestException: If no endpoint answered, so that
+        the failure is not cached as "not found"
+    """
+    import requests
+    import json_codec
+
     # Try multiple API endpoints to increase chance of success
     urls = [
         f"https://www.immobiliare.it/api-next/geography/autocomplete/?query={query}"
@@ -110,13 +104,15 @@ def get_comune_id_by_name(query):
     }
     
     # Try API endpoints
+    answered = False
     for url in urls:
         try:
             logger.info(f"[INFO] Querying comune search API: {url}")
             response = requests.get(url, headers=headers, timeout=15)
             
             if response.status_code == 200:
-                data = response.json()
+                answered = True
+                data = json_codec.loads(response.content)
                 
                 # First API format
                 if "results" in data:
@@ -153,29 +149,8 @@ def get_comune_id_by_name(query):
         except requests.exceptions.RequestException as e:
             logger.warning(f"[WARNING] Error with {url}: {e}")
     
-    # Fuzzy match with common cities as a last resort
-    best_match = None
-    best_score = 0
-    for city, info in COMMON_CITIES.items():
-        similarity = 0
-        query_parts = query_lower.split()
-        city_parts = city.split()
-        
-        # Simple matching algorithm
-        for qp in query_parts:
-            for cp in city_parts:
-                if qp in cp or cp in qp:
-                    similarity += 1
-        
-        if similarity > best_score:
-            best_score = similarity
-            best_match = info
-    
-    if best_match and best_score > 0:
-        logger.info(f"[INFO] Found closest matching comune: {best_match['name']} (ID: {best_match['idComune']})")
-        return best_match
-    
-    logger.warning(f"[WARNING] No comune found for query: {query}")
+    if not answered:
+        raise requests.exceptions.RequestException(f"Comune search API unavailable for query: {query}")
     return None
 
 def get_params_mapper(contract_type, comune_id=None, comune_name=None, macrozones=None):
@@ -273,44 +248,30 @@ def load_data_from_dict(data_dict):
     Args:
         data_dict: The dictionary containing the data to be loaded.
     """
-    results = data_dict["results"]
-    ads = []
+    from pydantic import ValidationError
+    from models import RealEstateAd
+    from validation import get_ads_adapter
+
+    items = [item["realEstate"] for item in data_dict["results"]]
 
-    for item in results:
+    # Fast path: validate the whole page in one call
+    try:
+        return get_ads_adapter().validate_python(items)
+    except ValidationError:
+        pass
+
+    # Some items are invalid: keep the valid ones and log the others
+    ads = []
+    for item in items:
         try:
-            ad = RealEstateAd.model_validate(item["realEstate"])
-            ads.append(ad)
-        except Exception as e:
-            logger.info("[ERRORE] Parsing fallito:", e)
+            ads.append(RealEstateAd.model_validate(item))
+        except ValidationError as e:
+            logger.warning(f"[ERRORE] Parsing fallito per l'annuncio {item.get('id')}: {e.error_count()} errori")
     
     return ads
 
-def clean_dataframe_for_export(df):
-    """
-    Clean DataFrame by replacing NaN values with None and empty strings with None.
-    This ensures consistency when saving to JSON or uploading to databases.
-    
-    Args:
-        df: Pandas DataFrame to clean
-        
-    Returns:
-        Cleaned DataFrame with NaN and empty strings replaced with None
-    """
-    # Make a copy to avoid modifying the original DataFrame
-    cleaned_df = df.copy()
-    
-    # Replace NaN with None (which becomes null in JSON)
-    cleaned_df = cleaned_df.astype(object).replace({pd.NA: None})
-    cleaned_df = cleaned_df.where(pd.notnull(cleaned_df), None)
-    
-    # Replace empty strings with None
-    for col in cleaned_df.columns:
-        if cleaned_df[col].dtype == object:  # Only process string columns
-            cleaned_df[col] = cleaned_df[col].replace('', None)
-    
-    return cleaned_df
-
-def fetch_ads(area_params, base_url, headers=None, cookies=None, max_pages=None, start_page=1, delay_range=(2.5, 5.0)):
+def fetch_ads(area_params, base_url, headers=None, cookies=None, max_pages=None, start_page=1, delay_range=(2.5, 5.0),
+              validation_mode="off", on_page=None):
     """
     Fetch real estate ads from immobiliare.it based on the provided parameters.
     
@@ -322,16 +283,29 @@ def fetch_ads(area_params, base_url, headers=None, cookies=None, max_pages=None,
         max_pages: Maximum number of pages to fetch (optional)
         start_page: Page to start fetching from (optional, default 1)
         delay_range: Tuple of min/max delay between requests (optional)
+        validation_mode: Schema validation of each page against models.py: 'off', 'sample' or 'full' (optional)
+        on_page: Callback receiving the column arrays of each page as soon as it is fetched (optional)
         
     Returns:
-        DataFrame containing the fetched ads
+        DataFrame containing the fetched ads; df.attrs["crawl_complete"] tells whether every
+        page of the search was fetched (from page 1, without errors), df.attrs["requests"]
+        how many requests were sent
     """
+    import requests
+    import json_codec
+    from flatten import flatten_page, extend_columns, columns_to_dataframe
+    from validation import validate_page, new_validation_report, merge_validation_reports, log_validation_report
+
     session = requests.Session()
     if headers:
         session.headers.update(headers)
     if cookies:
         session.cookies.update(cookies)
-    ads = []
+    columns = {}
+    validation_report = new_validation_report(validation_mode)
+    site_max_pages = None
+    failed = False
+    request_count = 0
 
     page = start_page
     while not max_pages or page <= max_pages:
@@ -339,10 +313,12 @@ def fetch_ads(area_params, base_url, headers=None, cookies=None, max_pages=None,
         area_params["pag"] = page
 
         response = session.get(base_url, params=area_params)
+        request_count += 1
         if response.status_code == 200:
-            data = response.json()
+            data = json_codec.loads(response.content)
+            site_max_pages = data.get("maxPages", 0)
             if max_pages is None:
-                max_pages = data.get("maxPages", 0)
+                max_pages = site_max_pages
             if max_pages == 0:
                 logger.info("[ERROR] No pages found.")
                 break
@@ -351,11 +327,20 @@ def fetch_ads(area_params, base_url, headers=None, cookies=None, max_pages=None,
                 logger.info("[INFO] All pages have been processed.")
                 break
             
+            page_report = validate_page(data["results"], validation_mode)
+            log_validation_report(page_report, f"Pagina {page}:")
+            merge_validation_reports(validation_report, page_report)
+            
+            # Flatten the page straight into column arrays
+            page_columns = flatten_page(data["results"], include_raw=True)
+            extend_columns(columns, page_columns)
+            if on_page is not None:
+                on_page(page_columns)
             for item in data["results"]:
-                ads.append(item)
                 logger.info(f"[OK] fetched ad '{item['realEstate']['title']}'")
         else:
             logger.info(f"[ERROR] status code {response.status_code}, response: {response.text}")
+            failed = True
             break
 
         # Random delay between requests
@@ -363,7 +348,12 @@ def fetch_ads(area_params, base_url, headers=None, cookies=None, max_pages=None,
         time.sleep(random.uniform(min_delay, max_delay))
         page += 1
     
-    df = create_ads_dataframe(ads)
+    log_validation_report(validation_report, "Totale:")
+    df = columns_to_dataframe(columns)
+    df.attrs["crawl_complete"] = (
+        not failed and start_page == 1 and site_max_pages is not None and page > site_max_pages
+    )
+    df.attrs["requests"] = request_count
     
     return df
 
@@ -373,8 +363,21 @@ def process_ads(config):
     
     Args:
         config: Dictionary containing configuration parameters
+
+    Returns:
+        DataFrame of the fetched ads; df.attrs["results"] holds the outcome of every output
     """
-    
+    import pandas as pd
+    from helpers import clean_dataframe_for_export
+    from cosmos_ingest import DEFAULT_CONCURRENCY
+    from flatten import columns_to_dataframe
+    from export_writers import render_stream_path
+    from crawl_sessions import record_crawl
+    from enrichment import enrich_ads
+    from feature_store import DEFAULT_THRESHOLD, score_ads
+    from sinks import CosmosSink, SQLiteSink, CSVSink, JSONSink, stream_file_sink
+    from sqlite_shards import group_by_shard
+    from content_hash import compute_content_hashes, count_written, filter_changed, get_ad_keys, mark_df_written
     
     contract_type = config.get("contract_type", "rent")
     cosmos_container_name = f"ads_{contract_type}"
@@ -401,6 +404,20 @@ def process_ads(config):
     save_to_csv = config.get("save_to_csv", True)
     save_to_json = config.get("save_to_json", False)
     sqlite_db_path = config.get("sqlite_db_path", f"{output_path}/ads.db")
+    sqlite_shard_dir = config.get("sqlite_shard_dir")
+    validation_mode = config.get("validation_mode", "off")
+    skip_unchanged = config.get("skip_unchanged", False)
+    hash_index_path = config.get("hash_index_path", f"{output_path}/ad_hashes.db")
+    stream_files = config.get("stream_files", [])
+    cosmos_concurrency = config.get("cosmos_concurrency") or DEFAULT_CONCURRENCY
+    track_delistings = config.get("track_delistings", False)
+    enrich_details = config.get("enrich_details", False)
+    detail_workers = config.get("detail_workers", 4)
+    detail_rate = config.get("detail_rate", 1.0)
+    score_model = config.get("score_model")
+    underprice_threshold = config.get("underprice_threshold")
+    if underprice_threshold is None:
+        underprice_threshold = DEFAULT_THRESHOLD
     
     # Get parameters mapper for the selected contract type, with comune details if provided
     params_mapper = get_params_mapper(contract_type, comune_id, comune_name, macrozones)
@@ -414,15 +431,62 @@ def process_ads(config):
     area_params["pag"] = start_page
     logger.info(f"[INFO] Parametri di ricerca per {city}: {area_params}")
     
+    # Stream files are appended to page by page while the crawl runs
+    stream_result = {"attempted": False, "success": True, "records": 0, "unchanged": 0, "files": [], "error": None}
+    stream_sinks = {}
+    if stream_files:
+        stream_result["attempted"] = True
+        try:
+            for template in stream_files:
+                stream_sinks[template] = stream_file_sink(render_stream_path(template, city, contract_type)).open()
+                logger.info(f"[INFO] Stream {stream_sinks[template].name}: {stream_sinks[template].path}")
+            stream_result["files"] = [sink.path for sink in stream_sinks.values()]
+        except Exception as e:
+            logger.error(f"[ERRORE] Apertura dei file stream fallita: {e}")
+            stream_result["success"] = False
+            stream_result["error"] = str(e)
+            stream_sinks = {}
+    
+    def stream_page(page_columns):
+        """Append one page to every stream file, skipping unchanged ads if requested."""
+        page_df = clean_dataframe_for_export(columns_to_dataframe(page_columns))
+        page_df = page_df[[col for col in page_df.columns if col != "raw_data"]]
+        page_hashes = compute_content_hashes(page_df) if skip_unchanged and not page_df.empty else None
+        for template, sink in stream_sinks.items():
+            try:
+                # The hash key is the template, so rotated files share the same hash history
+                stream_key = f"stream:{template}"
+                stream_df, unchanged = page_df, 0
+                if page_hashes is not None:
+                    stream_df, unchanged = filter_changed(page_df, hash_index_path, stream_key, page_hashes)
+                positions = sink.write(stream_df)
+                stream_result["records"] += len(positions)
+                stream_result["unchanged"] += unchanged
+                if page_hashes is not None:
+                    mark_df_written(hash_index_path, stream_key, stream_df.iloc[positions], page_hashes)
+                if sink.last_error:
+                    stream_result["success"] = False
+                    stream_result["error"] = sink.last_error
+            except Exception as e:
+                logger.error(f"[ERRORE] Scrittura nello stream {sink.path} fallita: {e}")
+                stream_result["success"] = False
+                stream_result["error"] = str(e)
+    
     # Fetch the ads
-    df = fetch_ads(
-        area_params=area_params,
-        base_url=base_url,
-        headers=headers,
-        cookies=cookies,
-        max_pages=max_pages,
-        start_page=start_page
-    )
+    try:
+        df = fetch_ads(
+            area_params=area_params,
+            base_url=base_url,
+            headers=headers,
+            cookies=cookies,
+            max_pages=max_pages,
+            start_page=start_page,
+            validation_mode=validation_mode,
+            on_page=stream_page if stream_sinks else None
+        )
+    finally:
+        for sink in stream_sinks.values():
+            sink.close()
     logger.info(f"[INFO] Numero di annunci trovati: {len(df)}")
     
     # Clean the DataFrame for export to ensure consistency across formats
@@ -434,102 +498,179 @@ def process_ads(config):
         # Create an empty DataFrame as fallback if cleaning fails
         clean_df = pd.DataFrame()
     
+    # Hash each ad once so that every sink only receives new or changed records
+    content_hashes = None
+    if skip_unchanged and not clean_df.empty:
+        content_hashes = compute_content_hashes(clean_df)
+    
+    def changed_rows(hash_key):
+        """Return the rows of clean_df that are new or changed for the given sink."""
+        if content_hashes is None:
+            return clean_df, 0
+        return filter_changed(clean_df, hash_index_path, hash_key, content_hashes)
+    
+    def write_changed_rows(sink, hash_key, result):
+        """Write the new or changed rows to a sink and remember the hashes of those written."""
+        sink_df, unchanged = changed_rows(hash_key)
+        result["unchanged"] = unchanged
+        with sink:
+            positions = sink.write(sink_df)
+        if content_hashes is not None:
+            mark_df_written(hash_index_path, hash_key, sink_df.iloc[positions], content_hashes)
+        result["success"] = sink.last_error is None
+        result["error"] = sink.last_error
+        return sink
+    
+    def rewrite_file(sink, hash_key, result):
+        """Rewrite a file holding the full crawl, only when its ads changed, appeared or dropped out."""
+        file_df, unchanged = changed_rows(hash_key)
+        result["unchanged"] = unchanged
+        result["file"] = sink.path
+        # Every ad of the crawl is unchanged: the file is the same if it holds no other ad
+        same_ads = (
+            content_hashes is not None and file_df.empty and unchanged
+            and count_written(hash_index_path, hash_key) == get_ad_keys(clean_df).nunique()
+        )
+        if same_ads and os.path.exists(sink.path):
+            logger.info(f"[INFO] Nessuna modifica, file {sink.name.upper()} non riscritto: {sink.path}")
+        else:
+            with sink:
+                sink.write(clean_df)
+            if sink.last_error:
+                raise RuntimeError(sink.last_error)
+            logger.info(f"[INFO] Dati salvati nel file {sink.name.upper()}: {sink.path}")
+            if content_hashes is not None:
+                mark_df_written(hash_index_path, hash_key, clean_df, content_hashes, replace=True)
+        result["success"] = True
+    
+    def ads_databases():
+        """(database, ads) pairs of the SQLite files holding the crawled ads: each shard, or the database."""
+        if not save_to_sqlite:
+            raise RuntimeError("richiede il salvataggio degli annunci in SQLite (--save-sqlite)")
+        if sqlite_shard_dir:
+            return list(group_by_shard(clean_df, sqlite_shard_dir).items())
+        return [(sqlite_db_path, clean_df)]
+    
     # Store operation results for summary
     results = {
-        "cosmos_db": {"attempted": False, "success": False, "records": 0, "error": None},
-        "sqlite": {"attempted": False, "success": False, "new": 0, "updated": 0, "error": None},
-        "csv": {"attempted": False, "success": False, "file": None, "error": None},
-        "json": {"attempted": False, "success": False, "file": None, "error": None}
+        "cosmos_db": {"attempted": False, "success": False, "records": 0, "unchanged": 0, "request_charge": 0.0, "error": None},
+        "sqlite": {"attempted": False, "success": False, "new": 0, "updated": 0, "unchanged": 0, "error": None},
+        "csv": {"attempted": False, "success": False, "file": None, "unchanged": 0, "error": None},
+        "json": {"attempted": False, "success": False, "file": None, "unchanged": 0, "error": None},
+        "stream": stream_result,
+        "delistings": {"attempted": False, "success": False, "delisted": 0, "error": None},
+        "details": {"attempted": False, "success": False, "fetched": 0, "unchanged": 0, "failed": 0, "error": None},
+        "scores": {"attempted": False, "success": False, "changed": 0, "scored": 0, "underpriced": 0, "error": None}
     }
     
-    # Save to Cosmos DB if requested - independent try/except
+    # Every output goes through a sink (see sinks.py) - independent try/except
     if save_to_cosmos and cosmos_endpoint and cosmos_key and cosmos_db:
         results["cosmos_db"]["attempted"] = True
         try:
-            # Initialize Cosmos DB client
-            container_client = init_cosmos_client(cosmos_endpoint, cosmos_key, cosmos_db, cosmos_container_name)
-            logger.info(f"[INFO] Client Cosmos DB inizializzato per il container: {cosmos_container_name}")
-            
-            # Convert cleaned DataFrame to records for insertion
-            records = clean_df.to_dict('records')
-            
-            # Add ID and partition key for Cosmos DB
-            for record in records:
-                if 'uuid' in record and record['uuid']:
-                    record['id'] = str(record['uuid'])  # Cosmos DB requires a unique ID
-                else:
-                    record['id'] = str(uuid.uuid4())    # Generate UUID if not present
-                
-                # Ensure partition key (city) is present
-                if 'city' not in record or not record['city']:
-                    record['city'] = city  # Use current city as fallback
-            
-            # Insert records into Cosmos DB
-            successful_inserts = 0
-            for i, record in enumerate(records):
-                try:
-                    container_client.upsert_item(body=record)
-                    successful_inserts += 1
-                    if i % 10 == 0 or i == len(records) - 1:  # Log every 10 records and the last one
-                        logger.info(f"[INFO] Inserito record {i+1}/{len(records)}")
-                except Exception as record_e:
-                    logger.error(f"[ERRORE] Inserimento fallito per record {i+1}: {record_e}")
-            
-            logger.info(f"[INFO] Inserimento completato. {successful_inserts}/{len(records)} record inseriti in Cosmos DB")
-            results["cosmos_db"]["success"] = True
-            results["cosmos_db"]["records"] = successful_inserts
+            # Records are upserted in parallel, grouped in transactional batches per city
+            logger.info(f"[INFO] Inserimento dei record nel container: {cosmos_container_name}")
+            cosmos_sink = write_changed_rows(
+                CosmosSink(
+                    cosmos_container_name,
+                    endpoint=cosmos_endpoint,
+                    key=cosmos_key,
+                    db_name=cosmos_db,
+                    default_city=city,
+                    concurrency=cosmos_concurrency
+                ),
+                f"cosmos:{cosmos_db}/{cosmos_container_name}",
+                results["cosmos_db"]
+            )
+            if results["cosmos_db"]["unchanged"]:
+                logger.info(f"[INFO] Cosmos DB: {results['cosmos_db']['unchanged']} record invariati non riscritti")
+            results["cosmos_db"]["records"] = cosmos_sink.metrics["written"]
+            results["cosmos_db"]["request_charge"] = cosmos_sink.metrics.get("request_charge", 0.0)
         except Exception as e:
             logger.error(f"[ERRORE] Salvataggio in Cosmos DB fallito: {e}")
             results["cosmos_db"]["error"] = str(e)
     
-    # Save to SQLite if requested - independent try/except
     if save_to_sqlite:
         results["sqlite"]["attempted"] = True
         try:
-            # Initialize the database if it doesn't exist
-            init_database(sqlite_db_path)
-            
-            # Write cleaned DataFrame to SQLite
-            new_records, updated_records = write_df_to_sqlite(clean_df, sqlite_db_path, replace_existing=True)
-            logger.info(f"[INFO] SQLite: {new_records} nuovi record, {updated_records} record aggiornati")
-            results["sqlite"]["success"] = True
-            results["sqlite"]["new"] = new_records
-            results["sqlite"]["updated"] = updated_records
+            # Set-based upserts on url, into one file or into per-province shards
+            sqlite_sink = write_changed_rows(
+                SQLiteSink(sqlite_db_path, mode="ads", shard_dir=sqlite_shard_dir),
+                f"sqlite:{sqlite_shard_dir or sqlite_db_path}",
+                results["sqlite"]
+            )
+            results["sqlite"]["new"] = sqlite_sink.metrics.get("new", 0)
+            results["sqlite"]["updated"] = sqlite_sink.metrics.get("updated", 0)
+            logger.info(
+                f"[INFO] SQLite: {results['sqlite']['new']} nuovi record, {results['sqlite']['updated']} record aggiornati, "
+                f"{results['sqlite']['unchanged']} invariati"
+            )
         except Exception as e:
             logger.error(f"[ERRORE] Salvataggio in SQLite fallito: {e}")
             results["sqlite"]["error"] = str(e)
     
-    # Save to CSV if requested - independent try/except
     if save_to_csv:
         results["csv"]["attempted"] = True
         try:
             output_filename = f"{output_path}/ads_{city}_{contract_type}.csv"
-            clean_df.to_csv(output_filename, index=False)
-            logger.info(f"[INFO] Dati salvati nel file CSV: {output_filename}")
-            results["csv"]["success"] = True
-            results["csv"]["file"] = output_filename
+            rewrite_file(CSVSink(output_filename, overwrite=True), f"csv:{output_filename}", results["csv"])
         except Exception as e:
             logger.error(f"[ERRORE] Salvataggio in CSV fallito: {e}")
             results["csv"]["error"] = str(e)
     
-    # Save to JSON if requested - independent try/except
     if save_to_json:
         results["json"]["attempted"] = True
         try:
-            # Convert cleaned DataFrame to list of dictionaries
-            records = clean_df.to_dict('records')
             json_filename = f"{output_path}/ads_{city}_{contract_type}.json"
-            
-            with open(json_filename, 'w', encoding='utf-8') as f:
-                json.dump(records, f, ensure_ascii=False, indent=2)
-                
-            logger.info(f"[INFO] Dati salvati nel file JSON: {json_filename}")
-            results["json"]["success"] = True
-            results["json"]["file"] = json_filename
+            rewrite_file(JSONSink(json_filename, indent=2), f"json:{json_filename}", results["json"])
         except Exception as e:
             logger.error(f"[ERRORE] Salvataggio in JSON fallito: {e}")
             results["json"]["error"] = str(e)
     
+    # Fetch the detail page of the new or changed ads only
+    if enrich_details:
+        results["details"]["attempted"] = True
+        try:
+            # Details go next to the ads, where the enriched_ads view joins them
+            for db_path, ads in ads_databases():
+                detail_stats = enrich_ads(db_path, ads, workers=detail_workers, rate=detail_rate, cookies=cookies)
+                for key in ("fetched", "unchanged", "failed"):
+                    results["details"][key] += detail_stats[key]
+            results["details"]["success"] = True
+        except Exception as e:
+            logger.error(f"[ERRORE] Recupero dei dettagli degli annunci fallito: {e}")
+            results["details"]["error"] = str(e)
+    
+    # Score the new or changed ads only and flag the under-priced ones
+    if score_model:
+        results["scores"]["attempted"] = True
+        try:
+            for db_path, ads in ads_databases():
+                score_stats = score_ads(db_path, ads, score_model, threshold=underprice_threshold)
+                for key in ("changed", "scored", "underpriced"):
+                    results["scores"][key] += score_stats[key]
+            results["scores"]["success"] = True
+        except Exception as e:
+            logger.error(f"[ERRORE] Valutazione degli annunci fallita: {e}")
+            results["scores"]["error"] = str(e)
+    
+    # Diff the ads seen by this crawl against its scope to find the delisted ones
+    if track_delistings:
+        results["delistings"]["attempted"] = True
+        try:
+            # listing_status lives next to the ads, for the active_ads view and retention.py
+            for db_path, ads in ads_databases():
+                crawl_stats = record_crawl(
+                    db_path, city, contract_type,
+                    ads["url"] if "url" in ads.columns else [],
+                    complete=df.attrs.get("crawl_complete", False),
+                    macrozones=macrozones
+                )
+                results["delistings"]["delisted"] += crawl_stats["delisted"]
+            results["delistings"]["success"] = True
+        except Exception as e:
+            logger.error(f"[ERRORE] Rilevamento degli annunci rimossi fallito: {e}")
+            results["delistings"]["error"] = str(e)
+    
     # Log summary of all operations
     logger.info("[RIEPILOGO OPERAZIONI]")
     if results["cosmos_db"]["attempted"]:
@@ -544,7 +685,26 @@ def process_ads(config):
     if results["json"]["attempted"]:
         status = "✓ Successo" if results["json"]["success"] else f"✗ Fallito ({results['json']['error']})"
         logger.info(f"- JSON: {status}")
+    if results["stream"]["attempted"]:
+        status = "✓ Successo" if results["stream"]["success"] else f"✗ Fallito ({results['stream']['error']})"
+        logger.info(f"- Stream: {status} ({results['stream']['records']} record, {results['stream']['unchanged']} invariati)")
+    if results["delistings"]["attempted"]:
+        status = "✓ Successo" if results["delistings"]["success"] else f"✗ Fallito ({results['delistings']['error']})"
+        logger.info(f"- Annunci rimossi: {status} ({results['delistings']['delisted']} rimossi)")
+    if results["details"]["attempted"]:
+        status = "✓ Successo" if results["details"]["success"] else f"✗ Fallito ({results['details']['error']})"
+        logger.info(
+            f"- Dettagli: {status} ({results['details']['fetched']} scaricati, "
+            f"{results['details']['unchanged']} invariati, {results['details']['failed']} falliti)"
+        )
+    if results["scores"]["attempted"]:
+        status = "✓ Successo" if results["scores"]["success"] else f"✗ Fallito ({results['scores']['error']})"
+        logger.info(
+            f"- Valutazione: {status} ({results['scores']['scored']} annunci valutati, "
+            f"{results['scores']['underpriced']} sottoprezzo)"
+        )
     
+    df.attrs["results"] = results
     return df
 
 def parse_arguments():
@@ -575,6 +735,9 @@ def parse_arguments():
                         help='Maximum number of pages to fetch (default: 1)')
     parser.add_argument('--start-page', '-s', type=int, default=1,
                         help='Page to start fetching from (default: 1)')
+    parser.add_argument('--validation', type=str, choices=VALIDATION_MODES, default='sample',
+                        help='Validate each API page against models.py to detect schema drift: '
+                             'off, sample (a few ads per page) or full (default: sample)')
     
     # Output parameters
     output_group = parser.add_argument_group('Output parameters')
@@ -590,8 +753,46 @@ def parse_arguments():
                         help='Save data to JSON file as a list of dictionaries')
     output_group.add_argument('--sqlite-path', type=str, default=None,
                         help='Path to SQLite database file (default: output-path/ads.db)')
-    
-    return parser.parse_args()
+    output_group.add_argument('--skip-unchanged', action='store_true', default=False,
+                        help='Only send new or changed ads to each output, using a local content-hash index')
+    output_group.add_argument('--hash-index-path', type=str, default=None,
+                        help='Path to the content-hash index database (default: output-path/ad_hashes.db)')
+    output_group.add_argument('--track-delistings', action='store_true', default=False,
+                        help='Record the ads seen by this crawl in the SQLite database and mark the ads of the same '
+                             'city/contract/macrozones no longer listed as delisted (complete crawls only)')
+    output_group.add_argument('--enrich-details', action='store_true', default=False,
+                        help='Fetch the detail page of the new or changed ads (energy class, condominium fees, features, '
+                             'all photos) into the ad_details table of the SQLite database')
+    output_group.add_argument('--detail-workers', type=int, default=4,
+                        help='Concurrent detail page requests (default: 4)')
+    output_group.add_argument('--detail-rate', type=float, default=1.0,
+                        help='Maximum detail page requests per second (default: 1.0)')
+    output_group.add_argument('--score-model', type=str, default=None, metavar='PATH',
+                        help='Store the features of the new or changed ads and score them with this pickle/joblib '
+                             'price model, flagging the under-priced ones (see feature_store.py)')
+    output_group.add_argument('--underprice-threshold', type=float, default=None,
+                        help='Gap below the predicted price that flags an ad as under-priced (default: 0.15)')
+    output_group.add_argument('--sqlite-shard-dir', type=str, default=None,
+                        help='Save SQLite data to one database file per province in this directory instead of a single database')
+    output_group.add_argument('--cosmos-concurrency', type=int, default=None,
+                        help='Maximum number of parallel Cosmos DB requests (default: 16)')
+    output_group.add_argument('--stream-file', type=str, nargs='+', default=[], dest='stream_files',
+                        help='Append ads page by page to these files while crawling. Format from the extension '
+                             '(.jsonl, .ndjson, .csv, optionally + .gz or .zst); {city}, {contract} and {date} '
+                             'are replaced, e.g. archive/{city}_{contract}_{date}.jsonl.gz')
+    
+    args = parser.parse_args()
+    # These tables are stored next to the ads, in the SQLite database or in its shards
+    needs_sqlite = [
+        option for option, value in (
+            ("--track-delistings", args.track_delistings),
+            ("--enrich-details", args.enrich_details),
+            ("--score-model", args.score_model)
+        ) if value
+    ]
+    if needs_sqlite and not args.save_sqlite:
+        parser.error(f"{', '.join(needs_sqlite)} require the ads to be saved to SQLite (drop --no-save-sqlite)")
+    return args
 
 def list_macrozones(city):
     """
@@ -607,20 +808,20 @@ def list_macrozones(city):
         logger.error("[ERROR] No city provided to list macrozones")
         return False
     
-    city_lower = city.lower()
-    
-    if city_lower not in COMMON_CITIES:
+    store = get_geography_store(json_path=COMMON_CITIES_FILE)
+    city_info = store.get_city(city)
+    if city_info is None:
         logger.error(f"[ERROR] City '{city}' not found in common cities database")
         return False
     
-    city_info = COMMON_CITIES[city_lower]
-    if "macrozones" not in city_info or not city_info["macrozones"]:
+    macrozones = store.macrozones(city_info["key"])
+    if not macrozones:
         logger.error(f"[ERROR] No macrozones defined for city '{city}'")
         return False
     
     logger.info(f"\n[INFO] Available macrozones for {city_info['name']} (ID: {city_info['idComune']}):")
-    for key, macrozone in city_info["macrozones"].items():
-        logger.info(f"  - {macrozone['name']} (ID: {macrozone['id']}, Key: {key})")
+    for macrozone in macrozones:
+        logger.info(f"  - {macrozone['name']} (ID: {macrozone['id']}, Key: {macrozone['key']})")
     
     return True
 
@@ -658,14 +859,15 @@ def main(args: argparse.Namespace):
             logger.warning(f"[WARNING] Comune not found for query: {args.comune_query}. Using default city: {city}")
     
     # Look up macrozone names if provided and convert to IDs
-    if args.macrozone_names and city.lower() in COMMON_CITIES:
-        city_info = COMMON_CITIES[city.lower()]
-        if "macrozones" in city_info:
+    store = get_geography_store(json_path=COMMON_CITIES_FILE) if args.macrozone_names else None
+    city_info = store.get_city(city) if store else None
+    if city_info:
+        if store.macrozones(city_info["key"]):
             for name in args.macrozone_names:
-                name_lower = name.lower()
-                # Try to find the macrozone ID by name
-                if name_lower in city_info["macrozones"]:
-                    macrozone_id = city_info["macrozones"][name_lower]["id"]
+                # Try to find the macrozone ID by key or name
+                macrozone = store.find_macrozone(city_info["key"], name)
+                if macrozone:
+                    macrozone_id = macrozone["id"]
                     if macrozone_id not in macrozones:
                         macrozones.append(macrozone_id)
                         logger.info(f"[INFO] Found macrozone ID for '{name}': {macrozone_id}")
@@ -694,7 +896,19 @@ def main(args: argparse.Namespace):
         "save_to_sqlite": args.save_sqlite,
         "save_to_csv": args.save_csv,
         "save_to_json": args.save_json,
-        "sqlite_db_path": args.sqlite_path or f"{args.output_path}/ads.db"
+        "sqlite_db_path": args.sqlite_path or f"{args.output_path}/ads.db",
+        "sqlite_shard_dir": args.sqlite_shard_dir,
+        "validation_mode": args.validation,
+        "skip_unchanged": args.skip_unchanged,
+        "hash_index_path": args.hash_index_path or f"{args.output_path}/ad_hashes.db",
+        "stream_files": args.stream_files,
+        "cosmos_concurrency": args.cosmos_concurrency,
+        "track_delistings": args.track_delistings,
+        "enrich_details": args.enrich_details,
+        "detail_workers": args.detail_workers,
+        "detail_rate": args.detail_rate,
+        "score_model": args.score_model,
+        "underprice_threshold": args.underprice_threshold
     }
     
     # Log macrozone information
@@ -705,11 +919,9 @@ def main(args: argparse.Namespace):
     
     # Check if we should just list macrozones
     if args.list_macrozones:
-        if list_macrozones(city):
-            return pd.DataFrame()  # Return empty DataFrame since we're just listing macrozones
-        else:
+        if not list_macrozones(city):
             logger.error(f"[ERROR] Failed to list macrozones for {city}")
-            return pd.DataFrame()
+        return None  # Nothing was fetched, we're just listing macrozones
     
     # Create output directory if it doesn't exist
     os.makedirs(config["output_path"], exist_ok=True)
@@ -722,6 +934,9 @@ def main(args: argparse.Namespace):
     return df
 
 if __name__ == "__main__":
+    # Setup logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
     # Parse command-line arguments
     args = parse_arguments()
     
@@ -0,0 +1,208 @@
+"""
+Compiled flattening of search-list API pages into column arrays.
+
+Instead of building one dict per ad with chained ``.get()`` calls and
+``update()`` merges, the list of output columns is described once as paths
+into the API item (FLAT_AD_FIELDS); the paths are compiled into
+a plan where shared prefixes (realEstate, properties[0], location, ...) are
+resolved once per ad, and every column is then filled with a single list
+comprehension over the page. The result is a dict of lists, ready to become a
+DataFrame without any per-row dict.
+
+``helpers.create_ads_dataframe`` and ``helpers.extract_flat_ad_data`` (one
+ad as a dict) use the same plan.
+"""
+
+import pandas as pd
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from raw_payload import compress_payloads
+
+
+def _join_features(value):
+    return ", ".join(value) if value else None
+
+
+def _join_views(value):
+    return ", ".join([view.get("name", "") for view in value]) if value else None
+
+
+# (column, path into the API item, optional transform), in output column order
+FLAT_AD_FIELDS: List[Tuple[str, Tuple[Any, ...], Optional[Callable]]] = [
+    # Identificazione
+    ("id", ("realEstate", "id"), None),
+    ("uuid", ("realEstate", "uuid"), None),
+    ("title", ("realEstate", "title"), None),
+    ("url", ("seo", "url"), None),
+    ("geoHash", ("idGeoHash",), None),
+    # Tipo e visibilità
+    ("type", ("realEstate", "type"), None),
+    ("typology_id", ("realEstate", "typology", "id"), None),
+    ("typology_name", ("realEstate", "typology", "name"), None),
+    ("contract", ("realEstate", "contract"), None),
+    ("isNew", ("realEstate", "isNew"), None),
+    ("luxury", ("realEstate", "luxury"), None),
+    ("visibility", ("realEstate", "visibility"), None),
+    ("isProjectLike", ("realEstate", "isProjectLike"), None),
+    ("isMosaic", ("realEstate", "isMosaic"), None),
+    ("propertiesCount", ("realEstate", "propertiesCount"), None),
+    # Prezzo
+    ("price_value", ("realEstate", "price", "value"), None),
+    ("price_formatted", ("realEstate", "price", "formattedValue"), None),
+    ("price_min", ("realEstate", "price", "minValue"), None),
+    ("price_max", ("realEstate", "price", "maxValue"), None),
+    ("price_range", ("realEstate", "price", "priceRange"), None),
+    ("price_visible", ("realEstate", "price", "visible"), None),
+    # Caratteristiche principali
+    ("surface", ("realEstate", "properties", 0, "surface"), None),
+    ("rooms", ("realEstate", "properties", 0, "rooms"), None),
+    ("bathrooms", ("realEstate", "properties", 0, "bathrooms"), None),
+    ("floor", ("realEstate", "properties", 0, "floor", "value"), None),
+    ("floor_number", ("realEstate", "properties", 0, "floor", "floorOnlyValue"), None),
+    ("floor_ga4value", ("realEstate", "properties", 0, "floor", "ga4FloorValue"), None),
+    ("elevator", ("realEstate", "properties", 0, "elevator"), None),
+    # Posizione
+    ("address", ("realEstate", "properties", 0, "location", "address"), None),
+    ("latitude", ("realEstate", "properties", 0, "location", "latitude"), None),
+    ("longitude", ("realEstate", "properties", 0, "location", "longitude"), None),
+    ("city", ("realEstate", "properties", 0, "location", "city"), None),
+    ("province", ("realEstate", "properties", 0, "location", "province"), None),
+    ("region", ("realEstate", "properties", 0, "location", "region"), None),
+    ("macrozone", ("realEstate", "properties", 0, "location", "macrozone"), None),
+    ("nation", ("realEstate", "properties", 0, "location", "nation", "name"), None),
+    # Descrizioni e caratteristiche
+    ("description", ("realEstate", "properties", 0, "description"), None),
+    ("caption", ("realEstate", "properties", 0, "caption"), None),
+    ("ga4features", ("realEstate", "properties", 0, "ga4features"), _join_features),
+    ("ga4Heating", ("realEstate", "properties", 0, "ga4Heating"), None),
+    ("ga4Garage", ("realEstate", "properties", 0, "ga4Garage"), None),
+    ("views", ("realEstate", "properties", 0, "views"), _join_views),
+    # Agenzia
+    ("agency_id", ("realEstate", "advertiser", "agency", "id"), None),
+    ("agency_type", ("realEstate", "advertiser", "agency", "type"), None),
+    ("agency_name", ("realEstate", "advertiser", "agency", "displayName"), None),
+    ("agency_label", ("realEstate", "advertiser", "agency", "label"), None),
+    ("agency_url", ("realEstate", "advertiser", "agency", "agencyUrl"), None),
+    # Foto
+    ("photo_id", ("realEstate", "properties", 0, "photo", "id"), None),
+    ("photo_caption", ("realEstate", "properties", 0, "photo", "caption"), None),
+    ("photo_url_small", ("realEstate", "properties", 0, "photo", "urls", "small"), None),
+    ("photo_url_medium", ("realEstate", "properties", 0, "photo", "urls", "medium"), None),
+    ("photo_url_large", ("realEstate", "properties", 0, "photo", "urls", "large"), None),
+    # Altro
+    ("typologyGA4Translation", ("realEstate", "properties", 0, "typologyGA4Translation"), None),
+    ("matchSearch", ("realEstate", "properties", 0, "matchSearch"), None),
+]
+
+
+def _compile_step(step) -> Callable[[Any], Any]:
+    """Compile one path step into a function that never raises on missing data."""
+    if isinstance(step, int):
+        return lambda value: value[step] if isinstance(value, list) and len(value) > step else None
+    return lambda value: value.get(step) if isinstance(value, dict) else None
+
+
+class FlattenPlan:
+    """
+    Compiled form of a list of (column, path, transform) fields.
+
+    Every distinct parent path ("anchor") is resolved once per ad, from its own
+    parent anchor, so the common prefixes of the paths are never walked twice.
+    """
+
+    def __init__(self, fields: Sequence[Tuple[str, Tuple[Any, ...], Optional[Callable]]]):
+        self.column_names = [name for name, _, _ in fields]
+        self.anchors: List[Tuple[tuple, tuple, Callable]] = []
+        self.columns: List[Tuple[str, tuple, Any, Optional[Callable]]] = []
+
+        known = {()}
+        for name, path, transform in fields:
+            parent = tuple(path[:-1])
+            for depth in range(1, len(parent) + 1):
+                anchor = parent[:depth]
+                if anchor not in known:
+                    known.add(anchor)
+                    self.anchors.append((anchor, anchor[:-1], _compile_step(anchor[-1])))
+            self.columns.append((name, parent, path[-1], transform))
+
+    def flatten(self, items: Sequence[dict]) -> Dict[str, list]:
+        """
+        Flatten a list of API items into column arrays.
+
+        Args:
+            items: The `results` list of an API page
+
+        Returns:
+            Dictionary mapping each column name to the list of its values
+        """
+        anchor_values = {(): list(items)}
+        for anchor, parent, step in self.anchors:
+            anchor_values[anchor] = [step(value) for value in anchor_values[parent]]
+
+        columns = {}
+        for name, parent, key, transform in self.columns:
+            values = anchor_values[parent]
+            if isinstance(key, int):
+                column = [v[key] if isinstance(v, list) and len(v) > key else None for v in values]
+            else:
+                column = [v.get(key) if isinstance(v, dict) else None for v in values]
+            if transform is not None:
+                column = [transform(v) for v in column]
+            columns[name] = column
+        return columns
+
+
+FLAT_AD_PLAN = FlattenPlan(FLAT_AD_FIELDS)
+
+
+def flatten_page(items: Sequence[dict], include_raw: bool = False, plan: FlattenPlan = FLAT_AD_PLAN) -> Dict[str, list]:
+    """
+    Flatten one page of search-list results into column arrays.
+
+    Items without a `realEstate` object (e.g. banners) are skipped.
+
+    Args:
+        items: The `results` list of an API page
+        include_raw: Whether to add the compressed `realEstate` payload as a `raw_data` column
+        plan: Compiled flattening plan (default: FLAT_AD_PLAN)
+
+    Returns:
+        Dictionary mapping each column name to the list of its values
+    """
+    items = [item for item in items if item.get("realEstate")]
+    columns = plan.flatten(items)
+    if include_raw:
+        columns["raw_data"] = compress_payloads([item["realEstate"] for item in items])
+    return columns
+
+
+def extend_columns(columns: Dict[str, list], page_columns: Dict[str, list]) -> Dict[str, list]:
+    """
+    Append the column arrays of a page to the column arrays of the whole crawl.
+
+    Args:
+        columns: Accumulated column arrays (modified in place)
+        page_columns: Column arrays of one page
+
+    Returns:
+        The updated `columns`
+    """
+    for name, values in page_columns.items():
+        columns.setdefault(name, []).extend(values)
+    return columns
+
+
+def columns_to_dataframe(columns: Dict[str, list], plan: FlattenPlan = FLAT_AD_PLAN) -> pd.DataFrame:
+    """
+    Build the ads DataFrame from column arrays, in the standard column order.
+
+    Args:
+        columns: Column arrays as returned by flatten_page / extend_columns
+        plan: Plan whose column order is used (extra columns such as raw_data go last)
+
+    Returns:
+        pandas.DataFrame with one row per ad
+    """
+    order = [name for name in plan.column_names if name in columns]
+    order += [name for name in columns if name not in order]
+    return pd.DataFrame({name: columns.get(name, []) for name in order}, columns=order)
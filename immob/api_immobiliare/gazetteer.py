@@ -0,0 +1,463 @@
+"""
+Local gazetteer of Italian comuni for offline, typo-tolerant name lookups.
+
+The comuni are kept in a small SQLite file (gazetteer.db next to this module,
+or IMMOB_GAZETTEER_DB) and loaded once into memory, where they are indexed by
+normalised name (exact lookups) and by character trigrams (typo-tolerant
+lookups: "Genva" or "vado-ligure" still find the right comune). Lookups do not
+touch the disk or the network.
+
+The gazetteer starts with the cities of common_cities.json. The full list of
+comuni (about 7,900) is not shipped with the repository: import the ISTAT
+"Elenco comuni italiani" CSV once with
+
+    python gazetteer.py --import-istat Elenco-comuni-italiani.csv
+
+ISTAT codes are not immobiliare.it ids, so an imported comune still needs one
+autocomplete request to get its idComune; the result is then stored in the
+gazetteer. Autocomplete responses, including "not found", are also cached
+with a TTL, so the network is only used on a real cache miss.
+
+This module provides functions to:
+1. Normalise comune names and match them exactly or by trigram similarity
+2. Cache autocomplete results persistently, with a TTL
+3. Import the ISTAT list of comuni
+4. Resolve a query to an immobiliare.it comune (local, cache, then network)
+"""
+
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+import argparse
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import json_codec
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GAZETTEER_PATH = Path(__file__).resolve().parent / "gazetteer.db"
+DEFAULT_CACHE_TTL = 30 * 24 * 3600       # Comune ids practically never change
+DEFAULT_NEGATIVE_TTL = 24 * 3600         # "Not found" is retried after a day
+DEFAULT_MIN_SIMILARITY = 0.5             # Dice coefficient on trigrams
+FALLBACK_MIN_SIMILARITY = 0.3            # Closest known comune when the API has no answer
+
+# Candidate column names of the ISTAT CSV (they changed slightly over the years)
+ISTAT_COLUMNS = {
+    "name": ["Denominazione in italiano", "Denominazione (Italiana e straniera)", "name", "denominazione"],
+    "istat_code": ["Codice Comune formato alfanumerico", "Codice Istat del Comune (alfanumerico)", "istat_code"],
+    "province": ["Sigla automobilistica", "province", "sigla"],
+    "region": ["Denominazione Regione", "Denominazione regione", "region", "regione"]
+}
+
+
+@lru_cache(maxsize=4096)
+def normalize_name(name: str) -> str:
+    """
+    Normalise a comune name for matching: lower case, no accents, apostrophes,
+    hyphens and underscores as spaces, single spaces.
+
+    Args:
+        name: Comune name or query
+
+    Returns:
+        Normalised name (e.g. "Sant'Olcese" -> "sant olcese")
+    """
+    text = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii")
+    text = re.sub(r"[^a-z0-9]+", " ", text.lower())
+    return text.strip()
+
+
+def trigrams(text: str) -> Counter:
+    """Character trigrams of a normalised name, padded so that word boundaries count."""
+    padded = f"  {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def init_gazetteer(db_path: str) -> bool:
+    """
+    Initialize the gazetteer database.
+
+    Args:
+        db_path: Path to the SQLite file of the gazetteer
+
+    Returns:
+        True if initialization was successful, False otherwise
+    """
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with get_connection(db_path) as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS comuni (
+                name_key TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                id_comune TEXT,
+                path TEXT,
+                istat_code TEXT,
+                province TEXT,
+                region TEXT,
+                source TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS autocomplete_cache (
+                query_key TEXT PRIMARY KEY,
+                result TEXT,
+                fetched_at REAL NOT NULL
+            ) WITHOUT ROWID
+            ''')
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error initializing gazetteer: {e}")
+        return False
+
+
+def _entry_from_row(row) -> Dict[str, Any]:
+    """Comune dictionary in the format of common_cities.json / the autocomplete API."""
+    entry = {"idComune": row["id_comune"], "name": row["name"], "path": row["path"]}
+    for key in ("istat_code", "province", "region"):
+        if row[key]:
+            entry[key] = row[key]
+    return entry
+
+
+class Gazetteer:
+    """
+    In-memory index of comuni backed by the gazetteer database.
+
+    Args:
+        db_path: Path to the gazetteer database
+        seed: Comuni known in advance, e.g. COMMON_CITIES (kept in memory only)
+        ttl: Seconds an autocomplete result stays valid
+        negative_ttl: Seconds a "not found" autocomplete result stays valid
+        min_similarity: Minimum trigram similarity (0-1) of a fuzzy match
+    """
+
+    def __init__(
+        self,
+        db_path: str = DEFAULT_GAZETTEER_PATH,
+        seed: Optional[Dict[str, Dict[str, Any]]] = None,
+        ttl: float = DEFAULT_CACHE_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+        min_similarity: float = DEFAULT_MIN_SIMILARITY
+    ):
+        self.db_path = str(db_path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.min_similarity = min_similarity
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._trigrams: Dict[str, Counter] = {}
+        self._index: Dict[str, List[str]] = {}
+        self._matches: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._cache: Dict[str, Tuple[Optional[Dict[str, Any]], float]] = {}
+        self._persistent = init_gazetteer(self.db_path)
+
+        if self._persistent:
+            try:
+                with get_connection(self.db_path) as conn:
+                    for row in conn.execute("SELECT * FROM comuni"):
+                        self._add(row["name_key"], _entry_from_row(row))
+                    for row in conn.execute("SELECT query_key, result, fetched_at FROM autocomplete_cache"):
+                        result = json_codec.loads(row["result"]) if row["result"] else None
+                        self._cache[row["query_key"]] = (result, row["fetched_at"])
+            except sqlite3.Error as e:
+                logger.warning(f"[WARNING] Could not load gazetteer {self.db_path}: {e}")
+        # The seed (common_cities.json) has the macrozones, so it wins over stored entries
+        for key, info in (seed or {}).items():
+            self._add(normalize_name(info.get("name") or key), info)
+            self._add(normalize_name(key), info)
+        logger.debug(f"Gazetteer: {len(self._entries)} comuni, {len(self._cache)} cached queries")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, key: str, entry: Dict[str, Any]) -> None:
+        if not key:
+            return
+        if key not in self._entries:
+            self._trigrams[key] = trigrams(key)
+            for gram in self._trigrams[key]:
+                self._index.setdefault(gram, []).append(key)
+        self._entries[key] = entry
+        self._matches.clear()
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        Rank comuni by trigram similarity to a query.
+
+        Args:
+            query: Comune name, possibly misspelled
+            limit: Maximum number of results
+
+        Returns:
+            List of (similarity, comune) sorted by decreasing similarity
+        """
+        key = normalize_name(query)
+        if not key:
+            return []
+        query_grams = trigrams(key)
+        shared = Counter()
+        for gram, count in query_grams.items():
+            for candidate in self._index.get(gram, ()):
+                shared[candidate] += min(count, self._trigrams[candidate][gram])
+
+        query_size = sum(query_grams.values())
+        scored = []
+        for candidate, common in shared.items():
+            similarity = 2 * common / (query_size + sum(self._trigrams[candidate].values()))
+            # Prefer comuni whose immobiliare.it id is known when similarities tie
+            scored.append((similarity, self._entries[candidate].get("idComune") is not None, candidate))
+        scored.sort(reverse=True)
+        return [(similarity, self._entries[candidate]) for similarity, _, candidate in scored[:limit]]
+
+    def match(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a comune by exact normalised name, or by trigram similarity.
+
+        Args:
+            query: Comune name, possibly misspelled
+
+        Returns:
+            Comune dictionary or None if nothing is similar enough
+        """
+        key = normalize_name(query)
+        if key in self._entries:
+            return self._entries[key]
+        if key not in self._matches:
+            results = self.search(key, limit=1)
+            best = results[0] if results else None
+            self._matches[key] = best[1] if best and best[0] >= self.min_similarity else None
+        return self._matches[key]
+
+    def cached(self, query: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Look up a query in the autocomplete cache.
+
+        Args:
+            query: Query sent to the autocomplete API
+
+        Returns:
+            Tuple of (hit, result); result is None for a cached "not found"
+        """
+        hit = self._cache.get(normalize_name(query))
+        if hit is None:
+            return False, None
+        result, fetched_at = hit
+        ttl = self.ttl if result is not None else self.negative_ttl
+        if time.time() - fetched_at > ttl:
+            return False, None
+        return True, result
+
+    def store(self, query: str, result: Optional[Dict[str, Any]]) -> None:
+        """
+        Cache an autocomplete result and add the comune found to the gazetteer.
+
+        Args:
+            query: Query sent to the autocomplete API
+            result: Comune returned by the API, or None if not found
+        """
+        key = normalize_name(query)
+        fetched_at = time.time()
+        self._cache[key] = (result, fetched_at)
+        if result is not None:
+            self._add(normalize_name(result["name"]), result)
+        if not self._persistent:
+            return
+        try:
+            with get_connection(self.db_path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO autocomplete_cache (query_key, result, fetched_at) VALUES (?, ?, ?)",
+                    (key, json_codec.dumps(result).decode() if result is not None else None, fetched_at)
+                )
+                if result is not None:
+                    conn.execute('''
+                    INSERT INTO comuni (name_key, name, id_comune, path, source) VALUES (?, ?, ?, ?, 'autocomplete')
+                    ON CONFLICT(name_key) DO UPDATE SET
+                        id_comune = excluded.id_comune,
+                        path = excluded.path,
+                        updated_at = CURRENT_TIMESTAMP
+                    ''', (normalize_name(result["name"]), result["name"], str(result["idComune"]), result.get("path")))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"[WARNING] Could not save autocomplete result for '{query}': {e}")
+
+    def import_comuni(self, comuni: Iterable[Dict[str, Any]], source: str = "istat") -> int:
+        """
+        Add comuni (name, istat_code, province, region) to the gazetteer database.
+
+        Existing immobiliare.it ids are kept. Homonymous comuni in different
+        provinces share one entry; the autocomplete API resolves them by id.
+
+        Args:
+            comuni: Dictionaries with at least a `name`
+            source: Source label stored with the rows
+
+        Returns:
+            Number of comuni imported
+        """
+        rows = []
+        for comune in comuni:
+            key = normalize_name(comune.get("name") or "")
+            if key:
+                rows.append((key, comune["name"], comune.get("istat_code"), comune.get("province"),
+                             comune.get("region"), source))
+        with get_connection(self.db_path) as conn:
+            conn.executemany('''
+            INSERT INTO comuni (name_key, name, istat_code, province, region, source) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name_key) DO UPDATE SET
+                istat_code = COALESCE(comuni.istat_code, excluded.istat_code),
+                province = COALESCE(comuni.province, excluded.province),
+                region = COALESCE(comuni.region, excluded.region),
+                updated_at = CURRENT_TIMESTAMP
+            ''', rows)
+            conn.commit()
+            for row in conn.execute("SELECT * FROM comuni"):
+                if row["name_key"] not in self._entries or self._entries[row["name_key"]].get("idComune") is None:
+                    self._add(row["name_key"], _entry_from_row(row))
+        return len(rows)
+
+    def resolve(self, query: str, fetch: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None
+                ) -> Optional[Dict[str, Any]]:
+        """
+        Resolve a query to a comune with its immobiliare.it id.
+
+        Order: exact local match with a known id, then for the query (and, for a
+        misspelling, the closest local name) the autocomplete cache and `fetch`
+        (the network, whose result is cached), and finally the closest local match.
+        A fuzzy local match is never returned before the API was asked, since a
+        near miss (e.g. "Genola" for Genova) can be another real comune.
+
+        Args:
+            query: Comune name, possibly misspelled
+            fetch: Function querying the autocomplete API (optional)
+
+        Returns:
+            Comune dictionary with idComune, name and path, or None
+        """
+        exact = self._entries.get(normalize_name(query))
+        if exact is not None and exact.get("idComune") is not None:
+            logger.info(f"[INFO] Found comune from local gazetteer: {exact['name']} (ID: {exact['idComune']})")
+            return exact
+
+        # The query as typed first, then the spelling of the closest known comune
+        api_queries = [exact["name"] if exact is not None else query]
+        local = self.match(query) if exact is None else None
+        if local is not None:
+            api_queries.append(local["name"])
+
+        for api_query in api_queries:
+            hit, result = self.cached(api_query)
+            if hit:
+                if result is not None:
+                    logger.info(f"[INFO] Found comune from autocomplete cache: {result['name']} (ID: {result['idComune']})")
+                    return result
+                continue
+            if fetch is None:
+                continue
+            try:
+                result = fetch(api_query)
+            except Exception as e:
+                # Transport errors are not cached, the next lookup tries again
+                logger.warning(f"[WARNING] Comune lookup for '{api_query}' failed: {e}")
+                break
+            self.store(api_query, result)
+            if result is not None:
+                return result
+
+        closest = [
+            entry for similarity, entry in self.search(query)
+            if similarity >= FALLBACK_MIN_SIMILARITY and entry.get("idComune") is not None
+        ]
+        if closest:
+            logger.info(f"[INFO] Found closest matching comune: {closest[0]['name']} (ID: {closest[0]['idComune']})")
+            return closest[0]
+        return None
+
+
+def read_istat_csv(csv_path: str) -> List[Dict[str, Any]]:
+    """
+    Read the ISTAT list of comuni ("Elenco comuni italiani", semicolon separated).
+
+    Args:
+        csv_path: Path to the CSV file
+
+    Returns:
+        List of dictionaries with name, istat_code, province and region
+    """
+    import pandas as pd  # Only needed to import the ISTAT file, not for lookups
+
+    try:
+        df = pd.read_csv(csv_path, sep=None, engine="python", dtype=str, encoding="utf-8")
+    except UnicodeDecodeError:
+        df = pd.read_csv(csv_path, sep=None, engine="python", dtype=str, encoding="latin-1")
+
+    columns = {}
+    normalized = {col.strip().lower(): col for col in df.columns}
+    for field, candidates in ISTAT_COLUMNS.items():
+        for candidate in candidates:
+            if candidate.lower() in normalized:
+                columns[field] = normalized[candidate.lower()]
+                break
+    if "name" not in columns:
+        raise ValueError(f"{csv_path}: no comune name column found (expected one of {ISTAT_COLUMNS['name']})")
+
+    df = df[list(columns.values())].rename(columns={col: field for field, col in columns.items()})
+    df = df.where(df.notna(), None)
+    return df.to_dict("records")
+
+
+_gazetteers: Dict[str, Gazetteer] = {}
+_gazetteers_lock = threading.Lock()
+
+
+def get_gazetteer(seed: Optional[Dict[str, Dict[str, Any]]] = None, db_path: Optional[str] = None) -> Gazetteer:
+    """
+    Get the shared gazetteer of a database, loaded once per process.
+
+    Args:
+        seed: Comuni known in advance, e.g. COMMON_CITIES (used when the gazetteer is first loaded)
+        db_path: Gazetteer database (default: IMMOB_GAZETTEER_DB or gazetteer.db)
+
+    Returns:
+        The Gazetteer instance
+    """
+    db_path = db_path or os.environ.get("IMMOB_GAZETTEER_DB") or str(DEFAULT_GAZETTEER_PATH)
+    with _gazetteers_lock:
+        if db_path not in _gazetteers:
+            _gazetteers[db_path] = Gazetteer(db_path, seed=seed)
+        return _gazetteers[db_path]
+
+
+def main():
+    """Import the ISTAT list of comuni or look up comuni from the command line."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Manage the local gazetteer of Italian comuni')
+    parser.add_argument('--db', type=str, default=None,
+                        help=f'Path to the gazetteer database (default: {DEFAULT_GAZETTEER_PATH})')
+    parser.add_argument('--import-istat', type=str, metavar='CSV_PATH',
+                        help='Import the ISTAT "Elenco comuni italiani" CSV')
+    parser.add_argument('--search', type=str, metavar='NAME',
+                        help='Show the comuni most similar to NAME')
+    args = parser.parse_args()
+
+    gazetteer = get_gazetteer(db_path=args.db)
+    if args.import_istat:
+        count = gazetteer.import_comuni(read_istat_csv(args.import_istat))
+        logger.info(f"[INFO] Imported {count} comuni, {len(gazetteer)} in the gazetteer")
+    if args.search:
+        for similarity, entry in gazetteer.search(args.search):
+            print(f"{similarity:.2f}  {entry['name']}  (ID: {entry.get('idComune') or '-'}, {entry.get('province') or ''})")
+
+
+if __name__ == "__main__":
+    main()
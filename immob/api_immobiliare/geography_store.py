@@ -0,0 +1,420 @@
+"""
+SQLite store of the geography used to filter searches: regions, provinces,
+comuni, macrozones and microzones.
+
+common_cities.json stays the editable source (populate_zones.py and
+populate_all_zones.py write it), but it is no longer loaded as a whole by
+every CLI. The store (geography.db next to this module, or
+IMMOB_GEOGRAPHY_DB) is rebuilt from the JSON file when the file changes, and
+callers ask for one city or one macrozone at a time through indexed queries,
+so start-up time does not grow with the number of comuni and zones.
+
+    python geography_store.py --import-json common_cities.json
+    python geography_store.py --export-json backup.json
+    python geography_store.py --city genova
+
+This module provides functions to:
+1. Create the geography tables and their indexes
+2. Import and export the common_cities.json format
+3. Look up comuni and their macrozones/microzones by key or name
+4. Keep a per-process store in sync with common_cities.json
+"""
+
+import os
+import sqlite3
+import logging
+import argparse
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import json_codec
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GEOGRAPHY_PATH = Path(__file__).resolve().parent / "geography.db"
+COMMON_CITIES_FILE = Path(__file__).resolve().parent / "common_cities.json"
+
+
+def init_geography_store(db_path: str) -> bool:
+    """
+    Initialize the geography database.
+
+    Args:
+        db_path: Path to the SQLite file of the store
+
+    Returns:
+        True if initialization was successful, False otherwise
+    """
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with get_connection(db_path) as conn:
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS regions (
+                region_key TEXT PRIMARY KEY,
+                name TEXT NOT NULL
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS provinces (
+                province_key TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                region_key TEXT REFERENCES regions(region_key) ON DELETE SET NULL
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS comuni (
+                city_key TEXT PRIMARY KEY,
+                id_comune TEXT NOT NULL,
+                name TEXT NOT NULL,
+                path TEXT,
+                province_key TEXT REFERENCES provinces(province_key) ON DELETE SET NULL,
+                position INTEGER NOT NULL
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS macrozones (
+                city_key TEXT NOT NULL REFERENCES comuni(city_key) ON DELETE CASCADE,
+                zone_key TEXT NOT NULL,
+                id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (city_key, zone_key)
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS microzones (
+                city_key TEXT NOT NULL,
+                macrozone_key TEXT NOT NULL,
+                zone_key TEXT NOT NULL,
+                id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (city_key, macrozone_key, zone_key),
+                FOREIGN KEY (city_key, macrozone_key) REFERENCES macrozones(city_key, zone_key) ON DELETE CASCADE
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS geography_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            ) WITHOUT ROWID;
+
+            CREATE INDEX IF NOT EXISTS idx_comuni_name ON comuni(name COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS idx_comuni_id ON comuni(id_comune);
+            CREATE INDEX IF NOT EXISTS idx_macrozones_name ON macrozones(city_key, name COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS idx_macrozones_id ON macrozones(id);
+            ''')
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error initializing geography store: {e}")
+        return False
+
+
+def zone_key(name: str) -> str:
+    """Key of a zone name, in the format of common_cities.json ("San Fruttuoso" -> "san_fruttuoso")."""
+    return "_".join(str(name).lower().replace("-", " ").split())
+
+
+def _zone_from_row(row) -> Dict[str, Any]:
+    return {"key": row["zone_key"], "id": row["id"], "name": row["name"]}
+
+
+class GeographyStore:
+    """
+    Indexed lookups of comuni and zones in the geography database.
+
+    Args:
+        db_path: Path to the geography database
+    """
+
+    def __init__(self, db_path: str = DEFAULT_GEOGRAPHY_PATH):
+        self.db_path = str(db_path)
+        self.available = init_geography_store(self.db_path)
+
+    def _query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        if not self.available:
+            return []
+        try:
+            with get_connection(self.db_path) as conn:
+                return conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"[ERROR] Geography query failed: {e}")
+            return []
+
+    def get_meta(self, key: str) -> Optional[str]:
+        """Value stored in the geography_meta table, or None."""
+        rows = self._query("SELECT value FROM geography_meta WHERE key = ?", (key,))
+        return rows[0]["value"] if rows else None
+
+    def import_common_cities(self, data: Dict[str, Dict[str, Any]], source: Optional[str] = None) -> int:
+        """
+        Replace the content of the store with a common_cities.json dictionary.
+
+        Cities may also carry "province"/"region" names and macrozones may carry
+        a "microzones" dictionary in the same {key: {"id", "name"}} format.
+        Malformed entries (e.g. without idComune) are logged and skipped.
+
+        Args:
+            data: Dictionary in the format of common_cities.json
+            source: Signature of the source file, stored to detect changes (optional)
+
+        Returns:
+            Number of imported comuni, or -1 on error
+        """
+        regions, provinces, comuni, macrozones, microzones = {}, {}, [], [], []
+        for position, (city_key, info) in enumerate(data.items()):
+            # A malformed entry (e.g. without idComune) is skipped with its zones
+            try:
+                province_key = zone_key(info["province"]) if info.get("province") else None
+                comune = (city_key, str(info["idComune"]), info.get("name") or city_key, info.get("path"),
+                          province_key, position)
+                city_macrozones, city_microzones = [], []
+                for zone_position, (key, zone) in enumerate((info.get("macrozones") or {}).items()):
+                    city_macrozones.append((city_key, key, str(zone["id"]), zone["name"], zone_position))
+                    for micro_position, (micro_key, micro) in enumerate((zone.get("microzones") or {}).items()):
+                        city_microzones.append((city_key, key, micro_key, str(micro["id"]), micro["name"],
+                                                micro_position))
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                logger.warning(f"[WARNING] Skipping malformed entry '{city_key}' of common_cities: {e!r}")
+                continue
+            region_key = zone_key(info["region"]) if info.get("region") else None
+            if region_key:
+                regions[region_key] = info["region"]
+            if province_key:
+                provinces[province_key] = (info["province"], region_key)
+            comuni.append(comune)
+            macrozones.extend(city_macrozones)
+            microzones.extend(city_microzones)
+
+        if not self.available:
+            return -1
+        try:
+            with get_connection(self.db_path) as conn:
+                for table in ("microzones", "macrozones", "comuni", "provinces", "regions"):
+                    conn.execute(f"DELETE FROM {table}")
+                conn.executemany("INSERT INTO regions VALUES (?, ?)", regions.items())
+                conn.executemany("INSERT INTO provinces VALUES (?, ?, ?)",
+                                 [(key, name, region) for key, (name, region) in provinces.items()])
+                conn.executemany("INSERT INTO comuni VALUES (?, ?, ?, ?, ?, ?)", comuni)
+                conn.executemany("INSERT INTO macrozones VALUES (?, ?, ?, ?, ?)", macrozones)
+                conn.executemany("INSERT INTO microzones VALUES (?, ?, ?, ?, ?, ?)", microzones)
+                conn.execute("INSERT OR REPLACE INTO geography_meta VALUES ('source', ?)", (source,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"[ERROR] Could not import the geography: {e}")
+            return -1
+        logger.info(f"[INFO] Geography store: {len(comuni)} comuni, {len(macrozones)} macrozones, "
+                    f"{len(microzones)} microzones")
+        return len(comuni)
+
+    def export_common_cities(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Export the whole store in the format of common_cities.json.
+
+        Returns:
+            Dictionary of cities with their macrozones
+        """
+        cities = {}
+        for row in self._query('''
+            SELECT c.*, p.name AS province, r.name AS region FROM comuni c
+            LEFT JOIN provinces p ON p.province_key = c.province_key
+            LEFT JOIN regions r ON r.region_key = p.region_key
+            ORDER BY c.position
+        '''):
+            city = {"idComune": row["id_comune"], "name": row["name"], "path": row["path"], "macrozones": {}}
+            for key in ("province", "region"):
+                if row[key]:
+                    city[key] = row[key]
+            cities[row["city_key"]] = city
+        for row in self._query("SELECT * FROM macrozones ORDER BY city_key, position"):
+            if row["city_key"] in cities:
+                cities[row["city_key"]]["macrozones"][row["zone_key"]] = {"id": row["id"], "name": row["name"]}
+        for row in self._query("SELECT * FROM microzones ORDER BY city_key, macrozone_key, position"):
+            macrozone = cities.get(row["city_key"], {}).get("macrozones", {}).get(row["macrozone_key"])
+            if macrozone is not None:
+                macrozone.setdefault("microzones", {})[row["zone_key"]] = {"id": row["id"], "name": row["name"]}
+        return cities
+
+    def comuni(self) -> Dict[str, Dict[str, Any]]:
+        """
+        All comuni without their zones, e.g. to seed the gazetteer.
+
+        Returns:
+            Dictionary {city_key: {"idComune", "name", "path"}}
+        """
+        return {
+            row["city_key"]: {"idComune": row["id_comune"], "name": row["name"], "path": row["path"]}
+            for row in self._query("SELECT city_key, id_comune, name, path FROM comuni ORDER BY position")
+        }
+
+    def get_city(self, city: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a comune by key or name (case-insensitive).
+
+        Args:
+            city: City key (e.g. "genova") or name (e.g. "Genova")
+
+        Returns:
+            Dictionary with key, idComune, name and path, or None if unknown
+        """
+        if not city:
+            return None
+        rows = self._query('''
+            SELECT city_key, id_comune, name, path FROM comuni WHERE city_key = ?
+            UNION ALL
+            SELECT city_key, id_comune, name, path FROM comuni WHERE name = ? COLLATE NOCASE
+            LIMIT 1
+        ''', (city.lower(), city))
+        if not rows:
+            return None
+        row = rows[0]
+        return {"key": row["city_key"], "idComune": row["id_comune"], "name": row["name"], "path": row["path"]}
+
+    def macrozones(self, city_key: str) -> List[Dict[str, Any]]:
+        """
+        Macrozones of a comune, in their original order.
+
+        Args:
+            city_key: Key of the comune
+
+        Returns:
+            List of dictionaries with key, id and name
+        """
+        rows = self._query("SELECT zone_key, id, name FROM macrozones WHERE city_key = ? ORDER BY position",
+                           (city_key,))
+        return [_zone_from_row(row) for row in rows]
+
+    def find_macrozone(self, city_key: str, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a macrozone of a comune by key or name (case-insensitive).
+
+        Args:
+            city_key: Key of the comune
+            name: Macrozone key (e.g. "san_fruttuoso") or name (e.g. "San Fruttuoso")
+
+        Returns:
+            Dictionary with key, id and name, or None if not found
+        """
+        rows = self._query('''
+            SELECT zone_key, id, name FROM macrozones WHERE city_key = ? AND zone_key IN (?, ?)
+            UNION ALL
+            SELECT zone_key, id, name FROM macrozones WHERE city_key = ? AND name = ? COLLATE NOCASE
+            LIMIT 1
+        ''', (city_key, name.lower(), zone_key(name), city_key, name))
+        return _zone_from_row(rows[0]) if rows else None
+
+    def microzones(self, city_key: str, macrozone_key: str) -> List[Dict[str, Any]]:
+        """
+        Microzones of a macrozone, in their original order.
+
+        Args:
+            city_key: Key of the comune
+            macrozone_key: Key of the macrozone
+
+        Returns:
+            List of dictionaries with key, id and name
+        """
+        rows = self._query('''
+            SELECT zone_key, id, name FROM microzones WHERE city_key = ? AND macrozone_key = ? ORDER BY position
+        ''', (city_key, macrozone_key))
+        return [_zone_from_row(row) for row in rows]
+
+
+def file_signature(file_path) -> Optional[str]:
+    """Path, modification time and size of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return f"{os.path.abspath(file_path)}|{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def sync_from_json(store: GeographyStore, json_path=COMMON_CITIES_FILE) -> bool:
+    """
+    Re-import common_cities.json into the store if the file changed since the last import.
+
+    A store imported from another file with --import-json is left alone.
+
+    Args:
+        store: Geography store to update
+        json_path: Path to common_cities.json
+
+    Returns:
+        True if the store was rebuilt, False otherwise
+    """
+    signature = file_signature(json_path)
+    source = store.get_meta("source")
+    if signature is None or signature == source:
+        return False
+    if source and not source.startswith(f"{os.path.abspath(json_path)}|"):
+        return False
+    try:
+        data = json_codec.load_file(json_path)
+    except Exception as e:
+        logger.error(f"Error loading {json_path}: {e}")
+        return False
+    if not isinstance(data, dict):
+        logger.error(f"Error loading {json_path}: expected an object of comuni, got {type(data).__name__}")
+        return False
+    return store.import_common_cities(data, source=signature) >= 0
+
+
+_stores: Dict[str, GeographyStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_geography_store(db_path: Optional[str] = None, json_path=COMMON_CITIES_FILE) -> GeographyStore:
+    """
+    Get the shared geography store of a database, synced with common_cities.json once per process.
+
+    Args:
+        db_path: Geography database (default: IMMOB_GEOGRAPHY_DB or geography.db)
+        json_path: common_cities.json to import when it changed (None to skip the check)
+
+    Returns:
+        The GeographyStore instance
+    """
+    db_path = db_path or os.environ.get("IMMOB_GEOGRAPHY_DB") or str(DEFAULT_GEOGRAPHY_PATH)
+    with _stores_lock:
+        if db_path not in _stores:
+            store = GeographyStore(db_path)
+            if json_path is not None:
+                sync_from_json(store, json_path)
+            _stores[db_path] = store
+        return _stores[db_path]
+
+
+def main():
+    """Import, export or query the geography store from the command line."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Manage the SQLite geography store (comuni and zones)')
+    parser.add_argument('--db', type=str, default=None,
+                        help=f'Path to the geography database (default: {DEFAULT_GEOGRAPHY_PATH})')
+    parser.add_argument('--import-json', type=str, metavar='JSON_PATH',
+                        help='Replace the store with a file in the common_cities.json format')
+    parser.add_argument('--export-json', type=str, metavar='JSON_PATH',
+                        help='Write the store in the common_cities.json format')
+    parser.add_argument('--city', type=str, help='Show a comune and its macrozones')
+    args = parser.parse_args()
+
+    store = get_geography_store(db_path=args.db, json_path=None)
+    if args.import_json:
+        count = store.import_common_cities(json_codec.load_file(args.import_json),
+                                           source=file_signature(args.import_json))
+        if count < 0:
+            return
+    if args.export_json:
+        data = store.export_common_cities()
+        json_codec.dump_file(data, args.export_json, indent=4)
+        logger.info(f"[INFO] Exported {len(data)} comuni to {args.export_json}")
+    if args.city:
+        city = store.get_city(args.city)
+        if city is None:
+            logger.error(f"[ERROR] City '{args.city}' not found in the geography store")
+            return
+        print(f"{city['name']} (ID: {city['idComune']}, Key: {city['key']})")
+        for zone in store.macrozones(city["key"]):
+            print(f"  - {zone['name']} (ID: {zone['id']}, Key: {zone['key']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,96 @@
 # --- helpers.py ---
 
-from pydantic import BaseModel, HttpUrl
-from typing import List, Optional
-from uuid import UUID
-from azure.cosmos import CosmosClient, exceptions, ContainerProxy
-from models import RealEstateAd
-import pandas as pd
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+# pandas, pydantic (models.py) and the Azure SDK are imported by the functions
+# using them, so that command-line tools only pay for what they run
+
+
+def __getattr__(name):
+    if name == "RealEstateAd":
+        from models import RealEstateAd
+        return RealEstateAd
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# CONFIGURAZIONE
+
+def load_env_vars():
+    """Load environment variables from .env file"""
+    env_path = Path(__file__).resolve().parent / ".env"
+    load_dotenv(env_path)
+    
+    # Get environment variables with fallbacks
+    env_vars = {
+        "COSMOS_ENDPOINT": os.environ.get("COSMOS_DB_ACCOUNT_URI", ""),
+        "COSMOS_KEY": os.environ.get("COSMOS_DB_ACCOUNT_KEY", ""),
+        "COSMOS_DB": os.environ.get("COSMOS_DB_DATABASE_NAME", ""),
+        "BASE_URL": os.environ.get("IMMOBILIARE_API_URL", "https://www.immobiliare.it/api-next/search-list/listings/"),
+        "COOKIES": {
+            "PHPSESSID": os.environ.get("PHPSESSID", "e5686b96fbe172ee7cd72d2fee24712d"),
+            "IMMSESSID": os.environ.get("IMMSESSID", "e463dc3c67fb3bbc2073da5b3b8fcfed"),
+            "datadome": os.environ.get("DATADOME", "raRTHfOWVs3UHHI0mL8JHd28BnmNGvrwoW0YQoe1OGWN0396cfnXqNZrH0efDY3YacgoqDuIrgM200pQSPu_HDzKNaXsJwGE6B2_cz_TqXauGiR04B_nuZPm7RCwmRt7")
+        }
+    }
+    
+    return env_vars
+
+def missing_cosmos_settings(config):
+    """
+    Return the names of the Cosmos DB environment variables missing from a configuration.
+    
+    Args:
+        config: Configuration dictionary with cosmos_endpoint, cosmos_key and cosmos_db
+        
+    Returns:
+        List of missing environment variable names (empty if the configuration is complete)
+    """
+    missing = []
+    if not config.get("cosmos_endpoint"):
+        missing.append("COSMOS_DB_ACCOUNT_URI")
+    if not config.get("cosmos_key"):
+        missing.append("COSMOS_DB_ACCOUNT_KEY")
+    if not config.get("cosmos_db"):
+        missing.append("COSMOS_DB_DATABASE_NAME")
+    return missing
+
+# PULIZIA DATI
+
+def clean_dataframe_for_export(df):
+    """
+    Clean DataFrame by replacing NaN values with None and empty strings with None.
+    This ensures consistency when saving to JSON or uploading to databases.
+    
+    Args:
+        df: Pandas DataFrame to clean
+        
+    Returns:
+        Cleaned DataFrame with NaN and empty strings replaced with None
+    """
+    import pandas as pd
+
+    # Make a copy to avoid modifying the original DataFrame
+    cleaned_df = df.copy()
+    
+    # Replace NaN with None (which becomes null in JSON)
+    cleaned_df = cleaned_df.astype(object).replace({pd.NA: None})
+    cleaned_df = cleaned_df.where(pd.notnull(cleaned_df), None)
+    
+    # Replace empty strings with None
+    for col in cleaned_df.columns:
+        if cleaned_df[col].dtype == object:  # Only process string columns
+            cleaned_df[col] = cleaned_df[col].replace('', None)
+    
+    return cleaned_df
 
 # INIZIALIZZAZIONE COSMOS
 
 def init_cosmos_client(endpoint: str, key: str, db_name: str, container_name: str):
+    from azure.cosmos import CosmosClient
+
     client = CosmosClient(endpoint, credential=key)
     db = client.get_database_client(db_name)
     container = db.create_container_if_not_exists(container_name, partition_key="/city")
@@ -18,6 +99,8 @@ def init_cosmos_client(endpoint: str, key: str, db_name: str, container_name: st
 # INSERIMENTO SINGOLO ANNUNCIO
 
 def insert_ad(container: ContainerProxy, ad: RealEstateAd):
+    from azure.cosmos import exceptions
+
     try:
         item = ad.model_dump()
         # Convert UUID to string for Cosmos DB
@@ -34,166 +117,38 @@ def extract_flat_ad_data(ad_data: dict) -> dict:
     Estrae i dati rilevanti da un annuncio immobiliare e li inserisce in un dizionario
     con tutte le chiavi al primo livello.
     
+    Usa lo stesso piano di flattening compilato di create_ads_dataframe (flatten.py),
+    quindi colonne e valori sono sempre gli stessi.
+    
     Args:
         ad_data: Dizionario contenente i dati dell'annuncio (realEstate)
         
     Returns:
         Dizionario con i dati rilevanti dell'annuncio in formato piatto
+        (vuoto se l'elemento non contiene un annuncio)
     """
-    real_estate = ad_data.get("realEstate", {})
-    if not real_estate:
-        return {}
-    
-    # Estrai i dati di base dell'annuncio
-    flat_data = {
-        "id": real_estate.get("id"),
-        "uuid": real_estate.get("uuid"),
-        "visibility": real_estate.get("visibility"),
-        "contract": real_estate.get("contract"),
-        "isNew": real_estate.get("isNew"),
-        "luxury": real_estate.get("luxury"),
-        "title": real_estate.get("title"),
-        "type": real_estate.get("type"),
-        "typology_id": real_estate.get("typology", {}).get("id"),
-        "typology_name": real_estate.get("typology", {}).get("name"),
-        "isProjectLike": real_estate.get("isProjectLike"),
-        "isMosaic": real_estate.get("isMosaic"),
-        "propertiesCount": real_estate.get("propertiesCount"),
-        "url": ad_data.get("seo", {}).get("url"),
-        "geoHash": ad_data.get("idGeoHash")
-    }
-    
-    # Estrai i dati di prezzo
-    price = real_estate.get("price", {})
-    flat_data.update({
-        "price_value": price.get("value"),
-        "price_formatted": price.get("formattedValue"),
-        "price_min": price.get("minValue"),
-        "price_max": price.get("maxValue"),
-        "price_range": price.get("priceRange"),
-        "price_visible": price.get("visible")
-    })
-    
-    # Estrai i dati dell'agenzia
-    agency = real_estate.get("advertiser", {}).get("agency", {})
-    flat_data.update({
-        "agency_id": agency.get("id"),
-        "agency_type": agency.get("type"),
-        "agency_name": agency.get("displayName"),
-        "agency_label": agency.get("label"),
-        "agency_url": agency.get("agencyUrl")
-    })
-    
-    # Estrai le info sulla proprietà principale (se presente)
-    properties = real_estate.get("properties", [])
-    if properties:
-        main_property = properties[0]
-        
-        # Aggiungi informazioni sulla proprietà principale
-        flat_data.update({
-            "surface": main_property.get("surface"),
-            "rooms": main_property.get("rooms"),
-            "bathrooms": main_property.get("bathrooms"),
-            "description": main_property.get("description"),
-            "elevator": main_property.get("elevator"),
-            "typologyGA4Translation": main_property.get("typologyGA4Translation"),
-            "ga4Heating": main_property.get("ga4Heating"),
-            "ga4features": ", ".join(main_property.get("ga4features", [])) if main_property.get("ga4features") else None,
-            "ga4Garage": main_property.get("ga4Garage"),
-            "caption": main_property.get("caption"),
-            "matchSearch": main_property.get("matchSearch")
-        })
-        
-        # Aggiungi informazioni sulla posizione
-        location = main_property.get("location", {})
-        if location:
-            flat_data.update({
-                "address": location.get("address"),
-                "latitude": location.get("latitude"),
-                "longitude": location.get("longitude"),
-                "region": location.get("region"),
-                "province": location.get("province"),
-                "city": location.get("city"),
-                "macrozone": location.get("macrozone"),
-                "nation": location.get("nation", {}).get("name")
-            })
-        
-        # Aggiungi informazioni sul piano (se presenti)
-        floor = main_property.get("floor", {})
-        if floor:
-            flat_data.update({
-                "floor": floor.get("value"),
-                "floor_number": floor.get("floorOnlyValue"),
-                "floor_ga4value": floor.get("ga4FloorValue")
-            })
-        
-        # Estrai URL della foto principale
-        photo = main_property.get("photo", {})
-        if photo:
-            urls = photo.get("urls", {})
-            flat_data.update({
-                "photo_id": photo.get("id"),
-                "photo_caption": photo.get("caption"),
-                "photo_url_small": urls.get("small"),
-                "photo_url_medium": urls.get("medium"),
-                "photo_url_large": urls.get("large")
-            })
-        
-        # Estrai viste disponibili
-        views = main_property.get("views", [])
-        if views:
-            flat_data["views"] = ", ".join([view.get("name", "") for view in views])
-    
-    return flat_data
+    from flatten import flatten_page
+
+    columns = flatten_page([ad_data])
+    return {name: values[0] for name, values in columns.items()} if columns["id"] else {}
 
-def create_ads_dataframe(ads_list: list) -> pd.DataFrame:
+def create_ads_dataframe(ads_list: list, include_raw: bool = False) -> pd.DataFrame:
     """
     Crea un DataFrame pandas a partire da una lista di annunci immobiliari.
     
+    Usa il motore di flattening compilato (flatten.py), che produce direttamente
+    le colonne senza costruire un dizionario per ogni annuncio.
+    
     Args:
         ads_list: Lista di dizionari contenenti gli annunci immobiliari
+        include_raw: Se True aggiunge la colonna raw_data con il payload realEstate compresso
         
     Returns:
         pandas.DataFrame contenente tutti gli annunci in formato tabellare
     """
-    flat_ads = []
-    for ad in ads_list:
-        flat_ad = extract_flat_ad_data(ad)
-        if flat_ad:
-            flat_ads.append(flat_ad)
-    
-    df = pd.DataFrame(flat_ads)
-    
-    # Riorganizza le colonne in gruppi logici per migliore leggibilità
-    column_groups = [
-        # Identificazione
-        ["id", "uuid", "title", "url", "geoHash"],
-        # Tipo e visibilità
-        ["type", "typology_id", "typology_name", "contract", "isNew", "luxury", "visibility", "isProjectLike", "isMosaic", "propertiesCount"],
-        # Prezzo
-        [col for col in df.columns if col.startswith("price_")],
-        # Caratteristiche principali
-        ["surface", "rooms", "bathrooms", "floor", "floor_number", "floor_ga4value", "elevator"],
-        # Posizione
-        ["address", "latitude", "longitude", "city", "province", "region", "macrozone", "nation"],
-        # Descrizioni e caratteristiche
-        ["description", "caption", "ga4features", "ga4Heating", "ga4Garage", "views"],
-        # Agenzia
-        [col for col in df.columns if col.startswith("agency_")],
-        # Foto
-        [col for col in df.columns if col.startswith("photo_")]
-    ]
-    
-    # Appiattisci e filtra per colonne esistenti
-    sorted_columns = []
-    for group in column_groups:
-        sorted_columns.extend([col for col in group if col in df.columns])
-    
-    # Aggiungi eventuali colonne rimanenti
-    remaining_columns = [col for col in df.columns if col not in sorted_columns]
-    sorted_columns.extend(remaining_columns)
-    
-    return df[sorted_columns]
+    from flatten import flatten_page, columns_to_dataframe
+
+    return columns_to_dataframe(flatten_page(ads_list, include_raw=include_raw))
 
 def transform_df_dtypes(df):
     def extract_surface_m2(s):
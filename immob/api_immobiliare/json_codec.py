@@ -0,0 +1,178 @@
+"""
+Pluggable JSON codec used for API pages, exports and local data files.
+
+The fastest available backend is picked automatically:
+    orjson  -> msgspec -> json (stdlib)
+and can be forced with the IMMOB_JSON_BACKEND environment variable
+("orjson", "msgspec" or "json").
+
+All backends behave the same way for our data: output is UTF-8 without
+ASCII escaping, NaN becomes null, and values JSON cannot represent natively
+(Timestamps as ISO strings, numpy scalars as numbers, anything else with str()).
+
+Pages can also be decoded straight into the msgspec Structs of fast_models.py
+(typed=True), which mirror models.py and validate while parsing.
+"""
+
+import os
+import json
+import math
+import logging
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+
+def _select_backend() -> str:
+    available = {"orjson": orjson is not None, "msgspec": msgspec is not None, "json": True}
+    requested = os.environ.get("IMMOB_JSON_BACKEND", "").strip().lower()
+    if requested:
+        if requested in available and available[requested]:
+            return requested
+        logger.warning(f"JSON backend '{requested}' not available, falling back to automatic selection")
+    return next(name for name in BACKENDS if available[name])
+
+
+BACKEND = _select_backend()
+
+
+def _default(value):
+    """Fallback for values the backends cannot serialise natively."""
+    if hasattr(value, 'item'):  # numpy scalars
+        return value.item()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _nan_to_none(obj):
+    """Replace float NaN/inf with None (stdlib json would write invalid NaN tokens)."""
+    if isinstance(obj, float):
+        return None if math.isnan(obj) or math.isinf(obj) else obj
+    if isinstance(obj, dict):
+        return {k: _nan_to_none(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_nan_to_none(v) for v in obj]
+    return obj
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    """
+    Parse a JSON document.
+
+    Args:
+        data: JSON text (bytes are preferred, e.g. `response.content`)
+
+    Returns:
+        The decoded Python object
+    """
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    if BACKEND == "msgspec":
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def _numpy_or(default: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """Fallback keeping numpy scalars as numbers and passing anything else to `default`."""
+    def fallback(value):
+        return value.item() if hasattr(value, 'item') else default(value)
+    return fallback
+
+
+def dumps(obj: Any, indent: Optional[int] = None, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """
+    Serialise an object to UTF-8 JSON.
+
+    Args:
+        obj: Object to serialise
+        indent: Optional indentation (orjson only supports 2; other values use another backend)
+        default: Optional function for the values JSON cannot represent, dates and times
+            included, as with json.dump(default=...); e.g. `str` writes "2026-10-19 08:30:05"
+            instead of ISO 8601. numpy scalars are still written as numbers
+
+    Returns:
+        The JSON document as bytes
+    """
+    fallback = _default if default is None else _numpy_or(default)
+
+    if BACKEND == "orjson" and indent in (None, 2):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if default is not None:
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        return orjson.dumps(obj, default=fallback, option=option)
+
+    # msgspec always writes dates as ISO 8601, so a custom `default` needs the standard library
+    if BACKEND in ("orjson", "msgspec") and msgspec is not None and default is None:
+        data = msgspec.json.encode(_nan_to_none(obj), enc_hook=_default)
+        return msgspec.json.format(data, indent=indent) if indent else data
+
+    return json.dumps(
+        _nan_to_none(obj), ensure_ascii=False, indent=indent, default=fallback, allow_nan=False
+    ).encode('utf-8')
+
+
+def dump_file(obj: Any, path: Union[str, Path], indent: Optional[int] = None,
+              default: Optional[Callable[[Any], Any]] = None) -> None:
+    """
+    Write an object to a JSON file.
+
+    Args:
+        obj: Object to serialise
+        path: Destination file
+        indent: Optional indentation
+        default: Optional function for the values JSON cannot represent (see dumps)
+    """
+    with open(path, 'wb') as f:
+        f.write(dumps(obj, indent=indent, default=default))
+
+
+def load_file(path: Union[str, Path]) -> Any:
+    """
+    Read a JSON file.
+
+    Args:
+        path: File to read
+
+    Returns:
+        The decoded Python object
+    """
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def decode_page(data: Union[bytes, str], typed: bool = False) -> Any:
+    """
+    Decode a search-list API page.
+
+    Args:
+        data: Raw response body
+        typed: If True, decode into fast_models.SearchListPage (requires msgspec);
+               otherwise return plain dicts
+
+    Returns:
+        The decoded page
+    """
+    if not typed:
+        return loads(data)
+    if msgspec is None:
+        raise ValueError("msgspec package is required for typed decoding")
+
+    from fast_models import page_decoder
+    return page_decoder().decode(data)
@@ -0,0 +1,448 @@
+"""
+Market analytics over the ads database: price per m², rent yield and rooms.
+
+The reports are computed from narrow queries pushed down to SQLite: filters
+(cities, contract, ads still on the site, one listing per duplicate cluster)
+and the price per m² are evaluated in SQL, the room counts are aggregated by
+a GROUP BY, and a covering index (contract, city, macrozone, rooms, price,
+surface, url) lets SQLite read the index instead of the wide ad rows. Only
+the quantiles, which SQLite cannot compute, are left to pandas, in a single
+groupby pass over one float per ad.
+
+Reports are cached in the analytics_cache table, one row per report,
+parameters and crawl date (the day of the latest crawl). A cached report is
+reused as long as the data version (ad count, latest ad, latest update,
+latest crawl session, duplicate clusters) has not changed, so reporting on
+50 comuni after a crawl costs one pass and every later request a lookup.
+
+    python market_analytics.py --db data/ads.db --report price --city genova
+    python market_analytics.py --db data/ads.db --report yield --by city macrozone
+
+This module provides functions to:
+1. Compute price per m² statistics and quantiles per city, contract, macrozone, ...
+2. Estimate the gross rent yield of each zone by joining rent and sale prices
+3. Count the ads per number of rooms in each zone
+4. Cache the reports per crawl date
+"""
+
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
+
+import pandas as pd
+
+import json_codec
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+RENT_CONTRACT = "rent"
+SALE_CONTRACT = "sale"
+DEFAULT_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+DEFAULT_ZONE_COLUMNS = ("city", "macrozone")
+MIN_SURFACE_M2 = 10  # Smaller surfaces are typing errors (or parking spaces) and blow up €/m²
+MAX_ROOMS_BUCKET = 5  # 5 stands for "5 rooms or more"
+DEFAULT_MIN_YIELD_ADS = 5
+
+# Columns the reports can be grouped by (they are interpolated in the queries)
+GROUP_COLUMNS = ("city", "province", "region", "contract", "macrozone", "typology_name", "rooms")
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def init_analytics_tables(db_path: str) -> bool:
+    """
+    Initialize the analytics_cache table and the indexes used by the reports.
+
+    Args:
+        db_path: Path to the ads database
+
+    Returns:
+        True if initialization was successful, False otherwise
+    """
+    try:
+        with get_connection(db_path) as conn:
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS analytics_cache (
+                report TEXT NOT NULL,
+                params TEXT NOT NULL,
+                crawl_date TEXT NOT NULL,
+                data_version TEXT NOT NULL,
+                computed_at TIMESTAMP NOT NULL,
+                result BLOB NOT NULL,
+                PRIMARY KEY (report, params, crawl_date)
+            ) WITHOUT ROWID;
+            ''')
+            if _has_table(conn, "real_estate_ads"):
+                conn.executescript('''
+                CREATE INDEX IF NOT EXISTS idx_ads_market
+                    ON real_estate_ads(contract, city, macrozone, rooms, price_value, surface_m2, url);
+                CREATE INDEX IF NOT EXISTS idx_ads_updated_at ON real_estate_ads(updated_at);
+                ''')
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error initializing analytics tables: {e}")
+        return False
+
+
+def _group_columns(by: Union[str, Sequence[str]]) -> List[str]:
+    columns = [by] if isinstance(by, str) else list(by)
+    unknown = [column for column in columns if column not in GROUP_COLUMNS]
+    if not columns or unknown:
+        raise ValueError(f"Reports are grouped by one or more of {GROUP_COLUMNS}, got {columns}")
+    return columns
+
+
+def _as_list(values: Union[None, str, Sequence[str]]) -> List[str]:
+    if not values:
+        return []
+    return [values] if isinstance(values, str) else list(values)
+
+
+def _ads_filter(conn: sqlite3.Connection, cities: List[str], contracts: List[str], active_only: bool,
+                deduplicate: bool) -> Tuple[str, str, List[Any]]:
+    """JOIN clauses, WHERE conditions (starting with AND) and parameters selecting the ads of a report."""
+    joins, conditions, params = [], [], []
+    if active_only and _has_table(conn, "listing_status"):
+        joins.append("LEFT JOIN listing_status s ON s.url = a.url")
+        conditions.append("s.delisted_at IS NULL")
+    if deduplicate and _has_table(conn, "listing_clusters"):
+        joins.append("LEFT JOIN listing_clusters c ON c.url = a.url")
+        conditions.append("(c.url IS NULL OR c.url = c.canonical_url)")
+    if cities:
+        conditions.append(f"LOWER(a.city) IN ({', '.join('?' * len(cities))})")
+        params.extend(city.lower() for city in cities)
+    if contracts:
+        conditions.append(f"a.contract IN ({', '.join('?' * len(contracts))})")
+        params.extend(contracts)
+    return " ".join(joins), "".join(f" AND {condition}" for condition in conditions), params
+
+
+def data_version(conn: sqlite3.Connection) -> Tuple[str, str]:
+    """
+    Crawl date and version of the data the reports are computed from.
+
+    Every query is answered from an index or a small table, so checking the
+    cache does not scan the ads.
+
+    Args:
+        conn: Connection to the ads database
+
+    Returns:
+        Tuple (crawl_date as YYYY-MM-DD, data_version string)
+    """
+    max_id = conn.execute("SELECT MAX(db_id) FROM real_estate_ads").fetchone()[0]
+    count = conn.execute("SELECT COUNT(*) FROM real_estate_ads").fetchone()[0]
+    last_update = conn.execute("SELECT MAX(updated_at) FROM real_estate_ads").fetchone()[0]
+    parts = [max_id, count, last_update]
+    crawled_at = [last_update]
+    if _has_table(conn, "crawl_sessions"):
+        session_id, finished_at = conn.execute("SELECT MAX(session_id), MAX(finished_at) FROM crawl_sessions").fetchone()
+        parts.append(session_id)
+        crawled_at.append(finished_at)
+    if _has_table(conn, "listing_clusters"):
+        parts.extend(conn.execute("SELECT COUNT(*), MAX(updated_at) FROM listing_clusters").fetchone())
+
+    crawled_at = [str(value) for value in crawled_at if value]
+    crawl_date = max(crawled_at)[:10] if crawled_at else datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    return crawl_date, "|".join("" if part is None else str(part) for part in parts)
+
+
+def _cached_report(db_path: str, report: str, params: Dict[str, Any],
+                   compute: Callable[[sqlite3.Connection], pd.DataFrame], use_cache: bool = True) -> pd.DataFrame:
+    """
+    Return a report from analytics_cache, or compute and cache it.
+
+    Args:
+        db_path: Path to the ads database
+        report: Name of the report
+        params: Parameters of the report (part of the cache key)
+        compute: Function computing the report from a connection
+        use_cache: If False, always recompute (the result is still cached)
+
+    Returns:
+        The report; df.attrs["crawl_date"] is the crawl date it refers to and
+        df.attrs["cached"] whether it came from the cache
+    """
+    if not init_analytics_tables(db_path):
+        return pd.DataFrame()
+
+    key = json_codec.dumps(params).decode("utf-8")
+    with get_connection(db_path) as conn:
+        if not _has_table(conn, "real_estate_ads"):
+            logger.error(f"[ERROR] No real_estate_ads table in {db_path}")
+            return pd.DataFrame()
+
+        crawl_date, version = data_version(conn)
+        row = conn.execute(
+            "SELECT data_version, result FROM analytics_cache WHERE report = ? AND params = ? AND crawl_date = ?",
+            (report, key, crawl_date)
+        ).fetchone() if use_cache else None
+        if row is not None and row["data_version"] == version:
+            payload = json_codec.loads(row["result"])
+            df = pd.DataFrame(payload["data"], columns=payload["columns"])
+            cached = True
+        else:
+            conn.row_factory = None  # pandas builds the frame faster from plain tuples
+            df = compute(conn)
+            payload = {"columns": [str(column) for column in df.columns], "data": df.to_numpy().tolist()}
+            conn.execute(
+                "INSERT OR REPLACE INTO analytics_cache (report, params, crawl_date, data_version, computed_at, result) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (report, key, crawl_date, version, datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                 json_codec.dumps(payload))
+            )
+            conn.commit()
+            cached = False
+
+    df.attrs["crawl_date"] = crawl_date
+    df.attrs["cached"] = cached
+    return df
+
+
+def _quantile_label(quantile: float) -> str:
+    return f"p{round(quantile * 100):02d}"
+
+
+def price_per_m2_stats(
+    db_path: str,
+    by: Union[str, Sequence[str]] = ("city", "contract", "macrozone"),
+    cities: Union[None, str, Sequence[str]] = None,
+    contract: Union[None, str, Sequence[str]] = None,
+    quantiles: Sequence[float] = DEFAULT_QUANTILES,
+    min_surface_m2: float = MIN_SURFACE_M2,
+    active_only: bool = True,
+    deduplicate: bool = True,
+    use_cache: bool = True
+) -> pd.DataFrame:
+    """
+    Price per m² statistics of each group of ads.
+
+    Args:
+        db_path: Path to the ads database
+        by: Column(s) to group by, among GROUP_COLUMNS
+        cities: Only the ads of these cities (optional)
+        contract: Only the ads of this contract, or these contracts (optional)
+        quantiles: Quantiles of the price per m² to compute
+        min_surface_m2: Ads with a smaller surface are ignored
+        active_only: Ignore the delisted ads (when delistings are tracked)
+        deduplicate: Count a flat listed by several agencies once (when dedup.py was run)
+        use_cache: Reuse the cached report of the same crawl date if the data did not change
+
+    Returns:
+        DataFrame with the group columns, `ads` (number of ads), `mean` and one
+        column per quantile (`p10`, `p25`, `p50`, ...), in € per m²
+    """
+    by = _group_columns(by)
+    cities = sorted(city.lower() for city in _as_list(cities))
+    contracts = sorted(_as_list(contract))
+    quantiles = sorted(float(quantile) for quantile in quantiles)
+
+    def compute(conn):
+        joins, conditions, params = _ads_filter(conn, cities, contracts, active_only, deduplicate)
+        ads = pd.read_sql_query(
+            f"SELECT {', '.join(f'a.{column}' for column in by)}, a.price_value / a.surface_m2 AS price_per_m2 "
+            f"FROM real_estate_ads a {joins} "
+            f"WHERE a.price_value > 0 AND a.surface_m2 >= ?{conditions}",
+            conn, params=[min_surface_m2, *params]
+        )
+        columns = by + ["ads", "mean"] + [_quantile_label(quantile) for quantile in quantiles]
+        if ads.empty:
+            return pd.DataFrame(columns=columns)
+
+        grouped = ads.groupby(by, dropna=False, sort=True)["price_per_m2"]
+        stats = grouped.agg(ads="count", mean="mean")
+        if quantiles:
+            stats = stats.join(grouped.quantile(quantiles).unstack())
+        return stats.reset_index().set_axis(columns, axis=1)
+
+    params = {"by": by, "cities": cities, "contracts": contracts, "quantiles": quantiles,
+              "min_surface_m2": min_surface_m2, "active_only": active_only, "deduplicate": deduplicate}
+    return _cached_report(db_path, "price_per_m2", params, compute, use_cache)
+
+
+def rent_yield(
+    db_path: str,
+    by: Union[str, Sequence[str]] = DEFAULT_ZONE_COLUMNS,
+    cities: Union[None, str, Sequence[str]] = None,
+    min_ads: int = DEFAULT_MIN_YIELD_ADS,
+    min_surface_m2: float = MIN_SURFACE_M2,
+    active_only: bool = True,
+    deduplicate: bool = True,
+    use_cache: bool = True
+) -> pd.DataFrame:
+    """
+    Gross rent yield of each zone: yearly median rent per m² over median sale price per m².
+
+    The medians come from price_per_m2_stats grouped by the zone and the
+    contract (the same cached report as the price statistics of market_report);
+    the rent and sale rows of each zone are then joined.
+
+    Args:
+        db_path: Path to the ads database
+        by: Column(s) identifying a zone, among GROUP_COLUMNS
+        cities: Only the ads of these cities (optional)
+        min_ads: Zones with fewer rent or sale ads are left out
+        min_surface_m2: Ads with a smaller surface are ignored
+        active_only: Ignore the delisted ads (when delistings are tracked)
+        deduplicate: Count a flat listed by several agencies once (when dedup.py was run)
+        use_cache: Reuse the cached statistics of the same crawl date if the data did not change
+
+    Returns:
+        DataFrame with the zone columns, `rent_ads`, `rent_m2` (median monthly
+        rent per m²), `sale_ads`, `sale_m2` (median price per m²) and
+        `gross_yield_pct`, sorted by decreasing yield
+    """
+    by = _group_columns(by)
+    stats = price_per_m2_stats(db_path, by=by + ["contract"], cities=cities, min_surface_m2=min_surface_m2,
+                               active_only=active_only, deduplicate=deduplicate, use_cache=use_cache)
+    columns = by + ["rent_ads", "rent_m2", "sale_ads", "sale_m2", "gross_yield_pct"]
+    if stats.empty:
+        return pd.DataFrame(columns=columns)
+
+    sides = {
+        contract: stats[(stats["contract"] == contract) & (stats["ads"] >= min_ads)]
+        .set_index(by)[["ads", "p50"]]
+        .rename(columns={"ads": f"{contract}_ads", "p50": f"{contract}_m2"})
+        for contract in (RENT_CONTRACT, SALE_CONTRACT)
+    }
+    yields = sides[RENT_CONTRACT].join(sides[SALE_CONTRACT], how="inner")
+    yields["gross_yield_pct"] = 12 * 100 * yields[f"{RENT_CONTRACT}_m2"] / yields[f"{SALE_CONTRACT}_m2"]
+    yields = yields.sort_values("gross_yield_pct", ascending=False).reset_index()[columns]
+    yields.attrs = dict(stats.attrs)
+    return yields
+
+
+def room_distribution(
+    db_path: str,
+    by: Union[str, Sequence[str]] = DEFAULT_ZONE_COLUMNS,
+    cities: Union[None, str, Sequence[str]] = None,
+    contract: Union[None, str, Sequence[str]] = None,
+    shares: bool = False,
+    active_only: bool = True,
+    deduplicate: bool = True,
+    use_cache: bool = True
+) -> pd.DataFrame:
+    """
+    Number of ads per number of rooms in each zone, counted by SQLite.
+
+    Args:
+        db_path: Path to the ads database
+        by: Column(s) identifying a zone, among GROUP_COLUMNS
+        cities: Only the ads of these cities (optional)
+        contract: Only the ads of this contract, or these contracts (optional)
+        shares: Return the share of each number of rooms instead of the counts
+        active_only: Ignore the delisted ads (when delistings are tracked)
+        deduplicate: Count a flat listed by several agencies once (when dedup.py was run)
+        use_cache: Reuse the cached counts of the same crawl date if the data did not change
+
+    Returns:
+        DataFrame with the zone columns, one column per number of rooms
+        ("1" ... "4", "5+") and `ads` (the total of the zone)
+    """
+    by = _group_columns(by)
+    cities = sorted(city.lower() for city in _as_list(cities))
+    contracts = sorted(_as_list(contract))
+    room_columns = [str(rooms) for rooms in range(1, MAX_ROOMS_BUCKET)] + [f"{MAX_ROOMS_BUCKET}+"]
+
+    def compute(conn):
+        joins, conditions, params = _ads_filter(conn, cities, contracts, active_only, deduplicate)
+        group = ", ".join(f"a.{column}" for column in by)
+        # CAST('5+' AS INTEGER) is 5, so "5+" and larger numbers share the last bucket
+        counts = pd.read_sql_query(
+            f"SELECT {group}, MIN(CAST(a.rooms AS INTEGER), {MAX_ROOMS_BUCKET}) AS rooms_bucket, COUNT(*) AS ads "
+            f"FROM real_estate_ads a {joins} "
+            f"WHERE CAST(a.rooms AS INTEGER) >= 1{conditions} "
+            f"GROUP BY {group}, rooms_bucket",
+            conn, params=params
+        )
+        if counts.empty:
+            return pd.DataFrame(columns=by + room_columns + ["ads"])
+
+        table = counts.set_index(by + ["rooms_bucket"])["ads"].unstack(fill_value=0)
+        table = table.reindex(columns=range(1, MAX_ROOMS_BUCKET + 1), fill_value=0)
+        table.columns = room_columns
+        table["ads"] = table.sum(axis=1)
+        return table.sort_index().reset_index()
+
+    params = {"by": by, "cities": cities, "contracts": contracts, "active_only": active_only,
+              "deduplicate": deduplicate}
+    table = _cached_report(db_path, "room_distribution", params, compute, use_cache)
+    if shares and not table.empty:
+        table[room_columns] = table[room_columns].div(table["ads"], axis=0)
+    return table
+
+
+def market_report(
+    db_path: str,
+    by: Union[str, Sequence[str]] = DEFAULT_ZONE_COLUMNS,
+    cities: Union[None, str, Sequence[str]] = None,
+    active_only: bool = True,
+    deduplicate: bool = True,
+    use_cache: bool = True
+) -> Dict[str, pd.DataFrame]:
+    """
+    All the reports of the zones of some cities, per contract.
+
+    Args:
+        db_path: Path to the ads database
+        by: Column(s) identifying a zone, among GROUP_COLUMNS
+        cities: Only the ads of these cities (optional, default all)
+        active_only: Ignore the delisted ads (when delistings are tracked)
+        deduplicate: Count a flat listed by several agencies once (when dedup.py was run)
+        use_cache: Reuse the cached reports of the same crawl date if the data did not change
+
+    Returns:
+        Dictionary with the "price_per_m2", "rent_yield" and "rooms" DataFrames
+    """
+    by = _group_columns(by)
+    options = {"cities": cities, "active_only": active_only, "deduplicate": deduplicate, "use_cache": use_cache}
+    return {
+        "price_per_m2": price_per_m2_stats(db_path, by=by + ["contract"], **options),
+        "rent_yield": rent_yield(db_path, by=by, **options),
+        "rooms": room_distribution(db_path, by=by + ["contract"], **options)
+    }
+
+
+def main():
+    """Print market reports of an ads database."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Price per m², rent yield and room reports of an ads database')
+    parser.add_argument('--db', type=str, required=True, help='Path to the ads database')
+    parser.add_argument('--report', choices=('price', 'yield', 'rooms', 'all'), default='all',
+                        help='Report to print (default: all)')
+    parser.add_argument('--by', nargs='+', choices=GROUP_COLUMNS, default=list(DEFAULT_ZONE_COLUMNS),
+                        help='Columns identifying a zone (default: city macrozone)')
+    parser.add_argument('--city', nargs='+', dest='cities', help='Only these cities')
+    parser.add_argument('--contract', choices=(RENT_CONTRACT, SALE_CONTRACT), help='Only this contract')
+    parser.add_argument('--all-ads', action='store_true',
+                        help='Include delisted ads and every listing of a duplicate cluster')
+    parser.add_argument('--no-cache', action='store_true', help='Recompute the reports even if they are cached')
+    args = parser.parse_args()
+
+    options = {"cities": args.cities, "active_only": not args.all_ads, "deduplicate": not args.all_ads,
+               "use_cache": not args.no_cache}
+    reports = {}
+    if args.report in ('price', 'all'):
+        by = args.by if args.contract or 'contract' in args.by else args.by + ['contract']
+        reports["Price per m²"] = price_per_m2_stats(args.db, by=by, contract=args.contract, **options)
+    if args.report in ('yield', 'all'):
+        reports["Gross rent yield"] = rent_yield(args.db, by=args.by, **options)
+    if args.report in ('rooms', 'all'):
+        reports["Rooms"] = room_distribution(args.db, by=args.by, contract=args.contract, **options)
+
+    with pd.option_context("display.max_rows", None, "display.width", 200, "display.float_format", "{:.2f}".format):
+        for title, df in reports.items():
+            source = "cached" if df.attrs.get("cached") else "computed"
+            print(f"\n{title} (crawl of {df.attrs.get('crawl_date', '-')}, {source}):")
+            print(df.to_string(index=False) if not df.empty else "  no ads")
+
+
+if __name__ == "__main__":
+    main()
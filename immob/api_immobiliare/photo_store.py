@@ -0,0 +1,547 @@
+"""
+Concurrent download of listing photos into a content-addressed store.
+
+Photos are fetched by a bounded pool of threads sharing one pooled session and
+one RateLimiter, and saved under their SHA-256:
+
+    <root>/ab/cd/abcd1234....jpg
+
+so an image re-used by several listings (or agencies) is stored once, and a
+file already on disk is never written again. A SQLite index in the store
+(photos.db by default) records every photo URL with its digest or its last
+error, the files with their size and perceptual hash, and which ad uses which
+photo. The index is written by the main thread only and committed every
+`commit_every` photos, so an interrupted run resumes where it stopped: URLs
+already stored are skipped, failed ones are retried up to `max_attempts`.
+
+The perceptual hash is a 64-bit dHash of the image, computed when Pillow is
+installed. Photos of a re-posted listing usually differ by a re-encoding or a
+resize only, which changes the SHA-256 but not (or barely) the dHash.
+
+    python photo_store.py --db data/ads.db --photos-dir data/photos --size medium --workers 8 --rate 10
+    python photo_store.py --photos-dir data/photos --similar https://www.immobiliare.it/annunci/12345678/
+
+This module provides functions to:
+1. Download photos concurrently under a rate limit into a content-addressed store
+2. Index the photos, their URLs and the ads using them in SQLite
+3. Find photos (and ads) with a similar perceptual hash
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import argparse
+import mimetypes
+from io import BytesIO
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import requests
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, photos are stored without perceptual hash
+    Image = None
+
+from rate_limit import RateLimiter, make_session, retry_after_seconds
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+PHOTO_SIZES = ("small", "medium", "large")
+DEFAULT_WORKERS = 8
+DEFAULT_RATE = 10.0
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_MAX_DISTANCE = 6       # dHash bits that may differ between two similar photos
+COMMIT_EVERY = 100
+MAX_PHOTO_BYTES = 20 * 1024 * 1024
+REQUEST_TIMEOUT = 30
+PHOTO_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Accept": "image/avif,image/webp,image/*,*/*;q=0.8"
+}
+
+
+def dhash(data: bytes, hash_size: int = 8) -> Optional[str]:
+    """
+    Difference hash of an image: the sign of the horizontal gradients of a
+    grayscale (hash_size + 1) x hash_size thumbnail.
+
+    Args:
+        data: Encoded image
+        hash_size: Side of the hash grid (8 gives a 64-bit hash)
+
+    Returns:
+        Hexadecimal hash, or None if Pillow is not installed or the image cannot be decoded
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(BytesIO(data)) as image:
+            pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    except Exception as e:
+        logger.warning(f"[WARNING] Could not compute the perceptual hash of an image: {e}")
+        return None
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes().hex()
+
+
+def hamming_distances(reference: str, hashes: Iterable[str]) -> np.ndarray:
+    """Number of differing bits between a hexadecimal hash and each of `hashes`."""
+    reference_bytes = np.frombuffer(bytes.fromhex(reference), dtype=np.uint8)
+    other_bytes = np.array([np.frombuffer(bytes.fromhex(value), dtype=np.uint8) for value in hashes],
+                           dtype=np.uint8).reshape(-1, len(reference_bytes))
+    return np.unpackbits(other_bytes ^ reference_bytes, axis=1).sum(axis=1)
+
+
+def _extension(url: str, content_type: Optional[str]) -> str:
+    """File extension of a photo, from its content type or its URL."""
+    if content_type:
+        extension = mimetypes.guess_extension(content_type.split(";")[0].strip())
+        if extension:
+            return extension
+    extension = os.path.splitext(url.split("?")[0])[1].lower()
+    return extension if 1 < len(extension) <= 5 else ".bin"
+
+
+def download_photo(
+    session: requests.Session,
+    url: str,
+    rate_limiter: Optional[RateLimiter] = None,
+    timeout: float = REQUEST_TIMEOUT
+) -> Tuple[Optional[bytes], Optional[str], Optional[str]]:
+    """
+    Download one photo.
+
+    Args:
+        session: Requests session
+        url: Photo URL
+        rate_limiter: Rate limiter shared by the workers (optional)
+        timeout: Request timeout in seconds
+
+    Returns:
+        Tuple (content, content_type, error); content is None on error
+    """
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    try:
+        with session.get(url, timeout=timeout, stream=True) as response:
+            if response.status_code == 429 and rate_limiter is not None:
+                rate_limiter.pause(retry_after_seconds(response.headers, 10))
+            if response.status_code != 200:
+                return None, None, f"HTTP {response.status_code}"
+            chunks, size = [], 0
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > MAX_PHOTO_BYTES:
+                    return None, None, f"larger than {MAX_PHOTO_BYTES} bytes"
+                chunks.append(chunk)
+            return b"".join(chunks), response.headers.get("Content-Type"), None
+    except requests.RequestException as e:
+        return None, None, str(e)
+
+
+class PhotoStore:
+    """
+    Content-addressed photo files with a SQLite index.
+
+    Args:
+        root: Directory of the photo files
+        index_path: Path to the SQLite index (default: <root>/photos.db)
+    """
+
+    def __init__(self, root: str, index_path: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.index_path = index_path or os.path.join(self.root, "photos.db")
+        if not self.init_index():
+            raise sqlite3.DatabaseError(f"Could not initialize the photo index {self.index_path}")
+
+    def init_index(self) -> bool:
+        """
+        Initialize the photo index tables.
+
+        Returns:
+            True if initialization was successful, False otherwise
+        """
+        try:
+            with get_connection(self.index_path) as conn:
+                conn.executescript('''
+                CREATE TABLE IF NOT EXISTS photo_files (
+                    sha256 TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_type TEXT,
+                    dhash TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) WITHOUT ROWID;
+
+                CREATE INDEX IF NOT EXISTS idx_photo_files_dhash ON photo_files(dhash);
+
+                CREATE TABLE IF NOT EXISTS photo_urls (
+                    url TEXT PRIMARY KEY,
+                    sha256 TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) WITHOUT ROWID;
+
+                CREATE INDEX IF NOT EXISTS idx_photo_urls_sha256 ON photo_urls(sha256);
+
+                CREATE TABLE IF NOT EXISTS ad_photos (
+                    ad_url TEXT NOT NULL,
+                    size TEXT NOT NULL,
+                    photo_url TEXT NOT NULL,
+                    PRIMARY KEY (ad_url, size)
+                ) WITHOUT ROWID;
+
+                CREATE INDEX IF NOT EXISTS idx_ad_photos_photo ON ad_photos(photo_url);
+                ''')
+                conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error initializing photo index: {e}")
+            return False
+
+    def path_for(self, sha256: str, extension: str = "") -> str:
+        """Path of a photo file, sharded by the first two bytes of its digest."""
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256 + extension)
+
+    def put(self, content: bytes, extension: str) -> Tuple[str, str, bool]:
+        """
+        Store a photo unless a file with the same content exists.
+        Safe to call from several threads: files are written atomically.
+
+        Args:
+            content: Photo bytes
+            extension: File extension, e.g. ".jpg"
+
+        Returns:
+            Tuple (sha256, path, written)
+        """
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = self.path_for(sha256, extension)
+        if os.path.exists(path):
+            return sha256, path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(content)
+        os.replace(temp_path, path)
+        return sha256, path, True
+
+    def link_ads(self, links: Iterable[Tuple[str, str, str]]) -> None:
+        """
+        Record which ad uses which photo.
+
+        Args:
+            links: Tuples (ad_url, size, photo_url)
+        """
+        with get_connection(self.index_path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ad_photos (ad_url, size, photo_url) VALUES (?, ?, ?)", links
+            )
+            conn.commit()
+
+    def pending_urls(self, urls: Iterable[str], max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> List[str]:
+        """
+        URLs not stored yet and not failed `max_attempts` times, without duplicates.
+
+        Args:
+            urls: Photo URLs
+            max_attempts: Attempts after which a failing URL is given up
+
+        Returns:
+            URLs to download, in their original order
+        """
+        with get_connection(self.index_path) as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS requested_urls (position INTEGER PRIMARY KEY, url TEXT)")
+            conn.execute("DELETE FROM requested_urls")
+            conn.executemany("INSERT INTO requested_urls (url) VALUES (?)",
+                             ((url,) for url in urls if isinstance(url, str) and url))
+            rows = conn.execute('''
+                SELECT r.url FROM requested_urls r
+                LEFT JOIN photo_urls p ON p.url = r.url
+                WHERE p.url IS NULL OR (p.sha256 IS NULL AND p.attempts < ?)
+                GROUP BY r.url
+                ORDER BY MIN(r.position)
+            ''', (max_attempts,)).fetchall()
+        return [row[0] for row in rows]
+
+    def fetch(
+        self,
+        urls: Iterable[str],
+        workers: int = DEFAULT_WORKERS,
+        rate: Optional[float] = DEFAULT_RATE,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        commit_every: int = COMMIT_EVERY,
+        session: Optional[requests.Session] = None
+    ) -> Dict[str, int]:
+        """
+        Download the photos not stored yet.
+
+        Args:
+            urls: Photo URLs
+            workers: Concurrent downloads
+            rate: Maximum requests per second across all workers (None for no limit)
+            max_attempts: Attempts after which a failing URL is given up
+            commit_every: Photos between two commits of the index (the resume points)
+            session: Requests session (default: a pooled session sized for the workers)
+
+        Returns:
+            Counters: requested, skipped, downloaded, stored (new files), deduplicated, failed
+        """
+        urls = [url for url in urls if isinstance(url, str) and url]
+        pending = self.pending_urls(urls, max_attempts)
+        stats = {"requested": len(set(urls)), "skipped": len(set(urls)) - len(pending), "downloaded": 0,
+                 "stored": 0, "deduplicated": 0, "failed": 0}
+        if not pending:
+            logger.info(f"[INFO] All {stats['requested']} photos are already stored")
+            return stats
+
+        session = session or make_session(pool_size=workers, headers=PHOTO_HEADERS)
+        rate_limiter = RateLimiter(rate, burst=workers) if rate else None
+        start_time = time.time()
+
+        def work(url: str) -> Tuple[str, Optional[Tuple[str, str, int, Optional[str], Optional[str]]], Optional[str]]:
+            content, content_type, error = download_photo(session, url, rate_limiter)
+            if content is None:
+                return url, None, error
+            sha256, path, _ = self.put(content, _extension(url, content_type))
+            return url, (sha256, path, len(content), content_type, dhash(content)), None
+
+        with get_connection(self.index_path) as conn, ThreadPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of downloads in flight instead of one future per URL
+            queue, in_flight, done_since_commit = iter(pending), set(), 0
+            try:
+                for url in queue:
+                    in_flight.add(executor.submit(work, url))
+                    if len(in_flight) < workers * 2:
+                        continue
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    done_since_commit += self._record(conn, finished, stats)
+                    if done_since_commit >= commit_every:
+                        conn.commit()
+                        done_since_commit = 0
+                        logger.info(f"[INFO] Photos: {stats['downloaded']} downloaded, {stats['failed']} failed, "
+                                    f"{len(pending) - stats['downloaded'] - stats['failed']} left")
+                self._record(conn, wait(in_flight).done, stats)
+                in_flight = set()
+            except KeyboardInterrupt:
+                logger.warning("[WARNING] Interrupted, saving the progress of the finished downloads")
+                for future in in_flight:
+                    future.cancel()
+                self._record(conn, {future for future in in_flight if future.done() and not future.cancelled()}, stats)
+                raise
+            finally:
+                conn.commit()
+
+        logger.info(
+            f"[INFO] Photos: {stats['downloaded']} downloaded ({stats['stored']} new files, "
+            f"{stats['deduplicated']} duplicates), {stats['skipped']} already stored, "
+            f"{stats['failed']} failed in {time.time() - start_time:.1f}s"
+        )
+        return stats
+
+    @staticmethod
+    def _record(conn: sqlite3.Connection, futures: Iterable, stats: Dict[str, int]) -> int:
+        """Write the results of finished downloads to the index; returns their number."""
+        count = 0
+        for future in futures:
+            url, stored, error = future.result()
+            count += 1
+            if stored is None:
+                stats["failed"] += 1
+                logger.warning(f"[WARNING] Could not download {url}: {error}")
+                conn.execute('''
+                    INSERT INTO photo_urls (url, attempts, error) VALUES (?, 1, ?)
+                    ON CONFLICT(url) DO UPDATE SET attempts = attempts + 1, error = excluded.error,
+                        fetched_at = CURRENT_TIMESTAMP
+                ''', (url, error))
+                continue
+            sha256, path, size, content_type, perceptual = stored
+            stats["downloaded"] += 1
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO photo_files (sha256, path, size, content_type, dhash) VALUES (?, ?, ?, ?, ?)
+            ''', (sha256, path, size, content_type, perceptual))
+            stats["stored" if cursor.rowcount else "deduplicated"] += 1
+            conn.execute('''
+                INSERT INTO photo_urls (url, sha256, attempts, error) VALUES (?, ?, 1, NULL)
+                ON CONFLICT(url) DO UPDATE SET sha256 = excluded.sha256, attempts = attempts + 1, error = NULL,
+                    fetched_at = CURRENT_TIMESTAMP
+            ''', (url, sha256))
+        return count
+
+    def get(self, url: str) -> Optional[str]:
+        """Path of the stored file of a photo URL, or None if it is not stored."""
+        with get_connection(self.index_path) as conn:
+            row = conn.execute('''
+                SELECT f.path FROM photo_urls u JOIN photo_files f ON f.sha256 = u.sha256 WHERE u.url = ?
+            ''', (url,)).fetchone()
+        return row[0] if row else None
+
+    def similar_photos(self, reference: str, max_distance: int = DEFAULT_MAX_DISTANCE) -> pd.DataFrame:
+        """
+        Stored photos whose dHash differs from `reference` by at most `max_distance` bits.
+
+        Args:
+            reference: dHash (hexadecimal)
+            max_distance: Maximum number of differing bits
+
+        Returns:
+            DataFrame with sha256, path, dhash and distance, closest first
+        """
+        with get_connection(self.index_path) as conn:
+            df = pd.read_sql_query("SELECT sha256, path, dhash FROM photo_files WHERE dhash IS NOT NULL", conn)
+        if df.empty:
+            return df.assign(distance=pd.Series(dtype=int))
+        df["distance"] = hamming_distances(reference, df["dhash"])
+        return df[df["distance"] <= max_distance].sort_values("distance").reset_index(drop=True)
+
+    def similar_ads(self, ad_url: str, max_distance: int = DEFAULT_MAX_DISTANCE) -> pd.DataFrame:
+        """
+        Other ads whose photos look like the photos of an ad, e.g. re-posted listings.
+
+        Args:
+            ad_url: URL of the ad
+            max_distance: Maximum number of differing dHash bits
+
+        Returns:
+            DataFrame with ad_url, photo_url, sha256 and distance, closest first
+        """
+        with get_connection(self.index_path) as conn:
+            references = [row[0] for row in conn.execute('''
+                SELECT DISTINCT f.dhash FROM ad_photos a
+                JOIN photo_urls u ON u.url = a.photo_url
+                JOIN photo_files f ON f.sha256 = u.sha256
+                WHERE a.ad_url = ? AND f.dhash IS NOT NULL
+            ''', (ad_url,))]
+            links = pd.read_sql_query('''
+                SELECT a.ad_url, a.photo_url, u.sha256, f.dhash FROM ad_photos a
+                JOIN photo_urls u ON u.url = a.photo_url
+                JOIN photo_files f ON f.sha256 = u.sha256
+                WHERE a.ad_url <> ? AND f.dhash IS NOT NULL
+            ''', conn, params=(ad_url,))
+        columns = ["ad_url", "photo_url", "sha256", "distance"]
+        if not references or links.empty:
+            return pd.DataFrame(columns=columns)
+        links["distance"] = np.min([hamming_distances(reference, links["dhash"]) for reference in references], axis=0)
+        links = links[links["distance"] <= max_distance].sort_values("distance")
+        return links.drop_duplicates("ad_url")[columns].reset_index(drop=True)
+
+
+def read_ad_photo_urls(
+    db_path: str,
+    sizes: Iterable[str] = ("medium",),
+    city: Optional[str] = None,
+    limit: Optional[int] = None
+) -> List[Tuple[str, str, str]]:
+    """
+    Photo URLs of the ads of a database.
+
+    Args:
+        db_path: Path to the ads database
+        sizes: Photo sizes to read (small, medium, large)
+        city: Only ads of this city (optional)
+        limit: Maximum number of ads, most recently updated first (optional)
+
+    Returns:
+        List of (ad_url, size, photo_url)
+    """
+    sizes = [size for size in sizes if size in PHOTO_SIZES]
+    if not sizes:
+        raise ValueError(f"sizes must be among {PHOTO_SIZES}")
+    columns = ", ".join(f"photo_url_{size}" for size in sizes)
+    query = f"SELECT url, {columns} FROM real_estate_ads WHERE url IS NOT NULL"
+    params: List[Any] = []
+    if city:
+        query += " AND LOWER(city) = LOWER(?)"
+        params.append(city)
+    query += " ORDER BY updated_at DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(int(limit))
+    with get_connection(db_path) as conn:
+        rows = conn.execute(query, params).fetchall()
+    return [(row[0], size, row[i + 1]) for row in rows for i, size in enumerate(sizes) if row[i + 1]]
+
+
+def fetch_ad_photos(
+    db_path: str,
+    photos_dir: str,
+    sizes: Iterable[str] = ("medium",),
+    city: Optional[str] = None,
+    limit: Optional[int] = None,
+    index_path: Optional[str] = None,
+    **options
+) -> Dict[str, int]:
+    """
+    Download the photos of the ads of a database into a photo store.
+
+    Args:
+        db_path: Path to the ads database
+        photos_dir: Root directory of the photo store
+        sizes: Photo sizes to download
+        city: Only ads of this city (optional)
+        limit: Maximum number of ads (optional)
+        index_path: Path to the photo index (default: <photos_dir>/photos.db)
+        **options: Parameters of PhotoStore.fetch (workers, rate, max_attempts, ...)
+
+    Returns:
+        Counters of PhotoStore.fetch
+    """
+    store = PhotoStore(photos_dir, index_path)
+    links = read_ad_photo_urls(db_path, sizes, city, limit)
+    store.link_ads(links)
+    return store.fetch([photo_url for _, _, photo_url in links], **options)
+
+
+def main():
+    """Download listing photos or find similar ones from the command line."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Download listing photos into a content-addressed store')
+    parser.add_argument('--photos-dir', type=str, required=True, help='Root directory of the photo store')
+    parser.add_argument('--index', type=str, help='Path to the photo index (default: <photos-dir>/photos.db)')
+    parser.add_argument('--db', type=str, help='Ads database whose photos are downloaded')
+    parser.add_argument('--size', nargs='+', choices=PHOTO_SIZES, default=['medium'], help='Photo sizes (default: medium)')
+    parser.add_argument('--city', type=str, help='Only the ads of this city')
+    parser.add_argument('--limit', type=int, help='Maximum number of ads, most recent first')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'Concurrent downloads (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help=f'Maximum requests per second (default: {DEFAULT_RATE})')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help=f'Attempts before a failing photo is given up (default: {DEFAULT_MAX_ATTEMPTS})')
+    parser.add_argument('--similar', type=str, metavar='AD_URL', help='List the ads whose photos look like those of this ad')
+    parser.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                        help=f'Maximum differing dHash bits of similar photos (default: {DEFAULT_MAX_DISTANCE})')
+    args = parser.parse_args()
+
+    if args.similar:
+        similar = PhotoStore(args.photos_dir, args.index).similar_ads(args.similar, args.max_distance)
+        print(similar.to_string(index=False) if not similar.empty else "No similar ads found")
+        return
+    if not args.db:
+        parser.error("--db is required to download photos")
+    if Image is None:
+        logger.warning("[WARNING] Pillow is not installed, photos are stored without perceptual hash")
+
+    fetch_ad_photos(
+        args.db,
+        args.photos_dir,
+        sizes=args.size,
+        city=args.city,
+        limit=args.limit,
+        index_path=args.index,
+        workers=args.workers,
+        rate=args.rate,
+        max_attempts=args.max_attempts
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
 # --- populate_all_zones.py ---
 
-import json
-import requests
 import logging
 import argparse
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from populate_zones import load_common_cities, save_common_cities, query_zone_data, process_zone_data
+from rate_limit import RateLimiter, make_session
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,7 +17,7 @@ logger = logging.getLogger(__name__)
 # Default paths
 COMMON_CITIES_FILE = Path(__file__).resolve().parent / "common_cities.json"
 
-def populate_zones_for_city(city_key, city_info, max_level=3, delay_range=(1.0, 2.0)):
+def populate_zones_for_city(city_key, city_info, max_level=3, delay_range=(1.0, 2.0), session=None, rate_limiter=None):
     """
     Populate zones for a specific city
     
@@ -26,6 +26,8 @@ def populate_zones_for_city(city_key, city_info, max_level=3, delay_range=(1.0,
         city_info: Dictionary containing city information
         max_level: Maximum level of detail (3 = zones/neighborhoods)
         delay_range: Tuple of min/max delay between requests
+        session: Pooled requests session (optional)
+        rate_limiter: Shared RateLimiter (optional)
         
     Returns:
         Updated city_info dictionary with zones
@@ -38,7 +40,7 @@ def populate_zones_for_city(city_key, city_info, max_level=3, delay_range=(1.0,
     logger.info(f"Populating zones for city: {city_name}")
     
     # Query API for zone data
-    zone_data = query_zone_data(city_name, max_level, delay_range)
+    zone_data = query_zone_data(city_name, max_level, delay_range, session=session, rate_limiter=rate_limiter)
     
     if not zone_data:
         logger.warning(f"No zone data found for city: {city_name}")
@@ -52,53 +54,148 @@ def populate_zones_for_city(city_key, city_info, max_level=3, delay_range=(1.0,
     
     return updated_dict.get(city_key, city_info)
 
-def populate_all_zones(max_level=3, delay_range=(1.0, 2.0)):
+def populate_zones_concurrently(common_cities, city_keys, max_level=3, delay_range=(1.0, 2.0), workers=8, rate=None, file_path=None):
+    """
+    Populate zones for several cities in parallel and save the file once
+    
+    All workers share one pooled session and one rate limiter, so the request
+    rate toward the API is the same as with a single worker; only the waiting
+    on the network overlaps. Zone data is merged in memory as each city
+    completes and common_cities.json is written atomically at the end, also
+    when the run is interrupted.
+    
+    Args:
+        common_cities: common_cities dictionary to update
+        city_keys: Keys of the cities to populate
+        max_level: Maximum level of detail (3 = zones/neighborhoods)
+        delay_range: Tuple of min/max delay between requests, used for the rate when `rate` is not given
+        workers: Number of concurrent requests
+        rate: Maximum requests per second across all workers (optional)
+        file_path: Path to common_cities.json (optional)
+    
+    Returns:
+        Updated common_cities dictionary
+    """
+    rate_limiter = RateLimiter(rate, burst=workers) if rate else RateLimiter.from_delay_range(delay_range)
+    session = make_session(pool_size=workers)
+    start_time = time.time()
+    completed = 0
+    
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {}
+        for city_key in city_keys:
+            city_name = common_cities[city_key].get("name")
+            if not city_name:
+                logger.warning(f"Missing name for city '{city_key}', skipping")
+                continue
+            futures[executor.submit(query_zone_data, city_name, max_level, delay_range, session, rate_limiter)] = city_key
+        
+        for future in as_completed(futures):
+            city_key = futures[future]
+            city_info = common_cities[city_key]
+            zone_data = future.result()
+            completed += 1
+            if zone_data:
+                # Merge on a single-city view, as populate_zones_for_city does
+                common_cities[city_key] = process_zone_data(zone_data, {city_key: city_info}).get(city_key, city_info)
+            else:
+                logger.warning(f"No zone data found for city: {city_info.get('name')}")
+            logger.info(f"[INFO] {completed}/{len(futures)} cities done")
+    except KeyboardInterrupt:
+        logger.warning(f"[WARNING] Interrupted, saving the {completed} cities completed so far")
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        session.close()
+        if save_common_cities(common_cities, file_path):
+            logger.info(f"[INFO] Saved zone data for {completed} cities in {time.time() - start_time:.1f}s")
+        else:
+            logger.error("Failed to save updated zone data")
+    
+    return common_cities
+
+def find_city_key(common_cities, city_name):
+    """
+    Find the key of a city by key or by name
+    
+    Args:
+        common_cities: common_cities dictionary
+        city_name: Key or name of the city
+    
+    Returns:
+        The city key, or None if the city is not in the dictionary
+    """
+    city_name_lower = city_name.lower()
+    
+    # First try exact match on key
+    if city_name_lower in common_cities:
+        return city_name_lower
+    
+    # Try matching by name
+    for key, info in common_cities.items():
+        if info.get("name", "").lower() == city_name_lower:
+            return key
+    return None
+
+def populate_all_zones(max_level=3, delay_range=(1.0, 2.0), workers=1, rate=None, file_path=None):
     """
     Populate zones for all cities in common_cities.json
     
     Args:
         max_level: Maximum level of detail (3 = zones/neighborhoods)
         delay_range: Tuple of min/max delay between requests
+        workers: Number of concurrent requests; above 1 the file is saved once at the end
+        rate: Maximum requests per second across all workers (optional)
+        file_path: Path to common_cities.json (optional)
     
     Returns:
         Updated common_cities dictionary
     """
+    file_path = file_path or COMMON_CITIES_FILE
+    
     # Load current common cities data
-    common_cities = load_common_cities()
+    common_cities = load_common_cities(file_path)
     
     # Backup the original data
-    backup_file = f"{COMMON_CITIES_FILE}.backup"
+    backup_file = f"{file_path}.backup"
     save_common_cities(common_cities, backup_file)
     logger.info(f"Created backup at {backup_file}")
     
-    # Process each city
+    # Skip cities that already have macrozones
+    city_keys = []
     for city_key, city_info in common_cities.items():
-        # Skip if already has macrozones
         if "macrozones" in city_info and city_info["macrozones"]:
             logger.info(f"City '{city_info.get('name', city_key)}' already has macrozones, skipping")
             continue
-        
+        city_keys.append(city_key)
+    
+    if workers > 1:
+        return populate_zones_concurrently(common_cities, city_keys, max_level, delay_range, workers, rate, file_path)
+    
+    # Process each city
+    for city_key in city_keys:
         # Populate zones for this city
-        updated_city_info = populate_zones_for_city(city_key, city_info, max_level, delay_range)
+        updated_city_info = populate_zones_for_city(city_key, common_cities[city_key], max_level, delay_range)
         
         # Update the dictionary
         common_cities[city_key] = updated_city_info
         
         # Save after each city to avoid losing data if something goes wrong
-        save_common_cities(common_cities)
+        save_common_cities(common_cities, file_path)
         
         # Add a delay between cities to avoid rate limiting
         time.sleep(random.uniform(delay_range[0] * 2, delay_range[1] * 2))
     
     # Final save
-    if save_common_cities(common_cities):
+    if save_common_cities(common_cities, file_path):
         logger.info("Successfully updated common_cities.json with zone data for all cities")
     else:
         logger.error("Failed to save updated zone data")
     
     return common_cities
 
-def populate_zones_for_specific_cities(city_names, max_level=3, delay_range=(1.0, 2.0)):
+def populate_zones_for_specific_cities(city_names, max_level=3, delay_range=(1.0, 2.0), workers=1, rate=None, file_path=None):
     """
     Populate zones for specific cities by name
     
@@ -106,56 +203,51 @@ def populate_zones_for_specific_cities(city_names, max_level=3, delay_range=(1.0
         city_names: List of city names to populate zones for
         max_level: Maximum level of detail (3 = zones/neighborhoods)
         delay_range: Tuple of min/max delay between requests
+        workers: Number of concurrent requests; above 1 the file is saved once at the end
+        rate: Maximum requests per second across all workers (optional)
+        file_path: Path to common_cities.json (optional)
     
     Returns:
         Updated common_cities dictionary
     """
+    file_path = file_path or COMMON_CITIES_FILE
+    
     # Load current common cities data
-    common_cities = load_common_cities()
+    common_cities = load_common_cities(file_path)
     
     # Backup the original data
-    backup_file = f"{COMMON_CITIES_FILE}.backup"
+    backup_file = f"{file_path}.backup"
     save_common_cities(common_cities, backup_file)
     logger.info(f"Created backup at {backup_file}")
     
     # Find cities by name
+    city_keys = []
     for city_name in city_names:
-        city_name_lower = city_name.lower()
-        found = False
+        city_key = find_city_key(common_cities, city_name)
+        if city_key is None:
+            logger.warning(f"City not found: {city_name}")
+        elif city_key not in city_keys:
+            logger.info(f"Found city: {common_cities[city_key].get('name')} (key: {city_key})")
+            city_keys.append(city_key)
+    
+    if workers > 1:
+        return populate_zones_concurrently(common_cities, city_keys, max_level, delay_range, workers, rate, file_path)
+    
+    for city_key in city_keys:
+        # Populate zones for this city
+        updated_city_info = populate_zones_for_city(city_key, common_cities[city_key], max_level, delay_range)
         
-        # First try exact match on key
-        if city_name_lower in common_cities:
-            city_key = city_name_lower
-            city_info = common_cities[city_key]
-            found = True
-        else:
-            # Try matching by name
-            for key, info in common_cities.items():
-                if info.get("name", "").lower() == city_name_lower:
-                    city_key = key
-                    city_info = info
-                    found = True
-                    break
+        # Update the dictionary
+        common_cities[city_key] = updated_city_info
         
-        if found:
-            logger.info(f"Found city: {city_info.get('name')} (key: {city_key})")
-            
-            # Populate zones for this city
-            updated_city_info = populate_zones_for_city(city_key, city_info, max_level, delay_range)
-            
-            # Update the dictionary
-            common_cities[city_key] = updated_city_info
-            
-            # Save after each city to avoid losing data if something goes wrong
-            save_common_cities(common_cities)
-            
-            # Add a delay between cities to avoid rate limiting
-            time.sleep(random.uniform(delay_range[0] * 2, delay_range[1] * 2))
-        else:
-            logger.warning(f"City not found: {city_name}")
+        # Save after each city to avoid losing data if something goes wrong
+        save_common_cities(common_cities, file_path)
+        
+        # Add a delay between cities to avoid rate limiting
+        time.sleep(random.uniform(delay_range[0] * 2, delay_range[1] * 2))
     
     # Final save
-    if save_common_cities(common_cities):
+    if save_common_cities(common_cities, file_path):
         logger.info("Successfully updated common_cities.json with zone data for specified cities")
     else:
         logger.error("Failed to save updated zone data")
@@ -170,6 +262,8 @@ def parse_arguments():
     parser.add_argument('--max-level', type=int, default=3, help='Maximum level of detail (default: 3 = zones/neighborhoods)')
     parser.add_argument('--min-delay', type=float, default=1.0, help='Minimum delay between requests in seconds (default: 1.0)')
     parser.add_argument('--max-delay', type=float, default=2.0, help='Maximum delay between requests in seconds (default: 2.0)')
+    parser.add_argument('--workers', type=int, default=1, help='Concurrent requests; above 1 the file is written once at the end (default: 1)')
+    parser.add_argument('--rate', type=float, help='Maximum requests per second across all workers (default: from the average delay)')
     parser.add_argument('--file', type=str, default=str(COMMON_CITIES_FILE), help=f'Path to common_cities.json file (default: {COMMON_CITIES_FILE})')
     
     return parser.parse_args()
@@ -187,14 +281,20 @@ def main():
         # Populate zones for all cities
         populate_all_zones(
             max_level=args.max_level,
-            delay_range=(args.min_delay, args.max_delay)
+            delay_range=(args.min_delay, args.max_delay),
+            workers=args.workers,
+            rate=args.rate,
+            file_path=COMMON_CITIES_FILE
         )
     elif args.cities:
         # Populate zones for specific cities
         populate_zones_for_specific_cities(
             city_names=args.cities,
             max_level=args.max_level,
-            delay_range=(args.min_delay, args.max_delay)
+            delay_range=(args.min_delay, args.max_delay),
+            workers=args.workers,
+            rate=args.rate,
+            file_path=COMMON_CITIES_FILE
         )
     else:
         logger.error("Please specify either --all or --cities")
@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 # --- populate_zones.py ---
 
-import json
+import os
+import json_codec
 import requests
 import logging
 import argparse
 import time
 import random
 from pathlib import Path
+from rate_limit import retry_after_seconds
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,36 +18,42 @@ logger = logging.getLogger(__name__)
 # Default paths
 COMMON_CITIES_FILE = Path(__file__).resolve().parent / "common_cities.json"
 
-def load_common_cities(file_path=COMMON_CITIES_FILE):
+def load_common_cities(file_path=None):
     """Load the current common cities data from JSON file"""
+    file_path = file_path or COMMON_CITIES_FILE
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = json_codec.load_file(file_path)
         logger.info(f"Loaded {len(data)} cities from {file_path}")
         return data
     except Exception as e:
         logger.error(f"Error loading common cities file: {e}")
         return {}
 
-def save_common_cities(data, file_path=COMMON_CITIES_FILE):
-    """Save updated common cities data to JSON file"""
+def save_common_cities(data, file_path=None):
+    """Save updated common cities data to JSON file (atomically, through a temporary file)"""
+    file_path = file_path or COMMON_CITIES_FILE
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        # Readers never see a half-written file, and a failed write keeps the old one
+        tmp_path = f"{file_path}.tmp"
+        json_codec.dump_file(data, tmp_path, indent=4)
+        os.replace(tmp_path, file_path)
         logger.info(f"Saved {len(data)} cities to {file_path}")
         return True
     except Exception as e:
         logger.error(f"Error saving common cities file: {e}")
         return False
 
-def query_zone_data(query, max_level=3, delay_range=(1.0, 2.0)):
+def query_zone_data(query, max_level=3, delay_range=(1.0, 2.0), session=None, rate_limiter=None, max_attempts=3):
     """
     Query the Immobiliare.it autocomplete API for zone data
     
     Args:
         query: Search query for zones/neighborhoods
         max_level: Maximum level of detail (3 = zones/neighborhoods)
-        delay_range: Tuple of min/max delay between requests
+        delay_range: Tuple of min/max delay after the request, used when there is no rate limiter
+        session: Pooled requests session to reuse (optional)
+        rate_limiter: Shared rate_limit.RateLimiter spacing the requests of all threads (optional)
+        max_attempts: Attempts when the API answers 429, with a rate limiter
         
     Returns:
         List of zone data entries if successful, empty list otherwise
@@ -67,28 +75,38 @@ def query_zone_data(query, max_level=3, delay_range=(1.0, 2.0)):
         'sec-ch-ua-platform': '"Windows"'
     }
     
-    try:
-        logger.info(f"Querying API for zones matching '{query}'")
-        response = requests.get(url, headers=headers)
-        
-        # Add random delay to avoid rate limiting
-        time.sleep(random.uniform(delay_range[0], delay_range[1]))
-        
-        if response.status_code == 200:
-            data = response.json()
-            if isinstance(data, list) and len(data) > 0:
-                logger.info(f"Found {len(data)} results for query '{query}'")
-                return data
+    http = session or requests
+    for attempt in range(max_attempts):
+        try:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            logger.info(f"Querying API for zones matching '{query}'")
+            response = http.get(url, headers=headers, timeout=30)
+            
+            if rate_limiter is None:
+                # Add random delay to avoid rate limiting
+                time.sleep(random.uniform(delay_range[0], delay_range[1]))
+            elif response.status_code == 429 and attempt < max_attempts - 1:
+                # Slow every worker down, then try again
+                rate_limiter.pause(retry_after_seconds(response.headers, 10))
+                continue
+            
+            if response.status_code == 200:
+                data = json_codec.loads(response.content)
+                if isinstance(data, list) and len(data) > 0:
+                    logger.info(f"Found {len(data)} results for query '{query}'")
+                    return data
+                else:
+                    logger.warning(f"No results found for query '{query}'")
+                    return []
             else:
-                logger.warning(f"No results found for query '{query}'")
+                logger.error(f"API request failed with status code {response.status_code}: {response.text}")
                 return []
-        else:
-            logger.error(f"API request failed with status code {response.status_code}: {response.text}")
+        
+        except Exception as e:
+            logger.error(f"Error querying API: {e}")
             return []
-    
-    except Exception as e:
-        logger.error(f"Error querying API: {e}")
-        return []
+    return []
 
 def process_zone_data(zone_data, common_cities):
     """
@@ -161,7 +179,7 @@ def process_zone_data(zone_data, common_cities):
     
     return common_cities
 
-def populate_zones_for_queries(queries, max_level=3, delay_range=(1.0, 2.0)):
+def populate_zones_for_queries(queries, max_level=3, delay_range=(1.0, 2.0), file_path=None):
     """
     Populate zone data for a list of queries
     
@@ -169,15 +187,18 @@ def populate_zones_for_queries(queries, max_level=3, delay_range=(1.0, 2.0)):
         queries: List of search queries for zones/neighborhoods
         max_level: Maximum level of detail (3 = zones/neighborhoods)
         delay_range: Tuple of min/max delay between requests
+        file_path: Path to common_cities.json (optional)
         
     Returns:
         Updated common_cities dictionary
     """
+    file_path = file_path or COMMON_CITIES_FILE
+    
     # Load current common cities data
-    common_cities = load_common_cities()
+    common_cities = load_common_cities(file_path)
     
     # Backup the original data
-    backup_file = f"{COMMON_CITIES_FILE}.backup"
+    backup_file = f"{file_path}.backup"
     save_common_cities(common_cities, backup_file)
     logger.info(f"Created backup at {backup_file}")
     
@@ -196,7 +217,7 @@ def populate_zones_for_queries(queries, max_level=3, delay_range=(1.0, 2.0)):
             common_cities = process_zone_data(zone_data, common_cities)
     
     # Save updated data
-    if save_common_cities(common_cities):
+    if save_common_cities(common_cities, file_path):
         logger.info("Successfully updated common_cities.json with zone data")
     else:
         logger.error("Failed to save updated zone data")
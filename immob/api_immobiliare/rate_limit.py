@@ -0,0 +1,150 @@
+"""
+Thread-safe rate limiting for requests to the Immobiliare.it APIs.
+
+A RateLimiter is a token bucket shared by all the threads of a process: each
+request takes one token, tokens come back at `rate` per second, and up to
+`burst` requests may go out back to back. Threads that find the bucket empty
+reserve the next free slot and sleep until then, so waiting threads are served
+in order and the overall rate holds whatever the number of workers.
+
+When the server answers 429, pause() pushes every pending and future request
+back, so that all workers slow down together.
+
+This module provides functions to:
+1. Limit the request rate of several threads with one token bucket
+2. Read the Retry-After header of a 429 response
+3. Build a pooled requests session retrying transient server errors
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+MAX_RETRY_AFTER = 300.0  # A server asking for longer only gets this pause
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the rate of requests across threads.
+
+    Args:
+        rate: Requests per second
+        burst: Requests that may be sent back to back after an idle period
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_delay_range(cls, delay_range: Sequence[float]) -> "RateLimiter":
+        """Rate limiter matching the average of a (min, max) delay between requests."""
+        average_delay = (delay_range[0] + delay_range[1]) / 2
+        return cls(1.0 / average_delay if average_delay > 0 else 1000.0)
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """
+        Wait until a request may be sent.
+
+        Returns:
+            Seconds waited
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """
+        Delay all requests by `seconds`, e.g. after a 429 response.
+
+        Args:
+            seconds: Pause length
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+        logger.warning(f"[WARNING] Rate limited by the server, pausing requests for {seconds:.1f}s")
+
+
+def retry_after_seconds(headers: Mapping[str, str], default: float) -> float:
+    """
+    Seconds to wait according to the Retry-After header of a response.
+
+    The header is either a number of seconds or an HTTP date
+    ("Wed, 21 Oct 2026 07:28:00 GMT"); a missing or malformed header gives `default`.
+
+    Args:
+        headers: Response headers
+        default: Pause when the header is missing or malformed
+
+    Returns:
+        Seconds to wait, between 0 and MAX_RETRY_AFTER
+    """
+    value = headers.get("Retry-After")
+    if value is None:
+        return default
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return default
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    if seconds != seconds:  # NaN
+        return default
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def make_session(pool_size: int = 10, retries: int = 3, headers: Optional[dict] = None) -> requests.Session:
+    """
+    Create a requests session with a connection pool shared by `pool_size`
+    threads, retrying connection errors and 5xx answers with backoff.
+
+    Args:
+        pool_size: Maximum number of pooled connections per host
+        retries: Retries of a failed request
+        headers: Default headers of the session (optional)
+
+    Returns:
+        The configured session
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET"])
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
@@ -0,0 +1,210 @@
+"""
+Compressed storage of the original API payloads in the `raw_data` column.
+
+The `realEstate` object returned by the search-list API is serialised once per
+page and compressed (zstd when the `zstandard` package is installed, zlib
+otherwise). Fields are only decompressed when they are actually requested.
+
+Each blob starts with a one-byte codec marker:
+    b'z' -> zlib
+    b's' -> zstd
+Rows written before this format (plain JSON text) are still readable.
+
+This module provides functions to:
+1. Compress a batch of payloads for the `raw_data` column
+2. Decompress a payload and extract a single field by path
+3. Read single fields lazily from the database (also from the command line),
+   or from SQL via `raw_field()`
+"""
+
+import json
+import zlib
+import sqlite3
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+ZLIB_MARKER = b'z'
+ZSTD_MARKER = b's'
+DEFAULT_CODEC = 'zstd' if zstandard is not None else 'zlib'
+
+
+def compress_payloads(
+    payloads: Sequence[Optional[dict]],
+    codec: str = DEFAULT_CODEC,
+    level: int = 6
+) -> List[Optional[bytes]]:
+    """
+    Serialise and compress a batch of API payloads.
+
+    A single encoder and compressor are reused for the whole batch.
+
+    Args:
+        payloads: List of `realEstate` dictionaries (None entries are kept as None)
+        codec: 'zstd' or 'zlib'
+        level: Compression level
+
+    Returns:
+        List of compressed blobs aligned with `payloads`
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    encoded = [
+        encoder.encode(payload).encode('utf-8') if payload is not None else None
+        for payload in payloads
+    ]
+
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd codec requested but the zstandard package is not installed")
+        compressor = zstandard.ZstdCompressor(level=level)
+        return [ZSTD_MARKER + compressor.compress(data) if data is not None else None for data in encoded]
+
+    if codec == 'zlib':
+        return [ZLIB_MARKER + zlib.compress(data, level) if data is not None else None for data in encoded]
+
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+@lru_cache(maxsize=1)
+def _zstd_decompressor():
+    return zstandard.ZstdDecompressor()
+
+
+def decompress_payload(blob: Union[bytes, str, None]) -> Optional[Dict[str, Any]]:
+    """
+    Decompress a `raw_data` value back into the original payload.
+
+    Args:
+        blob: Value of the `raw_data` column
+
+    Returns:
+        The decoded payload, or None for empty values
+    """
+    if blob is None:
+        return None
+    if isinstance(blob, str):  # legacy rows stored as plain JSON text
+        return json.loads(blob)
+
+    marker, data = blob[:1], blob[1:]
+    if marker == ZLIB_MARKER:
+        return json.loads(zlib.decompress(data))
+    if marker == ZSTD_MARKER:
+        if zstandard is None:
+            raise ValueError("zstandard package is required to read zstd-compressed payloads")
+        return json.loads(_zstd_decompressor().decompress(data))
+    return json.loads(blob)
+
+
+def get_payload_field(payload: Any, path: str) -> Any:
+    """
+    Extract a nested field from a payload using a dotted path.
+
+    Args:
+        payload: Decoded payload
+        path: Dotted path, list indices allowed (e.g. "properties.0.floor.value")
+
+    Returns:
+        The field value, or None if any step is missing
+    """
+    value = payload
+    for step in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(step)
+        elif isinstance(value, list) and step.lstrip('-').isdigit():
+            index = int(step)
+            value = value[index] if -len(value) <= index < len(value) else None
+        else:
+            return None
+        if value is None:
+            return None
+    return value
+
+
+def raw_field(blob: Union[bytes, str, None], path: str) -> Any:
+    """
+    Decompress a `raw_data` value and return only the requested field.
+
+    Args:
+        blob: Value of the `raw_data` column
+        path: Dotted path of the field
+
+    Returns:
+        The field value, or None if missing
+    """
+    return get_payload_field(decompress_payload(blob), path)
+
+
+def register_raw_functions(conn: sqlite3.Connection) -> None:
+    """
+    Register the `raw_field(raw_data, path)` SQL function on a connection.
+
+    Scalar results are returned as-is, lists and objects as JSON text, e.g.
+        SELECT url, raw_field(raw_data, 'properties.0.floor.value') FROM real_estate_ads
+
+    Args:
+        conn: SQLite connection
+    """
+    def sql_raw_field(blob, path):
+        value = raw_field(blob, path)
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    conn.create_function("raw_field", 2, sql_raw_field, deterministic=True)
+
+
+def read_raw_fields(
+    db_path: str,
+    url: str,
+    paths: Sequence[str]
+) -> Dict[str, Any]:
+    """
+    Read selected raw payload fields of a single ad, decompressing only its blob.
+
+    Args:
+        db_path: Path to the SQLite database file
+        url: URL of the ad
+        paths: Dotted paths of the fields to extract
+
+    Returns:
+        Dictionary mapping each path to its value (empty if the ad has no payload)
+    """
+    try:
+        with get_connection(db_path) as conn:
+            row = conn.execute("SELECT raw_data FROM real_estate_ads WHERE url = ?", (url,)).fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Error reading raw payload: {e}")
+        return {}
+
+    if row is None or row['raw_data'] is None:
+        return {}
+    payload = decompress_payload(row['raw_data'])
+    return {path: get_payload_field(payload, path) for path in paths}
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if len(sys.argv) < 4:
+        print("Usage: python raw_payload.py <db_path> <url> <field_path> [<field_path> ...]")
+        print("Example: python raw_payload.py ads.db https://www.immobiliare.it/annunci/123/ properties.0.floor.value")
+        sys.exit(1)
+
+    fields = read_raw_fields(sys.argv[1], sys.argv[2], sys.argv[3:])
+    if not fields:
+        print(f"No raw payload stored for {sys.argv[2]}")
+        sys.exit(1)
+    for path, value in fields.items():
+        print(f"{path}: {json.dumps(value, ensure_ascii=False)}")
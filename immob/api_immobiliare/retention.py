@@ -0,0 +1,441 @@
+"""
+Retention policy, archival and compaction of the ads database.
+
+Ads leave the hot real_estate_ads table when they are
+- delisted for more than `delisted_days` days (see crawl_sessions.py), or
+- neither seen by a crawl (listing_status.last_seen_at, when delistings are
+  tracked) nor updated for more than `expire_days` days. With
+  --skip-unchanged a stable ad is never rewritten, so its updated_at alone
+  would expire ads that every crawl still sees.
+
+The candidates are selected once into a TEMP table with set-based queries,
+then moved in chunks: each chunk is copied to the archive and deleted from
+the hot table in one transaction, so an interrupted run never loses or
+duplicates ads. The archive is either a SQLite database (table archived_ads,
+same columns plus archive_reason and archived_at) or a directory of
+zstd-compressed Parquet files, one per chunk (requires pyarrow).
+
+After archiving, the database is compacted: ANALYZE, incremental VACUUM (the
+first run switches the file to auto_vacuum=INCREMENTAL with one full VACUUM),
+WAL checkpoint and PRAGMA optimize. Each run is logged in retention_runs with
+the bytes reclaimed, and --min-interval-hours makes the command safe to call
+from cron as often as wanted:
+
+    python retention.py --db data/ads.db --delisted-days 30 --expire-days 180
+    python retention.py --db data/ads.db --archive-format parquet --min-interval-hours 24
+    python retention.py --shard-dir data/shards --every 24
+
+This module provides functions to:
+1. Select the ads to retire according to the retention policy
+2. Move them to a SQLite or Parquet archive in chunked transactions
+3. Compact the database and report the bytes reclaimed
+4. Record the runs and schedule them
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from sqlite_helpers import get_connection
+from sqlite_shards import list_shards
+from sinks import ParquetSink
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DELISTED_DAYS = 30
+DEFAULT_CHUNK_SIZE = 5000
+ARCHIVE_TABLE = "archived_ads"
+ARCHIVE_FORMATS = ("sqlite", "parquet", "none")
+VACUUM_MODES = ("incremental", "full", "none")
+
+
+def init_retention_tables(db_path: str) -> bool:
+    """
+    Initialize the table logging the retention runs.
+
+    Args:
+        db_path: Path to the ads database
+
+    Returns:
+        True if initialization was successful, False otherwise
+    """
+    try:
+        with get_connection(db_path) as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS retention_runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TIMESTAMP NOT NULL,
+                finished_at TIMESTAMP,
+                archived INTEGER,
+                delisted INTEGER,
+                expired INTEGER,
+                archive TEXT,
+                bytes_before INTEGER,
+                bytes_after INTEGER,
+                bytes_reclaimed INTEGER,
+                error TEXT
+            )
+            ''')
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error initializing retention tables: {e}")
+        return False
+
+
+def _timestamp(days_ago: float = 0) -> str:
+    """UTC timestamp in the format of CURRENT_TIMESTAMP."""
+    return (datetime.now(timezone.utc) - timedelta(days=days_ago)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def database_size(db_path: str) -> int:
+    """Size in bytes of a database file and its WAL."""
+    return sum(os.path.getsize(path) for path in (db_path, f"{db_path}-wal") if os.path.exists(path))
+
+
+def default_archive_path(db_path: str, archive_format: str) -> str:
+    """Archive next to the database: ads_archive.db or the ads_archive/ directory."""
+    path = Path(db_path)
+    suffix = ".db" if archive_format == "sqlite" else ""
+    return str(path.with_name(f"{path.stem}_archive{suffix}"))
+
+
+def select_candidates(conn: sqlite3.Connection, delisted_days: Optional[float], expire_days: Optional[float]) -> Dict[str, int]:
+    """
+    Fill the TEMP table retention_candidates with the ads to retire.
+
+    Args:
+        conn: Open connection to the ads database
+        delisted_days: Retire ads delisted for more than this many days (None to keep them)
+        expire_days: Retire ads neither seen by a crawl nor updated for more than this many days (None to keep them)
+
+    Returns:
+        Number of candidates per reason
+    """
+    conn.execute("DROP TABLE IF EXISTS temp.retention_candidates")
+    conn.execute("CREATE TEMP TABLE retention_candidates (db_id INTEGER PRIMARY KEY, reason TEXT NOT NULL)")
+    counts = {"delisted": 0, "expired": 0}
+    has_status = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listing_status'"
+    ).fetchone()
+    if delisted_days is not None and has_status:
+        counts["delisted"] = conn.execute('''
+            INSERT OR IGNORE INTO retention_candidates
+            SELECT a.db_id, 'delisted' FROM real_estate_ads a
+            JOIN listing_status s ON s.url = a.url
+            WHERE s.delisted_at IS NOT NULL AND s.delisted_at < ?
+        ''', (_timestamp(delisted_days),)).rowcount
+    if expire_days is not None and has_status:
+        # Ads without a status row (never tracked) fall back on updated_at
+        counts["expired"] = conn.execute('''
+            INSERT OR IGNORE INTO retention_candidates
+            SELECT a.db_id, 'expired' FROM real_estate_ads a
+            LEFT JOIN listing_status s ON s.url = a.url
+            WHERE MAX(COALESCE(s.last_seen_at, a.updated_at), a.updated_at) < ?
+        ''', (_timestamp(expire_days),)).rowcount
+    elif expire_days is not None:
+        counts["expired"] = conn.execute('''
+            INSERT OR IGNORE INTO retention_candidates
+            SELECT db_id, 'expired' FROM real_estate_ads WHERE updated_at < ?
+        ''', (_timestamp(expire_days),)).rowcount
+    conn.commit()
+    return counts
+
+
+def _candidate_chunks(conn: sqlite3.Connection, chunk_size: int):
+    """Yield (low, high] db_id ranges of at most chunk_size candidates."""
+    last = 0
+    while True:
+        rows = conn.execute(
+            "SELECT db_id FROM retention_candidates WHERE db_id > ? ORDER BY db_id LIMIT ?", (last, chunk_size)
+        ).fetchall()
+        if not rows:
+            return
+        yield last, rows[-1][0]
+        last = rows[-1][0]
+
+
+def _prepare_sqlite_archive(conn: sqlite3.Connection, archive_path: str) -> List[str]:
+    """Attach the archive database and align its table with the columns of real_estate_ads."""
+    os.makedirs(os.path.dirname(os.path.abspath(archive_path)), exist_ok=True)
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+    columns = [row[1] for row in conn.execute("PRAGMA main.table_info(real_estate_ads)")]
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS archive.{ARCHIVE_TABLE} AS
+        SELECT *, NULL AS archive_reason, NULL AS archived_at FROM main.real_estate_ads WHERE 0
+    ''')
+    archived = {row[1] for row in conn.execute(f"PRAGMA archive.table_info({ARCHIVE_TABLE})")}
+    for column in columns:
+        if column not in archived:
+            conn.execute(f"ALTER TABLE archive.{ARCHIVE_TABLE} ADD COLUMN {column}")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS archive.idx_{ARCHIVE_TABLE}_url ON {ARCHIVE_TABLE}(url)")
+    conn.commit()
+    return columns
+
+
+def archive_candidates(conn: sqlite3.Connection, archive_format: str, archive_path: Optional[str],
+                       chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Move the candidates to the archive, one transaction per chunk.
+
+    Args:
+        conn: Open connection to the ads database, with retention_candidates filled
+        archive_format: 'sqlite', 'parquet' or 'none' (delete without archiving)
+        archive_path: Archive database or directory of Parquet files
+        chunk_size: Ads per transaction
+
+    Returns:
+        Number of ads moved out of real_estate_ads
+    """
+    columns = _prepare_sqlite_archive(conn, archive_path) if archive_format == "sqlite" else None
+    stamp = _timestamp()
+    moved = 0
+    try:
+        for chunk, (low, high) in enumerate(_candidate_chunks(conn, chunk_size)):
+            candidates = "SELECT db_id FROM retention_candidates WHERE db_id > ? AND db_id <= ?"
+            if archive_format == "sqlite":
+                column_list = ", ".join(columns)
+                conn.execute(f'''
+                    INSERT INTO archive.{ARCHIVE_TABLE} ({column_list}, archive_reason, archived_at)
+                    SELECT {", ".join(f"a.{column}" for column in columns)}, c.reason, ?
+                    FROM main.real_estate_ads a JOIN retention_candidates c ON c.db_id = a.db_id
+                    WHERE c.db_id > ? AND c.db_id <= ?
+                ''', (stamp, low, high))
+            elif archive_format == "parquet":
+                df = pd.read_sql_query(f'''
+                    SELECT a.*, c.reason AS archive_reason FROM real_estate_ads a
+                    JOIN retention_candidates c ON c.db_id = a.db_id
+                    WHERE c.db_id > ? AND c.db_id <= ?
+                ''', conn, params=(low, high))
+                df["archived_at"] = stamp
+                file_stamp = stamp.replace("-", "").replace(":", "").replace(" ", "_")
+                sink = ParquetSink(os.path.join(archive_path, f"real_estate_ads_{file_stamp}_{chunk:04d}.parquet"))
+                sink.excluded_columns = ()  # The archive keeps the raw payload
+                with sink:
+                    sink.write(df)
+                if sink.last_error:
+                    raise OSError(f"Parquet archive failed: {sink.last_error}")
+            # The chunk is deleted in the same transaction as its copy to the archive
+            moved += conn.execute(
+                f"DELETE FROM main.real_estate_ads WHERE db_id IN ({candidates})", (low, high)
+            ).rowcount
+            conn.commit()
+            logger.info(f"[INFO] Archived chunk {chunk + 1}: {moved} ads moved so far")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if archive_format == "sqlite":
+            conn.execute("DETACH DATABASE archive")
+    return moved
+
+
+def compact_database(db_path: str, vacuum: str = "incremental") -> Dict[str, int]:
+    """
+    Refresh the statistics and give the free pages back to the file system.
+
+    Args:
+        db_path: Path to the ads database
+        vacuum: 'incremental' (switches the file to auto_vacuum=INCREMENTAL on first use), 'full' or 'none'
+
+    Returns:
+        Dictionary with bytes_before and bytes_after
+    """
+    bytes_before = database_size(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("ANALYZE")
+        if vacuum == "full":
+            conn.execute("VACUUM")
+        elif vacuum == "incremental":
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                logger.info("[INFO] Switching the database to incremental auto-vacuum (one full VACUUM)")
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            else:
+                conn.execute("PRAGMA incremental_vacuum").fetchall()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    return {"bytes_before": bytes_before, "bytes_after": database_size(db_path)}
+
+
+def last_run_at(db_path: str) -> Optional[datetime]:
+    """Time of the last successful retention run, or None."""
+    try:
+        with get_connection(db_path) as conn:
+            row = conn.execute(
+                "SELECT MAX(finished_at) FROM retention_runs WHERE error IS NULL"
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    if not row or not row[0]:
+        return None
+    return datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+def run_retention(
+    db_path: str,
+    delisted_days: Optional[float] = DEFAULT_DELISTED_DAYS,
+    expire_days: Optional[float] = None,
+    archive_format: str = "sqlite",
+    archive_path: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    vacuum: str = "incremental",
+    dry_run: bool = False,
+    min_interval_hours: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    Apply the retention policy to an ads database.
+
+    Args:
+        db_path: Path to the ads database
+        delisted_days: Retire ads delisted for more than this many days (None to keep them)
+        expire_days: Retire ads neither seen by a crawl nor updated for more than this many days (None to keep them)
+        archive_format: 'sqlite', 'parquet' or 'none' (delete without archiving)
+        archive_path: Archive database or Parquet directory (default: next to the database)
+        chunk_size: Ads per transaction
+        vacuum: Compaction after archiving: 'incremental', 'full' or 'none'
+        dry_run: Only count the candidates
+        min_interval_hours: Skip the run if the last one finished less than this many hours ago
+
+    Returns:
+        Report with the candidates per reason, archived ads and bytes reclaimed
+    """
+    report = {"db_path": db_path, "skipped": None, "delisted": 0, "expired": 0, "archived": 0,
+              "archive": None, "bytes_before": 0, "bytes_after": 0, "bytes_reclaimed": 0, "seconds": 0.0, "error": None}
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"archive_format must be one of {ARCHIVE_FORMATS}")
+    if vacuum not in VACUUM_MODES:
+        raise ValueError(f"vacuum must be one of {VACUUM_MODES}")
+    if not os.path.exists(db_path):
+        report["error"] = f"Database file not found: {db_path}"
+        logger.error(report["error"])
+        return report
+    if not init_retention_tables(db_path):
+        report["error"] = "Retention tables not available"
+        return report
+
+    last_run = last_run_at(db_path)
+    if min_interval_hours is not None and last_run is not None:
+        if datetime.now(timezone.utc) - last_run < timedelta(hours=min_interval_hours):
+            report["skipped"] = f"last run at {last_run:%Y-%m-%d %H:%M:%S} UTC"
+            logger.info(f"[INFO] Retention skipped for {db_path}: {report['skipped']}")
+            return report
+
+    start_time = time.time()
+    if archive_format != "none":
+        report["archive"] = archive_path or default_archive_path(db_path, archive_format)
+    report["bytes_before"] = database_size(db_path)
+    started_at = _timestamp()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        report.update(select_candidates(conn, delisted_days, expire_days))
+        logger.info(f"[INFO] Retention candidates in {db_path}: {report['delisted']} delisted, {report['expired']} expired")
+        if not dry_run and report["delisted"] + report["expired"]:
+            report["archived"] = archive_candidates(conn, archive_format, report["archive"], chunk_size)
+    except (sqlite3.Error, OSError, ValueError) as e:
+        report["error"] = str(e)
+        logger.error(f"[ERROR] Retention failed for {db_path}: {e}")
+    finally:
+        conn.close()
+
+    if not dry_run:
+        try:
+            report["bytes_after"] = compact_database(db_path, vacuum)["bytes_after"]
+        except sqlite3.Error as e:
+            report["error"] = report["error"] or str(e)
+            logger.error(f"[ERROR] Compaction failed for {db_path}: {e}")
+            report["bytes_after"] = database_size(db_path)
+        report["bytes_reclaimed"] = report["bytes_before"] - report["bytes_after"]
+    report["seconds"] = time.time() - start_time
+
+    if not dry_run:
+        try:
+            with get_connection(db_path) as conn:
+                conn.execute('''
+                    INSERT INTO retention_runs (started_at, finished_at, archived, delisted, expired, archive,
+                                                bytes_before, bytes_after, bytes_reclaimed, error)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (started_at, _timestamp(), report["archived"], report["delisted"], report["expired"],
+                      report["archive"], report["bytes_before"], report["bytes_after"], report["bytes_reclaimed"],
+                      report["error"]))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"[WARNING] Could not record the retention run: {e}")
+
+    logger.info(
+        f"[INFO] Retention of {db_path}: {report['archived']} ads archived, "
+        f"{report['bytes_reclaimed'] / 1024 / 1024:.1f} MB reclaimed in {report['seconds']:.1f}s"
+    )
+    return report
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='Archive old ads and compact the ads database')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--db', type=str, help='Path to the SQLite database')
+    target.add_argument('--shard-dir', type=str, help='Apply the policy to every province shard in this directory')
+    parser.add_argument('--delisted-days', type=float, default=DEFAULT_DELISTED_DAYS,
+                        help=f'Archive ads delisted for more than this many days (default: {DEFAULT_DELISTED_DAYS})')
+    parser.add_argument('--keep-delisted', action='store_true', help='Do not archive delisted ads')
+    parser.add_argument('--expire-days', type=float, default=None,
+                        help='Archive ads neither seen by a crawl nor updated for more than this many days (default: never)')
+    parser.add_argument('--archive-format', choices=ARCHIVE_FORMATS, default='sqlite',
+                        help='Archive to a SQLite database, to Parquet files (requires pyarrow) or delete (default: sqlite)')
+    parser.add_argument('--archive-path', type=str, default=None,
+                        help='Archive database or Parquet directory (default: <db>_archive.db or <db>_archive/)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Ads moved per transaction (default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--vacuum', choices=VACUUM_MODES, default='incremental',
+                        help='Compaction after archiving (default: incremental)')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the ads that would be archived')
+    parser.add_argument('--min-interval-hours', type=float, default=None,
+                        help='Skip databases whose last retention run is more recent than this (for cron)')
+    parser.add_argument('--every', type=float, default=None, metavar='HOURS',
+                        help='Keep running and apply the policy every HOURS hours')
+    return parser.parse_args()
+
+
+def main():
+    """Main function"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_arguments()
+
+    while True:
+        db_paths = [args.db] if args.db else list(list_shards(args.shard_dir).values())
+        for db_path in db_paths:
+            archive_path = args.archive_path
+            if archive_path and args.shard_dir:
+                # One archive per shard inside the given directory
+                archive_path = os.path.join(archive_path, Path(default_archive_path(db_path, args.archive_format)).name)
+            run_retention(
+                db_path,
+                delisted_days=None if args.keep_delisted else args.delisted_days,
+                expire_days=args.expire_days,
+                archive_format=args.archive_format,
+                archive_path=archive_path,
+                chunk_size=args.chunk_size,
+                vacuum=args.vacuum,
+                dry_run=args.dry_run,
+                min_interval_hours=args.min_interval_hours
+            )
+        if not args.every:
+            break
+        logger.info(f"[INFO] Next retention run in {args.every} hours")
+        time.sleep(args.every * 3600)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,599 @@
+"""
+Output sinks for real estate ads.
+
+Every destination an ad can be written to (SQLite, Cosmos DB, CSV, JSON Lines,
+JSON, Parquet) implements the same small interface:
+
+    sink.open()               # connect / create the file
+    sink.write_batch(df)      # write one batch of cleaned ads
+    sink.close()              # flush, disconnect and log the metrics
+
+The Sink base class adds what every path needs on top of write_batch:
+- batching: write(df) splits a DataFrame into batches of `batch_size` rows
+- retries: a batch failing with a transient error (`retry_on`) is retried
+  with exponential backoff, up to `max_retries` times
+- metrics: records, written, failed, retries and time spent, plus the counters
+  reported by each sink (new/updated for SQLite, RU charge for Cosmos DB)
+
+The crawler (fetch_ads.process_ads) and the CSV upload scripts both write
+through these classes, so a faster writer benefits every path at once.
+
+This module provides functions to:
+1. Write DataFrames of ads to SQLite, Cosmos DB, CSV, JSONL, JSON and Parquet
+2. Pick the file sink matching a file name
+3. Upload a CSV file to any sink in resumable chunks
+"""
+
+import os
+import time
+import random
+import sqlite3
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import json_codec
+from helpers import clean_dataframe_for_export
+from cosmos_ingest import (
+    prepare_cosmos_records,
+    ingest_records,
+    CosmosSession,
+    DEFAULT_CONCURRENCY,
+    MAX_BATCH_OPERATIONS
+)
+from csv_chunks import iter_csv_frames, save_progress, clear_progress
+from export_writers import StreamWriter, detect_stream_format
+from sqlite_helpers import init_database, upsert_ads_df
+from sqlite_shards import write_df_to_shards
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SINK_RETRIES = 3
+EXPORT_EXCLUDED_COLUMNS = ("raw_data",)  # The compressed raw payload only goes to SQLite
+
+
+def new_sink_metrics() -> Dict[str, Any]:
+    """Create an empty metrics dictionary for a sink."""
+    return {
+        "records": 0,
+        "written": 0,
+        "failed": 0,
+        "batches": 0,
+        "failed_batches": 0,
+        "retries": 0,
+        "seconds": 0.0,
+        "errors": []
+    }
+
+
+class Sink:
+    """
+    Base class of all output sinks.
+
+    Subclasses implement write_batch() and, if they hold resources, open(),
+    flush() and close(). write_batch() returns a dictionary with the number of
+    records `written` and `failed`, optionally the `positions` (within the
+    batch) of the records written when only some of them were, an `errors`
+    list, and any other numeric counter to add to the metrics.
+
+    Args:
+        batch_size: Rows per write_batch() call (None writes each DataFrame in one batch)
+        max_retries: Retries of a batch failing with one of the `retry_on` errors
+    """
+
+    name = "sink"
+    retry_on: Tuple[type, ...] = ()
+    excluded_columns: Tuple[str, ...] = ()
+
+    def __init__(self, batch_size: Optional[int] = None, max_retries: int = DEFAULT_SINK_RETRIES):
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.metrics = new_sink_metrics()
+        self.last_error: Optional[str] = None
+        self.is_open = False
+
+    def open(self) -> "Sink":
+        """Open the sink (connect, create files). Called automatically by write()."""
+        self.is_open = True
+        return self
+
+    def write_batch(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """Write one batch of cleaned ads and return its counters."""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Make the batches written so far durable (e.g. commit a transaction)."""
+
+    def close(self) -> None:
+        """Release the sink resources and log its metrics."""
+        if self.is_open:
+            self.is_open = False
+            logger.info(f"[INFO] {self.name}: {self.summary()}")
+
+    def summary(self) -> str:
+        """One-line description of the metrics."""
+        m = self.metrics
+        return (
+            f"{m['written']}/{m['records']} record scritti, {m['failed']} falliti, "
+            f"{m['batches']} batch, {m['retries']} tentativi ripetuti, {m['seconds']:.2f}s"
+        )
+
+    def _record_error(self, message: str) -> None:
+        logger.warning(f"[WARNING] {message}")
+        if len(self.metrics["errors"]) < 10:  # Limit number of stored errors
+            self.metrics["errors"].append(message)
+
+    def _write_with_retry(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """Call write_batch, retrying transient errors with exponential backoff."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.write_batch(df)
+            except self.retry_on as e:
+                if attempt == self.max_retries:
+                    raise
+                self.metrics["retries"] += 1
+                delay = min(0.5 * (2 ** attempt), 10.0) * random.uniform(0.5, 1.5)
+                logger.warning(f"[WARNING] {self.name}: batch fallito ({e}), nuovo tentativo tra {delay:.1f}s")
+                time.sleep(delay)
+
+    def write(self, df: pd.DataFrame) -> List[int]:
+        """
+        Write a DataFrame of cleaned ads in batches.
+
+        A batch that still fails after the retries is counted as failed (see
+        `last_error`) and the next batch is written anyway.
+
+        Args:
+            df: Cleaned DataFrame (see helpers.clean_dataframe_for_export)
+
+        Returns:
+            Positions (within df) of the records written successfully
+        """
+        if not self.is_open:
+            self.open()
+        if self.excluded_columns:
+            df = df[[col for col in df.columns if col not in self.excluded_columns]]
+
+        positions = []
+        size = self.batch_size or len(df) or 1
+        for start in range(0, len(df), size):
+            batch = df.iloc[start:start + size]
+            started = time.perf_counter()
+            try:
+                result = self._write_with_retry(batch)
+            except Exception as e:
+                self.metrics["failed_batches"] += 1
+                self.last_error = f"{self.name}: batch di {len(batch)} record fallito: {e}"
+                self._record_error(self.last_error)
+                result = {"written": 0, "failed": len(batch), "positions": []}
+            self.metrics["seconds"] += time.perf_counter() - started
+            self.metrics["batches"] += 1
+            self.metrics["records"] += len(batch)
+
+            batch_positions = result.pop("positions", None)
+            if batch_positions is None:
+                batch_positions = range(len(batch)) if not result.get("failed") else []
+            positions.extend(start + position for position in batch_positions)
+            # Errors of single records were already logged by the sink
+            self.metrics["errors"].extend(result.pop("errors", [])[:max(0, 10 - len(self.metrics["errors"]))])
+            for key, value in result.items():
+                self.metrics[key] = self.metrics.get(key, 0) + value
+        return positions
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteSink(Sink):
+    """
+    SQLite sink.
+
+    In 'ads' mode records are upserted on `url` into the real_estate_ads table
+    (see sqlite_helpers.upsert_ads_df), or into per-province shard files when
+    `shard_dir` is given. In 'table' mode the columns are written as-is into
+    `table_name` with pandas to_sql, and committed on flush().
+
+    Args:
+        db_path: Path to the SQLite database file
+        mode: 'ads' or 'table'
+        table_name: Target table in 'table' mode
+        if_exists: Behaviour of the first batch in 'table' mode ('fail', 'replace', 'append')
+        shard_dir: Directory of the per-province shard files ('ads' mode, optional)
+        replace_existing: Update existing ads with the same URL ('ads' mode)
+    """
+
+    name = "sqlite"
+    retry_on = (sqlite3.OperationalError,)  # e.g. "database is locked"
+
+    def __init__(self, db_path: Optional[str] = None, mode: str = "ads", table_name: Optional[str] = None,
+                 if_exists: str = "append", shard_dir: Optional[str] = None, replace_existing: bool = True,
+                 **options):
+        super().__init__(**options)
+        if mode not in ("ads", "table"):
+            raise ValueError(f"Unsupported SQLite mode '{mode}': use 'ads' or 'table'")
+        if mode == "table" and not table_name:
+            raise ValueError("table_name is required in 'table' mode")
+        self.db_path = db_path
+        self.mode = mode
+        self.table_name = table_name
+        self.if_exists = if_exists
+        self.shard_dir = shard_dir
+        self.replace_existing = replace_existing
+        self.conn = None
+
+    def open(self):
+        if not self.is_open and not self.shard_dir:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            if self.mode == "ads":
+                init_database(self.db_path)
+            else:
+                self.conn = sqlite3.connect(self.db_path, timeout=60)  # Other workers may write to the same file
+        return super().open()
+
+    def write_batch(self, df):
+        if self.shard_dir:
+            # Route each ad to the SQLite file of its province
+            shard_results = write_df_to_shards(
+                df, self.shard_dir, replace_existing=self.replace_existing, raise_errors=True
+            )
+            new_records = sum(new for new, _ in shard_results.values())
+            updated_records = sum(updated for _, updated in shard_results.values())
+        elif self.mode == "ads":
+            new_records, updated_records = upsert_ads_df(
+                df, self.db_path, replace_existing=self.replace_existing, raise_errors=True
+            )
+        else:
+            # Only the first batch may create or replace the table
+            df.to_sql(self.table_name, self.conn, if_exists=self.if_exists, index=False)
+            self.if_exists = "append"
+            return {"written": len(df), "failed": 0}
+        # Unchanged ads are written too (their updated_at is refreshed), they are just not counted as updated
+        written = int(df["url"].notna().sum()) if "url" in df.columns else 0
+        return {"written": written, "failed": 0, "new": new_records, "updated": updated_records}
+
+    def flush(self):
+        if self.conn is not None:
+            self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+        super().close()
+
+    def summary(self):
+        return f"{super().summary()} ({self.metrics.get('new', 0)} nuovi, {self.metrics.get('updated', 0)} aggiornati)"
+
+
+class CosmosSink(Sink):
+    """
+    Cosmos DB sink, writing through cosmos_ingest (parallel transactional batches).
+
+    Records get their `id` and `city` partition key from prepare_cosmos_records.
+    The sink uses, in order of preference, an async `container` (or stand-in),
+    a shared CosmosSession, or a CosmosSession of its own opened in open().
+
+    Args:
+        container_name: Cosmos DB container name
+        endpoint: Cosmos DB account URI
+        key: Cosmos DB account key
+        db_name: Database name
+        default_city: Partition key for records without a city
+        session: Shared CosmosSession (optional)
+        container: Async container client to write to directly (optional)
+        concurrency: Maximum number of requests in flight
+        max_batch_operations: Maximum operations per transactional batch (capped at 100)
+    """
+
+    name = "cosmos"
+    excluded_columns = EXPORT_EXCLUDED_COLUMNS
+
+    def __init__(self, container_name: str, endpoint: Optional[str] = None, key: Optional[str] = None,
+                 db_name: Optional[str] = None, default_city: Optional[str] = None,
+                 session: Optional[CosmosSession] = None, container=None,
+                 concurrency: int = DEFAULT_CONCURRENCY, max_batch_operations: int = MAX_BATCH_OPERATIONS,
+                 **options):
+        # The Azure SDK is only loaded when a Cosmos DB sink is actually used
+        from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+
+        super().__init__(**options)
+        self.retry_on = (ServiceRequestError, ServiceResponseError, OSError)  # Connection problems; 429s are retried by cosmos_ingest
+        self.container_name = container_name
+        self.endpoint = endpoint
+        self.key = key
+        self.db_name = db_name
+        self.default_city = default_city
+        self.session = session
+        self.container = container
+        self.concurrency = concurrency
+        self.max_batch_operations = max_batch_operations
+        self._owns_session = False
+
+    def open(self):
+        if not self.is_open and self.container is None and self.session is None:
+            self.session = CosmosSession(self.endpoint, self.key, self.db_name)
+            self._owns_session = True
+        return super().open()
+
+    def write_batch(self, df):
+        records = prepare_cosmos_records(df.to_dict('records'), default_city=self.default_city)
+        options = {"concurrency": self.concurrency, "max_batch_operations": self.max_batch_operations}
+        if self.container is not None:
+            stats = ingest_records(records, container=self.container, **options)
+        else:
+            stats = self.session.ingest(records, self.container_name, **options)
+        return {
+            "written": stats["successful"],
+            "failed": stats["failed"],
+            "positions": stats["succeeded_positions"],
+            "errors": stats["errors"],
+            "request_charge": stats["request_charge"],
+            "throttled": stats["throttled"]
+        }
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+            self.session = None
+            self._owns_session = False
+        super().close()
+
+    def summary(self):
+        return (
+            f"{super().summary()} ({self.metrics.get('request_charge', 0.0):.1f} RU, "
+            f"{self.metrics.get('throttled', 0)} richieste limitate)"
+        )
+
+
+class StreamFileSink(Sink):
+    """
+    Append-only file sink (see export_writers.StreamWriter), compressed if the
+    name ends with .gz or .zst. Every batch is flushed to disk when written.
+
+    Args:
+        path: File path
+        overwrite: Truncate the file on open instead of appending to it
+        level: Compression level (optional)
+    """
+
+    name = "file"
+    file_format: Optional[str] = None
+    excluded_columns = EXPORT_EXCLUDED_COLUMNS
+
+    def __init__(self, path: str, overwrite: bool = False, level: Optional[int] = None, **options):
+        super().__init__(**options)
+        self.path = str(path)
+        if self.file_format is not None and detect_stream_format(self.path)[0] != self.file_format:
+            raise ValueError(f"{type(self).__name__} cannot write '{self.path}'")
+        self.overwrite = overwrite
+        self.level = level
+        self.writer: Optional[StreamWriter] = None
+
+    def open(self):
+        if not self.is_open:
+            if self.overwrite and os.path.exists(self.path):
+                os.remove(self.path)
+            self.writer = StreamWriter(self.path, self.level)
+        return super().open()
+
+    def write_batch(self, df):
+        return {"written": self.writer.write_page(df), "failed": 0}
+
+
+class CSVSink(StreamFileSink):
+    """CSV file sink; the header is written only when the file is new."""
+
+    name = "csv"
+    file_format = "csv"
+
+
+class JSONLSink(StreamFileSink):
+    """JSON Lines file sink, one ad per line."""
+
+    name = "jsonl"
+    file_format = "jsonl"
+
+
+class JSONSink(Sink):
+    """
+    JSON file sink: the ads are collected and written as one JSON array on close.
+
+    Args:
+        path: File path
+        indent: JSON indentation
+    """
+
+    name = "json"
+    excluded_columns = EXPORT_EXCLUDED_COLUMNS
+
+    def __init__(self, path: str, indent: Optional[int] = 2, **options):
+        super().__init__(**options)
+        self.path = str(path)
+        self.indent = indent
+        self._records: List[Dict[str, Any]] = []
+
+    def write_batch(self, df):
+        self._records.extend(df.to_dict('records'))
+        return {"written": len(df), "failed": 0}
+
+    def close(self):
+        if self.is_open:
+            json_codec.dump_file(self._records, self.path, indent=self.indent)
+            self._records = []
+        super().close()
+
+
+class ParquetSink(Sink):
+    """
+    Parquet file sink (requires `pyarrow`), one row group per batch.
+
+    The schema is taken from the first batch; columns that are empty in the
+    first batch are stored as strings.
+
+    Args:
+        path: File path
+        compression: Parquet compression codec
+    """
+
+    name = "parquet"
+    excluded_columns = EXPORT_EXCLUDED_COLUMNS
+
+    def __init__(self, path: str, compression: str = "zstd", **options):
+        super().__init__(**options)
+        self.path = str(path)
+        self.compression = compression
+        self._writer = None
+        self._schema = None
+
+    def open(self):
+        if not self.is_open:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ValueError("pyarrow package is required for Parquet output")
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        return super().open()
+
+    def _to_table(self, df):
+        import pyarrow as pa
+
+        if self._schema is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self._schema = pa.schema(
+                [field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema]
+            )
+            return table.cast(self._schema)
+        return pa.Table.from_pandas(df, schema=self._schema, preserve_index=False, safe=False)
+
+    def write_batch(self, df):
+        import pyarrow.parquet as pq
+
+        table = self._to_table(df)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, self._schema, compression=self.compression)
+        self._writer.write_table(table)
+        return {"written": len(df), "failed": 0}
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        super().close()
+
+
+FILE_SINKS = {"csv": CSVSink, "jsonl": JSONLSink}
+
+
+def stream_file_sink(path: str, **options) -> StreamFileSink:
+    """
+    Create the append-only sink of a stream file (.csv or .jsonl / .ndjson,
+    optionally followed by .gz or .zst).
+
+    Args:
+        path: File path
+        **options: Options of the sink class
+
+    Returns:
+        CSVSink or JSONLSink
+    """
+    file_format, _ = detect_stream_format(path)
+    return FILE_SINKS[file_format](path, **options)
+
+
+def file_sink(path: str, **options) -> Sink:
+    """
+    Create the file sink matching a file name (.csv, .jsonl, .ndjson, .json,
+    .parquet, optionally .gz / .zst for CSV and JSONL).
+
+    Args:
+        path: File path
+        **options: Options of the sink class
+
+    Returns:
+        The sink for the file
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == ".parquet":
+        return ParquetSink(path, **options)
+    if suffix == ".json":
+        return JSONSink(path, **options)
+    return stream_file_sink(path, **options)
+
+
+def upload_csv_to_sink(csv_path: str, sink: Sink, chunksize: Optional[int] = None, resume: bool = False,
+                       executor=None) -> Dict[str, Any]:
+    """
+    Read, clean and write a CSV file to a sink, optionally in resumable chunks.
+
+    Progress is saved after every chunk that was written completely; if a
+    batch of a chunk fails even after the retries, the upload stops so that a
+    resumed run starts again from that chunk.
+
+    Args:
+        csv_path: Path to the CSV file
+        sink: Destination sink (closed when the upload ends)
+        chunksize: Read, clean and upload the file in chunks of this many rows (optional)
+        resume: Continue from the progress saved by an interrupted chunked upload (optional)
+        executor: Process pool used to parse and clean the CSV (optional)
+
+    Returns:
+        Dictionary with upload statistics (the sink metrics for this file)
+    """
+    results = {
+        "file": csv_path,
+        "total_records": 0,
+        "successful": 0,
+        "failed": 0,
+        "start_time": datetime.now(),
+        "end_time": None,
+        "errors": []
+    }
+
+    try:
+        sink.open()
+        logger.info(f"[INFO] Loading CSV file: {csv_path}")
+        # Parsing and cleaning run in the process pool when one is given
+        frames = iter_csv_frames(csv_path, chunksize, resume, transform=clean_dataframe_for_export, executor=executor)
+        for clean_df, offset, rows_read in frames:
+            results["total_records"] += len(clean_df)
+            failed_batches = sink.metrics["failed_batches"]
+            sink.write(clean_df)
+            del clean_df
+            sink.flush()
+            if sink.metrics["failed_batches"] > failed_batches:
+                logger.error(f"[ERROR] {sink.name}: upload of {csv_path} stopped, progress kept at the last complete chunk")
+                break
+            logger.info(f"[INFO] {sink.metrics['written']} records uploaded so far")
+            if chunksize:
+                save_progress(csv_path, offset, rows_read)
+        else:
+            clear_progress(csv_path)
+
+    except Exception as e:
+        logger.error(f"[ERROR] Failed to process CSV file: {str(e)}")
+        results["errors"].append(f"File processing error: {str(e)}")
+
+    finally:
+        try:
+            sink.close()
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to close {sink.name} sink: {str(e)}")
+            results["errors"].append(f"Sink error: {str(e)}")
+
+    metrics = dict(sink.metrics)
+    results["successful"] = metrics.pop("written")
+    results["failed"] = metrics.pop("failed")
+    results["errors"] = metrics.pop("errors") + results["errors"]
+    for key in ("records", "batches", "failed_batches", "retries", "seconds"):
+        metrics.pop(key)
+    results.update(metrics)  # Sink-specific counters: new/updated, request_charge/throttled
+    results["end_time"] = datetime.now()
+    return results
@@ -0,0 +1,386 @@
+"""
+Spatial index over the coordinates of the ads in a SQLite database.
+
+The index is an R*Tree virtual table (ads_rtree) holding one point per row of
+real_estate_ads, keyed by db_id. Triggers on real_estate_ads keep it in sync
+on every insert, coordinate update and delete, so the writers (upsert_ads_df,
+write_df_to_sqlite, shards) do not need to know about it. It is created, and
+filled from the existing rows, the first time a database is opened here.
+
+Queries probe the R*Tree with a bounding box, join the matching rows and, for
+radius and nearest-neighbour searches, compute the exact great-circle distance
+on the few candidates only. Comparable listings for a valuation ("3-room flats
+for sale within 500 m") become an index probe instead of loading the table:
+
+    python spatial_index.py --db ads.db --near 44.4056 8.9463 --radius 500 --rooms 3
+
+This module provides functions to:
+1. Create the R*Tree index and the triggers keeping it in sync
+2. Query ads in a bounding box or within a radius of a point
+3. Find the k ads nearest to a point
+4. Find the comparable listings of an ad
+"""
+
+import math
+import sqlite3
+import logging
+import argparse
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from sqlite_helpers import get_connection
+
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+
+# Columns returned by default, enough to compare listings
+DEFAULT_COLUMNS = (
+    "db_id", "url", "title", "contract", "typology_name", "price_value", "surface_m2",
+    "rooms", "bathrooms", "floor_number", "city", "macrozone", "latitude", "longitude"
+)
+
+SPATIAL_INDEX_SQL = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS ads_rtree USING rtree(
+    db_id, min_lat, max_lat, min_lon, max_lon
+);
+
+CREATE TRIGGER IF NOT EXISTS ads_rtree_insert
+AFTER INSERT ON real_estate_ads
+WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+BEGIN
+    INSERT OR REPLACE INTO ads_rtree VALUES (NEW.db_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+END;
+
+CREATE TRIGGER IF NOT EXISTS ads_rtree_update
+AFTER UPDATE OF latitude, longitude ON real_estate_ads
+BEGIN
+    DELETE FROM ads_rtree WHERE db_id = OLD.db_id;
+    INSERT INTO ads_rtree
+    SELECT NEW.db_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+    WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS ads_rtree_delete
+AFTER DELETE ON real_estate_ads
+BEGIN
+    DELETE FROM ads_rtree WHERE db_id = OLD.db_id;
+END;
+'''
+
+
+def init_spatial_index(db_path: str) -> bool:
+    """
+    Create the R*Tree index of an ads database and fill it from the existing rows.
+
+    Nothing is done if the index already exists: the triggers keep it up to date.
+
+    Args:
+        db_path: Path to a database with the real_estate_ads table
+
+    Returns:
+        True if the index is available, False otherwise
+    """
+    try:
+        with get_connection(db_path) as conn:
+            if conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'ads_rtree_delete'"
+            ).fetchone():
+                return True
+            conn.executescript(SPATIAL_INDEX_SQL)
+            cursor = conn.execute('''
+                INSERT OR REPLACE INTO ads_rtree
+                SELECT db_id, latitude, latitude, longitude, longitude FROM real_estate_ads
+                WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            ''')
+            conn.commit()
+            logger.info(f"[INFO] Spatial index created for {db_path} ({cursor.rowcount} ads)")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error creating spatial index: {e}")
+        return False
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in meters between two points."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """
+    Bounding box containing every point within `radius_m` of a point.
+
+    Returns:
+        Tuple (min_lat, min_lon, max_lat, max_lon)
+    """
+    d_lat = radius_m / METERS_PER_DEGREE_LAT
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    d_lon = min(radius_m / (METERS_PER_DEGREE_LAT * cos_lat), 180.0)
+    return lat - d_lat, lon - d_lon, lat + d_lat, lon + d_lon
+
+
+class SpatialIndex:
+    """
+    Spatial queries over the ads of a SQLite database.
+
+    The connection stays open between queries, so repeated lookups (e.g. the
+    comparables of every ad of a batch) are only index probes. Use one
+    instance per thread.
+
+    Args:
+        db_path: Path to a database with the real_estate_ads table
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        if not init_spatial_index(self.db_path):
+            raise sqlite3.OperationalError(f"Spatial index not available for {self.db_path}")
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.table_columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(real_estate_ads)")]
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _check_column(self, column: str) -> str:
+        if column not in self.table_columns:
+            raise ValueError(f"Unknown column: {column}")
+        return column
+
+    def _where_filters(self, filters: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        """
+        SQL conditions for column filters: a value, a list of values or a (min, max) tuple.
+        """
+        clauses, params = [], []
+        for column, value in (filters or {}).items():
+            column = f"a.{self._check_column(column)}"
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    clauses.append(f"{column} >= ?")
+                    params.append(low)
+                if high is not None:
+                    clauses.append(f"{column} <= ?")
+                    params.append(high)
+            elif isinstance(value, (list, set)):
+                values = list(value)
+                clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+            elif value is None:
+                clauses.append(f"{column} IS NULL")
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return "".join(f" AND {clause}" for clause in clauses), params
+
+    def _select_columns(self, columns: Optional[Sequence[str]]) -> str:
+        if columns == "*":
+            return "a.*"
+        names = {self._check_column(column) for column in columns or DEFAULT_COLUMNS}
+        names |= {"db_id", "latitude", "longitude"}
+        return ", ".join(f"a.{column}" for column in self.table_columns if column in names)
+
+    def bbox(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        filters: Optional[Dict[str, Any]] = None,
+        columns: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Ads inside a bounding box.
+
+        Args:
+            min_lat, min_lon, max_lat, max_lon: Corners of the box in degrees
+            filters: Column filters, e.g. {"rooms": 3, "contract": "sale", "price_value": (None, 300000)}
+            columns: Columns to return (default: DEFAULT_COLUMNS, "*" for all)
+            limit: Maximum number of ads (optional)
+
+        Returns:
+            List of ads as dictionaries
+        """
+        where, params = self._where_filters(filters)
+        sql = (
+            f"SELECT {self._select_columns(columns)} FROM ads_rtree r "
+            f"JOIN real_estate_ads a ON a.db_id = r.db_id "
+            f"WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?{where}"
+        )
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        rows = self.conn.execute(sql, [min_lat, max_lat, min_lon, max_lon] + params).fetchall()
+        return [dict(row) for row in rows]
+
+    def within_radius(
+        self,
+        lat: float,
+        lon: float,
+        radius_m: float,
+        filters: Optional[Dict[str, Any]] = None,
+        columns: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Ads within `radius_m` meters of a point, nearest first.
+
+        Args:
+            lat, lon: Center in degrees
+            radius_m: Radius in meters
+            filters: Column filters (see bbox)
+            columns: Columns to return (see bbox)
+            limit: Maximum number of ads (optional)
+
+        Returns:
+            List of ads as dictionaries, with a distance_m key
+        """
+        ads = []
+        for ad in self.bbox(*bounding_box(lat, lon, radius_m), filters=filters, columns=columns):
+            ad["distance_m"] = haversine_m(lat, lon, ad["latitude"], ad["longitude"])
+            if ad["distance_m"] <= radius_m:
+                ads.append(ad)
+        ads.sort(key=lambda ad: ad["distance_m"])
+        return ads[:limit] if limit else ads
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        columns: Optional[Sequence[str]] = None,
+        start_radius_m: float = 250.0,
+        max_radius_m: float = 50000.0
+    ) -> List[Dict[str, Any]]:
+        """
+        The k ads nearest to a point.
+
+        The search radius doubles until it contains k ads: those are then
+        exactly the k nearest, as every closer ad is inside the radius too.
+
+        Args:
+            lat, lon: Point in degrees
+            k: Number of ads
+            filters: Column filters (see bbox)
+            columns: Columns to return (see bbox)
+            start_radius_m: First search radius
+            max_radius_m: Largest search radius
+
+        Returns:
+            Up to k ads as dictionaries, nearest first, with a distance_m key
+        """
+        radius = start_radius_m
+        while True:
+            ads = self.within_radius(lat, lon, radius, filters=filters, columns=columns)
+            if len(ads) >= k or radius >= max_radius_m:
+                return ads[:k]
+            radius = min(radius * 2, max_radius_m)
+
+    def comparables(
+        self,
+        url: str,
+        radius_m: float = 500.0,
+        same: Sequence[str] = ("contract", "rooms"),
+        filters: Optional[Dict[str, Any]] = None,
+        columns: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Listings near an ad sharing some of its attributes, e.g. for a valuation.
+
+        Args:
+            url: URL of the reference ad
+            radius_m: Search radius in meters
+            same: Columns whose value must equal the reference ad's
+            filters: Further column filters (see bbox)
+            columns: Columns to return (see bbox)
+            limit: Maximum number of ads (optional)
+
+        Returns:
+            List of ads as dictionaries, nearest first, without the reference ad
+        """
+        same = [self._check_column(column) for column in same]
+        row = self.conn.execute(
+            f"SELECT {', '.join(['db_id', 'latitude', 'longitude'] + same)} FROM real_estate_ads WHERE url = ?",
+            (url,)
+        ).fetchone()
+        if row is None or row["latitude"] is None or row["longitude"] is None:
+            return []
+        filters = dict(filters or {})
+        filters.update({column: row[column] for column in same})
+        ads = self.within_radius(row["latitude"], row["longitude"], radius_m, filters=filters, columns=columns)
+        ads = [ad for ad in ads if ad["db_id"] != row["db_id"]]
+        return ads[:limit] if limit else ads
+
+
+def ads_within_radius(db_path: str, lat: float, lon: float, radius_m: float,
+                      filters: Optional[Dict[str, Any]] = None, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Ads within `radius_m` meters of a point as a DataFrame, nearest first.
+
+    Args:
+        db_path: Path to the ads database
+        lat, lon: Center in degrees
+        radius_m: Radius in meters
+        filters: Column filters (see SpatialIndex.bbox)
+        columns: Columns to return (see SpatialIndex.bbox)
+
+    Returns:
+        DataFrame of ads with a distance_m column
+    """
+    with SpatialIndex(db_path) as index:
+        return pd.DataFrame(index.within_radius(lat, lon, radius_m, filters=filters, columns=columns))
+
+
+def main():
+    """Query ads near a point or in a bounding box from the command line."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Spatial queries over an ads SQLite database')
+    parser.add_argument('--db', type=str, required=True, help='Path to the SQLite database')
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument('--near', type=float, nargs=2, metavar=('LAT', 'LON'), help='Search around a point')
+    query.add_argument('--bbox', type=float, nargs=4, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                       help='Search in a bounding box')
+    query.add_argument('--comparables', type=str, metavar='URL',
+                       help='Search the listings comparable to an ad (same contract and rooms)')
+    parser.add_argument('--radius', type=float, default=500.0, help='Search radius in meters (default: 500)')
+    parser.add_argument('--k', type=int, help='Return the K nearest ads instead of a radius search')
+    parser.add_argument('--rooms', type=int, help='Only ads with this number of rooms')
+    parser.add_argument('--contract', type=str, help='Only ads with this contract')
+    parser.add_argument('--limit', type=int, default=50, help='Maximum number of ads shown (default: 50)')
+    args = parser.parse_args()
+
+    filters = {column: value for column, value in (("rooms", args.rooms), ("contract", args.contract))
+               if value is not None}
+    with SpatialIndex(args.db) as index:
+        if args.comparables:
+            ads = index.comparables(args.comparables, args.radius, filters=filters, limit=args.limit)
+        elif args.bbox:
+            ads = index.bbox(*args.bbox, filters=filters, limit=args.limit)
+        elif args.k:
+            ads = index.nearest(*args.near, k=args.k, filters=filters)
+        else:
+            ads = index.within_radius(*args.near, args.radius, filters=filters, limit=args.limit)
+
+    logger.info(f"[INFO] {len(ads)} ads found")
+    if ads:
+        with pd.option_context('display.max_columns', None, 'display.width', 200):
+            print(pd.DataFrame(ads).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,15 @@ SQLite helper functions for storing and retrieving real estate ads.
 
 This module provides functions to:
 1. Initialize a SQLite database with the required schema
-2. Write a DataFrame of real estate ads to the database
+2. Write a DataFrame of real estate ads to the database (row by row, or with set-based upserts)
 3. Read data from the database with various filtering options
 4. Update existing records
 5. Delete records
 """
 
+from __future__ import annotations
+
 import sqlite3
-import pandas as pd
 import os
 import json
 from typing import Optional, List, Dict, Any, Tuple, Union
@@ -19,13 +20,11 @@ import logging
 from datetime import datetime
 
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# URLs per DELETE ... IN (...) statement, well below SQLite's parameter limit
+DELETE_CHUNK_SIZE = 500
+
 
 @contextmanager
 def get_connection(db_path: str):
@@ -168,6 +167,8 @@ def transform_df_dtypes(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         DataFrame with transformed data types
     """
+    import pandas as pd
+
     # Create a copy to avoid modifying the original DataFrame
     df = df.copy()
     
@@ -287,6 +288,8 @@ def clean_df_from_sqlite(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         Cleaned DataFrame with proper data types
     """
+    import pandas as pd
+
     if df.empty:
         return df
         
@@ -443,6 +446,8 @@ def write_df_to_sqlite(df: pd.DataFrame, db_path: str, replace_existing: bool =
     Returns:
         Tuple of (number of new records, number of updated records)
     """
+    import pandas as pd
+
     try:
         # Initialize the database if it doesn't exist
         if not os.path.exists(db_path):
@@ -543,9 +548,8 @@ def write_df_to_sqlite(df: pd.DataFrame, db_path: str, replace_existing: bool =
             #     conn.commit()
             #     logger.info(f"Added new columns to schema: {missing_columns}")
             
-            # Add raw_data column with the entire row as JSON if not present
-            if 'raw_data' not in df.columns:
-                df['raw_data'] = df.apply(lambda row: json.dumps(row.to_dict(), ensure_ascii=False), axis=1)
+            # raw_data is only stored when the caller provides the original API payload
+            # (see raw_payload.compress_payloads); the typed columns are not duplicated there
             
             # Insert each row individually to handle duplicate URLs properly
             for _, row in df.iterrows():
@@ -593,6 +597,119 @@ def write_df_to_sqlite(df: pd.DataFrame, db_path: str, replace_existing: bool =
         return 0, 0
 
 
+# Columns managed by SQLite itself, never written by the upsert
+UPSERT_EXCLUDED_COLUMNS = {'db_id', 'created_at', 'updated_at'}
+
+
+def upsert_ads_df(df: pd.DataFrame, db_path: str, chunk_size: int = 10000,
+                  replace_existing: bool = True, raise_errors: bool = False) -> Tuple[int, int]:
+    """
+    Write a DataFrame of real estate ads with set-based upserts on `url`.
+
+    Each chunk is loaded into a temporary staging table with executemany and
+    merged into real_estate_ads with a single
+    INSERT ... SELECT ... ON CONFLICT(url) DO UPDATE, in one transaction.
+    As in write_df_to_sqlite, missing (NULL) values never overwrite existing ones
+    and rows without a URL are skipped, so re-uploading the same data is idempotent.
+    Existing ads are still rewritten (refreshing updated_at, i.e. "seen"), but only
+    those where a value changed are counted as updated.
+    
+    Args:
+        df: DataFrame containing real estate ads
+        db_path: Path to the SQLite database file
+        chunk_size: Number of rows merged per transaction
+        replace_existing: Whether to update existing records with the same URL
+        raise_errors: Raise sqlite3 errors instead of logging them (for callers that retry)
+        
+    Returns:
+        Tuple of (number of new records, number of existing records with a changed value)
+    """
+    if df.empty or 'url' not in df.columns:
+        return 0, 0
+        
+    try:
+        # Initialize the database if it doesn't exist
+        if not os.path.exists(db_path):
+            init_database(db_path)
+            
+        new_records = 0
+        updated_records = 0
+        
+        df = transform_df_dtypes(df)
+        skipped = int(df['url'].isna().sum())
+        if skipped:
+            logger.warning(f"Skipping {skipped} records with missing URL")
+        # The last occurrence of a URL wins, as with row-by-row updates
+        df = df[df['url'].notna()].drop_duplicates(subset='url', keep='last')
+            
+        with get_connection(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA table_info(real_estate_ads)")
+            existing_columns = {column[1] for column in cursor.fetchall()}
+            columns = [col for col in df.columns if col in existing_columns and col not in UPSERT_EXCLUDED_COLUMNS]
+            
+            column_names = ", ".join(columns)
+            placeholders = ", ".join(["?"] * len(columns))
+            if replace_existing:
+                updates = ", ".join(
+                    f"{col} = COALESCE(excluded.{col}, real_estate_ads.{col})" for col in columns if col != 'url'
+                )
+                conflict_clause = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+            else:
+                conflict_clause = "DO NOTHING"
+            changed_condition = " OR ".join(
+                f"(s.{col} IS NOT NULL AND s.{col} IS NOT r.{col})" for col in columns if col != 'url'
+            )
+            
+            cursor.execute("DROP TABLE IF EXISTS temp.staging_ads")
+            cursor.execute(f"CREATE TEMP TABLE staging_ads ({column_names})")
+            
+            # None instead of NaN/NA, so that missing values are stored as NULL
+            values = df[columns].astype(object).where(df[columns].notna(), None)
+            
+            for start in range(0, len(values), chunk_size):
+                chunk = values.iloc[start:start + chunk_size]
+                cursor.executemany(
+                    f"INSERT INTO staging_ads ({column_names}) VALUES ({placeholders})",
+                    chunk.itertuples(index=False, name=None)
+                )
+                cursor.execute(
+                    "SELECT COUNT(*) FROM staging_ads s "
+                    "WHERE NOT EXISTS (SELECT 1 FROM real_estate_ads r WHERE r.url = s.url)"
+                )
+                chunk_new = cursor.fetchone()[0]
+                chunk_updated = 0
+                if replace_existing and changed_condition:
+                    # Only the existing ads where a value actually changes count as updated
+                    cursor.execute(
+                        "SELECT COUNT(*) FROM staging_ads s JOIN real_estate_ads r ON r.url = s.url "
+                        f"WHERE {changed_condition}"
+                    )
+                    chunk_updated = cursor.fetchone()[0]
+                
+                # WHERE true avoids the parsing ambiguity between a join and ON CONFLICT
+                cursor.execute(
+                    f"INSERT INTO real_estate_ads ({column_names}) "
+                    f"SELECT {column_names} FROM staging_ads WHERE true "
+                    f"ON CONFLICT(url) {conflict_clause}"
+                )
+                cursor.execute("DELETE FROM staging_ads")
+                conn.commit()
+                
+                new_records += chunk_new
+                updated_records += chunk_updated
+            
+            cursor.execute("DROP TABLE IF EXISTS temp.staging_ads")
+            logger.info(f"Wrote {new_records} new records and updated {updated_records} existing records to database")
+            return new_records, updated_records
+            
+    except sqlite3.Error as e:
+        if raise_errors:
+            raise
+        logger.error(f"Error writing to database: {e}")
+        return 0, 0
+
+
 def read_ads_from_sqlite(
     db_path: str, 
     filters: Optional[Dict[str, Any]] = None, 
@@ -613,6 +730,8 @@ def read_ads_from_sqlite(
     Returns:
         DataFrame containing the requested records
     """
+    import pandas as pd
+
     try:
         if not os.path.exists(db_path):
             logger.error(f"Database file not found: {db_path}")
@@ -641,7 +760,8 @@ def read_ads_from_sqlite(
                 
             if limit is not None:
                 query += f" LIMIT {limit}"
-                df = pd.read_sql_query(query, conn, params=params)
+
+            df = pd.read_sql_query(query, conn, params=params)
             logger.info(f"Retrieved {len(df)} records from database")
             
             if clean_data and not df.empty:
@@ -675,6 +795,8 @@ def search_ads_by_text(
     Returns:
         DataFrame containing the matching records
     """
+    import pandas as pd
+
     try:
         if not os.path.exists(db_path):
             logger.error(f"Database file not found: {db_path}")
@@ -705,13 +827,17 @@ def search_ads_by_text(
         return pd.DataFrame()
 
 
-def delete_ads_by_url(db_path: str, urls: List[str]) -> int:
+def delete_ads_by_url(db_path: str, urls: List[str], chunk_size: int = DELETE_CHUNK_SIZE) -> int:
     """
     Delete real estate ads with the specified URLs.
     
+    URLs are deleted in chunks of `chunk_size`, within SQLite's limit on the
+    number of parameters of a statement, in a single transaction.
+    
     Args:
         db_path: Path to the SQLite database file
         urls: List of URLs to delete
+        chunk_size: URLs per DELETE statement
         
     Returns:
         Number of records deleted
@@ -724,10 +850,13 @@ def delete_ads_by_url(db_path: str, urls: List[str]) -> int:
         with get_connection(db_path) as conn:
             cursor = conn.cursor()
             
-            placeholders = ", ".join(["?"] * len(urls))
-            cursor.execute(f"DELETE FROM real_estate_ads WHERE url IN ({placeholders})", urls)
-            
-            deleted_count = cursor.rowcount
+            urls = list(urls)
+            deleted_count = 0
+            for start in range(0, len(urls), chunk_size):
+                chunk = urls[start:start + chunk_size]
+                placeholders = ", ".join(["?"] * len(chunk))
+                cursor.execute(f"DELETE FROM real_estate_ads WHERE url IN ({placeholders})", chunk)
+                deleted_count += cursor.rowcount
             conn.commit()
             
             logger.info(f"Deleted {deleted_count} records from database")
@@ -964,6 +1093,11 @@ def export_to_csv(
 if __name__ == "__main__":
     # Example usage
     import sys
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
     
     if len(sys.argv) < 2:
         print("Please provide a SQLite database path")
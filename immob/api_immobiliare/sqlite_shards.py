@@ -0,0 +1,318 @@
+"""
+Province-sharded SQLite storage for real estate ads.
+
+Each province gets its own SQLite file (``ads_<province>.db``) inside a shard
+directory, with the same schema created by ``sqlite_helpers.init_database``.
+Writers for different provinces never contend on the same write lock, and
+maintenance (VACUUM, backup) can run on one province at a time.
+
+This module provides functions to:
+1. Route a DataFrame of ads to the per-province shard files (or group it by shard)
+2. Query the shards in parallel and merge the results into one DataFrame
+3. Vacuum or back up a single province shard
+"""
+
+import os
+import re
+import sqlite3
+import logging
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple
+
+from sqlite_helpers import (
+    get_connection,
+    upsert_ads_df,
+    read_ads_from_sqlite,
+    clean_df_from_sqlite
+)
+
+
+logger = logging.getLogger(__name__)
+
+SHARD_PREFIX = "ads_"
+SHARD_SUFFIX = ".db"
+UNKNOWN_PROVINCE = "unknown"
+
+
+def province_slug(province: Any) -> str:
+    """
+    Normalise a province name into a safe shard identifier.
+
+    Args:
+        province: Province name as found in the `province` column
+
+    Returns:
+        Lowercase identifier with non-alphanumeric characters replaced by underscores
+    """
+    if province is None or pd.isna(province) or not str(province).strip():
+        return UNKNOWN_PROVINCE
+    slug = re.sub(r'[^0-9a-z]+', '_', str(province).strip().lower()).strip('_')
+    return slug or UNKNOWN_PROVINCE
+
+
+def get_shard_path(shard_dir: str, province: Any) -> str:
+    """
+    Get the path of the SQLite file holding the ads of a province.
+
+    Args:
+        shard_dir: Directory containing the shard files
+        province: Province name (or slug)
+
+    Returns:
+        Path to the province shard file
+    """
+    return os.path.join(shard_dir, f"{SHARD_PREFIX}{province_slug(province)}{SHARD_SUFFIX}")
+
+
+def list_shards(shard_dir: str) -> Dict[str, str]:
+    """
+    List the province shards available in a shard directory.
+
+    Args:
+        shard_dir: Directory containing the shard files
+
+    Returns:
+        Dictionary mapping province slug to shard file path
+    """
+    if not os.path.isdir(shard_dir):
+        return {}
+
+    shards = {}
+    for filename in sorted(os.listdir(shard_dir)):
+        if filename.startswith(SHARD_PREFIX) and filename.endswith(SHARD_SUFFIX):
+            province = filename[len(SHARD_PREFIX):-len(SHARD_SUFFIX)]
+            shards[province] = os.path.join(shard_dir, filename)
+    return shards
+
+
+def group_by_shard(df: pd.DataFrame, shard_dir: str) -> Dict[str, pd.DataFrame]:
+    """
+    Split a DataFrame of ads by the shard file of their province.
+
+    Args:
+        df: DataFrame containing real estate ads
+        shard_dir: Directory containing the shard files
+
+    Returns:
+        Dictionary mapping shard file path to the rows it holds
+    """
+    if 'province' in df.columns:
+        slugs = df['province'].map(province_slug)
+    else:
+        slugs = pd.Series(UNKNOWN_PROVINCE, index=df.index)
+    return {get_shard_path(shard_dir, slug): group for slug, group in df.groupby(slugs, sort=False)}
+
+
+def write_df_to_shards(
+    df: pd.DataFrame,
+    shard_dir: str,
+    replace_existing: bool = False,
+    max_workers: Optional[int] = None,
+    raise_errors: bool = False
+) -> Dict[str, Tuple[int, int]]:
+    """
+    Write a DataFrame of real estate ads to the per-province shard files.
+
+    Rows are grouped by the `province` column and each group is written to its
+    own shard with ``upsert_ads_df``. Different shards are written
+    concurrently since they do not share a database lock.
+
+    Args:
+        df: DataFrame containing real estate ads
+        shard_dir: Directory containing the shard files
+        replace_existing: Whether to replace existing records with the same URL
+        max_workers: Maximum number of shards written concurrently (default: one per shard)
+        raise_errors: Raise the sqlite3 error of a failed shard (after every shard was attempted)
+            instead of logging it and counting (0, 0) for that shard
+
+    Returns:
+        Dictionary mapping province slug to (new records, updated records)
+    """
+    if df.empty:
+        return {}
+
+    os.makedirs(shard_dir, exist_ok=True)
+    groups = group_by_shard(df, shard_dir)
+
+    def write_group(path):
+        slug = os.path.basename(path)[len(SHARD_PREFIX):-len(SHARD_SUFFIX)]
+        return slug, upsert_ads_df(groups[path], path, replace_existing=replace_existing, raise_errors=raise_errors)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(groups)) as executor:
+        results = dict(executor.map(write_group, groups))
+
+    for slug, (new_records, updated_records) in results.items():
+        logger.info(f"Shard {slug}: {new_records} new records, {updated_records} updated records")
+
+    return results
+
+
+def _sort_merged(df: pd.DataFrame, order_by: Optional[str]) -> pd.DataFrame:
+    """Apply a simple SQL ORDER BY clause (e.g. "price_value DESC, id") to a merged DataFrame."""
+    if not order_by or df.empty:
+        return df
+
+    columns = []
+    ascending = []
+    for term in order_by.split(','):
+        parts = term.split()
+        if not parts or parts[0] not in df.columns:
+            continue
+        columns.append(parts[0])
+        ascending.append(len(parts) < 2 or parts[1].upper() != 'DESC')
+
+    if not columns:
+        return df
+    return df.sort_values(columns, ascending=ascending, kind='mergesort', na_position='last')
+
+
+def read_ads_from_shards(
+    shard_dir: str,
+    provinces: Optional[List[str]] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    order_by: str = "created_at DESC",
+    limit: Optional[int] = None,
+    clean_data: bool = True,
+    max_workers: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Read real estate ads from the province shards, querying them in parallel.
+
+    The same query is run on every selected shard; the partial results are
+    concatenated, sorted again with `order_by` and cut to `limit`.
+
+    Args:
+        shard_dir: Directory containing the shard files
+        provinces: Optional list of provinces to query (default: all shards)
+        filters: Dictionary of column name to filter value
+        order_by: Column to sort by, with optional ASC/DESC
+        limit: Maximum number of records to return
+        clean_data: Whether to clean and transform the loaded data
+        max_workers: Maximum number of shards queried concurrently
+
+    Returns:
+        DataFrame containing the merged records
+    """
+    shards = list_shards(shard_dir)
+    if provinces:
+        wanted = {province_slug(p) for p in provinces}
+        shards = {slug: path for slug, path in shards.items() if slug in wanted}
+
+    if not shards:
+        logger.warning(f"No shards found in {shard_dir}")
+        return pd.DataFrame()
+
+    def read_shard(path):
+        return read_ads_from_sqlite(path, filters, order_by, limit, clean_data=False)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(shards)) as executor:
+        frames = [frame for frame in executor.map(read_shard, shards.values()) if not frame.empty]
+
+    if not frames:
+        return pd.DataFrame()
+
+    df = _sort_merged(pd.concat(frames, ignore_index=True), order_by)
+    if limit is not None:
+        df = df.head(limit)
+    df = df.reset_index(drop=True)
+    logger.info(f"Retrieved {len(df)} records from {len(shards)} shards")
+
+    if clean_data and not df.empty:
+        df = clean_df_from_sqlite(df)
+
+    return df
+
+
+def vacuum_shard(shard_dir: str, province: str) -> bool:
+    """
+    Run VACUUM on a single province shard.
+
+    Args:
+        shard_dir: Directory containing the shard files
+        province: Province whose shard should be vacuumed
+
+    Returns:
+        True if the shard was vacuumed, False otherwise
+    """
+    db_path = get_shard_path(shard_dir, province)
+    if not os.path.exists(db_path):
+        logger.error(f"Shard not found: {db_path}")
+        return False
+
+    try:
+        with get_connection(db_path) as conn:
+            conn.execute("VACUUM")
+        logger.info(f"Vacuumed shard {db_path}")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error vacuuming shard {db_path}: {e}")
+        return False
+
+
+def backup_shard(shard_dir: str, province: str, backup_path: str) -> bool:
+    """
+    Copy a single province shard to `backup_path` using SQLite's online backup API.
+
+    Args:
+        shard_dir: Directory containing the shard files
+        province: Province whose shard should be backed up
+        backup_path: Destination file for the backup
+
+    Returns:
+        True if the backup was written, False otherwise
+    """
+    db_path = get_shard_path(shard_dir, province)
+    if not os.path.exists(db_path):
+        logger.error(f"Shard not found: {db_path}")
+        return False
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(backup_path)), exist_ok=True)
+        with get_connection(db_path) as src:
+            dst = sqlite3.connect(backup_path)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+        logger.info(f"Backed up shard {db_path} to {backup_path}")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error backing up shard {db_path}: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if len(sys.argv) < 2:
+        print("Please provide a shard directory")
+        print("Usage: python sqlite_shards.py <shard_dir> [command] [province] [backup_path]")
+        print("Available commands:")
+        print("  list - Show province shards and their record counts")
+        print("  vacuum <province> - VACUUM a single province shard")
+        print("  backup <province> <backup_path> - Back up a single province shard")
+        sys.exit(1)
+
+    shard_dir = sys.argv[1]
+    command = sys.argv[2] if len(sys.argv) > 2 else "list"
+
+    if command == "list":
+        shards = list_shards(shard_dir)
+        print(f"Found {len(shards)} shards:")
+        for province, path in shards.items():
+            with get_connection(path) as conn:
+                count = conn.execute("SELECT COUNT(*) FROM real_estate_ads").fetchone()[0]
+            print(f"- {province}: {count} records ({os.path.getsize(path)} bytes)")
+
+    elif command == "vacuum" and len(sys.argv) > 3:
+        sys.exit(0 if vacuum_shard(shard_dir, sys.argv[3]) else 1)
+
+    elif command == "backup" and len(sys.argv) > 4:
+        sys.exit(0 if backup_shard(shard_dir, sys.argv[3], sys.argv[4]) else 1)
+
+    else:
+        print(f"Unknown command or missing arguments: {' '.join(sys.argv[2:])}")
+        print("Available commands: list, vacuum <province>, backup <province> <backup_path>")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# --- test_content_hash.py ---
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sinks import Sink
+from content_hash import (compute_content_hash, compute_content_hashes, count_written, filter_changed,
+                          mark_df_written)
+from conftest import make_ads
+
+
+class PartialSink(Sink):
+    """Sink rejecting the ads at the positions of `rejected` in every batch"""
+
+    name = "partial"
+
+    def __init__(self, rejected=(), **options):
+        super().__init__(**options)
+        self.rejected = set(rejected)
+
+    def write_batch(self, df):
+        positions = [position for position in range(len(df)) if position not in self.rejected]
+        return {"written": len(positions), "failed": len(df) - len(positions), "positions": positions}
+
+
+def test_hash_ignores_key_order_and_write_columns():
+    """NaN and None hash the same; key order and the columns set on write do not count"""
+    record = {"url": "a", "price_value": 1000, "floor": None}
+
+    assert compute_content_hash(record) == compute_content_hash({"floor": np.nan, "price_value": np.int64(1000),
+                                                                 "url": "a", "updated_at": "2026-01-01"})
+    assert compute_content_hash(record) != compute_content_hash(dict(record, price_value=1001))
+
+
+def test_unchanged_ads_are_skipped_per_sink(tmp_path):
+    """A sink skips the ads it already holds; another sink still gets them, and changed ads are sent again"""
+    index_path = str(tmp_path / "ad_hashes.db")
+    ads = make_ads(4, id=range(4), price_value=1000)
+    hashes = compute_content_hashes(ads)
+
+    assert mark_df_written(index_path, "sqlite:ads.db", ads, hashes) == 4
+    assert filter_changed(ads, index_path, "sqlite:ads.db", hashes)[1] == 4
+    assert filter_changed(ads, index_path, "csv:ads.csv", hashes)[1] == 0
+
+    ads.loc[2, "price_value"] = 900
+    changed, unchanged = filter_changed(ads, index_path, "sqlite:ads.db")
+    assert changed["id"].tolist() == [2] and unchanged == 3
+
+
+def test_only_the_written_positions_are_marked(tmp_path):
+    """Ads a sink failed to write stay pending, so the next crawl sends them again"""
+    index_path = str(tmp_path / "ad_hashes.db")
+    ads = make_ads(6, id=range(6), price_value=1000)
+    hashes = compute_content_hashes(ads)
+
+    with PartialSink(rejected={1}, batch_size=3) as sink:
+        positions = sink.write(ads)
+    assert positions == [0, 2, 3, 5]
+    mark_df_written(index_path, "partial", ads.iloc[positions], hashes)
+
+    changed, unchanged = filter_changed(ads, index_path, "partial", hashes)
+    assert changed["id"].tolist() == [1, 4] and unchanged == 4
+
+
+def test_rewritten_file_replaces_its_entries(tmp_path):
+    """replace=True forgets the ads that are no longer in a rewritten file"""
+    index_path = str(tmp_path / "ad_hashes.db")
+    ads = make_ads(5, id=range(5), price_value=1000)
+    hashes = compute_content_hashes(ads)
+
+    mark_df_written(index_path, "csv:ads.csv", ads, hashes)
+    mark_df_written(index_path, "csv:ads.csv", ads.head(3), hashes, replace=True)
+
+    assert count_written(index_path, "csv:ads.csv") == 3
+    assert count_written(index_path, "sqlite:ads.db") == 0
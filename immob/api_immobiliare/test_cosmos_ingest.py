@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# --- test_cosmos_ingest.py ---
+
+import sys
+import asyncio
+from pathlib import Path
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosBatchOperationError
+
+from cosmos_ingest import CosmosIngestor, prepare_cosmos_records, ingest_records
+
+
+class FakeAsyncContainer:
+    """In-memory stand-in for an azure.cosmos.aio container partitioned by /city."""
+
+    def __init__(self, throttle_first=0, bad_ids=()):
+        self.items = {}
+        self.calls = {"upsert_item": 0, "execute_item_batch": 0}
+        self.throttle_left = throttle_first
+        self.bad_ids = set(bad_ids)
+
+    def _maybe_throttle(self):
+        if self.throttle_left:
+            self.throttle_left -= 1
+            error = CosmosHttpResponseError(status_code=429, message="Request rate is large")
+            error.headers = {"x-ms-retry-after-ms": "1"}
+            raise error
+
+    async def upsert_item(self, body, response_hook=None):
+        self.calls["upsert_item"] += 1
+        await asyncio.sleep(0)
+        self._maybe_throttle()
+        if body["id"] in self.bad_ids:
+            raise CosmosHttpResponseError(status_code=400, message="Bad request")
+        self.items[(body["city"], body["id"])] = body
+        response_hook({"x-ms-request-charge": "10.5"}, body)
+        return body
+
+    async def execute_item_batch(self, batch_operations, partition_key, response_hook=None):
+        self.calls["execute_item_batch"] += 1
+        await asyncio.sleep(0)
+        self._maybe_throttle()
+        assert len(batch_operations) <= 100
+        bodies = [args[0] for _, args in batch_operations]
+        assert all(body["city"] == partition_key for body in bodies)
+        for index, body in enumerate(bodies):
+            if body["id"] in self.bad_ids:
+                raise CosmosBatchOperationError(error_index=index, headers={}, status_code=400, message="Bad request")
+        for body in bodies:
+            self.items[(body["city"], body["id"])] = body
+        response_hook({"x-ms-request-charge": str(5.0 * len(bodies))}, bodies)
+        return bodies
+
+
+def make_records(counts):
+    records = []
+    for city, count in counts.items():
+        records += [{"uuid": f"{city}-{i}", "city": city, "price_value": i} for i in range(count)]
+    return prepare_cosmos_records(records)
+
+
+def test_prepare_cosmos_records():
+    """Records get an id from their uuid and a fallback partition key"""
+    records = prepare_cosmos_records([{"uuid": "abc", "city": None}, {"uuid": None, "city": "Genova"}], "milano")
+    assert records[0]["id"] == "abc"
+    assert records[0]["city"] == "milano"
+    assert records[1]["id"] and records[1]["city"] == "Genova"
+
+
+def test_batches_grouped_by_partition_key():
+    """Records sharing a city go in transactional batches of at most 100 operations"""
+    container = FakeAsyncContainer()
+    records = make_records({"genova": 250, "milano": 3, "roma": 1})
+
+    stats = ingest_records(records, container=container, concurrency=4)
+
+    assert stats["successful"] == 254 and stats["failed"] == 0
+    assert len(container.items) == 254
+    assert container.calls["execute_item_batch"] == 4  # 100 + 100 + 50 for genova, 3 for milano
+    assert container.calls["upsert_item"] == 1          # roma has a single record
+    assert stats["request_charge"] == 253 * 5.0 + 10.5
+    assert stats["succeeded_positions"] == list(range(254))
+
+
+def test_throttled_requests_are_retried():
+    """429 responses are retried after x-ms-retry-after-ms"""
+    container = FakeAsyncContainer(throttle_first=3)
+    records = make_records({"genova": 10})
+
+    stats = ingest_records(records, container=container)
+
+    assert stats["successful"] == 10
+    assert stats["throttled"] == 3
+    assert len(container.items) == 10
+
+
+def test_failed_batch_falls_back_to_single_upserts():
+    """A bad record does not prevent the rest of its batch from being written"""
+    container = FakeAsyncContainer(bad_ids={"genova-2"})
+    records = make_records({"genova": 5})
+
+    stats = asyncio.run(CosmosIngestor(container).ingest(records))
+
+    assert stats["successful"] == 4 and stats["failed"] == 1
+    assert stats["succeeded_positions"] == [0, 1, 3, 4]
+    assert len(stats["errors"]) == 1
+
+
+def test_concurrency_is_bounded():
+    """No more than `concurrency` requests are in flight at the same time"""
+    container = FakeAsyncContainer()
+    in_flight = {"now": 0, "max": 0}
+    upsert = container.upsert_item
+
+    async def tracked_upsert(body, response_hook=None):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.001)
+        try:
+            return await upsert(body, response_hook=response_hook)
+        finally:
+            in_flight["now"] -= 1
+
+    container.upsert_item = tracked_upsert
+    records = make_records({f"city{i}": 1 for i in range(40)})
+
+    stats = ingest_records(records, container=container, concurrency=5)
+
+    assert stats["successful"] == 40
+    assert in_flight["max"] == 5
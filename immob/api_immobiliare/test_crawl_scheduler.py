@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# --- test_crawl_scheduler.py ---
+
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from crawl_scheduler import CrawlScheduler, allocate_intervals, update_change_rate
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, hours):
+        self.now += timedelta(hours=hours)
+
+
+def make_crawl(clock, changes_per_hour, requests=10):
+    """Crawl stand-in: churn proportional to the hours since the previous crawl of the scope"""
+    last = {}
+
+    def crawl(scope):
+        hours = (clock.now - last.get(scope["scope"], clock.now)).total_seconds() / 3600
+        last[scope["scope"]] = clock.now
+        return {"requests": requests, "new": round(changes_per_hour[scope["city"]] * hours), "changed": 0,
+                "delisted": 0}
+    return crawl
+
+
+def test_intervals_are_inversely_proportional_to_change_rates():
+    """The budget is shared in proportion to the change rates, within the interval bounds"""
+    scopes = [
+        {"scope": "busy", "change_rate": 10.0, "requests_per_crawl": 10},
+        {"scope": "quiet", "change_rate": 1.0, "requests_per_crawl": 10},
+        {"scope": "dead", "change_rate": 0.0, "requests_per_crawl": 10},
+        {"scope": "new", "change_rate": None, "requests_per_crawl": None}
+    ]
+    intervals = allocate_intervals(scopes, budget_per_hour=112, min_interval_hours=0.01,
+                                   max_interval_hours=48, default_interval_hours=5)
+
+    assert intervals["new"] == 5
+    assert abs(intervals["quiet"] / intervals["busy"] - 10) < 1e-9
+    assert abs(intervals["busy"] - 0.1) < 1e-3
+    assert intervals["dead"] == 48
+    # A lone scope does not spend the whole budget on crawls finding nothing new
+    assert allocate_intervals([{"scope": "slow", "change_rate": 0.1, "requests_per_crawl": 2}], 300) == {"slow": 10}
+    assert update_change_rate(None, 12, 4) == 3
+    assert update_change_rate(3, 0, 1, alpha=0.5) == 1.5
+
+
+def test_busy_scopes_are_crawled_more_often_within_the_budget(tmp_path):
+    """Over two simulated days, the busy scope gets most crawls and the hourly budget holds"""
+    clock = FakeClock()
+    db_path = str(tmp_path / "ads.db")
+    crawl = make_crawl(clock, {"genova": 40, "savona": 2})
+    scheduler = CrawlScheduler(db_path, crawl, budget_per_hour=40, min_interval_hours=0.25,
+                               default_interval_hours=2, clock=clock)
+    scheduler.add_scope("Genova", "rent")
+    scheduler.add_scope("Savona", "rent")
+
+    crawled = []
+    while clock.now < datetime(2024, 5, 3, tzinfo=timezone.utc):
+        stats = scheduler.run_once()
+        if stats is None:
+            clock.advance(0.05)
+            continue
+        crawled.append(stats["scope"])
+        assert scheduler.requests_last_hour() <= 40
+
+    assert crawled.count("genova|rent|") > 5 * crawled.count("savona|rent|")
+    # The state survives a restart
+    scopes = CrawlScheduler(db_path, crawl, clock=clock).scopes().set_index("scope")
+    assert abs(scopes.loc["genova|rent|", "change_rate"] - 40) < 5
+    assert scopes.loc["savona|rent|", "interval_hours"] > scopes.loc["genova|rent|", "interval_hours"]
+
+
+def test_failed_crawls_are_retried_without_changing_the_rate(tmp_path):
+    """A failing crawl is logged and retried after the shortest interval"""
+    clock = FakeClock()
+
+    def failing(scope):
+        raise ConnectionError("blocked")
+
+    scheduler = CrawlScheduler(str(tmp_path / "ads.db"), failing, min_interval_hours=1, clock=clock)
+    scheduler.add_scope("genova", "sale", macrozones=["10001"])
+
+    stats = scheduler.run_once()
+    assert stats["error"] == "blocked" and stats["change_rate"] is None
+    assert scheduler.run_once() is None
+    clock.advance(1)
+    assert scheduler.run_once()["scope"] == "genova|sale|10001"
+    assert scheduler.scopes().loc[0, "crawls"] == 0
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# --- test_crawl_sessions.py ---
+
+import sys
+import sqlite3
+from pathlib import Path
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from crawl_sessions import CrawlSession, crawl_scope, read_delisted, record_crawl
+
+
+def urls(*ids):
+    return [f"https://www.immobiliare.it/annunci/{i}/" for i in ids]
+
+
+def test_missing_ads_are_delisted_and_relisted(tmp_path):
+    """A complete crawl delists the unseen ads of its scope; seeing them again relists them"""
+    db_path = str(tmp_path / "ads.db")
+
+    first = record_crawl(db_path, "Genova", "rent", urls(1, 2, 3, 4), complete=True)
+    second = record_crawl(db_path, "genova", "rent", urls(1, 2, 3), complete=True)
+    assert (first["new"], first["delisted"]) == (4, 0)
+    assert (second["new"], second["delisted"]) == (0, 1)
+    assert read_delisted(db_path)["url"].tolist() == urls(4)
+
+    third = record_crawl(db_path, "genova", "rent", urls(1, 2, 3, 4, 5), complete=True)
+    assert (third["new"], third["relisted"], third["delisted"]) == (1, 1, 0)
+    assert read_delisted(db_path).empty
+
+
+def test_incomplete_or_truncated_crawls_do_not_delist(tmp_path):
+    """Partial crawls, crawls seeing too few ads and other scopes never delist"""
+    db_path = str(tmp_path / "ads.db")
+    record_crawl(db_path, "genova", "rent", urls(*range(10)), complete=True)
+
+    assert record_crawl(db_path, "genova", "rent", urls(0, 1, 2, 3, 4, 5), complete=False)["delisted"] == 0
+    truncated = record_crawl(db_path, "genova", "rent", urls(0, 1), complete=True)
+    assert truncated["delisted"] == 0 and truncated["skipped"]
+    assert record_crawl(db_path, "genova", "sale", urls(100), complete=True)["delisted"] == 0
+    assert record_crawl(db_path, "genova", "rent", urls(0), complete=True, macrozones=["10001"])["delisted"] == 0
+    assert read_delisted(db_path).empty
+
+
+def test_session_closed_by_an_error_is_incomplete(tmp_path):
+    """An exception during the crawl records the seen ads without delisting"""
+    db_path = str(tmp_path / "ads.db")
+    record_crawl(db_path, "genova", "rent", urls(1, 2), complete=True)
+
+    try:
+        with CrawlSession(db_path, "genova", "rent") as session:
+            session.add_seen(urls(1))
+            raise ConnectionError("network down")
+    except ConnectionError:
+        pass
+
+    assert session.stats["complete"] is False and session.stats["delisted"] == 0
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM crawl_sessions WHERE finished_at IS NOT NULL").fetchone()[0] == 2
+    assert crawl_scope("Genova", "rent", [10002, "10001"]) == "genova|rent|10001,10002"
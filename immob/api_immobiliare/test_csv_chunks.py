@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# --- test_csv_chunks.py ---
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from csv_chunks import (clear_progress, iter_csv_frames, iter_csv_ranges, load_progress, progress_path,
+                        read_csv_range, save_progress)
+
+
+def write_csv(path, count=7):
+    """Descriptions with embedded newlines, commas and escaped quotes"""
+    pd.DataFrame({
+        "url": [f"https://www.immobiliare.it/annunci/{i}/" for i in range(count)],
+        "description": [f'Trilocale {i},\nvista mare\n"luminoso"' if i % 2 else f"Bilocale {i}" for i in range(count)],
+        "price_value": [1000 + i for i in range(count)]
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+def test_ranges_never_cut_a_quoted_field(tmp_path):
+    """Newlines inside quotes do not end a record, so the ranges parse back to the whole file"""
+    csv_path = write_csv(tmp_path / "ads.csv")
+
+    ranges = list(iter_csv_ranges(csv_path, chunksize=2))
+    chunks = [read_csv_range(csv_path, start, end) for start, end in ranges]
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 2, 1]
+    assert ranges[-1][1] == Path(csv_path).stat().st_size
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), pd.read_csv(csv_path))
+
+
+def test_upload_resumes_from_the_saved_offset(tmp_path):
+    """A run interrupted after a chunk starts again from the next one, counting the rows already read"""
+    csv_path = write_csv(tmp_path / "ads.csv")
+
+    df, offset, rows = next(iter_csv_frames(csv_path, chunksize=3))
+    save_progress(csv_path, offset, rows)
+    stat = Path(csv_path).stat()
+    assert load_progress(csv_path) == {"offset": offset, "rows": 3, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    resumed = list(iter_csv_frames(csv_path, chunksize=3, resume=True))
+    assert [rows for _, _, rows in resumed] == [6, 7]
+    assert resumed[0][0]["price_value"].tolist() == [1003, 1004, 1005]
+
+    # A larger file, or one of the same size, replaced the CSV: the saved offset is ignored
+    write_csv(tmp_path / "ads.csv", count=9)
+    assert load_progress(csv_path) is None
+    save_progress(csv_path, offset, rows)
+    size = Path(csv_path).stat().st_size
+    Path(csv_path).write_bytes(Path(csv_path).read_bytes().replace(b"Bilocale", b"Villetta"))
+    os.utime(csv_path, ns=(0, stat.st_mtime_ns + 10**9))
+    assert Path(csv_path).stat().st_size == size
+    assert load_progress(csv_path) is None
+    clear_progress(csv_path)
+    assert not Path(progress_path(csv_path)).exists()
+
+
+def test_prefetched_chunks_keep_their_order(tmp_path):
+    """With an executor, chunks are parsed ahead but yielded in file order, at most `prefetch` ahead"""
+    csv_path = write_csv(tmp_path / "ads.csv", count=10)
+    double = lambda df: df.assign(price_value=df["price_value"] * 2)
+
+    with CountingExecutor(max_workers=2) as executor:
+        frames = iter_csv_frames(csv_path, chunksize=2, transform=double, executor=executor, prefetch=2)
+        first = next(frames)
+        assert executor.submitted == 3
+        chunks = [first] + list(frames)
+
+    assert [rows for _, _, rows in chunks] == [2, 4, 6, 8, 10]
+    assert pd.concat([df for df, _, _ in chunks])["price_value"].tolist() == [2 * (1000 + i) for i in range(10)]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# --- test_dedup.py ---
+
+import sys
+import random
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sqlite_helpers import init_database, upsert_ads_df
+from dedup import dedup_database, find_duplicate_clusters, geohash_cells, geohash_to_cell, normalize_text
+
+WORDS = [f"parola{i}" for i in range(2000)]
+
+
+def description(seed, reworded=0):
+    generator = random.Random(seed)
+    words = generator.choices(WORDS, k=100)
+    for _ in range(reworded):
+        words[generator.randrange(len(words))] = generator.choice(WORDS)
+    return "Splendido trilocale " + " ".join(words)
+
+
+def ad(ad_id, text_seed, reworded=0, rooms=3, latitude=44.4075, surface=80):
+    return {
+        "db_id": ad_id,
+        "url": f"https://www.immobiliare.it/annunci/{ad_id}/",
+        "title": "Trilocale via Roma",
+        "description": description(text_seed, reworded),
+        "contract": "sale",
+        "rooms": rooms,
+        "surface_m2": surface,
+        "latitude": latitude,
+        "longitude": 8.9339,
+        "geoHash": None
+    }
+
+
+def test_reworded_listings_are_clustered():
+    """The same flat with a reworded text is a duplicate, other flats are not"""
+    df = pd.DataFrame([
+        ad(1, text_seed=1),
+        ad(2, text_seed=1, reworded=5, latitude=44.4076, surface=82),
+        ad(3, text_seed=1, reworded=5),
+        ad(4, text_seed=1, rooms=4),             # different rooms
+        ad(5, text_seed=1, latitude=45.4642),    # Milano
+        ad(6, text_seed=1, surface=120),         # different surface
+        ad(7, text_seed=2)                       # different text
+    ])
+
+    clusters, stats = find_duplicate_clusters(df)
+
+    assert sorted(clusters["url"]) == df["url"][:3].tolist()
+    assert set(clusters["cluster_id"]) == {1} and set(clusters["cluster_size"]) == {3}
+    assert set(clusters["canonical_url"]) == {df["url"][0]}
+    assert stats["clusters"] == 1 and stats["duplicates"] == 2
+
+
+def test_text_and_geohash_helpers():
+    """Texts are normalised and geohash cells match the geohash strings"""
+    assert normalize_text("  Città, è BELLA!! 2° piano ") == "citta e bella 2 piano"
+    assert normalize_text(None) == ""
+    assert geohash_cells([57.64911], [10.40744], precision=11)[0] == geohash_to_cell("u4pruydqqvj", precision=11)
+    assert geohash_to_cell("u4p", precision=5) is None
+
+
+def test_dedup_database_and_view(tmp_path):
+    """Clusters are stored and the view keeps one listing per cluster"""
+    db_path = str(tmp_path / "ads.db")
+    init_database(db_path)
+    ads = pd.DataFrame([ad(1, text_seed=1), ad(2, text_seed=1, reworded=3), ad(3, text_seed=2)])
+    ads["city"] = "Genova"
+    upsert_ads_df(ads.drop(columns=["db_id", "geoHash"]), db_path)
+
+    stats = dedup_database(db_path, city="genova")
+    assert stats["written"] == 2
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM deduplicated_ads").fetchone()[0] == 2
+
+    # A new run replaces the clusters of the ads it covers
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE real_estate_ads SET rooms = 5 WHERE url = ?", (ads["url"][1],))
+    assert dedup_database(db_path, city="genova")["written"] == 0
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM listing_clusters").fetchone()[0] == 0
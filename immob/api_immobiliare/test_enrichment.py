@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# --- test_enrichment.py ---
+
+import sys
+import json
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sqlite_helpers import init_database, upsert_ads_df
+from rate_limit import RateLimiter
+from enrichment import enrich_ads, enrich_database, extract_details, fetch_details, listing_hashes, parse_next_data
+from test_photo_store import ThrottlingSession
+from conftest import make_ads
+
+REAL_ESTATE = {
+    "id": 1,
+    "properties": [{
+        "description": "Luminoso trilocale con terrazzo",
+        "energy": {"class": {"name": "D"}, "epi": "120 kWh/m² anno", "heatingType": "Autonomo"},
+        "costs": {"condominiumExpenses": "€ 1.200/anno"},
+        "ga4features": ["terrazzo", "cantina"],
+        "primaryFeatures": [{"name": "Ascensore", "value": True, "isVisible": True}],
+        "multimedia": {"photos": [{"urls": {"large": "https://pwm.im-cdn.it/1/xxl.jpg"}},
+                                  {"urls": {"large": "https://pwm.im-cdn.it/2/xxl.jpg"}}]}
+    }]
+}
+
+
+def detail_page(real_estate):
+    next_data = json.dumps({"props": {"pageProps": {"detailData": {"realEstate": real_estate}}}})
+    return f'<html><body><script id="__NEXT_DATA__" type="application/json">{next_data}</script></body></html>'
+
+
+class DetailHandler(BaseHTTPRequestHandler):
+    """Local stand-in of the detail pages: /annunci/<id>/, 404 for ids above 100"""
+    requests = []
+
+    def do_GET(self):
+        DetailHandler.requests.append(self.path)
+        ad_id = int(self.path.strip("/").split("/")[-1])
+        if ad_id > 100:
+            self.send_error(404)
+            return
+        body = detail_page(dict(REAL_ESTATE, id=ad_id)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def detail_server():
+    DetailHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DetailHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_only_new_or_changed_ads_are_fetched(tmp_path, detail_server):
+    """Details are fetched once per version of an ad; failures are retried a bounded number of times"""
+    db_path = str(tmp_path / "ads.db")
+    ads = make_ads([1, 2, 3, 101], url=f"{detail_server}/annunci/{{id}}/", title="Trilocale {id}", price_value=1000,
+                   rooms="3")
+
+    stats = enrich_ads(db_path, ads, workers=3, rate=None, max_attempts=2)
+    assert (stats["fetched"], stats["failed"], stats["unchanged"]) == (3, 1, 0)
+
+    # Same crawl again: only the failed ad is retried, then given up
+    DetailHandler.requests = []
+    assert enrich_ads(db_path, ads, rate=None, max_attempts=2)["failed"] == 1
+    assert enrich_ads(db_path, ads, rate=None, max_attempts=2)["unchanged"] == 4
+    assert DetailHandler.requests == ["/annunci/101/"]
+
+    # A changed price refetches that ad only
+    DetailHandler.requests = []
+    ads.loc[ads["url"].str.endswith("/2/"), "price_value"] = 950
+    stats = enrich_ads(db_path, ads, rate=None, max_attempts=2)
+    assert stats["fetched"] == 1 and DetailHandler.requests == ["/annunci/2/"]
+
+    with sqlite3.connect(db_path) as conn:
+        row = conn.execute(
+            "SELECT energy_class, condominium_fees, photo_count, status FROM ad_details WHERE url LIKE '%/1/'"
+        ).fetchone()
+    assert row == ("D", 1200.0, 2, "ok")
+
+
+def test_stored_ads_are_enriched_once(tmp_path, detail_server):
+    """Ads read back from the database hash like the crawled ones and get the enriched_ads view"""
+    db_path = str(tmp_path / "ads.db")
+    init_database(db_path)
+    ads = make_ads([1, 2], url=f"{detail_server}/annunci/{{id}}/", title="Trilocale {id}", price_value=1000, rooms="3")
+    upsert_ads_df(ads, db_path)
+    assert listing_hashes(ads).tolist() == listing_hashes(
+        pd.read_sql_query("SELECT * FROM real_estate_ads ORDER BY db_id", sqlite3.connect(db_path))
+    ).tolist()
+
+    enrich_ads(db_path, ads, rate=None)
+    assert enrich_database(db_path, rate=None)["unchanged"] == 2
+
+    with sqlite3.connect(db_path) as conn:
+        classes = conn.execute("SELECT energy_class FROM enriched_ads").fetchall()
+    assert classes == [("D",), ("D",)]
+
+
+def test_detail_parsing():
+    """The detail fields are flattened from the __NEXT_DATA__ of the page"""
+    details = extract_details(parse_next_data(detail_page(REAL_ESTATE)))
+
+    assert details["energy_class"] == "D" and details["heating_type"] == "Autonomo"
+    assert details["condominium_fees"] == 1200.0
+    assert json.loads(details["features"]) == ["terrazzo", "cantina"]
+    assert json.loads(details["primary_features"]) == {"Ascensore": True}
+    assert json.loads(details["photo_urls"])[1] == "https://pwm.im-cdn.it/2/xxl.jpg"
+    assert parse_next_data("<html>blocked</html>") is None
+
+
+def test_http_date_retry_after_fails_only_that_ad():
+    """A 429 with a date in Retry-After is reported as an error of that ad, not raised"""
+    rate_limiter = RateLimiter(rate=1000, burst=10)
+    url = "https://www.immobiliare.it/annunci/1/"
+
+    assert fetch_details(ThrottlingSession({url}), url, rate_limiter=rate_limiter) == (None, "HTTP 429")
+    assert rate_limiter.acquire() < 1
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# --- test_feature_store.py ---
+
+import sys
+import pickle
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sqlite_helpers import init_database, upsert_ads_df
+from feature_store import (build_features, compute_features, read_training_set, read_underpriced, score_ads,
+                           score_pending)
+from conftest import make_ads as base_ads
+
+
+class PricePerM2Model:
+    """Picklable stand-in for a fitted regressor: a fixed price per m², counting its predict calls"""
+    calls = 0
+
+    def __init__(self, price_per_m2):
+        self.price_per_m2 = price_per_m2
+
+    def predict(self, X):
+        PricePerM2Model.calls += 1
+        return X["surface_m2"].to_numpy(dtype=float) * self.price_per_m2
+
+
+def save_model(path, model):
+    with open(path, "wb") as file:
+        pickle.dump(model, file)
+    return str(path)
+
+
+def make_ads(prices, start=0, contract="sale"):
+    """Ads of 100 m², 2000 €/m² unless the price says otherwise"""
+    return base_ads(range(start, start + len(prices)), url=f"https://x/{contract}/{{id}}/", contract=contract,
+                    city="Genova", price_value=prices, surface="100 m²", rooms="3", bathrooms=1, floor_number="2",
+                    elevator=True, latitude=44.4071, longitude=8.9339, ga4features="Balcone, Cantina")
+
+
+def test_features_are_derived_in_bulk():
+    """Words, '5+', thousands separators and negated amenities are parsed; the hash follows the features"""
+    ads = pd.DataFrame({
+        "url": ["a", "b", "c", "d"],
+        "price_value": [100000, 200000, None, 50000],
+        "surface": ["1.200 m²", None, "80 m²", "45 m²"],
+        "surface_m2": [1, 95, None, None],
+        "rooms": ["5+", 3, "2", None],
+        "floor_number": ["piano rialzato", "3", None, "interrato (-2)"],
+        "floor": [None, None, "Seminterrato", None],
+        "elevator": [True, 0, None, "true"],
+        "latitude": [44.4071, 44.41, None, 44.40],
+        "longitude": [8.9339, 8.95, None, 8.93],
+        "ga4features": ["Terrazzo, Arredato", "Non arredato, Giardino privato", None, "Balcone"],
+        "ga4Garage": [None, "1 in box privato", None, None]
+    })
+    features = compute_features(ads).set_index("url")
+
+    assert features["surface_m2"].tolist() == [1200, 95, 80, 45]
+    assert features["rooms"].fillna(-9).tolist() == [5, 3, 2, -9]
+    assert features["floor_level"].tolist() == [0.5, 3, 0, -2]
+    assert features["elevator"].fillna(-9).tolist() == [1, 0, -9, 1]
+    assert features.loc["a", ["lat_bin", "lon_bin"]].tolist() == [4440, 893]
+    assert features.loc["a", ["has_terrace", "furnished", "has_garden", "has_garage"]].tolist() == [1, 1, 0, 0]
+    assert features.loc["b", ["has_terrace", "furnished", "has_garden", "has_garage"]].tolist() == [0, 0, 1, 1]
+    assert features["feature_hash"].nunique() == 4
+
+    repriced = compute_features(ads.assign(price_value=ads["price_value"] * 2, title="changed"))
+    assert (repriced["feature_hash"] != features["feature_hash"].values).sum() == 3  # "c" has no price
+
+
+def test_crawls_only_score_new_or_changed_ads(tmp_path):
+    """The first crawl scores every ad; an unchanged crawl none; a repriced ad is scored again"""
+    db_path = str(tmp_path / "ads.db")
+    model_path = save_model(tmp_path / "sale.pkl", PricePerM2Model(2000))
+    ads = make_ads([200000, 150000, 190000, 100000])
+
+    stats = score_ads(db_path, ads, model_path, threshold=0.2)
+    assert (stats["changed"], stats["scored"], stats["underpriced"]) == (4, 4, 2)
+    calls = PricePerM2Model.calls
+
+    stats = score_ads(db_path, ads, model_path, threshold=0.2)
+    assert (stats["unchanged"], stats["scored"]) == (4, 0)
+    assert PricePerM2Model.calls == calls
+
+    ads.loc[3, "price_value"] = 199000
+    stats = score_ads(db_path, pd.concat([ads, make_ads([120000], start=10)]), model_path, threshold=0.2)
+    assert (stats["changed"], stats["scored"], stats["underpriced"]) == (2, 2, 1)
+
+    underpriced = read_underpriced(db_path)
+    assert underpriced["url"].tolist() == ["https://x/sale/10/", "https://x/sale/1/"]
+    assert np.allclose(underpriced["price_ratio"], [0.6, 0.75])
+    assert underpriced["predicted_price"].tolist() == [200000, 200000]
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM ad_scores WHERE underpriced = 1").fetchone()[0] == 2
+
+
+def test_stored_ads_are_scored_in_batches(tmp_path):
+    """build_features derives the stored ads once; a model bundle scores its contract in batches"""
+    db_path = str(tmp_path / "ads.db")
+    init_database(db_path)
+    upsert_ads_df(pd.concat([make_ads([200000, 120000, 210000, 90000, 180000]),
+                             make_ads([800, 700], contract="rent")], ignore_index=True), db_path)
+
+    assert build_features(db_path, batch_size=2) == {"ads": 7, "batches": 4}
+    assert build_features(db_path, batch_size=2)["ads"] == 0
+    # The crawl and the database give the same features
+    stored = read_training_set(db_path, contract="sale").set_index("url")
+    assert stored.loc["https://x/sale/0/", ["surface_m2", "rooms", "floor_level", "elevator", "has_cellar"]].tolist() \
+        == [100, 3, 2, 1, 1]
+    assert score_ads(db_path, make_ads([200000]), save_model(tmp_path / "m.pkl", PricePerM2Model(1)))["changed"] == 0
+
+    model_path = save_model(tmp_path / "bundle.pkl", {"model": PricePerM2Model(20), "target": "price_per_m2",
+                                                      "features": ["surface_m2", "rooms"], "contract": "sale"})
+    calls = PricePerM2Model.calls
+    stats = score_pending(db_path, model_path, batch_size=2)
+    assert (stats["scored"], stats["underpriced"], stats["batches"]) == (5, 2, 3)
+    assert PricePerM2Model.calls - calls == 3
+    assert score_pending(db_path, model_path)["scored"] == 0
+
+    underpriced = read_underpriced(db_path, model_id=stats["model_id"], cities=["genova"])
+    assert underpriced["url"].tolist() == ["https://x/sale/3/", "https://x/sale/1/"]
+    assert set(underpriced["contract"]) == {"sale"}
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# --- test_fetch_ads.py ---
+
+import sys
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+import fetch_ads
+from conftest import make_ads
+
+
+def crawled_ads(ids, province="Genova"):
+    return make_ads(ids, id=ids, title="Ad {id}", city="Genova", province=province, contract="rent",
+                    price_value=1000, surface="80 m²")
+
+
+def crawl(monkeypatch, ads, **options):
+    """Run process_ads on a fixed crawl, without network access"""
+    def fake_fetch(**kwargs):
+        df = ads.copy()
+        df.attrs["crawl_complete"] = True
+        return df
+
+    monkeypatch.setattr(fetch_ads, "fetch_ads", fake_fetch)
+    config = {"city": "genova", "contract_type": "rent", "save_to_cosmos": False, "save_to_csv": False}
+    config.update(options)
+    return fetch_ads.process_ads(config).attrs["results"]
+
+
+def test_full_crawl_file_is_rewritten_when_ads_drop_out(tmp_path, monkeypatch):
+    """With --skip-unchanged the CSV is kept as is only while the crawl has exactly the same ads"""
+    options = {"output_path": str(tmp_path), "save_to_csv": True, "skip_unchanged": True,
+               "hash_index_path": str(tmp_path / "ad_hashes.db")}
+    csv_path = tmp_path / "ads_genova_rent.csv"
+
+    crawl(monkeypatch, crawled_ads([1, 2, 3]), **options)
+    written = csv_path.stat().st_mtime_ns
+    results = crawl(monkeypatch, crawled_ads([1, 2, 3]), **options)
+    assert results["csv"]["unchanged"] == 3 and csv_path.stat().st_mtime_ns == written
+
+    # Ad 3 was delisted: nothing changed among the others, but the file must lose it
+    crawl(monkeypatch, crawled_ads([1, 2]), **options)
+    assert pd.read_csv(csv_path)["id"].tolist() == [1, 2]
+    written = csv_path.stat().st_mtime_ns
+    crawl(monkeypatch, crawled_ads([1, 2]), **options)
+    assert csv_path.stat().st_mtime_ns == written
+
+
+def tables(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+
+
+def sharded_crawl(tmp_path):
+    """Ads of one crawl routed to two province shards"""
+    return pd.concat([crawled_ads([1, 2, 3]), crawled_ads([4], province="Savona")], ignore_index=True), {
+        "output_path": str(tmp_path), "save_to_sqlite": True, "sqlite_shard_dir": str(tmp_path / "shards"),
+        "sqlite_db_path": str(tmp_path / "ads.db")
+    }
+
+
+def test_delistings_are_tracked_in_each_shard(tmp_path, monkeypatch):
+    """listing_status is written next to the ads of each shard, and without SQLite the option fails"""
+    ads, options = sharded_crawl(tmp_path)
+    crawl(monkeypatch, ads, track_delistings=True, **options)
+    results = crawl(monkeypatch, ads[ads["id"] != 2], track_delistings=True, **options)
+
+    assert results["delistings"]["success"] and results["delistings"]["delisted"] == 1
+    genova, savona = (str(tmp_path / "shards" / f"ads_{name}.db") for name in ("genova", "savona"))
+    assert {"listing_status", "active_ads"} <= tables(genova) and "listing_status" in tables(savona)
+    with sqlite3.connect(genova) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM active_ads").fetchone()[0] == 2
+    assert not (tmp_path / "ads.db").exists()
+
+    results = crawl(monkeypatch, ads, track_delistings=True, output_path=str(tmp_path),
+                    sqlite_db_path=str(tmp_path / "ads.db"))
+    assert "--save-sqlite" in results["delistings"]["error"] and not (tmp_path / "ads.db").exists()
+
+
+def test_details_are_stored_in_each_shard(tmp_path, monkeypatch):
+    """ad_details is created next to the ads, so each shard gets its enriched_ads view"""
+    import enrichment
+    monkeypatch.setattr(enrichment, "fetch_details", lambda session, url, rate_limiter=None: (None, "HTTP 404"))
+    ads, options = sharded_crawl(tmp_path)
+
+    results = crawl(monkeypatch, ads, enrich_details=True, detail_rate=None, **options)
+
+    assert results["details"]["success"] and results["details"]["failed"] == 4
+    for name in ("genova", "savona"):
+        assert {"ad_details", "enriched_ads"} <= tables(str(tmp_path / "shards" / f"ads_{name}.db"))
+    assert not (tmp_path / "ads.db").exists()
+
+
+def test_ads_are_scored_in_each_shard(tmp_path, monkeypatch):
+    """The feature store of each shard holds the features of its own ads"""
+    import pickle
+    from test_feature_store import PricePerM2Model
+    model_path = tmp_path / "rent.pkl"
+    model_path.write_bytes(pickle.dumps(PricePerM2Model(15)))
+    ads, options = sharded_crawl(tmp_path)
+
+    results = crawl(monkeypatch, ads, score_model=str(model_path), underprice_threshold=0.1, **options)
+
+    assert results["scores"]["success"] and (results["scores"]["scored"], results["scores"]["underpriced"]) == (4, 4)
+    with sqlite3.connect(str(tmp_path / "shards" / "ads_savona.db")) as conn:
+        assert conn.execute("SELECT url FROM underpriced_ads").fetchall() == [("https://www.immobiliare.it/annunci/4/",)]
+    assert not (tmp_path / "ads.db").exists()
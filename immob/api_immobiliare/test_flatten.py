@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# --- test_flatten.py ---
+
+import sys
+import copy
+from pathlib import Path
+
+import pandas as pd
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from flatten import FLAT_AD_PLAN, columns_to_dataframe, extend_columns, flatten_page
+from helpers import create_ads_dataframe, extract_flat_ad_data
+from raw_payload import decompress_payload
+
+FULL_ITEM = {
+    "realEstate": {
+        "id": 101, "uuid": "u-101", "title": "Trilocale via Balbi", "type": "ad", "contract": "sale",
+        "typology": {"id": 4, "name": "Appartamento"}, "isNew": False, "luxury": False, "visibility": "premium",
+        "isProjectLike": False, "isMosaic": False, "propertiesCount": 1,
+        "price": {"visible": True, "value": 250000, "formattedValue": "€ 250.000", "minValue": "250000",
+                  "maxValue": "280000", "priceRange": "250-280k"},
+        "advertiser": {"agency": {"id": 7, "type": "agency", "displayName": "Agenzia Balbi", "label": "agenzia",
+                                  "agencyUrl": "https://agenzia"}},
+        "properties": [{
+            "surface": "85 m²", "rooms": "3", "bathrooms": "1", "elevator": True, "description": "Luminoso",
+            "caption": "Via Balbi", "typologyGA4Translation": "Appartamento", "matchSearch": True,
+            "ga4features": ["Balcone", "Cantina"], "ga4Heating": "Autonomo", "ga4Garage": None,
+            "floor": {"value": "2° piano", "floorOnlyValue": "2", "ga4FloorValue": "2"},
+            "location": {"address": "Via Balbi", "latitude": 44.41, "longitude": 8.92, "city": "Genova",
+                         "province": "Genova", "region": "Liguria", "macrozone": "Centro", "nation": {"name": "Italia"}},
+            "photo": {"id": 9, "caption": "Soggiorno", "urls": {"small": "s.jpg", "medium": "m.jpg", "large": "l.jpg"}},
+            "views": [{"id": 1, "name": "Mare"}, {"id": 2, "name": "Città"}]
+        }]
+    },
+    "seo": {"url": "https://www.immobiliare.it/annunci/101/"},
+    "idGeoHash": "spdz"
+}
+
+
+def make_items():
+    """A complete ad, one without properties, one with an empty photo and no features, and a non-ad item"""
+    no_properties = copy.deepcopy(FULL_ITEM)
+    no_properties["realEstate"].update(id=102, properties=[])
+    no_properties["seo"]["url"] = "https://www.immobiliare.it/annunci/102/"
+
+    bare = copy.deepcopy(FULL_ITEM)
+    bare["realEstate"]["id"] = 103
+    bare["realEstate"]["price"] = {"visible": False, "value": None, "formattedValue": "Prezzo su richiesta"}
+    bare["realEstate"]["properties"][0].update(photo={}, ga4features=[], views=[], floor=None)
+    del bare["realEstate"]["properties"][0]["location"]
+    bare["seo"]["url"] = "https://www.immobiliare.it/annunci/103/"
+
+    return [FULL_ITEM, no_properties, bare, {"realEstate": None, "seo": {"url": "banner"}}]
+
+
+def test_page_is_flattened_into_columns():
+    """Paths missing from an ad give None; features and views are joined"""
+    columns = flatten_page(make_items())
+    full, no_properties, bare = (dict(zip(columns, row)) for row in zip(*columns.values()))
+
+    assert list(columns) == FLAT_AD_PLAN.column_names
+    assert columns["id"] == [101, 102, 103]
+    assert {key: full[key] for key in ("price_max", "price_range", "floor_number", "nation", "photo_url_large")} == {
+        "price_max": "280000", "price_range": "250-280k", "floor_number": "2", "nation": "Italia",
+        "photo_url_large": "l.jpg"
+    }
+    assert (full["ga4features"], full["views"]) == ("Balcone, Cantina", "Mare, Città")
+
+    assert no_properties["title"] == "Trilocale via Balbi" and no_properties["agency_name"] == "Agenzia Balbi"
+    assert all(no_properties[key] is None for key in ("surface", "city", "floor", "photo_id", "ga4features"))
+
+    assert bare["price_value"] is None and bare["price_range"] is None and bare["price_formatted"] == "Prezzo su richiesta"
+    assert all(bare[key] is None for key in ("photo_id", "photo_url_small", "ga4features", "views", "floor", "city"))
+    assert bare["surface"] == "85 m²"
+
+
+def test_pages_accumulate_into_one_dataframe():
+    """Pages are appended column by column; raw_data holds the compressed realEstate and goes last"""
+    columns = {}
+    extend_columns(columns, flatten_page(make_items()[:2], include_raw=True))
+    extend_columns(columns, flatten_page(make_items()[2:], include_raw=True))
+
+    df = columns_to_dataframe(columns)
+    assert df.columns.tolist() == FLAT_AD_PLAN.column_names + ["raw_data"]
+    assert df["id"].tolist() == [101, 102, 103]
+    assert decompress_payload(df.loc[0, "raw_data"]) == FULL_ITEM["realEstate"]
+    assert columns_to_dataframe({}).empty
+
+
+def test_helpers_use_the_same_plan():
+    """create_ads_dataframe and extract_flat_ad_data give the columns of the plan"""
+    items = make_items()
+    df = create_ads_dataframe(items)
+
+    pd.testing.assert_frame_equal(df, pd.DataFrame([extract_flat_ad_data(item) for item in items[:3]]))
+    assert extract_flat_ad_data(items[3]) == {}
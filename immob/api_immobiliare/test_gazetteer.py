@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# --- test_gazetteer.py ---
+
+import sys
+from pathlib import Path
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+import gazetteer
+from gazetteer import Gazetteer, normalize_name, read_istat_csv
+
+SEED = {
+    "genova": {"idComune": "6846", "name": "Genova", "path": "/genova/"},
+    "savona": {"idComune": "7043", "name": "Savona", "path": "/savona/"},
+    "vado_ligure": {"idComune": "7051", "name": "Vado Ligure", "path": "/vado-ligure/"}
+}
+
+
+class CountingFetch:
+    """Stand-in for the autocomplete API."""
+
+    def __init__(self, results, fail=False):
+        self.results = results
+        self.fail = fail
+        self.queries = []
+
+    def __call__(self, query):
+        self.queries.append(query)
+        if self.fail:
+            raise ConnectionError("network down")
+        return self.results.get(normalize_name(query))
+
+
+def test_exact_and_typo_tolerant_matches(tmp_path):
+    """Names match regardless of case, accents and separators, and with typos"""
+    g = Gazetteer(tmp_path / "gazetteer.db", seed=SEED)
+
+    assert g.match("GENOVA")["idComune"] == "6846"
+    assert g.match("vado-ligure")["idComune"] == "7051"
+    assert g.match("Genva")["idComune"] == "6846"
+    assert g.match("Vado Ligur")["idComune"] == "7051"
+    assert g.match("Palermo") is None
+    assert normalize_name("Sant'Olcese") == "sant olcese"
+
+
+def test_autocomplete_results_are_cached(tmp_path, monkeypatch):
+    """The network is only used on a cache miss, and results survive a restart until the TTL"""
+    db_path = tmp_path / "gazetteer.db"
+    fetch = CountingFetch({"milano": {"idComune": "8042", "name": "Milano", "path": "/milano/"}})
+
+    assert Gazetteer(db_path, seed=SEED).resolve("Milano", fetch)["idComune"] == "8042"
+    assert Gazetteer(db_path).resolve("milano", fetch)["idComune"] == "8042"
+    assert Gazetteer(db_path).resolve("Atlantide", fetch) is None
+    assert Gazetteer(db_path).resolve("Atlantide", fetch) is None
+    assert fetch.queries == ["Milano", "Atlantide"]
+
+    # "Not found" expires after the negative TTL
+    now = gazetteer.time.time()
+    monkeypatch.setattr(gazetteer.time, "time", lambda: now + gazetteer.DEFAULT_NEGATIVE_TTL + 1)
+    Gazetteer(db_path).resolve("Atlantide", fetch)
+    assert fetch.queries == ["Milano", "Atlantide", "Atlantide"]
+
+
+def test_network_errors_are_not_cached(tmp_path):
+    """A failed request is retried on the next lookup"""
+    db_path = tmp_path / "gazetteer.db"
+    failing = CountingFetch({}, fail=True)
+
+    assert Gazetteer(db_path).resolve("Milano", failing) is None
+
+    fetch = CountingFetch({"milano": {"idComune": "8042", "name": "Milano", "path": "/milano/"}})
+    assert Gazetteer(db_path).resolve("Milano", fetch)["idComune"] == "8042"
+
+
+def test_near_miss_names_are_asked_to_the_api(tmp_path):
+    """A real comune one letter away from a known one is not taken for it while the API can answer"""
+    db_path = tmp_path / "gazetteer.db"
+    fetch = CountingFetch({"genola": {"idComune": "4711", "name": "Genola", "path": "/genola/"}})
+    g = Gazetteer(db_path, seed=SEED)
+
+    assert g.resolve("Genola", fetch)["idComune"] == "4711"
+    assert g.resolve("Genova", fetch)["idComune"] == "6846"
+    assert fetch.queries == ["Genola"]
+    assert Gazetteer(db_path).resolve("genola")["idComune"] == "4711"
+
+    # Nothing from the API, or no API: the closest local comune is the last resort
+    assert g.resolve("Savogna", fetch)["idComune"] == "7043"
+    assert fetch.queries == ["Genola", "Savogna", "Savona"]
+    assert Gazetteer(tmp_path / "offline.db", seed=SEED).resolve("Savogna", CountingFetch({}, fail=True))["name"] \
+        == "Savona"
+
+
+def test_istat_import_corrects_typos_before_the_api(tmp_path):
+    """Imported comuni give the API a second try with the right spelling"""
+    csv_path = tmp_path / "comuni.csv"
+    csv_path.write_text(
+        "Codice Comune formato alfanumerico;Denominazione in italiano;Denominazione Regione;Sigla automobilistica\n"
+        "010047;Sant'Olcese;Liguria;GE\n"
+        "015146;Milano;Lombardia;MI\n",
+        encoding="latin-1"
+    )
+    g = Gazetteer(tmp_path / "gazetteer.db")
+    assert g.import_comuni(read_istat_csv(str(csv_path))) == 2
+    fetch = CountingFetch({"sant olcese": {"idComune": "6900", "name": "Sant'Olcese", "path": "/sant-olcese/"}})
+
+    assert g.resolve("santolcese", fetch)["idComune"] == "6900"
+    assert fetch.queries == ["santolcese", "Sant'Olcese"]
+    assert g.match("Sant Olcese")["idComune"] == "6900"
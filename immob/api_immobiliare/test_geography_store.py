@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# --- test_geography_store.py ---
+
+import os
+import sys
+import json
+from pathlib import Path
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from geography_store import GeographyStore, sync_from_json, zone_key
+
+CITIES = {
+    "genova": {
+        "idComune": "6846", "name": "Genova", "path": "/genova/",
+        "province": "Genova", "region": "Liguria",
+        "macrozones": {
+            "centro": {"id": "10001", "name": "Centro"},
+            "san_fruttuoso": {
+                "id": "10006", "name": "San Fruttuoso",
+                "microzones": {"quezzi": {"id": "20001", "name": "Quezzi"}}
+            }
+        }
+    },
+    "savona": {"idComune": "7052", "name": "Savona", "path": "/savona/", "macrozones": {}}
+}
+
+
+def test_import_export_round_trip(tmp_path):
+    """Exporting an imported common_cities.json gives the same dictionary"""
+    store = GeographyStore(tmp_path / "geography.db")
+
+    assert store.import_common_cities(CITIES) == 2
+    assert store.export_common_cities() == CITIES
+    assert list(store.comuni()) == ["genova", "savona"]
+
+    # Importing again replaces the content
+    assert store.import_common_cities({"savona": CITIES["savona"]}) == 1
+    assert list(store.export_common_cities()) == ["savona"]
+
+
+def test_lookups_by_key_and_name(tmp_path):
+    """Comuni and zones are found by key or by case-insensitive name"""
+    store = GeographyStore(tmp_path / "geography.db")
+    store.import_common_cities(CITIES)
+
+    assert store.get_city("GENOVA")["idComune"] == "6846"
+    assert store.get_city("Atlantide") is None
+    assert [zone["key"] for zone in store.macrozones("genova")] == ["centro", "san_fruttuoso"]
+    assert store.macrozones("savona") == []
+    assert store.find_macrozone("genova", "san fruttuoso")["id"] == "10006"
+    assert store.find_macrozone("genova", "San-Fruttuoso")["id"] == "10006"
+    assert store.find_macrozone("genova", "Foce") is None
+    assert store.microzones("genova", "san_fruttuoso")[0]["name"] == "Quezzi"
+    assert zone_key("Sampierdarena - Centro") == "sampierdarena_centro"
+
+
+def test_sync_from_json_only_when_the_file_changes(tmp_path):
+    """The store is rebuilt from common_cities.json only after the file changed"""
+    json_path = tmp_path / "common_cities.json"
+    json_path.write_text(json.dumps({"savona": CITIES["savona"]}))
+    store = GeographyStore(tmp_path / "geography.db")
+
+    assert sync_from_json(store, json_path)
+    assert not sync_from_json(store, json_path)
+
+    json_path.write_text(json.dumps(CITIES))
+    os.utime(json_path, ns=(0, 10**18))
+    assert sync_from_json(store, json_path)
+    assert store.get_city("genova") is not None
+
+
+def test_malformed_entries_are_skipped(tmp_path):
+    """An entry without idComune or with a broken zone is left out; a file that is not an object is rejected"""
+    json_path = tmp_path / "common_cities.json"
+    json_path.write_text(json.dumps(dict(CITIES, atlantide={"name": "Atlantide"},
+                                         imperia={"idComune": "7031", "macrozones": {"centro": {"name": "Centro"}}})))
+    store = GeographyStore(tmp_path / "geography.db")
+
+    assert sync_from_json(store, json_path)
+    assert list(store.comuni()) == ["genova", "savona"]
+    assert store.find_macrozone("genova", "Centro")["id"] == "10001"
+
+    json_path.write_text(json.dumps([CITIES]))
+    os.utime(json_path, ns=(0, 10**18))
+    assert not sync_from_json(store, json_path)
+    assert list(store.comuni()) == ["genova", "savona"]
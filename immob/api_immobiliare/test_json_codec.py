@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# --- test_json_codec.py ---
+
+import sys
+import typing
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+import json_codec
+from test_validation import make_page
+
+BACKENDS = [name for name in json_codec.BACKENDS
+            if name == "json" or getattr(json_codec, name) is not None]
+
+
+def test_backend_selection(monkeypatch):
+    """orjson, then msgspec, then the standard library; IMMOB_JSON_BACKEND forces an available one"""
+    monkeypatch.delenv("IMMOB_JSON_BACKEND", raising=False)
+    monkeypatch.setattr(json_codec, "orjson", object())
+    monkeypatch.setattr(json_codec, "msgspec", object())
+    assert json_codec._select_backend() == "orjson"
+
+    monkeypatch.setattr(json_codec, "orjson", None)
+    assert json_codec._select_backend() == "msgspec"
+    monkeypatch.setenv("IMMOB_JSON_BACKEND", "orjson")  # not installed: automatic selection
+    assert json_codec._select_backend() == "msgspec"
+    monkeypatch.setenv("IMMOB_JSON_BACKEND", " JSON ")
+    assert json_codec._select_backend() == "json"
+
+    monkeypatch.delenv("IMMOB_JSON_BACKEND")
+    monkeypatch.setattr(json_codec, "msgspec", None)
+    assert json_codec._select_backend() == "json"
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_round_trips(backend, monkeypatch, tmp_path):
+    """Every backend writes the same values: ISO dates, numpy scalars as numbers, NaN as null, UTF-8 text"""
+    monkeypatch.setattr(json_codec, "BACKEND", backend)
+    record = {
+        "city": "Forlì", "crawled_at": datetime(2026, 10, 19, 8, 30, 5), "updated_at": pd.Timestamp("2026-10-19 09:00"),
+        "day": date(2026, 10, 19), "rooms": np.int64(3), "surface": np.float64(82.5), "price": float("nan"),
+        "flags": (True, None), "ok": np.bool_(True)
+    }
+    expected = {
+        "city": "Forlì", "crawled_at": "2026-10-19T08:30:05", "updated_at": "2026-10-19T09:00:00", "day": "2026-10-19",
+        "rooms": 3, "surface": 82.5, "price": None, "flags": [True, None], "ok": True
+    }
+
+    data = json_codec.dumps(record)
+    assert "Forlì".encode("utf-8") in data
+    assert json_codec.loads(data) == expected
+    assert json_codec.loads(data.decode("utf-8")) == expected
+
+    path = tmp_path / "records.json"
+    json_codec.dump_file([record], path, indent=2)
+    assert json_codec.load_file(path) == [expected]
+    assert path.read_text(encoding="utf-8").startswith("[\n  {")
+
+
+def test_typed_pages_follow_the_pydantic_models():
+    """The Structs of fast_models.py have the fields, types and defaults of models.py"""
+    msgspec = pytest.importorskip("msgspec")
+    import models
+    import fast_models
+    from pydantic import BaseModel
+
+    def type_name(annotation):
+        args = typing.get_args(annotation)
+        if not args:
+            return getattr(annotation, "__name__", str(annotation))
+        return f"{typing.get_origin(annotation)}[{', '.join(type_name(arg) for arg in args)}]"
+
+    pydantic_models = {name: model for name, model in vars(models).items()
+                       if isinstance(model, type) and issubclass(model, BaseModel) and model is not BaseModel
+                       and name != "ImmobiliareResponse"}
+    for name, model in pydantic_models.items():
+        struct = getattr(fast_models, name)
+        expected = {field: (type_name(info.annotation), info.is_required())
+                    for field, info in model.model_fields.items()}
+        actual = {field.name: (type_name(field.type), field.required) for field in msgspec.structs.fields(struct)}
+        assert actual == expected, name
+
+
+def test_typed_decoding_matches_the_validated_page():
+    """decode_page(typed=True) gives the same ads as pydantic, and rejects an invalid page"""
+    msgspec = pytest.importorskip("msgspec")
+    from validation import get_page_adapter
+
+    page = make_page(3)
+    data = json_codec.dumps({"results": page, "maxPages": 4, "count": 75})
+
+    typed = json_codec.decode_page(data, typed=True)
+    assert (typed.maxPages, typed.count) == (4, 75)
+    assert msgspec.to_builtins(typed.results) == [item.model_dump() for item in get_page_adapter().validate_python(page)]
+    assert json_codec.decode_page(data) == json_codec.loads(data)
+
+    with pytest.raises(msgspec.ValidationError):
+        json_codec.decode_page(json_codec.dumps({"results": make_page(2, broken={1})}), typed=True)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_default_writes_dates_like_json_dump(backend, monkeypatch):
+    """default=str gives the dates of json.dump(default=str), with numpy scalars still numbers"""
+    monkeypatch.setattr(json_codec, "BACKEND", backend)
+    report = {"started": datetime(2026, 10, 19, 8, 30, 5), "ended": pd.Timestamp("2026-10-19 09:00"),
+              "successful": np.int64(25)}
+
+    assert json_codec.loads(json_codec.dumps(report, indent=2, default=str)) == {
+        "started": "2026-10-19 08:30:05", "ended": "2026-10-19 09:00:00", "successful": 25
+    }
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# --- test_market_analytics.py ---
+
+import sys
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sqlite_helpers import init_database, upsert_ads_df
+from crawl_sessions import init_crawl_tables
+from market_analytics import price_per_m2_stats, rent_yield, room_distribution
+from conftest import make_ads as base_ads
+
+
+def make_ads(city, zone, contract, price_per_m2, start=0, rooms=3):
+    """One ad of 50, 60, ... m² per price per m²"""
+    surfaces = 50 + 10 * np.arange(len(price_per_m2))
+    return base_ads(range(start, start + len(price_per_m2)), url=f"https://x/{city}/{zone}/{contract}/{{id}}/",
+                    title="Trilocale", city=city, macrozone=zone, contract=contract, surface_m2=surfaces,
+                    price_value=np.asarray(price_per_m2, dtype=float) * surfaces, rooms=rooms)
+
+
+def make_db(tmp_path):
+    db_path = str(tmp_path / "ads.db")
+    init_database(db_path)
+    upsert_ads_df(pd.concat([
+        make_ads("Genova", "Centro", "sale", [2000, 2500, 3000, 3500, 4000, 4500]),
+        make_ads("Genova", "Centro", "rent", [10, 12, 12.5, 15, 20, 11], rooms=2),
+        make_ads("Genova", "Foce", "sale", [3000, 3000, 3000, 3000, 3000]),
+        make_ads("Genova", "Foce", "rent", [15, 15, 15, 15]),  # Fewer rent ads than min_ads
+        make_ads("Savona", "Centro", "sale", [1500, 1800], rooms="5+")
+    ], ignore_index=True), db_path)
+    return db_path
+
+
+def test_price_per_m2_quantiles_match_numpy(tmp_path):
+    """Grouped statistics equal numpy's on each group; tiny surfaces and delisted ads are left out"""
+    db_path = make_db(tmp_path)
+    upsert_ads_df(pd.DataFrame({"url": ["https://x/box/"], "city": "Genova", "macrozone": "Centro",
+                                "contract": "sale", "surface_m2": [5], "price_value": [90000]}), db_path)
+
+    stats = price_per_m2_stats(db_path).set_index(["city", "contract", "macrozone"])
+    expected = [2000, 2500, 3000, 3500, 4000, 4500]
+    row = stats.loc[("Genova", "sale", "Centro")]
+    assert row["ads"] == 6 and abs(row["mean"] - np.mean(expected)) < 1e-6
+    assert np.allclose(row[["p10", "p25", "p50", "p75", "p90"]].tolist(),
+                       np.quantile(expected, [0.1, 0.25, 0.5, 0.75, 0.9]))
+    assert price_per_m2_stats(db_path, by="city", cities=["SAVONA"])["ads"].tolist() == [2]
+
+    # A delisted ad no longer counts
+    init_crawl_tables(db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO listing_status VALUES ('https://x/Genova/Centro/sale/5/', 'genova|sale|', "
+                     "'2024-05-01', '2024-05-01', 1, '2024-05-02')")
+    sale = price_per_m2_stats(db_path, by="city", contract="sale", cities="genova")
+    assert sale["ads"].tolist() == [10]
+    assert price_per_m2_stats(db_path, by="city", contract="sale", cities="genova", active_only=False)["ads"].tolist() == [11]
+
+
+def test_rent_yield_joins_rent_and_sale_by_zone(tmp_path):
+    """Yield = 12 x median rent per m² / median sale price per m², for zones with enough ads on both sides"""
+    db_path = make_db(tmp_path)
+
+    yields = rent_yield(db_path)
+    assert yields[["city", "macrozone"]].values.tolist() == [["Genova", "Centro"]]
+    row = yields.iloc[0]
+    assert (row["rent_ads"], row["sale_ads"]) == (6, 6)
+    assert abs(row["gross_yield_pct"] - 100 * 12 * np.median([10, 12, 12.5, 15, 20, 11]) / 3250) < 1e-9
+
+    assert rent_yield(db_path, min_ads=4)["macrozone"].tolist() == ["Foce", "Centro"]
+
+
+def test_reports_are_cached_per_crawl_date_until_the_data_changes(tmp_path):
+    """The second report is read from analytics_cache; a new ad invalidates it"""
+    db_path = make_db(tmp_path)
+
+    rooms = room_distribution(db_path, by=["city", "macrozone"])
+    assert not rooms.attrs["cached"]
+    assert rooms.set_index(["city", "macrozone"]).loc[("Genova", "Centro"), ["2", "3", "ads"]].tolist() == [6, 6, 12]
+    assert "Savona" not in rooms["city"].tolist()  # "5+" is stored as NULL by the ads writer
+
+    cached = room_distribution(db_path, by=["city", "macrozone"])
+    assert cached.attrs["cached"] and cached.attrs["crawl_date"] == rooms.attrs["crawl_date"]
+    pd.testing.assert_frame_equal(cached, rooms, check_dtype=False)
+    shares = room_distribution(db_path, by="city", shares=True).set_index("city")
+    assert abs(shares.loc["Genova", "3"] - 15 / 21) < 1e-9
+
+    upsert_ads_df(make_ads("Genova", "Centro", "sale", [2800], start=100, rooms=7), db_path)
+    updated = room_distribution(db_path, by=["city", "macrozone"])
+    assert not updated.attrs["cached"]
+    assert updated.set_index(["city", "macrozone"]).loc[("Genova", "Centro"), "5+"] == 1
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM analytics_cache WHERE report = 'room_distribution'").fetchone()[0] == 2
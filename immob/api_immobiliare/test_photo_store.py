@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# --- test_photo_store.py ---
+
+import os
+import sys
+import sqlite3
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sqlite_helpers import init_database, upsert_ads_df
+from photo_store import PhotoStore, dhash, fetch_ad_photos, hamming_distances
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def photo_server(tmp_path):
+    """Local stand-in of the image CDN serving the files of a directory"""
+    served = tmp_path / "served"
+    served.mkdir()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(served)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield served, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_photos_are_stored_once_and_resumed(tmp_path, photo_server):
+    """Identical photos share one file, stored photos are skipped and failures retried"""
+    served, base_url = photo_server
+    (served / "a.jpg").write_bytes(b"same image")
+    (served / "b.jpg").write_bytes(b"same image")
+    (served / "c.jpg").write_bytes(b"other image")
+    urls = [f"{base_url}/a.jpg", f"{base_url}/b.jpg", f"{base_url}/c.jpg", f"{base_url}/missing.jpg"]
+    store = PhotoStore(str(tmp_path / "photos"))
+
+    stats = store.fetch(urls, workers=4, rate=None)
+    assert (stats["downloaded"], stats["stored"], stats["deduplicated"], stats["failed"]) == (3, 2, 1, 1)
+    assert store.get(urls[0]) == store.get(urls[1])
+    assert Path(store.get(urls[0])).read_bytes() == b"same image"
+    assert len([name for _, _, files in os.walk(store.root) for name in files if name.endswith(".jpg")]) == 2
+
+    # A second run only retries the failed photo, until it gives up
+    (served / "missing.jpg").write_bytes(b"late image")
+    stats = store.fetch(urls, rate=None, max_attempts=2)
+    assert (stats["skipped"], stats["downloaded"], stats["failed"]) == (3, 1, 0)
+    assert store.fetch(urls, rate=None)["skipped"] == 4
+
+
+def test_ad_photos_from_the_database(tmp_path, photo_server):
+    """The photos of the ads of a database are downloaded and linked to the ads"""
+    served, base_url = photo_server
+    (served / "1.jpg").write_bytes(b"photo 1")
+    db_path = str(tmp_path / "ads.db")
+    init_database(db_path)
+    upsert_ads_df(pd.DataFrame({
+        "url": ["https://www.immobiliare.it/annunci/1/", "https://www.immobiliare.it/annunci/2/"],
+        "photo_url_medium": [f"{base_url}/1.jpg", f"{base_url}/1.jpg"],
+    }), db_path)
+
+    stats = fetch_ad_photos(db_path, str(tmp_path / "photos"), rate=None)
+
+    assert (stats["requested"], stats["downloaded"]) == (1, 1)
+    with sqlite3.connect(str(tmp_path / "photos" / "photos.db")) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM ad_photos WHERE size = 'medium'").fetchone()[0] == 2
+
+
+def test_perceptual_hash_finds_reencoded_photos(tmp_path):
+    """A resized and re-encoded photo keeps a close dHash, another photo does not"""
+    Image = pytest.importorskip("PIL.Image")
+
+    def photo(seed):
+        # Smooth random image, upscaled from a coarse grid like a blurred photo
+        pixels = np.random.RandomState(seed).randint(0, 255, (12, 12, 3), dtype=np.uint8)
+        return Image.fromarray(pixels).resize((256, 256), Image.BICUBIC)
+
+    def encoded(image, size, quality):
+        buffer = BytesIO()
+        image.resize(size).save(buffer, format="JPEG", quality=quality)
+        return buffer.getvalue()
+
+    original = dhash(encoded(photo(1), (256, 256), 95))
+    reposted = dhash(encoded(photo(1), (180, 180), 60))
+    other = dhash(encoded(photo(2), (256, 256), 95))
+
+    distances = hamming_distances(original, [reposted, other])
+    assert distances[0] <= 6 < distances[1]
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+
+class ThrottlingSession:
+    """Session answering 429 with an HTTP-date Retry-After for the URLs of `throttled`"""
+
+    def __init__(self, throttled):
+        self.throttled = throttled
+
+    def get(self, url, **kwargs):
+        if url in self.throttled:
+            return FakeResponse(429, headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        return FakeResponse(200, b"image " + url.encode(), {"Content-Type": "image/jpeg"})
+
+
+def test_http_date_retry_after_does_not_abort_the_run(tmp_path):
+    """A 429 with a date in Retry-After fails that photo only"""
+    store = PhotoStore(str(tmp_path / "photos"))
+    urls = ["https://cdn/a.jpg", "https://cdn/b.jpg"]
+
+    stats = store.fetch(urls, rate=1000, session=ThrottlingSession({urls[0]}))
+
+    assert (stats["downloaded"], stats["failed"]) == (1, 1)
+    assert store.get(urls[1]) is not None and store.get(urls[0]) is None
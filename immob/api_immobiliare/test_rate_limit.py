@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# --- test_rate_limit.py ---
+
+import sys
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from pathlib import Path
+
+import pytest
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+import rate_limit
+import populate_all_zones
+from rate_limit import MAX_RETRY_AFTER, RateLimiter, retry_after_seconds
+from populate_zones import query_zone_data
+
+
+class FakeClock:
+    """Stand-in for the time module: sleeping moves the clock forward"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.content = json.dumps(data).encode("utf-8")
+        self.text = self.content.decode("utf-8")
+        self.headers = headers or {}
+
+
+class FakeSession:
+    """Session returning the given responses in order"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+def zone(city, label, zone_id):
+    return {"id": zone_id, "type": 3, "label": label, "keyurl": label.lower().replace(" ", "-"),
+            "parents": [{"type": 2, "id": f"id-{city}", "label": city.title(), "keyurl": city}]}
+
+
+def test_retry_after_seconds_or_http_date():
+    """Retry-After is read as seconds or as an HTTP date, with a default for anything else"""
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+
+    assert retry_after_seconds({"Retry-After": "12"}, 10) == 12
+    assert 55 <= retry_after_seconds({"Retry-After": in_a_minute}, 10) <= 60
+    assert retry_after_seconds({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, 10) == 0
+    assert retry_after_seconds({"Retry-After": "soon"}, 10) == 10
+    assert retry_after_seconds({}, 30) == 30
+    assert retry_after_seconds({"Retry-After": "86400"}, 10) == MAX_RETRY_AFTER
+
+
+def test_token_bucket_spaces_requests(clock):
+    """A burst goes out at once, then requests are spaced by 1/rate; idle time refills only the burst"""
+    limiter = RateLimiter(rate=2, burst=2)
+
+    assert [limiter.acquire() for _ in range(4)] == [0, 0, 0.5, 0.5]
+    assert clock.now == 1.0
+
+    clock.now += 60
+    assert [limiter.acquire() for _ in range(3)] == [0, 0, 0.5]
+
+
+def test_pause_delays_every_request(clock):
+    """After a pause the next request waits the pause plus its own slot"""
+    limiter = RateLimiter(rate=2, burst=2)
+    limiter.acquire()
+
+    limiter.pause(3)
+
+    assert limiter.acquire() == 3.5
+    assert limiter.acquire() == 0.5
+
+
+def test_query_zone_data_retries_after_429(clock):
+    """A 429 pauses the shared limiter for Retry-After seconds and the query is sent again"""
+    limiter = RateLimiter(rate=10)
+    zones = [zone("genova", "Centro Storico", 10)]
+    session = FakeSession([FakeResponse(429, headers={"Retry-After": "2"}), FakeResponse(200, zones)])
+
+    assert query_zone_data("Genova", session=session, rate_limiter=limiter) == zones
+    assert session.calls == 2 and clock.now == pytest.approx(2.1)
+
+    session = FakeSession([FakeResponse(429, headers={"Retry-After": "2"})] * 3)
+    assert query_zone_data("Genova", session=session, rate_limiter=limiter, max_attempts=3) == []
+    assert session.calls == 3
+
+
+def test_concurrent_population_saves_once(tmp_path, monkeypatch):
+    """Cities are merged as they complete and the file is written once, also when a query fails"""
+    file_path = str(tmp_path / "common_cities.json")
+    saves = []
+    save_common_cities = populate_all_zones.save_common_cities
+    monkeypatch.setattr(populate_all_zones, "save_common_cities",
+                        lambda data, path=None: saves.append(path) or save_common_cities(data, path))
+
+    def fake_query(city_name, max_level, delay_range, session, rate_limiter):
+        if city_name == "Savona":
+            time.sleep(0.2)  # completes after the other cities
+            raise RuntimeError("connection reset")
+        return [zone(city_name.lower(), f"{city_name} Centro", len(city_name))]
+
+    monkeypatch.setattr(populate_all_zones, "query_zone_data", fake_query)
+    def make_cities():
+        return {key: {"idComune": f"id-{key}", "name": key.title()} for key in ("genova", "milano", "savona")}
+
+    populate_all_zones.populate_zones_concurrently(make_cities(), ["genova", "milano"], workers=4, rate=1000,
+                                                   file_path=file_path)
+    assert saves == [file_path]
+    with open(file_path) as f:
+        assert json.load(f)["milano"]["macrozones"] == {"milano_centro": {"id": 6, "name": "Milano Centro"}}
+
+    saves.clear()
+    with pytest.raises(RuntimeError):
+        populate_all_zones.populate_zones_concurrently(make_cities(), ["genova", "milano", "savona"], workers=4,
+                                                       rate=1000, file_path=file_path)
+    assert saves == [file_path]
+    with open(file_path) as f:
+        saved = json.load(f)
+    assert "macrozones" in saved["genova"] and "macrozones" not in saved["savona"]
+    assert not Path(f"{file_path}.tmp").exists()
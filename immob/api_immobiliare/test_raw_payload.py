@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# --- test_raw_payload.py ---
+
+import sys
+import json
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sqlite_helpers import get_connection, init_database, upsert_ads_df
+from raw_payload import (ZLIB_MARKER, ZSTD_MARKER, compress_payloads, decompress_payload, raw_field,
+                         read_raw_fields, register_raw_functions)
+
+REAL_ESTATE = {
+    "id": 123,
+    "title": "Trilocale via Balbi, Genova",
+    "properties": [{"floor": {"value": "2"}, "features": ["Balcone", "Cantina"]}]
+}
+
+
+@pytest.mark.parametrize("codec, marker", [("zlib", ZLIB_MARKER), ("zstd", ZSTD_MARKER)])
+def test_payloads_round_trip(codec, marker):
+    """Every blob carries its codec marker and decompresses back to the payload; None stays None"""
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    blobs = compress_payloads([REAL_ESTATE, None, {"id": 2}], codec=codec)
+
+    assert blobs[0][:1] == marker and blobs[1] is None
+    assert [decompress_payload(blob) for blob in blobs] == [REAL_ESTATE, None, {"id": 2}]
+
+
+def test_codec_is_chosen_from_the_marker():
+    """zlib blobs and the legacy plain JSON rows are read whatever the default codec"""
+    legacy = json.dumps(REAL_ESTATE)
+
+    assert decompress_payload(legacy) == REAL_ESTATE
+    assert decompress_payload(legacy.encode("utf-8")) == REAL_ESTATE
+    assert raw_field(compress_payloads([REAL_ESTATE], codec="zlib")[0], "properties.0.floor.value") == "2"
+    assert raw_field(legacy, "properties.-1.features.1") == "Cantina"
+    assert raw_field(legacy, "properties.3.floor") is None and raw_field(None, "id") is None
+    with pytest.raises(ValueError):
+        compress_payloads([REAL_ESTATE], codec="brotli")
+
+
+def test_fields_are_read_from_the_database(tmp_path):
+    """Single fields are read from the stored blobs, directly or with raw_field() in SQL"""
+    db_path = str(tmp_path / "ads.db")
+    init_database(db_path)
+    urls = ["https://www.immobiliare.it/annunci/123/", "https://www.immobiliare.it/annunci/124/"]
+    upsert_ads_df(pd.DataFrame({"url": urls, "raw_data": compress_payloads([REAL_ESTATE, None], codec="zlib")}),
+                  db_path)
+
+    assert read_raw_fields(db_path, urls[0], ["id", "properties.0.features"]) == {
+        "id": 123, "properties.0.features": ["Balcone", "Cantina"]
+    }
+    assert read_raw_fields(db_path, urls[1], ["id"]) == {}
+    assert read_raw_fields(db_path, "https://www.immobiliare.it/annunci/999/", ["id"]) == {}
+
+    with get_connection(db_path) as conn:
+        register_raw_functions(conn)
+        rows = conn.execute('''
+            SELECT raw_field(raw_data, 'properties.0.floor.value'), raw_field(raw_data, 'properties.0.features')
+            FROM real_estate_ads ORDER BY url
+        ''').fetchall()
+    assert [tuple(row) for row in rows] == [("2", '["Balcone", "Cantina"]'), (None, None)]
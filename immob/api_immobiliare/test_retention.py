@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# --- test_retention.py ---
+
+import sys
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sqlite_helpers import init_database, upsert_ads_df, delete_ads_by_url
+from crawl_sessions import record_crawl
+from retention import run_retention
+from conftest import make_ads
+
+
+def make_db(tmp_path, count=20):
+    db_path = str(tmp_path / "ads.db")
+    init_database(db_path)
+    upsert_ads_df(make_ads(count, title="Ad {id}", price_value=1000, description="x" * 2000,
+                           raw_data="compressed payload"), db_path)
+    return db_path
+
+
+def count(db_path, table):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_delisted_ads_are_archived_in_chunks(tmp_path):
+    """Ads delisted long enough move to the archive database, the others stay"""
+    db_path = make_db(tmp_path)
+    urls = make_ads(20)["url"].tolist()
+    record_crawl(db_path, "genova", "rent", urls, complete=True)
+    record_crawl(db_path, "genova", "rent", urls[:12], complete=True)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE listing_status SET delisted_at = '2000-01-01 00:00:00' WHERE url IN (?, ?, ?)",
+                     urls[12:15])
+
+    assert run_retention(db_path, delisted_days=30, dry_run=True)["delisted"] == 3
+    report = run_retention(db_path, delisted_days=30, chunk_size=2)
+
+    assert report["archived"] == 3 and report["error"] is None
+    assert count(db_path, "real_estate_ads") == 17
+    archive = str(tmp_path / "ads_archive.db")
+    assert count(archive, "archived_ads WHERE archive_reason = 'delisted' AND raw_data IS NOT NULL") == 3
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert count(db_path, "retention_runs") == 1
+
+    # Scheduling: a recent run skips the next one
+    assert run_retention(db_path, min_interval_hours=24)["skipped"]
+
+
+def test_expired_ads_and_bytes_reclaimed(tmp_path):
+    """Ads not updated for too long are removed and the space is given back"""
+    db_path = make_db(tmp_path, count=300)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE real_estate_ads SET updated_at = '2000-01-01 00:00:00' WHERE db_id > 100")
+    # The first run switches the file to incremental auto-vacuum
+    run_retention(db_path, delisted_days=None, archive_format="none")
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE real_estate_ads SET updated_at = '2000-01-01 00:00:00' WHERE db_id > 10")
+    report = run_retention(db_path, delisted_days=None, expire_days=365, archive_format="none", chunk_size=100)
+
+    assert report["archived"] == 290 and count(db_path, "real_estate_ads") == 10
+    assert report["bytes_reclaimed"] > 0
+
+
+def test_ads_seen_by_recent_crawls_do_not_expire(tmp_path):
+    """With listing_status, an ad unchanged (not rewritten) but seen by a recent crawl is kept"""
+    db_path = make_db(tmp_path)
+    urls = make_ads(20)["url"].tolist()
+    record_crawl(db_path, "genova", "rent", urls[:15], complete=False)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE real_estate_ads SET updated_at = '2000-01-01 00:00:00'")
+        conn.execute("UPDATE listing_status SET last_seen_at = '2000-01-01 00:00:00' WHERE url IN (?, ?)", urls[:2])
+
+    report = run_retention(db_path, delisted_days=None, expire_days=365, archive_format="none")
+
+    # 2 last seen long ago, 5 never tracked and not updated
+    assert report["expired"] == 7 and count(db_path, "real_estate_ads") == 13
+
+
+def test_parquet_archive(tmp_path):
+    """Ads can be archived to compressed Parquet files"""
+    pytest.importorskip("pyarrow")
+    db_path = make_db(tmp_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE real_estate_ads SET updated_at = '2000-01-01 00:00:00' WHERE db_id <= 5")
+
+    report = run_retention(db_path, delisted_days=None, expire_days=365, archive_format="parquet", chunk_size=2)
+
+    files = sorted(Path(report["archive"]).glob("*.parquet"))
+    assert len(files) == 3
+    assert len(pd.concat(pd.read_parquet(path) for path in files)) == 5
+
+
+def test_delete_ads_by_url_beyond_the_parameter_limit(tmp_path):
+    """Deleting more URLs than SQLite accepts parameters works"""
+    db_path = make_db(tmp_path, count=1000)
+    urls = make_ads(40000)["url"].tolist()
+
+    assert delete_ads_by_url(db_path, urls[:999] + urls[1000:]) == 999
+    assert count(db_path, "real_estate_ads") == 1
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# --- test_sinks.py ---
+
+import sys
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+import sinks
+from sinks import Sink, CosmosSink, SQLiteSink, file_sink, upload_csv_to_sink
+from csv_chunks import load_progress
+from content_hash import compute_content_hashes, filter_changed, mark_df_written
+from test_cosmos_ingest import FakeAsyncContainer
+from conftest import make_ads
+
+
+def city_ads(count, city="genova"):
+    return make_ads(count, url=f"https://www.immobiliare.it/annunci/{city}-{{id}}/", uuid=f"{city}-{{id}}", city=city,
+                    price_value=[1000 + i for i in range(count)], raw_data="compressed payload")
+
+
+class FlakySink(Sink):
+    """Sink failing the first `failures` calls with a transient error."""
+
+    name = "flaky"
+    retry_on = (OSError,)
+
+    def __init__(self, failures=0, **options):
+        super().__init__(**options)
+        self.failures = failures
+        self.batches = []
+
+    def write_batch(self, df):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("temporarily unavailable")
+        self.batches.append(len(df))
+        return {"written": len(df), "failed": 0}
+
+
+def test_batching_and_retries(monkeypatch):
+    """write() splits DataFrames in batches and retries transient errors"""
+    monkeypatch.setattr(sinks.time, "sleep", lambda seconds: None)
+    sink = FlakySink(failures=2, batch_size=4)
+
+    with sink:
+        positions = sink.write(city_ads(10))
+
+    assert sink.batches == [4, 4, 2]
+    assert positions == list(range(10))
+    assert sink.metrics["retries"] == 2
+    assert sink.metrics["written"] == 10 and sink.metrics["failed"] == 0
+    assert sink.last_error is None
+
+
+def test_failed_batch_is_counted(monkeypatch):
+    """A batch still failing after the retries does not stop the following ones"""
+    monkeypatch.setattr(sinks.time, "sleep", lambda seconds: None)
+    sink = FlakySink(failures=2, batch_size=5, max_retries=1)
+
+    positions = sink.write(city_ads(10))
+    sink.close()
+
+    assert positions == list(range(5, 10))
+    assert sink.metrics["failed"] == 5 and sink.metrics["failed_batches"] == 1
+    assert "temporarily unavailable" in sink.last_error
+
+
+def test_cosmos_sink_reports_written_positions():
+    """Only the records accepted by Cosmos DB are reported, and raw_data is not uploaded"""
+    container = FakeAsyncContainer(bad_ids={"genova-3"})
+
+    with CosmosSink("ads_rent", container=container, default_city="genova") as sink:
+        positions = sink.write(city_ads(6))
+
+    assert positions == [0, 1, 2, 4, 5]
+    assert sink.metrics["written"] == 5 and sink.metrics["failed"] == 1
+    assert sink.metrics["request_charge"] > 0
+    assert all("raw_data" not in item for item in container.items.values())
+
+
+def test_upload_csv_to_sqlite_sink_is_idempotent(tmp_path):
+    """Uploading the same CSV twice in chunks writes the same rows, none of them changed"""
+    csv_path = tmp_path / "ads_genova_rent.csv"
+    city_ads(25).to_csv(csv_path, index=False)
+    db_path = str(tmp_path / "ads.db")
+
+    first = upload_csv_to_sink(str(csv_path), SQLiteSink(db_path), chunksize=10)
+    second = upload_csv_to_sink(str(csv_path), SQLiteSink(db_path), chunksize=10)
+
+    assert (first["new"], first["updated"]) == (25, 0)
+    assert (second["new"], second["updated"], second["successful"]) == (0, 0, 25)
+    assert load_progress(str(csv_path)) is None
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM real_estate_ads").fetchone()[0] == 25
+
+
+def test_file_sinks(tmp_path):
+    """File sinks are chosen from the file name and drop the raw payload"""
+    for name in ("ads.csv", "ads.jsonl.gz", "ads.json"):
+        path = str(tmp_path / name)
+        with file_sink(path) as sink:
+            sink.write(city_ads(3))
+            sink.write(city_ads(2, city="milano"))
+        if name.endswith(".csv"):
+            df = pd.read_csv(path)
+        else:
+            df = pd.read_json(path, lines=name.endswith(".gz"))
+        assert len(df) == 5
+        assert "raw_data" not in df.columns
+
+
+def test_csv_append_follows_the_existing_header(tmp_path):
+    """A later run appends its columns in the order of the file header, compressed or not"""
+    for name in ("ads.csv", "ads.csv.gz"):
+        path = str(tmp_path / name)
+        with file_sink(path) as sink:
+            sink.write(city_ads(2))
+        # Columns reordered and one more, as another crawl could return them
+        with file_sink(path) as sink:
+            sink.write(city_ads(2, city="milano")[["price_value", "city", "url", "uuid"]].assign(floor="3"))
+
+        df = pd.read_csv(path)
+        assert df.columns.tolist() == ["url", "uuid", "city", "price_value"]
+        assert df["city"].tolist() == ["genova", "genova", "milano", "milano"]
+        assert df["price_value"].tolist() == [1000, 1001, 1000, 1001]
+
+
+def test_failed_shard_write_is_not_marked_written(tmp_path, monkeypatch):
+    """A shard that cannot be opened fails the batch, so its ads stay pending in the hash index"""
+    monkeypatch.setattr(sinks.time, "sleep", lambda seconds: None)
+    shard_dir = tmp_path / "shards"
+    (shard_dir / "ads_savona.db").mkdir(parents=True)  # Not a database file
+    ads = pd.concat([city_ads(2).assign(province="Genova"), city_ads(2, city="savona").assign(province="Savona")],
+                    ignore_index=True)
+    hashes = compute_content_hashes(ads)
+    index_path = str(tmp_path / "ad_hashes.db")
+
+    sink = SQLiteSink(shard_dir=str(shard_dir), max_retries=1)
+    with sink:
+        positions = sink.write(ads)
+    mark_df_written(index_path, "sqlite:shards", ads.iloc[positions], hashes)
+
+    assert positions == []
+    assert sink.metrics["failed"] == 4 and sink.metrics["retries"] == 1
+    assert "unable to open database file" in sink.last_error
+    pending, unchanged = filter_changed(ads, index_path, "sqlite:shards", hashes)
+    assert (len(pending), unchanged) == (4, 0)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# --- test_spatial_index.py ---
+
+import sys
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sqlite_helpers import init_database, upsert_ads_df, delete_ads_by_url
+from spatial_index import SpatialIndex, haversine_m
+from conftest import make_ads as base_ads
+
+# Piazza De Ferrari, Genova
+CENTER = (44.4075, 8.9339)
+
+
+def make_ads(offsets_m, rooms=3):
+    """Ads due north of CENTER, at the given distances in meters."""
+    return base_ads(len(offsets_m), contract="sale", rooms=rooms,
+                    price_value=[200000 + 1000 * i for i in range(len(offsets_m))],
+                    latitude=[CENTER[0] + offset / 111320.0 for offset in offsets_m], longitude=CENTER[1])
+
+
+def make_db(tmp_path, df):
+    db_path = str(tmp_path / "ads.db")
+    init_database(db_path)
+    upsert_ads_df(df, db_path)
+    return db_path
+
+
+def test_radius_bbox_and_nearest(tmp_path):
+    """Radius, bounding box and k-nearest queries return the expected ads, nearest first"""
+    db_path = make_db(tmp_path, make_ads([100, 400, 900, 3000, 20000]))
+
+    with SpatialIndex(db_path) as index:
+        within = index.within_radius(*CENTER, 1000)
+        assert [ad["url"][-2] for ad in within] == ["0", "1", "2"]
+        assert abs(within[1]["distance_m"] - 400) < 5
+
+        assert len(index.bbox(CENTER[0], CENTER[1] - 0.01, CENTER[0] + 0.01, CENTER[1] + 0.01)) == 3
+        assert len(index.within_radius(*CENTER, 1000, filters={"price_value": (None, 201000)})) == 2
+
+        nearest = index.nearest(*CENTER, k=4)
+        assert [round(ad["distance_m"], -2) for ad in nearest] == [100, 400, 900, 3000]
+
+
+def test_triggers_keep_the_index_in_sync(tmp_path):
+    """Inserts, coordinate updates and deletes after the index exists are reflected"""
+    db_path = make_db(tmp_path, make_ads([100]))
+    SpatialIndex(db_path).close()
+
+    moved = make_ads([5000, 200])
+    upsert_ads_df(moved, db_path)
+    delete_ads_by_url(db_path, [moved["url"][1]])
+
+    with SpatialIndex(db_path) as index:
+        assert index.within_radius(*CENTER, 1000) == []
+        assert [ad["url"] for ad in index.within_radius(*CENTER, 6000)] == [moved["url"][0]]
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM ads_rtree").fetchone()[0] == 1
+
+
+def test_comparables(tmp_path):
+    """Comparables share the contract and rooms of the reference ad and exclude it"""
+    df = pd.concat([make_ads([0, 300, 800]), make_ads([150], rooms=4).assign(url="https://x/4-rooms/")])
+    db_path = make_db(tmp_path, df)
+
+    with SpatialIndex(db_path) as index:
+        comparables = index.comparables(df["url"].iloc[0], radius_m=500)
+
+    assert [ad["url"] for ad in comparables] == [df["url"].iloc[1]]
+    assert abs(haversine_m(*CENTER, CENTER[0] + 1 / 111.32, CENTER[1]) - 1000) < 5
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# --- test_sqlite_helpers.py ---
+
+import sys
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sqlite_helpers import init_database, upsert_ads_df
+
+
+def stored(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT url, price_value, rooms FROM real_estate_ads ORDER BY url").fetchall()
+
+
+def test_upsert_keeps_stored_values_missing_from_a_recrawl(tmp_path):
+    """A NULL never overwrites a stored value; replace_existing updates (and counts) only the values that differ"""
+    db_path = str(tmp_path / "ads.db")
+    init_database(db_path)
+    urls = ["https://x/1/", "https://x/2/", None]
+    assert upsert_ads_df(pd.DataFrame({"url": urls, "price_value": [1000, 2000, 3000], "rooms": ["3", "2", "1"]}),
+                         db_path) == (2, 0)
+
+    recrawl = pd.DataFrame({"url": urls[:2] + ["https://x/3/"], "price_value": [1100, None, 900],
+                            "rooms": [None, "2", "4"]})
+
+    assert upsert_ads_df(recrawl, db_path, replace_existing=False) == (1, 0)
+    assert stored(db_path) == [("https://x/1/", 1000, 3), ("https://x/2/", 2000, 2), ("https://x/3/", 900, 4)]
+
+    assert upsert_ads_df(recrawl, db_path, replace_existing=True) == (0, 1)  # only ad 1 changed
+    assert stored(db_path) == [("https://x/1/", 1100, 3), ("https://x/2/", 2000, 2), ("https://x/3/", 900, 4)]
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# --- test_sqlite_shards.py ---
+
+import sys
+import sqlite3
+from pathlib import Path
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from sqlite_helpers import init_database, read_ads_from_sqlite, upsert_ads_df
+from sqlite_shards import (get_shard_path, group_by_shard, list_shards, province_slug, read_ads_from_shards,
+                           write_df_to_shards)
+from conftest import make_ads
+
+
+def shard_ads(provinces, prices):
+    return make_ads(len(prices), province=provinces, contract="sale", price_value=prices)
+
+
+def test_ads_are_routed_to_the_shard_of_their_province(tmp_path):
+    """Every province gets its own file; a missing province goes to the 'unknown' shard"""
+    shard_dir = str(tmp_path / "shards")
+    ads = shard_ads(["Genova", "La Spezia", "Genova", None], [100000, 90000, 120000, 80000])
+
+    assert province_slug(" Reggio nell'Emilia ") == "reggio_nell_emilia"
+    assert {path: len(rows) for path, rows in group_by_shard(ads, shard_dir).items()} == {
+        get_shard_path(shard_dir, "Genova"): 2, get_shard_path(shard_dir, "la_spezia"): 1,
+        get_shard_path(shard_dir, None): 1
+    }
+
+    assert write_df_to_shards(ads, shard_dir) == {"genova": (2, 0), "la_spezia": (1, 0), "unknown": (1, 0)}
+    assert sorted(list_shards(shard_dir)) == ["genova", "la_spezia", "unknown"]
+    with sqlite3.connect(get_shard_path(shard_dir, "Genova")) as conn:
+        assert sorted(row[0] for row in conn.execute("SELECT price_value FROM real_estate_ads")) == [100000, 120000]
+
+    # Re-crawling the ads updates them in place, counting only those that changed
+    assert write_df_to_shards(ads.assign(price_value=[100000, 90000, 110000, 80000]), shard_dir,
+                              replace_existing=True) == {"genova": (0, 1), "la_spezia": (0, 0), "unknown": (0, 0)}
+
+
+def test_shards_are_merged_sorted_and_limited(tmp_path):
+    """The shards are queried with the same filters, then sorted again and cut to the limit"""
+    shard_dir = str(tmp_path / "shards")
+    write_df_to_shards(shard_ads(["Genova", "Savona", "Genova", "Savona", "Imperia"],
+                                [100000, 300000, 200000, 150000, 250000]), shard_dir)
+
+    df = read_ads_from_shards(shard_dir, order_by="price_value DESC", limit=3, clean_data=False)
+    assert df["price_value"].tolist() == [300000, 250000, 200000]
+
+    df = read_ads_from_shards(shard_dir, provinces=["Savona", "Genova"], filters={"contract": "sale"},
+                              order_by="price_value", clean_data=False)
+    assert df["price_value"].tolist() == [100000, 150000, 200000, 300000]
+
+    assert read_ads_from_shards(str(tmp_path / "missing")).empty
+
+
+def test_read_ads_from_sqlite_without_limit(tmp_path):
+    """Without a limit the query still runs and returns every ad"""
+    db_path = str(tmp_path / "ads.db")
+    init_database(db_path)
+    upsert_ads_df(shard_ads("Genova", [100000, 200000, 300000]), db_path)
+
+    assert len(read_ads_from_sqlite(db_path, clean_data=False)) == 3
+    assert read_ads_from_sqlite(db_path, order_by="price_value", limit=2, clean_data=False)["price_value"].tolist() \
+        == [100000, 200000]
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# --- test_startup.py ---
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from bench_startup import LIGHT_MODULES, heavy_imports
+
+
+@pytest.mark.parametrize("module", LIGHT_MODULES)
+def test_lookup_modules_do_not_import_heavy_packages(module):
+    """pandas, pydantic, requests and the Azure SDK are only imported when a crawl or an output needs them"""
+    assert heavy_imports(module) == []
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# --- test_validation.py ---
+
+import sys
+import copy
+from pathlib import Path
+
+# Add the parent directory to the Python path
+parent_dir = str(Path(__file__).resolve().parent)
+sys.path.append(parent_dir)
+
+from validation import get_ads_adapter, merge_validation_reports, new_validation_report, validate_page
+from fetch_ads import load_data_from_dict
+
+PHONE = {"type": "vT", "value": "010 123456"}
+PRICE = {"visible": True, "value": 1000, "formattedValue": "€ 1.000/mese", "minValue": "1000"}
+TYPOLOGY = {"id": 4, "name": "Appartamento"}
+REAL_ESTATE = {
+    "visibility": "standard", "dataType": "ad", "id": 1, "uuid": "u-1", "contract": "rent",
+    "isNew": False, "luxury": False, "price": PRICE, "propertiesCount": 1, "title": "Trilocale",
+    "type": "ad", "typology": TYPOLOGY, "hasMainProperty": True, "isProjectLike": False, "isMosaic": False,
+    "advertiser": {
+        "hasCallNumbers": True,
+        "agency": {
+            "id": 7, "type": "agency", "showOnlyAgentPhone": False, "phones": [PHONE],
+            "bookableVisit": {"isVisitBookable": False, "virtualVisitEnabled": False}, "isPaid": True,
+            "label": "agenzia", "displayName": "Agenzia", "guaranteed": False, "showAgentPhone": True,
+            "showLogo": True, "imageUrls": {}, "agencyUrl": "https://agenzia", "showExternalLink": False
+        },
+        "supervisor": {"type": "user", "imageGender": "m", "phones": [PHONE], "imageType": "no_image",
+                       "displayName": "Mario", "label": "agente", "imageUrl": ""}
+    },
+    "properties": [{"price": PRICE, "surface": "80 m²", "typology": TYPOLOGY, "typologyGA4Translation": "Appartamento",
+                    "ga4features": ["Balcone"], "featureList": []}]
+}
+
+
+def make_page(count, broken=()):
+    """A page of `count` valid items; the positions in `broken` have a text price and no surface"""
+    items = []
+    for i in range(count):
+        real_estate = copy.deepcopy(REAL_ESTATE)
+        real_estate["id"] = i
+        if i in broken:
+            real_estate["price"]["value"] = "su richiesta"
+            del real_estate["properties"][0]["surface"]
+        items.append({"realEstate": real_estate, "seo": {"anchor": "Trilocale", "url": f"/annunci/{i}/"},
+                      "idGeoHash": "spdz"})
+    return items
+
+
+def test_validation_modes():
+    """off checks nothing, sample a few items per page, full every item"""
+    page = make_page(20)
+
+    assert validate_page(page, "off")["checked"] == 0
+    assert validate_page(page, "sample", sample_size=5) == new_validation_report("sample") | {"checked": 5}
+    assert validate_page(page, "full") == new_validation_report("full") | {"checked": 20}
+
+
+def test_errors_are_reported_per_field():
+    """Each failing field is counted once per ad, with its error types, across the pages of a crawl"""
+    total = new_validation_report("full")
+    merge_validation_reports(total, validate_page(make_page(10, broken={2, 5}), "full"))
+    merge_validation_reports(total, validate_page(make_page(4, broken={0}), "full"))
+
+    assert (total["checked"], total["invalid"]) == (14, 3)
+    assert total["field_errors"]["realEstate.price.value"]["count"] == 3
+    assert total["field_errors"]["realEstate.price.value"]["types"] == {"int_parsing": 3}
+    assert total["field_errors"]["realEstate.properties[].surface"]["types"] == {"missing": 3}
+
+
+def test_load_data_from_dict_reuses_the_adapter():
+    """Pages are validated with the cached adapter; invalid ads are dropped, the others kept"""
+    get_ads_adapter.cache_clear()
+
+    ads = load_data_from_dict({"results": make_page(3)})
+    ads += load_data_from_dict({"results": make_page(3, broken={1})})
+
+    assert [ad.id for ad in ads] == [0, 1, 2, 0, 2]
+    assert get_ads_adapter.cache_info().misses == 1
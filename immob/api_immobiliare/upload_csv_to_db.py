@@ -3,45 +3,24 @@
 
 import os
 import sys
-import json
-import uuid
-import sqlite3
+import json_codec
 import argparse
 import logging
-import pandas as pd
 from pathlib import Path
-from dotenv import load_dotenv
 from datetime import datetime
-from helpers import init_cosmos_client
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from helpers import load_env_vars, missing_cosmos_settings
+from cosmos_ingest import CosmosSession, DEFAULT_CONCURRENCY
+from csv_chunks import load_progress
+from sinks import CosmosSink, SQLiteSink, upload_csv_to_sink
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def load_env_vars():
-    """Load environment variables from .env file"""
-    env_path = Path(__file__).resolve().parent / ".env"
-    load_dotenv(env_path)
-    
-    # Get environment variables with fallbacks
-    env_vars = {
-        "COSMOS_ENDPOINT": os.environ.get("COSMOS_DB_ACCOUNT_URI", ""),
-        "COSMOS_KEY": os.environ.get("COSMOS_DB_ACCOUNT_KEY", ""),
-        "COSMOS_DB": os.environ.get("COSMOS_DB_DATABASE_NAME", "")
-    }
-    
-    return env_vars
-
 def validate_cosmos_config(config):
     """Validate Cosmos DB configuration has required values"""
-    missing = []
-    
-    if not config.get("cosmos_endpoint"):
-        missing.append("COSMOS_DB_ACCOUNT_URI")
-    if not config.get("cosmos_key"):
-        missing.append("COSMOS_DB_ACCOUNT_KEY")
-    if not config.get("cosmos_db"):
-        missing.append("COSMOS_DB_DATABASE_NAME")
+    missing = missing_cosmos_settings(config)
     
     if missing:
         logger.error(f"[ERROR] Missing environment variables: {', '.join(missing)}")
@@ -50,32 +29,8 @@ def validate_cosmos_config(config):
     
     return True
 
-def clean_dataframe_for_export(df):
-    """
-    Clean DataFrame by replacing NaN values with None and empty strings with None.
-    This ensures consistency when saving to JSON or uploading to databases.
-    
-    Args:
-        df: Pandas DataFrame to clean
-        
-    Returns:
-        Cleaned DataFrame with NaN and empty strings replaced with None
-    """
-    # Make a copy to avoid modifying the original DataFrame
-    cleaned_df = df.copy()
-    
-    # Replace NaN with None (which becomes null in JSON)
-    cleaned_df = cleaned_df.astype(object).replace({pd.NA: None})
-    cleaned_df = cleaned_df.where(pd.notnull(cleaned_df), None)
-    
-    # Replace empty strings with None
-    for col in cleaned_df.columns:
-        if cleaned_df[col].dtype == object:  # Only process string columns
-            cleaned_df[col] = cleaned_df[col].replace('', None)
-    
-    return cleaned_df
-
-def upload_csv_to_cosmos(csv_path, container_name, config, city=None, batch_size=50):
+def upload_csv_to_cosmos(csv_path, container_name, config, city=None, batch_size=50, concurrency=DEFAULT_CONCURRENCY,
+                         chunksize=None, resume=False, session=None, executor=None):
     """
     Upload data from a CSV file to Cosmos DB.
     
@@ -84,115 +39,51 @@ def upload_csv_to_cosmos(csv_path, container_name, config, city=None, batch_size
         container_name: Name of the Cosmos DB container
         config: Configuration dictionary with Cosmos DB settings
         city: Default city to use for partition key if missing (optional)
-        batch_size: Number of items to upload in a single batch (optional)
+        batch_size: Maximum number of records per transactional batch, capped at 100 (optional)
+        concurrency: Maximum number of parallel Cosmos DB requests (optional)
+        chunksize: Read, clean and upload the file in chunks of this many rows (optional)
+        resume: Continue from the progress saved by an interrupted chunked upload (optional)
+        session: Shared CosmosSession to upload through, instead of a new client (optional)
+        executor: Process pool used to parse and clean the CSV (optional)
         
     Returns:
         Dictionary with upload statistics
     """
-    results = {
-        "file": csv_path,
-        "total_records": 0,
-        "successful": 0,
-        "failed": 0,
-        "start_time": datetime.now(),
-        "end_time": None,
-        "errors": []
-    }
-    
-    try:
-        logger.info(f"[INFO] Loading CSV file: {csv_path}")
-        df = pd.read_csv(csv_path)
-        results["total_records"] = len(df)
-        logger.info(f"[INFO] Loaded {len(df)} records from CSV")
-        
-        # Clean DataFrame for export
-        try:
-            clean_df = clean_dataframe_for_export(df)
-            logger.info(f"[INFO] DataFrame cleaned and prepared for upload")
-        except Exception as e:
-            logger.error(f"[ERROR] Failed to clean DataFrame: {str(e)}")
-            results["errors"].append(f"DataFrame cleaning error: {str(e)}")
-            results["end_time"] = datetime.now()
-            return results
-        
-        # Initialize Cosmos DB client
-        try:
-            container_client = init_cosmos_client(
-                config["cosmos_endpoint"], 
-                config["cosmos_key"], 
-                config["cosmos_db"], 
-                container_name
-            )
-            logger.info(f"[INFO] Connected to Cosmos DB container: {container_name}")
-        except Exception as e:
-            logger.error(f"[ERROR] Failed to connect to Cosmos DB: {str(e)}")
-            results["errors"].append(f"Cosmos DB connection error: {str(e)}")
-            results["end_time"] = datetime.now()
-            return results
-        
-        # Convert DataFrame to records
-        records = clean_df.to_dict('records')
-        
-        # Extract city from filename if not provided
-        if not city:
-            # Try to extract city from filename, example: ads_genova_rent.csv
-            filename = Path(csv_path).stem  # Get filename without extension
-            parts = filename.split('_')
-            if len(parts) > 1:
-                extracted_city = parts[1]  # Assuming format is ads_CITY_CONTRACT.csv
-                city = extracted_city
-                logger.info(f"[INFO] Extracted city '{city}' from filename")
-            else:
-                # Default fallback city
-                city = "unknown"
-                logger.info(f"[INFO] Using fallback city '{city}' for partition key")
-        
-        # Process records in batches
-        batch_number = 0
-        for i in range(0, len(records), batch_size):
-            batch_number += 1
-            batch = records[i:i+batch_size]
-            logger.info(f"[INFO] Processing batch {batch_number} ({len(batch)} records)")
-            
-            successful_in_batch = 0
-            
-            for j, record in enumerate(batch):
-                try:
-                    # Add ID if not present
-                    if 'uuid' in record and record['uuid']:
-                        record['id'] = str(record['uuid'])
-                    else:
-                        record['id'] = str(uuid.uuid4())
-                    
-                    # Ensure partition key (city) is present
-                    if 'city' not in record or not record['city']:
-                        record['city'] = city
-                    
-                    # Upload to Cosmos DB
-                    container_client.upsert_item(body=record)
-                    successful_in_batch += 1
-                    results["successful"] += 1
-                except Exception as e:
-                    results["failed"] += 1
-                    error_message = f"Error uploading record {i+j+1}: {str(e)}"
-                    logger.warning(f"[WARNING] {error_message}")
-                    if len(results["errors"]) < 10:  # Limit number of stored errors
-                        results["errors"].append(error_message)
-            
-            logger.info(f"[INFO] Batch {batch_number} complete: {successful_in_batch}/{len(batch)} records successful")
+    # Extract city from filename if not provided
+    if not city:
+        # Try to extract city from filename, example: ads_genova_rent.csv
+        filename = Path(csv_path).stem  # Get filename without extension
+        parts = filename.split('_')
+        if len(parts) > 1:
+            extracted_city = parts[1]  # Assuming format is ads_CITY_CONTRACT.csv
+            city = extracted_city
+            logger.info(f"[INFO] Extracted city '{city}' from filename")
+        else:
+            # Default fallback city
+            city = "unknown"
+            logger.info(f"[INFO] Using fallback city '{city}' for partition key")
     
-    except Exception as e:
-        logger.error(f"[ERROR] Failed to process CSV file: {str(e)}")
-        results["errors"].append(f"File processing error: {str(e)}")
+    sink = CosmosSink(
+        container_name,
+        endpoint=config["cosmos_endpoint"],
+        key=config["cosmos_key"],
+        db_name=config["cosmos_db"],
+        default_city=city,
+        session=session,
+        concurrency=concurrency,
+        max_batch_operations=batch_size
+    )
+    results = upload_csv_to_sink(csv_path, sink, chunksize=chunksize, resume=resume, executor=executor)
     
-    results["end_time"] = datetime.now()
     duration = results["end_time"] - results["start_time"]
     logger.info(f"[INFO] Upload complete: {results['successful']}/{results['total_records']} records successful")
+    logger.info(f"[INFO] Request charge: {results.get('request_charge', 0.0):.1f} RU")
     logger.info(f"[INFO] Duration: {duration}")
     
     return results
 
-def upload_csv_to_sqlite(csv_path, table_name, db_path, batch_size=100, if_exists='append'):
+def upload_csv_to_sqlite(csv_path, table_name, db_path, batch_size=100, if_exists='append', chunksize=None, resume=False,
+                         executor=None, mode='table'):
     """
     Upload data from a CSV file to SQLite database.
     
@@ -202,94 +93,42 @@ def upload_csv_to_sqlite(csv_path, table_name, db_path, batch_size=100, if_exist
         db_path: Path to the SQLite database file
         batch_size: Number of items to upload in a single batch (optional)
         if_exists: How to behave if the table already exists ('fail', 'replace', 'append')
+        chunksize: Read, clean and upload the file in chunks of this many rows (optional)
+        resume: Continue from the progress saved by an interrupted chunked upload (optional)
+        executor: Process pool used to parse and clean the CSV (optional)
+        mode: 'table' writes the CSV columns as-is into `table_name` with to_sql;
+              'ads' upserts into the real_estate_ads schema on `url` (table_name and if_exists are ignored)
         
     Returns:
         Dictionary with upload statistics
     """
-    results = {
-        "file": csv_path,
-        "total_records": 0,
-        "successful": 0,
-        "failed": 0,
-        "start_time": datetime.now(),
-        "end_time": None,
-        "errors": []
-    }
+    # A resumed upload appends to the table written by the interrupted run
+    if resume and chunksize and load_progress(csv_path):
+        if_exists = 'append'
+    if mode == 'ads':
+        logger.info(f"[INFO] Upserting into real_estate_ads on url")
+    elif if_exists == 'replace':
+        logger.info(f"[INFO] Replacing existing table {table_name} if it exists")
     
     try:
-        logger.info(f"[INFO] Loading CSV file: {csv_path}")
-        df = pd.read_csv(csv_path)
-        results["total_records"] = len(df)
-        logger.info(f"[INFO] Loaded {len(df)} records from CSV")
-        
-        # Clean DataFrame for export
-        try:
-            clean_df = clean_dataframe_for_export(df)
-            logger.info(f"[INFO] DataFrame cleaned and prepared for upload")
-        except Exception as e:
-            logger.error(f"[ERROR] Failed to clean DataFrame: {str(e)}")
-            results["errors"].append(f"DataFrame cleaning error: {str(e)}")
-            results["end_time"] = datetime.now()
-            return results
-        
-        # Initialize SQLite connection
-        try:
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
-            
-            conn = sqlite3.connect(db_path)
-            logger.info(f"[INFO] Connected to SQLite database: {db_path}")
-        except Exception as e:
-            logger.error(f"[ERROR] Failed to connect to SQLite database: {str(e)}")
-            results["errors"].append(f"SQLite connection error: {str(e)}")
-            results["end_time"] = datetime.now()
-            return results
-        
-        # Process records in batches
-        total_rows = len(clean_df)
-        
-        try:
-            # If table doesn't exist or if_exists='replace', create it with proper schema
-            if if_exists == 'replace':
-                logger.info(f"[INFO] Replacing existing table {table_name} if it exists")
-                
-            # Upload DataFrame to SQLite in batches
-            batch_number = 0
-            for i in range(0, total_rows, batch_size):
-                batch_number += 1
-                batch_df = clean_df.iloc[i:i+batch_size]
-                logger.info(f"[INFO] Processing batch {batch_number} ({len(batch_df)} records)")
-                
-                try:
-                    # For the first batch only
-                    if_exists_param = if_exists if i == 0 else 'append'
-                    
-                    # Use pandas to_sql which handles most data type conversions
-                    batch_df.to_sql(table_name, conn, if_exists=if_exists_param, index=False)
-                    
-                    results["successful"] += len(batch_df)
-                    logger.info(f"[INFO] Batch {batch_number} complete: {len(batch_df)} records successful")
-                except Exception as e:
-                    results["failed"] += len(batch_df)
-                    error_message = f"Error uploading batch {batch_number}: {str(e)}"
-                    logger.warning(f"[WARNING] {error_message}")
-                    if len(results["errors"]) < 10:
-                        results["errors"].append(error_message)
-            
-            conn.commit()
-                
-        except Exception as e:
-            logger.error(f"[ERROR] Failed during batch processing: {str(e)}")
-            results["errors"].append(f"Batch processing error: {str(e)}")
-            
-        finally:
-            conn.close()
-    
+        sink = SQLiteSink(
+            db_path,
+            mode=mode,
+            table_name=table_name,
+            if_exists=if_exists,
+            # Upserts are set-based, so each chunk is merged in one go
+            batch_size=batch_size if mode == 'table' else None
+        )
+        sink.open()
+        logger.info(f"[INFO] Connected to SQLite database: {db_path}")
     except Exception as e:
-        logger.error(f"[ERROR] Failed to process CSV file: {str(e)}")
-        results["errors"].append(f"File processing error: {str(e)}")
+        logger.error(f"[ERROR] Failed to connect to SQLite database: {str(e)}")
+        now = datetime.now()
+        return {"file": csv_path, "total_records": 0, "successful": 0, "failed": 0, "start_time": now,
+                "end_time": now, "errors": [f"SQLite connection error: {str(e)}"]}
+    
+    results = upload_csv_to_sink(csv_path, sink, chunksize=chunksize, resume=resume, executor=executor)
     
-    results["end_time"] = datetime.now()
     duration = results["end_time"] - results["start_time"]
     logger.info(f"[INFO] Upload complete: {results['successful']}/{results['total_records']} records successful")
     logger.info(f"[INFO] Duration: {duration}")
@@ -317,9 +156,14 @@ def parse_arguments():
                         help='Name of the Cosmos DB container (default: derived from filename)')
     cosmos_group.add_argument('--city', type=str, default=None,
                         help='City name to use as partition key if missing in records')
+    cosmos_group.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'Maximum number of parallel Cosmos DB requests (default: {DEFAULT_CONCURRENCY})')
     
     # SQLite specific arguments
     sqlite_group = parser.add_argument_group('SQLite options')
+    sqlite_group.add_argument('--sqlite-mode', type=str, choices=['table', 'ads'], default='table',
+                        help="'table': write the CSV columns as-is with pandas to_sql (default); "
+                             "'ads': upsert into the real_estate_ads schema on url, so re-uploads are idempotent")
     sqlite_group.add_argument('--table', '-t', type=str, default=None,
                         help='Name of the SQLite table (default: derived from filename)')
     sqlite_group.add_argument('--if-exists', type=str, choices=['fail', 'replace', 'append'], 
@@ -328,6 +172,12 @@ def parse_arguments():
     # Common arguments
     parser.add_argument('--batch-size', '-b', type=int, default=50,
                         help='Number of records to upload in a single batch (default: 50)')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='Number of files processed in parallel, with CSV parsing and cleaning in a process pool (default: 1)')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Read, clean and upload the CSV in chunks of this many rows, to bound memory use on large files')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='With --chunksize, continue an interrupted upload from the offset saved in <csv>.progress.json')
     parser.add_argument('--report', '-r', action='store_true', default=False,
                         help='Generate a detailed JSON report after upload')
     
@@ -357,11 +207,11 @@ def main():
         if not validate_cosmos_config(config):
             sys.exit(1)
     
-    # Process each CSV file
-    for csv_path in args.csv_files:
+    def process_file(csv_path):
+        """Upload one CSV file and return its result (None if the file is missing)."""
         if not os.path.exists(csv_path):
             logger.error(f"[ERROR] File not found: {csv_path}")
-            continue
+            return None
         
         filename = Path(csv_path).stem  # Get filename without extension
         
@@ -391,7 +241,12 @@ def main():
                 container_name=container_name,
                 config=config,
                 city=args.city,
-                batch_size=args.batch_size
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+                chunksize=args.chunksize,
+                resume=args.resume,
+                session=session,
+                executor=executor
             )
         
         else:  # SQLite
@@ -404,16 +259,41 @@ def main():
             
             # Upload CSV file to SQLite
             logger.info(f"[INFO] Processing file: {csv_path}")
-            logger.info(f"[INFO] Target SQLite table: {table_name}")
+            logger.info(f"[INFO] Target SQLite table: {'real_estate_ads' if args.sqlite_mode == 'ads' else table_name}")
             
             result = upload_csv_to_sqlite(
                 csv_path=csv_path,
                 table_name=table_name,
                 db_path=args.sqlite,
                 batch_size=args.batch_size,
-                if_exists=args.if_exists
+                if_exists=args.if_exists,
+                chunksize=args.chunksize,
+                resume=args.resume,
+                executor=executor,
+                mode=args.sqlite_mode
             )
         
+        return result
+    
+    # With --workers, files are uploaded concurrently through one shared Cosmos client,
+    # while parsing and cleaning run in a process pool
+    session = CosmosSession(config["cosmos_endpoint"], config["cosmos_key"], config["cosmos_db"]) if args.cosmos else None
+    executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+    try:
+        if executor is not None:
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                file_results = list(pool.map(process_file, args.csv_files))
+        else:
+            file_results = [process_file(csv_path) for csv_path in args.csv_files]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if session is not None:
+            session.close()
+    
+    for result in file_results:
+        if result is None:
+            continue
         all_results.append(result)
         if result["successful"] > 0:
             success_count += 1
@@ -430,8 +310,8 @@ def main():
     if args.report:
         report_path = f"upload_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         try:
-            with open(report_path, 'w') as f:
-                json.dump(all_results, f, indent=2, default=str)
+            # default=str keeps the "YYYY-MM-DD HH:MM:SS" dates of the earlier reports
+            json_codec.dump_file(all_results, report_path, indent=2, default=str)
             logger.info(f"[INFO] Detailed report saved to: {report_path}")
         except Exception as e:
             logger.error(f"[ERROR] Failed to save report: {str(e)}")
@@ -0,0 +1,157 @@
+"""
+Schema validation of search-list API pages against the models in models.py.
+
+Whole pages are validated in a single pydantic call through a
+``TypeAdapter(List[ImmobiliareListItem])`` instead of one ``model_validate``
+per ad, and errors are aggregated per field so that schema drift shows up as
+"field X failed on N ads" rather than as one log line per ad.
+
+Modes:
+    off    - no validation
+    sample - validate a random sample of the items of every page
+    full   - validate every item of every page
+
+pydantic and models.py are only imported by the first page validated, so
+importing VALIDATION_MODES (e.g. for a command-line parser) stays cheap.
+"""
+
+import random
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+VALIDATION_MODES = ("off", "sample", "full")
+DEFAULT_SAMPLE_SIZE = 5
+
+
+@lru_cache(maxsize=1)
+def get_page_adapter():
+    """Build (once) the adapter validating a whole list of search results."""
+    from pydantic import TypeAdapter
+    from models import ImmobiliareListItem
+
+    return TypeAdapter(List[ImmobiliareListItem])
+
+
+@lru_cache(maxsize=1)
+def get_ads_adapter():
+    """Build (once) the adapter validating a list of `realEstate` objects."""
+    from pydantic import TypeAdapter
+    from models import RealEstateAd
+
+    return TypeAdapter(List[RealEstateAd])
+
+
+def _field_path(loc: tuple) -> str:
+    """Turn an error location like (3, 'realEstate', 'properties', 0, 'price') into 'realEstate.properties[].price'."""
+    parts = []
+    for step in loc[1:]:  # the first step is the position of the item in the page
+        if isinstance(step, int):
+            parts.append("[]")
+        else:
+            parts.append(("." if parts else "") + str(step))
+    return "".join(parts) or "<item>"
+
+
+def new_validation_report(mode: str) -> Dict[str, Any]:
+    """Create an empty validation report."""
+    return {"mode": mode, "checked": 0, "invalid": 0, "field_errors": {}}
+
+
+def validate_page(
+    items: List[dict],
+    mode: str = "sample",
+    sample_size: int = DEFAULT_SAMPLE_SIZE,
+    report: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Validate the items of one search-list page.
+
+    Args:
+        items: The `results` list of an API page
+        mode: One of VALIDATION_MODES
+        sample_size: Number of items validated per page in 'sample' mode
+        report: Optional report to accumulate into (e.g. across pages)
+
+    Returns:
+        Report with the number of checked/invalid items and a per-field error summary:
+        {"field_errors": {"realEstate.price.value": {"count": 3, "types": {"int_parsing": 3}, "example": "..."}}}
+    """
+    if mode not in VALIDATION_MODES:
+        raise ValueError(f"Unknown validation mode: {mode}")
+    if report is None:
+        report = new_validation_report(mode)
+    if mode == "off" or not items:
+        return report
+
+    from pydantic import ValidationError
+
+    if mode == "sample" and len(items) > sample_size:
+        items = random.sample(items, sample_size)
+
+    report["checked"] += len(items)
+    try:
+        get_page_adapter().validate_python(items)
+    except ValidationError as e:
+        invalid_items = set()
+        for error in e.errors(include_url=False):
+            loc = error["loc"]
+            if loc:
+                invalid_items.add(loc[0])
+            field = report["field_errors"].setdefault(
+                _field_path(loc), {"count": 0, "types": {}, "example": error["msg"]}
+            )
+            field["count"] += 1
+            field["types"][error["type"]] = field["types"].get(error["type"], 0) + 1
+        report["invalid"] += len(invalid_items)
+
+    return report
+
+
+def merge_validation_reports(total: Dict[str, Any], report: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Add the counts of `report` (e.g. one page) into `total` (e.g. the whole crawl).
+
+    Args:
+        total: Report to accumulate into
+        report: Report to add
+
+    Returns:
+        The updated `total` report
+    """
+    total["checked"] += report["checked"]
+    total["invalid"] += report["invalid"]
+    for path, info in report["field_errors"].items():
+        field = total["field_errors"].setdefault(path, {"count": 0, "types": {}, "example": info["example"]})
+        field["count"] += info["count"]
+        for error_type, count in info["types"].items():
+            field["types"][error_type] = field["types"].get(error_type, 0) + count
+    return total
+
+
+def log_validation_report(report: Dict[str, Any], label: str = "") -> None:
+    """
+    Log a validation report, one line per failing field.
+
+    Args:
+        report: Report returned by validate_page
+        label: Optional prefix (e.g. the page number)
+    """
+    if report["mode"] == "off" or not report["checked"]:
+        return
+
+    prefix = f"{label} " if label else ""
+    if not report["invalid"]:
+        logger.info(f"[INFO] {prefix}Validazione schema: {report['checked']} annunci validi")
+        return
+
+    logger.warning(
+        f"[WARNING] {prefix}Validazione schema: {report['invalid']}/{report['checked']} annunci non conformi a models.py"
+    )
+    fields = sorted(report["field_errors"].items(), key=lambda kv: kv[1]["count"], reverse=True)
+    for path, info in fields:
+        types = ", ".join(f"{t}={n}" for t, n in info["types"].items())
+        logger.warning(f"[WARNING]   - {path}: {info['count']} errori ({types}) es. '{info['example']}'")
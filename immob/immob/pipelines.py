@@ -8,11 +8,22 @@
 from itemadapter import ItemAdapter
 from scrapy.exceptions import DropItem
 import json, pandas as pd
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from pathlib import Path
 import logging
 import datetime
 from scrapy.utils.project import get_project_settings
 
+def _dumps(obj, indent=None):
+    """Serialise to UTF-8 JSON bytes, with orjson when installed (it only supports indent=2)."""
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(obj, default=str, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=indent, default=str).encode('utf-8')
+
 # Legacy constants for backwards compatibility
 IDS_FILE = Path("ids.json")
 OUTPUT_DIR = Path("output")
@@ -69,7 +80,7 @@ class GenericJSONPipeline:
     def close_spider(self, spider):
         """Called when the spider closes - save all items to a JSON file"""
         # Save all items to a structured JSON file
-        with open(self.json_file, 'w', encoding='utf-8') as f:
+        with open(self.json_file, 'wb') as f:
             output_data = {
                 "metadata": {
                     "timestamp": datetime.datetime.now().isoformat(),
@@ -83,11 +94,11 @@ class GenericJSONPipeline:
             if hasattr(spider, 'get_metadata'):
                 output_data["metadata"].update(spider.get_metadata())
                 
-            json.dump(output_data, f, ensure_ascii=False, indent=self.indent)
+            f.write(_dumps(output_data, indent=self.indent))
         
         # Save IDs for future deduplication if configured
         if self.keep_ids:
-            self.ids_file.write_text(json.dumps(list(self.ids), indent=self.indent))
+            self.ids_file.write_bytes(_dumps(list(self.ids), indent=self.indent))
             logging.info(f"Saved {len(self.ids)} IDs to {self.ids_file}")
         
         logging.info(f"Saved {len(self.items)} items to {self.json_file}")